@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Add reservation queue columns and indexes to book_reservations
+"""
+
+import sqlite3
+import os
+
+# Get the database path
+db_path = os.path.join(os.path.dirname(__file__), 'instance', 'library.db')
+
+print(f"Connecting to database: {db_path}")
+
+try:
+    # Connect to the database
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # Check which columns already exist
+    cursor.execute("PRAGMA table_info(book_reservations)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    for name, column_type in [('queue_position', 'INTEGER'), ('hold_expires_at', 'DATETIME')]:
+        if name in columns:
+            print(f"✓ Column '{name}' already exists in book_reservations table")
+        else:
+            print(f"Adding '{name}' column to book_reservations table...")
+            cursor.execute(f"ALTER TABLE book_reservations ADD COLUMN {name} {column_type}")
+            print(f"✓ Successfully added '{name}' column")
+    
+    indexes = [
+        ('idx_reservations_book_status_date', 'book_id, status, reserved_date'),
+        ('idx_reservations_book_status_position', 'book_id, status, queue_position'),
+        ('idx_reservations_status_hold', 'status, hold_expires_at'),
+    ]
+    for name, index_columns in indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON book_reservations ({index_columns})")
+    print("✓ Reservation queue indexes are in place")
+    
+    # Number existing active reservations 1..n per book in reservation order
+    cursor.execute("""
+        SELECT id, book_id FROM book_reservations
+        WHERE status = 'active'
+        ORDER BY book_id, reserved_date, id
+    """)
+    positions = {}
+    updates = []
+    for reservation_id, book_id in cursor.fetchall():
+        positions[book_id] = positions.get(book_id, 0) + 1
+        updates.append((positions[book_id], reservation_id))
+    cursor.executemany("UPDATE book_reservations SET queue_position = ? WHERE id = ?", updates)
+    conn.commit()
+    print(f"✓ Assigned queue positions to {len(updates)} active reservations")
+    
+    conn.close()
+    print("\n✓ Database migration completed successfully!")
+    
+except sqlite3.Error as e:
+    print(f"✗ Database error: {e}")
+except Exception as e:
+    print(f"✗ Error: {e}")
@@ -3,8 +3,6 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
-import logging
-from logging.handlers import RotatingFileHandler
 import os
 
 # Initialize extensions
@@ -73,6 +71,7 @@ def create_app(config_name='default'):
     from app.routes.summarize_search import summarize_search_bp
     from app.routes.ai_chat import ai_chat_bp
     from app.routes.offline import offline_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -83,7 +82,33 @@ def create_app(config_name='default'):
     app.register_blueprint(summarize_search_bp)
     app.register_blueprint(ai_chat_bp)
     app.register_blueprint(offline_bp)
-    # ...existing code...
+    app.register_blueprint(metrics_bp)
+    
+    # Periodic maintenance jobs and background job queue
+    from app.services.scheduler import scheduler, register_maintenance_jobs
+    from app.services.job_queue import job_queue
+    from app.services import tasks  # noqa: F401 - registers background tasks
+    scheduler.init_app(app)
+    register_maintenance_jobs(scheduler)
+    job_queue.init_app(app)
+    from app.services.ai_providers import ai_client
+    ai_client.init_app(app)
+    from app.services.chat_analytics import chat_events
+    chat_events.init_app(app)
+    from app.services import sessions
+    sessions.init_app(app)
+    from app.services.rate_limit import rate_limiter
+    rate_limiter.init_app(app)
+    from app.services.query_stats import query_stats
+    query_stats.init_app(app)
+    from app.services.metrics import metrics
+    metrics.init_app(app)
+    from app.services.profiler import profiler
+    profiler.init_app(app)
+    # Only start threads in the serving process, not the debug reloader's watcher
+    serving_process = not app.testing and (not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+    if serving_process and app.config.get('START_BACKGROUND_THREADS', True):
+        start_background_threads(app)
     
     # Error handlers
     @app.errorhandler(404)
@@ -103,23 +128,10 @@ def create_app(config_name='default'):
         flash('File too large. Maximum size is 100MB.', 'error')
         return render_template('errors/413.html'), 413
     
-    # Setup logging
-    if not app.debug and not app.testing:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        
-        file_handler = RotatingFileHandler(
-            'logs/library.log', 
-            maxBytes=10240000, 
-            backupCount=10
-        )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-        
-        app.logger.setLevel(logging.INFO)
+    # Setup logging: records are queued and written by a background thread
+    if not app.testing:
+        from app.services.structured_logging import configure_logging
+        configure_logging(app)
         app.logger.info('EduConnect Lesotho Digital Library startup')
     
     # Context processors for templates
@@ -188,4 +200,13 @@ def create_app(config_name='default'):
         s = round(size_bytes / p, 2)
         return f"{s} {size_names[i]}"
     
-    return app
\ No newline at end of file
+    return app
+
+def start_background_threads(app):
+    """Start the scheduler and job queue threads that are enabled for this process"""
+    from app.services.scheduler import scheduler
+    from app.services.job_queue import job_queue
+    if app.config.get('SCHEDULER_ENABLED'):
+        scheduler.start()
+    if app.config.get('JOB_QUEUE_ENABLED'):
+        job_queue.start()
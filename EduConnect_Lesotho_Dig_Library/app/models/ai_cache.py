@@ -0,0 +1,30 @@
+from app import db
+from datetime import datetime
+
+class AIResponseCache(db.Model):
+    """Stored AI answer, shared by every app process until it expires"""
+    __tablename__ = 'ai_response_cache'
+
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of prompt and context
+    kind = db.Column(db.String(20), nullable=False)  # chat, summary
+    provider = db.Column(db.String(20))
+    response = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_hit_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_ai_response_cache_expires', 'expires_at'),
+    )
+
+    @staticmethod
+    def get_kind_stats():
+        """Entries and stored hits per kind"""
+        rows = db.session.query(
+            AIResponseCache.kind, db.func.count(AIResponseCache.key), db.func.sum(AIResponseCache.hit_count)
+        ).group_by(AIResponseCache.kind).all()
+        return {kind: {'entries': entries, 'hits': int(hits or 0)} for kind, entries, hits in rows}
+
+    def __repr__(self):
+        return f'<AIResponseCache {self.kind} {self.key[:12]}>'
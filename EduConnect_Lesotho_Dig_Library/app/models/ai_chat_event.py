@@ -0,0 +1,88 @@
+from app import db
+from datetime import datetime
+import json
+
+class AIChatEvent(db.Model):
+    """One question answered (or not) by the AI assistant"""
+    __tablename__ = 'ai_chat_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # None for anonymous visitors
+    endpoint = db.Column(db.String(50), nullable=False)  # ai_chat, ai_chat_search, summarize, ...
+    question = db.Column(db.Text, nullable=False)
+    answer_preview = db.Column(db.String(300))
+    provider = db.Column(db.String(20))
+    status = db.Column(db.String(10), default='ok', nullable=False)  # ok, error
+    cached = db.Column(db.Boolean, default=False, nullable=False)
+    cache_source = db.Column(db.String(20))  # memory, database, shared, upstream
+    streamed = db.Column(db.Boolean, default=False, nullable=False)
+    latency_ms = db.Column(db.Integer)
+    first_token_ms = db.Column(db.Integer)
+    prompt_tokens = db.Column(db.Integer, default=0, nullable=False)
+    completion_tokens = db.Column(db.Integer, default=0, nullable=False)
+    actions = db.Column(db.Text)  # JSON list of suggested actions
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_ai_chat_events_created', 'created_at'),
+        db.Index('idx_ai_chat_events_user_id', 'user_id', 'id'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'endpoint': self.endpoint,
+            'query': self.question,
+            'answer': self.answer_preview,
+            'provider': self.provider,
+            'status': self.status,
+            'cached': self.cached,
+            'cache_source': self.cache_source,
+            'streamed': self.streamed,
+            'latency_ms': self.latency_ms,
+            'first_token_ms': self.first_token_ms,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'actions': json.loads(self.actions) if self.actions else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+    def __repr__(self):
+        return f'<AIChatEvent {self.id}: {self.endpoint} {self.status}>'
+
+class AIChatDailyRollup(db.Model):
+    """Per-day, per-provider totals kept up to date as events are written"""
+    __tablename__ = 'ai_chat_daily_rollups'
+
+    day = db.Column(db.Date, primary_key=True)
+    provider = db.Column(db.String(20), primary_key=True)  # 'none' when no provider answered
+    requests = db.Column(db.Integer, default=0, nullable=False)
+    errors = db.Column(db.Integer, default=0, nullable=False)
+    cache_hits = db.Column(db.Integer, default=0, nullable=False)
+    prompt_tokens = db.Column(db.Integer, default=0, nullable=False)
+    completion_tokens = db.Column(db.Integer, default=0, nullable=False)
+    total_latency_ms = db.Column(db.BigInteger, default=0, nullable=False)
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'day': self.day.isoformat(),
+            'provider': self.provider,
+            'requests': self.requests,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'average_latency_ms': round(self.total_latency_ms / self.requests) if self.requests else None
+        }
+
+class AIChatQueryRollup(db.Model):
+    """How often each normalised question was asked per day"""
+    __tablename__ = 'ai_chat_query_rollups'
+
+    day = db.Column(db.Date, primary_key=True)
+    query_hash = db.Column(db.String(64), primary_key=True)
+    question = db.Column(db.String(255), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
@@ -160,34 +160,29 @@ class Book(db.Model):
         """Check if digital book can be downloaded by a specific user"""
         from flask import current_app
         
-        current_app.logger.info(f"Download check for book {self.id} ({self.title}) by user {user.username}")
-        current_app.logger.info(f"Book is_active: {self.is_active}, is_digital: {self.is_digital}")
+        def decide(allowed, reason):
+            current_app.logger.debug('Download check for book %s by user %s: %s', self.id, user.id, reason)
+            return allowed, reason
         
         if not self.is_active:
-            current_app.logger.warning(f"Download blocked: Book is not active")
-            return False, "Book is not available"
+            return decide(False, "Book is not available")
         
         if not self.is_digital:
-            current_app.logger.warning(f"Download blocked: Book is not marked as digital")
-            return False, "This book is not available for download"
+            return decide(False, "This book is not available for download")
         
         # Only admin users can download without subscription
-        user_role = user.role.role_name if hasattr(user, 'role') and user.role else 'unknown'
-        current_app.logger.info(f"User role: {user_role}")
-
         if hasattr(user, 'role') and user.role and user.role.role_name == 'admin':
-            current_app.logger.info(f"Download allowed: User is {user_role}")
-            return True, "Can download"
+            return decide(True, "Can download")
 
         # All other users require active subscription
         if not user.can_access_digital_content():
             subscription_status = user.get_subscription_status()
             if subscription_status['status'] == 'expired':
-                return False, "Subscription expired. Please renew to download books."
+                return decide(False, "Subscription expired. Please renew to download books.")
             else:
-                return False, "You need an active subscription or pending renewal to download books"
+                return decide(False, "You need an active subscription or pending renewal to download books")
 
-        return True, "Can download with active subscription"
+        return decide(True, "Can download with active subscription")
     
     def get_average_rating(self):
         """Get average rating from reviews"""
@@ -238,12 +233,9 @@ class Book(db.Model):
         if self.is_digital:
             return  # Digital books don't have limited copies
         
-        borrowed_count = self.borrowing_transactions.filter(
-            BorrowingTransaction.status.in_(['borrowed', 'overdue'])
-        ).count()
-        
-        self.available_copies = max(0, self.total_copies - borrowed_count)
-        db.session.commit()
+        from app.services.inventory import reconcile_inventory
+        reconcile_inventory(book_ids=[self.id])
+        db.session.refresh(self)
     
     def to_dict(self, include_file_info=False):
         """Convert to dictionary for API responses"""
@@ -49,13 +49,14 @@ class BorrowingTransaction(db.Model):
         fine_per_day = float(current_app.config.get('FINE_PER_DAY', 1.00))
         return self.days_overdue() * fine_per_day
     
-    def update_fine(self):
+    def update_fine(self, commit=True):
         """Update fine amount"""
         if self.is_overdue():
             self.fine_amount = self.calculate_fine()
             if self.status != 'overdue':
                 self.status = 'overdue'
-            db.session.commit()
+            if commit:
+                db.session.commit()
     
     def can_renew(self):
         """Check if book can be renewed"""
@@ -71,14 +72,14 @@ class BorrowingTransaction(db.Model):
         if self.user.has_overdue_books():
             return False, "Cannot renew while having overdue books"
         
-        # Check if there are reservations for this book
+        # Check if anyone is waiting for this book
         from app.models.reservation import BookReservation
-        reservations = BookReservation.query.filter_by(
-            book_id=self.book_id,
-            status='active'
-        ).count()
+        has_reservations = db.session.query(db.exists().where(
+            BookReservation.book_id == self.book_id,
+            BookReservation.status == 'active'
+        )).scalar()
         
-        if reservations > 0:
+        if has_reservations:
             return False, "Book has pending reservations"
         
         return True, "Can renew"
@@ -103,6 +104,7 @@ class BorrowingTransaction(db.Model):
     
     def return_book(self, librarian_id, notes=None):
         """Return the book"""
+        from app.services.inventory import with_retry
         try:
             if self.status == 'returned':
                 return False, "Book already returned"
@@ -110,48 +112,52 @@ class BorrowingTransaction(db.Model):
                 from flask import current_app
                 current_app.logger.error(f"Return failed: Book object is None for transaction {self.id}")
                 return False, "Book object missing"
-            if not self.book.is_digital:
-                if self.book.available_copies is None:
-                    from flask import current_app
-                    current_app.logger.error(f"Return failed: available_copies is None for book {self.book_id}")
-                    return False, "Book available_copies missing"
-                self.book.available_copies += 1
-            self.returned_date = datetime.utcnow()
-            self.status = 'returned'
-            self.librarian_id = librarian_id
-            if notes:
-                self.notes = notes
-            if self.is_overdue():
-                self.update_fine()
-            db.session.commit()
+            
+            if not with_retry(self._check_in, librarian_id, notes):
+                return False, "Book already returned"
+            db.session.refresh(self)
             self._notify_reservations()
             return True, "Book returned successfully"
         except Exception as e:
+            db.session.rollback()
             from flask import current_app
             current_app.logger.error(f"Error processing return for transaction {self.id}: {str(e)}")
             return False, f"Error processing return: {str(e)}"
     
-    def _notify_reservations(self):
-        """Notify users with reservations that book is available"""
-        from app.models.reservation import BookReservation
-        from app.models.notification import Notification
+    def _check_in(self, librarian_id, notes):
+        """Mark the loan returned and put the copy back; does not commit"""
+        from app.services.inventory import checkin_copy
+        if self.is_overdue():
+            self.update_fine(commit=False)
         
-        reservations = BookReservation.query.filter_by(
-            book_id=self.book_id,
-            status='active'
-        ).order_by(BookReservation.reserved_date).all()
+        # Claim the loan with a conditional UPDATE so concurrent returns
+        # of the same loan put the copy back only once
+        values = {
+            'status': 'returned',
+            'returned_date': datetime.utcnow(),
+            'librarian_id': librarian_id,
+            'fine_amount': self.fine_amount,
+            'updated_at': datetime.utcnow()
+        }
+        if notes:
+            values['notes'] = notes
+        db.session.flush()
+        claimed = BorrowingTransaction.query.filter(
+            BorrowingTransaction.id == self.id,
+            BorrowingTransaction.status != 'returned'
+        ).update(values, synchronize_session=False)
+        if not claimed:
+            db.session.rollback()
+            return False
         
-        if reservations and self.book.is_available():
-            # Notify the first person in the reservation queue
-            reservation = reservations[0]
-            notification = Notification(
-                user_id=reservation.user_id,
-                title="Book Available",
-                message=f"The book '{self.book.title}' is now available for borrowing.",
-                type='info'
-            )
-            db.session.add(notification)
-            db.session.commit()
+        if not self.book.is_digital:
+            checkin_copy(self.book_id)
+        return True
+    
+    def _notify_reservations(self):
+        """Put the returned copy on hold for the next person in the reservation queue"""
+        from app.services.reservations import allocate_returned_copies
+        allocate_returned_copies([self.book_id])
     
     def get_duration_days(self):
         """Get borrowing duration in days"""
@@ -189,14 +195,29 @@ class BorrowingTransaction(db.Model):
         ).all()
     
     @staticmethod
-    def update_overdue_status():
-        """Update status of overdue books and calculate fines"""
-        overdue_transactions = BorrowingTransaction.get_overdue_transactions()
+    def update_overdue_status(batch_size=500):
+        """Update status of overdue books and calculate fines, committing per batch"""
+        updated = 0
+        last_id = 0
         
-        for transaction in overdue_transactions:
-            transaction.update_fine()
+        while True:
+            batch = BorrowingTransaction.query.filter(
+                BorrowingTransaction.status.in_(['borrowed', 'overdue']),
+                BorrowingTransaction.due_date < date.today(),
+                BorrowingTransaction.id > last_id
+            ).order_by(BorrowingTransaction.id).limit(batch_size).all()
+            
+            if not batch:
+                break
+            
+            for transaction in batch:
+                transaction.update_fine(commit=False)
+            db.session.commit()
+            
+            updated += len(batch)
+            last_id = batch[-1].id
         
-        return len(overdue_transactions)
+        return updated
     
     def __repr__(self):
         return f'<BorrowingTransaction {self.id}: User {self.user_id} - Book {self.book_id}>'
\ No newline at end of file
@@ -0,0 +1,55 @@
+from app import db
+from datetime import datetime
+
+class OutboundEmail(db.Model):
+    """Outgoing email waiting for (or done with) SMTP delivery"""
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    domain = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(500), nullable=False)
+    body_text = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text)
+    category = db.Column(db.String(50))  # reminder, billing, reservation, ...
+    status = db.Column(db.Enum('queued', 'sending', 'sent', 'failed', name='email_status'),
+                       default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_email_outbox_status_next', 'status', 'next_attempt_at'),
+        db.Index('idx_email_outbox_domain_sent', 'domain', 'sent_at'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'category': self.category,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+    @staticmethod
+    def get_status_counts():
+        """Get number of emails in each status"""
+        rows = db.session.query(
+            OutboundEmail.status, db.func.count(OutboundEmail.id)
+        ).group_by(OutboundEmail.status).all()
+        counts = {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def __repr__(self):
+        return f'<OutboundEmail {self.id}: {self.recipient} {self.status}>'
@@ -0,0 +1,61 @@
+from app import db
+from datetime import datetime
+
+class BackgroundJob(db.Model):
+    """Persistent background job picked up by the in-process worker pool"""
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON)
+    status = db.Column(db.Enum('queued', 'running', 'succeeded', 'failed', name='job_status'),
+                       default='queued', nullable=False)
+    idempotency_key = db.Column(db.String(255), unique=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    result = db.Column(db.JSON)
+    last_error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_background_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    def is_finished(self):
+        """Check if the job reached a terminal state"""
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'task_name': self.task_name,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'result': self.result,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    @staticmethod
+    def get_status_counts():
+        """Get number of jobs in each status"""
+        rows = db.session.query(
+            BackgroundJob.status, db.func.count(BackgroundJob.id)
+        ).group_by(BackgroundJob.status).all()
+        counts = {'queued': 0, 'running': 0, 'succeeded': 0, 'failed': 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id}: {self.task_name} {self.status}>'
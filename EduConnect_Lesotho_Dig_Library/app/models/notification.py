@@ -58,4 +58,24 @@ class Notification(db.Model):
         return notification
     
     def __repr__(self):
-        return f'<Notification {self.id}: {self.title}>'
\ No newline at end of file
+        return f'<Notification {self.id}: {self.title}>'
+
+class LoanReminder(db.Model):
+    """Record of a due/overdue reminder, one per loan per reminder window"""
+    __tablename__ = 'loan_reminders'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('borrowing_transactions.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    window_start = db.Column(db.Date, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # due_soon, overdue
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    emailed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('transaction_id', 'window_start', name='uq_loan_reminder_window'),
+        db.Index('idx_loan_reminders_email', 'window_start', 'emailed_at'),
+    )
+    
+    def __repr__(self):
+        return f'<LoanReminder {self.id}: Transaction {self.transaction_id} {self.kind}>'
@@ -75,6 +75,17 @@ class OfflineToken(db.Model):
             'device_info': self.device_info
         }
     
+    @staticmethod
+    def cleanup_expired():
+        """Deactivate expired offline tokens"""
+        expired_count = OfflineToken.query.filter(
+            OfflineToken.is_active == True,
+            OfflineToken.expiry_date < datetime.utcnow()
+        ).update({'is_active': False}, synchronize_session=False)
+        
+        db.session.commit()
+        return expired_count
+    
     def __repr__(self):
         return f'<OfflineToken {self.id}: User {self.user_id}>'
 
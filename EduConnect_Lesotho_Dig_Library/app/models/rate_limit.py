@@ -0,0 +1,16 @@
+from app import db
+
+class RateLimitBucket(db.Model):
+    """Token bucket shared by every app process (RATELIMIT_BACKEND=database)"""
+    __tablename__ = 'rate_limit_buckets'
+
+    key = db.Column(db.String(191), primary_key=True)  # scope:user:<id> or scope:ip:<address>
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix time of the last refill
+
+    __table_args__ = (
+        db.Index('idx_rate_limit_buckets_updated', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<RateLimitBucket {self.key}: {self.tokens:.1f}>'
@@ -0,0 +1,42 @@
+from app import db
+from datetime import datetime
+
+class BookSimilarity(db.Model):
+    """Precomputed top-K neighbours of a book from co-borrowing and reading history"""
+    __tablename__ = 'book_similarities'
+
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    similar_book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)  # 1 = most similar
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_book_similarities_book_rank', 'book_id', 'rank'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'book_id': self.book_id,
+            'similar_book_id': self.similar_book_id,
+            'score': self.score,
+            'rank': self.rank,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+    def __repr__(self):
+        return f'<BookSimilarity {self.book_id} -> {self.similar_book_id} ({self.score:.3f})>'
+
+class RelatedBook(db.Model):
+    """Ranked "related books" list for a book page, refreshed in the background"""
+    __tablename__ = 'related_books'
+
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 1 = most related; 0 marks a list found empty
+    related_book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<RelatedBook {self.book_id} #{self.rank}: {self.related_book_id}>'
@@ -14,6 +14,16 @@ class BookReservation(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)
     fulfilled_at = db.Column(db.DateTime)
     notes = db.Column(db.Text)
+    # 1-based place in the book's queue while active, NULL once it leaves
+    queue_position = db.Column(db.Integer)
+    # Set while a copy is waiting on the hold shelf for this patron
+    hold_expires_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_reservations_book_status_date', 'book_id', 'status', 'reserved_date'),
+        db.Index('idx_reservations_book_status_position', 'book_id', 'status', 'queue_position'),
+        db.Index('idx_reservations_status_hold', 'status', 'hold_expires_at'),
+    )
     
     def __init__(self, **kwargs):
         super(BookReservation, self).__init__(**kwargs)
@@ -25,20 +35,19 @@ class BookReservation(db.Model):
         """Check if reservation has expired"""
         return datetime.utcnow() > self.expires_at
     
+    def is_on_hold(self):
+        """Check if a copy is waiting on the hold shelf for this reservation"""
+        return self.status == 'active' and self.hold_expires_at is not None
+    
     def cancel(self, notes=None):
         """Cancel the reservation"""
-        self.status = 'cancelled'
-        if notes:
-            self.notes = notes
-        db.session.commit()
+        from app.services.reservations import leave_queue
+        leave_queue(self, 'cancelled', notes=notes)
     
     def fulfill(self, notes=None):
         """Mark reservation as fulfilled"""
-        self.status = 'fulfilled'
-        self.fulfilled_at = datetime.utcnow()
-        if notes:
-            self.notes = notes
-        db.session.commit()
+        from app.services.reservations import leave_queue
+        leave_queue(self, 'fulfilled', notes=notes)
     
     def mark_notified(self):
         """Mark that user has been notified"""
@@ -62,6 +71,9 @@ class BookReservation(db.Model):
             'status': self.status,
             'notified': self.notified,
             'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'queue_position': self.queue_position,
+            'on_hold': self.is_on_hold(),
+            'hold_expires_at': self.hold_expires_at.isoformat() if self.hold_expires_at else None,
             'fulfilled_at': self.fulfilled_at.isoformat() if self.fulfilled_at else None,
             'is_expired': self.is_expired(),
             'notes': self.notes
@@ -69,14 +81,9 @@ class BookReservation(db.Model):
     
     @staticmethod
     def cleanup_expired():
-        """Mark expired reservations"""
-        expired_count = BookReservation.query.filter(
-            BookReservation.status == 'active',
-            BookReservation.expires_at < datetime.utcnow()
-        ).update({'status': 'expired'})
-        
-        db.session.commit()
-        return expired_count
+        """Mark expired reservations and lapsed holds, passing copies on"""
+        from app.services.reservations import expire_reservations
+        return expire_reservations()
     
     def __repr__(self):
         return f'<BookReservation {self.id}: User {self.user_id} - Book {self.book_id}>'
\ No newline at end of file
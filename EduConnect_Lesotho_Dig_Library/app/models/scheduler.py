@@ -0,0 +1,90 @@
+from app import db
+from datetime import datetime
+
+class ScheduledJobState(db.Model):
+    """Shared schedule state and leader lock for a periodic job"""
+    __tablename__ = 'scheduled_jobs'
+
+    job_name = db.Column(db.String(100), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_run_at = db.Column(db.DateTime)
+    last_status = db.Column(db.String(20))
+    last_duration_ms = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def is_locked(self):
+        """Check if another instance currently holds the job lock"""
+        return self.locked_until is not None and self.locked_until > datetime.utcnow()
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'job_name': self.job_name,
+            'next_run_at': self.next_run_at.isoformat() if self.next_run_at else None,
+            'locked_by': self.locked_by if self.is_locked() else None,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_status': self.last_status,
+            'last_duration_ms': self.last_duration_ms
+        }
+
+    def __repr__(self):
+        return f'<ScheduledJobState {self.job_name}>'
+
+class ScheduledJobRun(db.Model):
+    """Run history for scheduled maintenance jobs"""
+    __tablename__ = 'scheduled_job_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(100), nullable=False)
+    instance_id = db.Column(db.String(100))
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='running')  # running, success, failed
+    batch_size = db.Column(db.Integer)
+    items_processed = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('idx_job_runs_name_started', 'job_name', 'started_at'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'job_name': self.job_name,
+            'instance_id': self.instance_id,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'batch_size': self.batch_size,
+            'items_processed': self.items_processed,
+            'error': self.error
+        }
+
+    @staticmethod
+    def get_duration_stats(job_name, limit=50):
+        """Get duration metrics over the most recent runs of a job"""
+        durations = [row[0] for row in db.session.query(ScheduledJobRun.duration_ms).filter(
+            ScheduledJobRun.job_name == job_name,
+            ScheduledJobRun.duration_ms.isnot(None)
+        ).order_by(db.desc(ScheduledJobRun.started_at)).limit(limit).all()]
+
+        if not durations:
+            return {'runs': 0, 'avg_ms': None, 'p95_ms': None, 'max_ms': None}
+
+        ordered = sorted(durations)
+        p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+        return {
+            'runs': len(durations),
+            'avg_ms': int(sum(durations) / len(durations)),
+            'p95_ms': ordered[p95_index],
+            'max_ms': ordered[-1]
+        }
+
+    def __repr__(self):
+        return f'<ScheduledJobRun {self.id}: {self.job_name} {self.status}>'
@@ -0,0 +1,19 @@
+from app import db
+from datetime import datetime
+
+class ServerSession(db.Model):
+    """Session data kept on the server; the cookie holds only the id"""
+    __tablename__ = 'server_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)  # Random, URL-safe
+    data = db.Column(db.Text, nullable=False)  # Tagged JSON, as in Flask's cookie sessions
+    version = db.Column(db.Integer, default=1, nullable=False)  # Bumped on every write
+    expires_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_server_sessions_expires', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<ServerSession {self.id[:8]} v{self.version}>'
@@ -1,7 +1,6 @@
 
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 import requests
-import random
 import string
 import os
 from werkzeug.utils import secure_filename
@@ -25,6 +24,16 @@ from decimal import Decimal
 from app.forms import SubscriptionPlanForm
 from flask import make_response
 
+def queue_related_books_refresh(book_id):
+    """Refresh a book's related-books list in the background"""
+    from app.services.job_queue import job_queue
+    job_queue.enqueue(
+        'refresh_related_books',
+        {'book_ids': [book_id]},
+        idempotency_key=f"refresh_related_books:{book_id}:{datetime.utcnow().strftime('%Y%m%d%H%M')}",
+        created_by=current_user.id
+    )
+
 def admin_required(f):
     """Decorator to require admin access"""
     @wraps(f)
@@ -78,85 +87,22 @@ def save_svg_to_file(svg_content, filename):
 @admin_bp.route('/books/load-free', methods=['POST'])
 @librarian_required
 def load_free_books():
-    """Automatically load 10 free books per active category"""
+    """Queue loading of 10 free books per active category"""
+    from app.services.job_queue import job_queue
+    
     categories = Category.query.filter_by(is_active=True).all()
     palette = ["#4e73df", "#1cc88a", "#36b9cc", "#f6c23e", "#e74a3b", "#858796", "#5a5c69", "#fd7e14", "#20c997", "#6610f2"]
-    added_count = 0
-    skipped_books = []
+    # One harvest per category per hour, so repeated clicks don't duplicate work
+    window = datetime.utcnow().strftime('%Y%m%d%H')
     for idx, category in enumerate(categories):
-        color = palette[idx % len(palette)]
-        books_data = fetch_free_books_for_category(category.name, count=10)
-        for book_info in books_data:
-            title = book_info.get('title', 'Untitled')
-            author = ', '.join(book_info.get('author_name', ['Unknown']))
-            isbn = book_info.get('isbn', [''])[0] if book_info.get('isbn') else None
-            publisher = book_info.get('publisher', [''])[0] if book_info.get('publisher') else ''
-            publication_year = book_info.get('first_publish_year', None)
-            pages = book_info.get('number_of_pages_median', None)
-            language = 'English'
-            description = book_info.get('subtitle', '')
-            is_digital = True
-            total_copies = 1
-            is_featured = False
-            # Sanitize file name for cover image
-            safe_title = secure_filename(title)
-            safe_author = secure_filename(author)
-            cover_image = None
-            if book_info.get('cover_i'):
-                cover_url = f"https://covers.openlibrary.org/b/id/{book_info['cover_i']}-L.jpg"
-                try:
-                    img_resp = requests.get(cover_url, timeout=10)
-                    if img_resp.status_code == 200:
-                        ext = '.jpg'
-                        fname = f"{secure_filename(category.name)}_{safe_title}_{safe_author}_{random.randint(1000,9999)}{ext}"
-                        covers_dir = os.path.join(current_app.root_path, '../static/uploads/covers')
-                        os.makedirs(covers_dir, exist_ok=True)
-                        img_path = os.path.join(covers_dir, fname)
-                        with open(img_path, 'wb') as img_file:
-                            img_file.write(img_resp.content)
-                        cover_image = f'covers/{fname}'
-                except Exception as e:
-                    current_app.logger.error(f"Cover image download error: {str(e)}")
-            if not cover_image:
-                svg = generate_svg_cover(title, author, color)
-                fname = f"{secure_filename(category.name)}_{safe_title}_{safe_author}_{random.randint(1000,9999)}.svg"
-                cover_image = save_svg_to_file(svg, fname)
-            # Check for duplicate ISBN
-            if isbn and Book.query.filter_by(isbn=isbn).first():
-                skipped_books.append({'title': title, 'author': author, 'category': category.name, 'reason': 'Duplicate ISBN'})
-                continue
-            # Add book
-            book = Book(
-                title=title,
-                author=author,
-                isbn=isbn,
-                publisher=publisher,
-                publication_year=publication_year,
-                pages=pages,
-                language=language,
-                description=description,
-                category_id=category.id,
-                is_digital=is_digital,
-                cover_image=cover_image,
-                total_copies=total_copies,
-                available_copies=total_copies,
-                is_featured=is_featured,
-                created_by=current_user.id
-            )
-            try:
-                db.session.add(book)
-                db.session.commit()
-                added_count += 1
-            except Exception as e:
-                db.session.rollback()
-                skipped_books.append({'title': title, 'author': author, 'category': category.name, 'reason': str(e)})
-                current_app.logger.error(f"Error adding book: {str(e)}")
-    summary = f"{added_count} free books loaded for all active categories."
-    if skipped_books:
-        summary += f" {len(skipped_books)} books skipped. "
-        for b in skipped_books:
-            summary += f"[Skipped: {b['title']} by {b['author']} ({b['category']}) - {b['reason']}] "
-    flash(summary, "success")
+        job_queue.enqueue(
+            'harvest_free_books',
+            {'category_id': category.id, 'color': palette[idx % len(palette)], 'user_id': current_user.id},
+            idempotency_key=f'harvest_free_books:{category.id}:{window}',
+            created_by=current_user.id
+        )
+    flash(f"Loading free books for {len(categories)} categories in the background. "
+          f"New books will appear as each category finishes.", "success")
     return redirect(url_for('admin.manage_books'))
 
 def admin_required(f):
@@ -211,18 +157,14 @@ def dashboard():
         if category:
             idx = (category.id - 1) % len(palette)
             color = palette[idx]
-        cover_image = book.cover_image
-        if not cover_image:
-            svg = generate_svg_cover(book.title, book.author, color)
-            fname = f"{category.name if category else 'General'}_{book.title[:18]}_{book.author[:18]}_{random.randint(1000,9999)}.svg"
-            cover_image = save_svg_to_file(svg, fname)
+        # Coverless books keep no cover here; viewing the dashboard must not write files
         recent_activity.append({
             'type': 'book',
             'type_class': 'primary',
             'description': f"Book added: {book.title}",
             'details': f"By {book.author}",
             'timestamp': book.created_at,
-            'cover_image': cover_image,
+            'cover_image': book.cover_image,
             'category_color': color
         })
 
@@ -437,7 +379,8 @@ def add_book():
                 except Exception as e:
                     flash('Error uploading cover image.', 'warning')
                     current_app.logger.error(f'Cover upload error: {str(e)}')
-        # If no cover image uploaded, assign SVG based on category
+        # If no cover image uploaded, an SVG based on category is generated in the background
+        cover_color = None
         if not cover_image:
             from app.models.book import Category
             category_obj = Category.query.get(category_id)
@@ -460,10 +403,7 @@ def add_book():
                 'Local': '#f59e42'
             }
             cat_name = category_obj.name.split(' ')[0] if category_obj else 'Academic'
-            color = category_colors.get(cat_name, '#764ba2')
-            svg = generate_svg_cover(title, author, color)
-            fname = f"{secure_filename(cat_name)}_{secure_filename(title)}_{secure_filename(author)}.svg"
-            cover_image = save_svg_to_file(svg, fname)
+            cover_color = category_colors.get(cat_name, '#764ba2')
         
         # Create book
         book = Book(
@@ -491,6 +431,15 @@ def add_book():
         try:
             db.session.add(book)
             db.session.commit()
+            if cover_color:
+                from app.services.job_queue import job_queue
+                job_queue.enqueue(
+                    'generate_book_cover',
+                    {'book_id': book.id, 'color': cover_color},
+                    idempotency_key=f'generate_book_cover:{book.id}',
+                    created_by=current_user.id
+                )
+            queue_related_books_refresh(book.id)
             flash(f'Book "{title}" has been added successfully.', 'success')
             return redirect(url_for('admin.manage_books'))
         except Exception as e:
@@ -591,6 +540,7 @@ def edit_book(book_id):
 
         try:
             db.session.commit()
+            queue_related_books_refresh(book.id)
             flash(f'Book "{book.title}" has been updated successfully.', 'success')
             return redirect(url_for('admin.manage_books'))
         except Exception as e:
@@ -1080,30 +1030,28 @@ def bulk_return():
             flash('No transactions selected for return.', 'error')
             return redirect(url_for('admin.bulk_return'))
         
-        success_count = 0
-        error_count = 0
-        error_messages = []
+        from app.services.returns import bulk_return_books
+        results = bulk_return_books(transaction_ids, current_user.id)
+        
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({
+                'success': all(r['status'] != 'error' for r in results),
+                'returned': sum(1 for r in results if r['status'] == 'returned'),
+                'results': results
+            })
         
-        for trans_id in transaction_ids:
-            try:
-                transaction = BorrowingTransaction.query.get(int(trans_id))
-                if transaction and transaction.status in ['borrowed', 'overdue']:
-                    success, message = transaction.return_book(current_user.id)
-                    if success:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        error_messages.append(f"Transaction {trans_id}: {message}")
-            except Exception as e:
-                error_count += 1
-                error_msg = f'Transaction {trans_id}: {str(e)}'
-                error_messages.append(error_msg)
-                current_app.logger.error(f'Bulk return error for transaction {trans_id}: {str(e)}')
+        success_count = sum(1 for r in results if r['status'] == 'returned')
+        error_messages = [f"Transaction {r['transaction_id']}: {r['message']}"
+                          for r in results if r['status'] != 'returned']
+        total_fines = sum(r['fine_amount'] or 0 for r in results)
         
         if success_count > 0:
-            flash(f'{success_count} book(s) successfully returned.', 'success')
-        if error_count > 0:
-            flash(f'{error_count} transaction(s) failed to process.', 'error')
+            message = f'{success_count} book(s) successfully returned.'
+            if total_fines:
+                message += f' Fines charged: {total_fines:.2f}.'
+            flash(message, 'success')
+        if error_messages:
+            flash(f'{len(error_messages)} transaction(s) failed to process.', 'error')
             for msg in error_messages[:3]:  # Show first 3 errors
                 flash(msg, 'warning')
         return redirect(url_for('admin.manage_borrowings'))
@@ -1115,6 +1063,42 @@ def bulk_return():
     
     return render_template('admin/bulk_return.html', transactions=borrowed_books)
 
+@admin_bp.route('/borrowings/pending')
+@librarian_required
+def pending_borrowings():
+    """Borrowing requests waiting for approval"""
+    borrowings = BorrowingTransaction.query.filter_by(status='pending').order_by(
+        BorrowingTransaction.created_at
+    ).all()
+    return render_template('admin/pending_borrowings.html', borrowings=borrowings)
+
+@admin_bp.route('/borrowings/<int:borrowing_id>/approve', methods=['POST'])
+@librarian_required
+def approve_borrowing(borrowing_id):
+    """Approve a borrowing request, taking a copy atomically"""
+    from app.services.inventory import approve_loan
+    
+    success, message = approve_loan(borrowing_id, current_user.id)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('admin.pending_borrowings'))
+
+@admin_bp.route('/borrowings/<int:borrowing_id>/reject', methods=['POST'])
+@librarian_required
+def reject_borrowing(borrowing_id):
+    """Reject a pending borrowing request"""
+    rejected = BorrowingTransaction.query.filter_by(id=borrowing_id, status='pending').update({
+        'status': 'rejected',
+        'librarian_id': current_user.id,
+        'updated_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    
+    if rejected:
+        flash('Borrowing request rejected.', 'success')
+    else:
+        flash('Request is no longer pending.', 'error')
+    return redirect(url_for('admin.pending_borrowings'))
+
 @admin_bp.route('/borrowings/<int:borrowing_id>/remind', methods=['POST'])
 @librarian_required
 def send_reminder(borrowing_id):
@@ -1130,21 +1114,12 @@ def send_reminder(borrowing_id):
                 'message': 'Cannot send reminder for returned books'
             }), 400
         
-        # Create notification
-        days_until_due = (transaction.due_date - date.today()).days
-        if days_until_due < 0:
-            message = f"Your borrowed book '{transaction.book.title}' is {abs(days_until_due)} day(s) overdue. Please return it as soon as possible."
-            notification_type = 'warning'
-        else:
-            message = f"Reminder: Your borrowed book '{transaction.book.title}' is due in {days_until_due} day(s). Due date: {transaction.due_date.strftime('%b %d, %Y')}."
-            notification_type = 'info'
-        
-        notification = Notification(
-            user_id=transaction.user_id,
-            title="Book Return Reminder",
-            message=message,
-            type=notification_type
-        )
+        # Same wording as the daily reminder run
+        from app.services.reminders import render_reminder
+        today = date.today()
+        kind = 'overdue' if transaction.due_date < today else 'due_soon'
+        notification = Notification(user_id=transaction.user_id,
+                                    **render_reminder(kind, transaction.book.title, transaction.due_date, today))
         
         db.session.add(notification)
         db.session.commit()
@@ -1164,46 +1139,29 @@ def send_reminder(borrowing_id):
 @admin_bp.route('/borrowings/send-reminders', methods=['POST'])
 @librarian_required
 def send_bulk_reminders():
-    """Send reminders to all users with due or overdue books"""
-    from app.models.notification import Notification
+    """Queue reminders to all users with due or overdue books"""
+    from app.services.job_queue import job_queue
     
     try:
-        # Get all borrowed and overdue books
-        transactions = BorrowingTransaction.query.filter(
-            BorrowingTransaction.status.in_(['borrowed', 'overdue'])
-        ).all()
-        
-        sent_count = 0
-        
-        for transaction in transactions:
-            # Only send reminders for books due within 3 days or overdue
-            days_until_due = (transaction.due_date - date.today()).days
-            
-            if days_until_due <= 3:
-                if days_until_due < 0:
-                    message = f"Your borrowed book '{transaction.book.title}' is {abs(days_until_due)} day(s) overdue. Please return it as soon as possible to avoid fines."
-                    notification_type = 'warning'
-                else:
-                    message = f"Reminder: Your borrowed book '{transaction.book.title}' is due in {days_until_due} day(s). Due date: {transaction.due_date.strftime('%b %d, %Y')}."
-                    notification_type = 'info'
-                
-                notification = Notification(
-                    user_id=transaction.user_id,
-                    title="Book Return Reminder",
-                    message=message,
-                    type=notification_type
-                )
-                
-                db.session.add(notification)
-                sent_count += 1
+        # At most one reminder run per day, however often the button is pressed
+        job = job_queue.enqueue(
+            'send_bulk_reminders',
+            idempotency_key=f'send_bulk_reminders:{date.today().isoformat()}',
+            created_by=current_user.id
+        )
         
-        db.session.commit()
+        if job.status == 'succeeded':
+            message = f"Reminders were already sent today ({(job.result or {}).get('sent_count', 0)} reminder(s))"
+        else:
+            message = 'Reminders are being sent in the background'
         
         return jsonify({
             'success': True,
-            'sent_count': sent_count,
-            'message': f'{sent_count} reminder(s) sent successfully'
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('api.get_job_status', job_id=job.id),
+            'message': message
+        }), 202
         
     except Exception as e:
         current_app.logger.error(f'Send bulk reminders error: {str(e)}')
@@ -1704,4 +1662,161 @@ def extend_subscription(subscription_id):
         db.session.rollback()
         flash(f'Error extending subscription: {str(e)}', 'error')
     
-    return redirect(url_for('admin.user_subscriptions'))
\ No newline at end of file
+    return redirect(url_for('admin.user_subscriptions'))
+
+@admin_bp.route('/scheduler')
+@login_required
+@admin_required
+def scheduler_status():
+    """Scheduled maintenance jobs with run history and duration metrics"""
+    from app.services.scheduler import scheduler
+    from app.models.scheduler import ScheduledJobRun
+    
+    recent_runs = ScheduledJobRun.query.order_by(
+        ScheduledJobRun.started_at.desc()
+    ).limit(50).all()
+    
+    return jsonify({
+        'success': True,
+        'instance_id': scheduler.instance_id,
+        'enabled': current_app.config.get('SCHEDULER_ENABLED', False),
+        'jobs': scheduler.get_status(),
+        'recent_runs': [run.to_dict() for run in recent_runs]
+    })
+
+@admin_bp.route('/scheduler/<job_name>/run', methods=['POST'])
+@login_required
+@admin_required
+def run_scheduled_job(job_name):
+    """Trigger a scheduled job immediately"""
+    from app.services.scheduler import scheduler
+    
+    if job_name not in scheduler.jobs:
+        return jsonify({'success': False, 'message': f'Unknown job {job_name}'}), 404
+    
+    run = scheduler.run_job(job_name, force=True)
+    if run is None:
+        return jsonify({'success': False, 'message': 'Job is already running on another instance'}), 409
+    
+    return jsonify({'success': run.status == 'success', 'run': run.to_dict()})
+
+@admin_bp.route('/ai-cache')
+@login_required
+@admin_required
+def ai_cache_status():
+    """AI response cache hit rates for this process and stored entries"""
+    from app.services.ai_cache import get_response_cache
+    from app.models.ai_cache import AIResponseCache
+    
+    return jsonify({
+        'success': True,
+        'enabled': current_app.config.get('AI_CACHE_ENABLED', True),
+        'process': get_response_cache().stats(),
+        'stored': AIResponseCache.get_kind_stats()
+    })
+
+@admin_bp.route('/rate-limits')
+@login_required
+@admin_required
+def rate_limit_status():
+    """Requests allowed and rejected per rate limit scope in this process"""
+    from app.services.rate_limit import rate_limiter
+    
+    return jsonify({'success': True, **rate_limiter.stats()})
+
+@admin_bp.route('/slow-endpoints')
+@login_required
+@admin_required
+def slow_endpoints():
+    """Query counts and database time per endpoint in this process; ?sort=db_ms|queries|slowest"""
+    from app.services.query_stats import query_stats
+    
+    return jsonify({
+        'success': True,
+        'endpoints': query_stats.report(sort=request.args.get('sort', 'db_ms'),
+                                        limit=min(request.args.get('limit', 50, type=int), 200))
+    })
+
+@admin_bp.route('/slow-endpoints/dashboard')
+@login_required
+@admin_required
+def slow_endpoints_dashboard():
+    """Slow endpoints table"""
+    from app.services.query_stats import query_stats
+    
+    sort = request.args.get('sort', 'db_ms')
+    return render_template('admin/slow_endpoints.html', endpoints=query_stats.report(sort=sort), sort=sort,
+                           n_plus_one=current_app.config.get('QUERY_STATS_N_PLUS_ONE', 10))
+
+@admin_bp.route('/profiles')
+@login_required
+@admin_required
+def request_profiles():
+    """Running profiling trigger and stored request profiles"""
+    import time
+    from app.services.profiler import profiler, MODES
+
+    return render_template('admin/profiles.html', trigger=profiler.active(), captures=profiler.captures(),
+                           modes=MODES, now=time.time(), enabled=current_app.config.get('PROFILE_ENABLED', True))
+
+@admin_bp.route('/profiles/start', methods=['POST'])
+@login_required
+@admin_required
+def start_profiling():
+    """Profile a fraction of the requests matching an endpoint or path pattern"""
+    from app.services.profiler import profiler
+
+    try:
+        profiler.start(request.form.get('pattern', '').strip(),
+                       fraction=request.form.get('percent', 100, type=float) / 100,
+                       mode=request.form.get('mode', 'sampling'),
+                       minutes=request.form.get('minutes', 30, type=int),
+                       max_captures=request.form.get('max_captures', 20, type=int),
+                       started_by=current_user.username)
+        flash('Profiling started.', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    return redirect(url_for('admin.request_profiles'))
+
+@admin_bp.route('/profiles/stop', methods=['POST'])
+@login_required
+@admin_required
+def stop_profiling():
+    """Stop the running profiling trigger in every worker"""
+    from app.services.profiler import profiler
+
+    profiler.stop()
+    flash('Profiling stopped.', 'info')
+    return redirect(url_for('admin.request_profiles'))
+
+@admin_bp.route('/profiles/<capture_id>.<kind>')
+@login_required
+@admin_required
+def download_profile(capture_id, kind):
+    """One capture file: collapsed stacks, pstats, or the cProfile text summary"""
+    from flask import send_file
+    from app.services.profiler import profiler, KINDS
+
+    path = profiler.capture_path(capture_id, kind)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_file(path, mimetype=KINDS[kind], as_attachment=True, download_name=os.path.basename(path))
+
+@admin_bp.route('/jobs')
+@login_required
+@admin_required
+def background_jobs():
+    """Background job queue status"""
+    from app.models.job_queue import BackgroundJob
+    
+    status = request.args.get('status')
+    query = BackgroundJob.query
+    if status:
+        query = query.filter_by(status=status)
+    jobs = query.order_by(BackgroundJob.created_at.desc()).limit(100).all()
+    
+    return jsonify({
+        'success': True,
+        'counts': BackgroundJob.get_status_counts(),
+        'jobs': [job.to_dict() for job in jobs]
+    })
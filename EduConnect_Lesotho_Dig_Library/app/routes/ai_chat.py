@@ -1,119 +1,85 @@
-from flask import Blueprint, request, jsonify, session, render_template
-import os, requests, openai, logging, json
+from flask import Blueprint, request, jsonify, session, render_template, g, current_app
+import logging, time
 from app.models.book import Book
-from app.models.review import BookReview
-from app.models.user import User
-from app import db
 from flask_login import login_required, current_user
+from app.services.ai_cache import cached_completion, stream_completion
+from app.services.ai_providers import ProviderError
+from app.services.ai_streaming import sse_response
+from app.services.chat_analytics import events_page, record_chat_event, rollups
+from app.services.rate_limit import AI_ANONYMOUS_LIMIT, AI_LIMIT, rate_limit
+from app.services.sessions import defer_session_save, save_deferred_session
 
 ai_chat_bp = Blueprint('ai_chat', __name__)
 
-openai.api_key = os.getenv('OPENAI_API_KEY', 'your-openai-key')
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your-gemini-key')
-AI_PROVIDER = os.getenv('AI_PROVIDER', 'openai')  # 'openai' or 'gemini'
-
-# Setup secure logger for analytics
-logger = logging.getLogger('ai_chat_analytics')
-logger.setLevel(logging.INFO)
-if not logger.hasHandlers():
-    handler = logging.FileHandler('logs/ai_chat_analytics.log')
-    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
-    logger.addHandler(handler)
-
-def get_ai_response(messages):
-    if AI_PROVIDER == 'openai':
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=256,
-            temperature=0.7
-        )
-        return response.choices[0].message['content'].strip()
-    elif AI_PROVIDER == 'gemini':
-        # Stub: Replace with Gemini API call
-        return "Gemini AI response (stub)."
-    else:
-        return "No valid AI provider configured."
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_ANSWER = "I'm sorry, I was unable to generate a response at this time. Please try again later."
+SYSTEM_PROMPT = 'You are a helpful, professional library assistant. Respond in a clear, polite, and professional manner.'
+
+def get_ai_response(messages, provider=None):
+    """Cached answer, or one from the preferred provider with fallback to the others"""
+    g.ai_completion = None
+    try:
+        g.ai_completion = cached_completion('chat', messages, provider=provider)
+        return g.ai_completion.text or UNAVAILABLE_ANSWER
+    except ProviderError as e:
+        logger.warning('AI chat unavailable: %s', e)
+        return UNAVAILABLE_ANSWER
 
 @ai_chat_bp.route('/api/ai-chat', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
 def ai_chat():
+    started = time.perf_counter()
     data = request.get_json()
     question = data.get('question', '')
-    provider = data.get('provider', 'openai')  # 'openai' or 'huggingface'
+    provider = data.get('provider')  # 'openai', 'gemini' or 'huggingface'
     if not question:
         return jsonify({'answer': 'Kindly enter your question so I may assist you.'}), 400
+    messages = [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        {'role': 'user', 'content': question}
+    ]
+    try:
+        completion = cached_completion('chat', messages, provider=provider)
+    except ProviderError:
+        record_chat_event('ai_chat', question, messages, started, answer='', error=True)
+        return jsonify({'answer': UNAVAILABLE_ANSWER}), 503
+    record_chat_event('ai_chat', question, messages, started, completion)
+    return jsonify({'answer': completion.text or UNAVAILABLE_ANSWER, 'provider': completion.provider})
 
-    if provider == 'huggingface':
-        HF_API_KEY = os.getenv('HF_API_KEY')
-        HF_API_URL = 'https://api-inference.huggingface.co/models/gpt2'  # Change model as needed
-        headers = {
-            'Authorization': f'Bearer {HF_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            'inputs': f"Please answer professionally: {question}"
-        }
-        try:
-            response = requests.post(HF_API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            answer = result[0]['generated_text'] if isinstance(result, list) and 'generated_text' in result[0] else str(result)
-            # Ensure professional fallback
-            if not answer or answer.strip() == '':
-                answer = "I'm sorry, I was unable to generate a response at this time. Please try again later."
-            return jsonify({'answer': answer})
-        except Exception as e:
-            return jsonify({'answer': f"An error occurred while processing your request. Please try again later. ({str(e)})"}), 500
-    else:
-        # Default to OpenAI
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        openai_api_url = os.getenv("OPENAI_API_URL")
-        headers = {
-            'Authorization': f'Bearer {openai_api_key}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            'model': 'gpt-3.5-turbo',
-            'messages': [
-                {'role': 'system', 'content': 'You are a helpful, professional library assistant. Respond in a clear, polite, and professional manner.'},
-                {'role': 'user', 'content': question}
-            ]
-        }
-        try:
-            response = requests.post(openai_api_url, headers=headers, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            answer = result['choices'][0]['message']['content']
-            if not answer or answer.strip() == '':
-                answer = "I'm sorry, I was unable to generate a response at this time. Please try again later."
-            return jsonify({'answer': answer})
-        except Exception as e:
-            return jsonify({'answer': f"An error occurred while processing your request. Please try again later. ({str(e)})"}), 500
-
-@ai_chat_bp.route('/ai_chat', methods=['POST'])
-def ai_chat_search():
+@ai_chat_bp.route('/api/ai-chat/stream', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
+def ai_chat_stream():
+    """/api/ai-chat, streamed as server-sent events"""
+    started = time.perf_counter()
     data = request.get_json()
-    user_query = data.get('query', '')
-    user_id = getattr(current_user, 'id', 'anonymous')
-    # Maintain chat history in session
-    if 'ai_chat_history' not in session:
-        session['ai_chat_history'] = []
-    session['ai_chat_history'].append({'role': 'user', 'content': user_query})
-    # Search books, reviews, categories, and static pages for context
-    books = Book.query.filter(Book.title.ilike(f'%{user_query}%')).limit(3).all()
-    reviews = BookReview.query.filter(BookReview.review_text.ilike(f'%{user_query}%')).limit(3).all()
-    categories = db.session.query(Book.category_id, Book.category).filter(Book.category.ilike(f'%{user_query}%')).limit(2).all()
-    # Optionally, search static pages (e.g., about, FAQ)
-    static_context = "Library hours: 8am-6pm. Contact: info@educonnect.ls. Location: Maseru, Lesotho."
-    context = []
-    for book in books:
-        context.append(f"Book: {book.title} by {book.author}. {book.description}")
-    for review in reviews:
-        context.append(f"Review: {review.review_text}")
-    for cat_id, cat_name in categories:
-        context.append(f"Category: {cat_name}")
-    context.append(static_context)
-    context_str = '\n'.join(context)
+    question = data.get('question', '')
+    if not question:
+        return jsonify({'answer': 'Kindly enter your question so I may assist you.'}), 400
+    messages = [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        {'role': 'user', 'content': question}
+    ]
+    stream = stream_completion('chat', messages, provider=data.get('provider'))
+    return sse_response(
+        stream, UNAVAILABLE_ANSWER,
+        on_complete=lambda stream: record_chat_event('ai_chat', question, messages, started, stream, streamed=True),
+        on_error=lambda error: record_chat_event('ai_chat', question, messages, started, stream, error=True,
+                                                 streamed=True)
+    )
+
+def _remember_chat_message(role, content):
+    """Add a message to the session's chat history, keeping only the newest"""
+    limit = current_app.config.get('AI_CHAT_HISTORY_LIMIT', 10)
+    history = session.get('ai_chat_history', []) + [{'role': role, 'content': content}]
+    session['ai_chat_history'] = history[-limit:]
+
+def _library_chat_messages(user_query):
+    """Record the question in the chat history and build the model's messages"""
+    _remember_chat_message('user', user_query)
+    # Retrieve the most relevant books, reviews, categories and library pages
+    from app.services.chat_retrieval import build_context
+    context_str = build_context(user_query)
     # Build chat history for AI
     history = session['ai_chat_history'][-5:]  # Last 5 messages for brevity
     messages = [
@@ -122,10 +88,9 @@ def ai_chat_search():
     ]
     for msg in history:
         messages.append(msg)
-    # Call OpenAI Chat API (can be replaced with Gemini, etc.)
-    answer = get_ai_response(messages)
-    session['ai_chat_history'].append({'role': 'assistant', 'content': answer})
-    session.modified = True
+    return messages
+
+def _answer_actions(answer):
     actions = []
     for book in Book.query.filter(Book.title.ilike(f'%{answer}%')).limit(1):
         actions.append({
@@ -138,46 +103,74 @@ def ai_chat_search():
             'label': f'View "{book.title}"',
             'book_id': book.id
         })
-    # Log analytics securely
-    logger.info(f"User: {user_id} | Query: {user_query} | Answer: {answer[:100]} | Actions: {actions}")
+    return actions
+
+@ai_chat_bp.route('/ai_chat', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
+def ai_chat_search():
+    started = time.perf_counter()
+    data = request.get_json()
+    user_query = data.get('query', '')
+    messages = _library_chat_messages(user_query)
+    answer = get_ai_response(messages)
+    _remember_chat_message('assistant', answer)
+    actions = _answer_actions(answer)
+    completion = g.get('ai_completion')
+    record_chat_event('ai_chat_search', user_query, messages, started, completion, answer=answer,
+                      actions=actions, error=answer == UNAVAILABLE_ANSWER)
     return jsonify({'answer': answer, 'actions': actions})
 
+@ai_chat_bp.route('/ai_chat/stream', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
+def ai_chat_search_stream():
+    """/ai_chat, streamed as server-sent events.
+
+    The session cookie is sent before the answer, so the answer is added to
+    the chat history by a deferred save once the stream ends.
+    """
+    started = time.perf_counter()
+    data = request.get_json()
+    user_query = data.get('query', '')
+    messages = _library_chat_messages(user_query)
+    stream = stream_completion('chat', messages)
+
+    def finish(stream):
+        _remember_chat_message('assistant', stream.text or UNAVAILABLE_ANSWER)
+        save_deferred_session()
+        actions = _answer_actions(stream.text)
+        record_chat_event('ai_chat_search', user_query, messages, started, stream, actions=actions, streamed=True)
+        return {'actions': actions}
+
+    def fail(error):
+        save_deferred_session()
+        record_chat_event('ai_chat_search', user_query, messages, started, stream, error=True, streamed=True)
+
+    defer_session_save()
+    return sse_response(stream, UNAVAILABLE_ANSWER, on_complete=finish, on_error=fail)
+
 @ai_chat_bp.route('/admin/ai_chat_logs')
 @login_required
 def ai_chat_logs():
-    if not getattr(current_user, 'is_admin', False):
+    """Recorded chat events, newest first; page with ?before_id=, filter by ?user_id="""
+    if not current_user.is_admin():
         return "Unauthorized", 403
-    # For demo: get all chat logs from session (in production, use DB)
-    logs = session.get('ai_chat_history', [])
-    return jsonify({'logs': logs})
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    page = events_page(before_id=request.args.get('before_id', type=int), per_page=per_page,
+                       user_id=request.args.get('user_id', type=int), endpoint=request.args.get('endpoint'))
+    return jsonify({'logs': page['events'], 'next_before_id': page['next_before_id']})
 
 @ai_chat_bp.route('/admin/ai_chat_analytics')
 @login_required
 def ai_chat_analytics():
-    if not getattr(current_user, 'is_admin', False):
+    """Daily, per-provider and top-question rollups for the last ?days= days"""
+    if not current_user.is_admin():
         return "Unauthorized", 403
-    log_path = 'logs/ai_chat_analytics.log'
-    analytics = []
-    if os.path.exists(log_path):
-        with open(log_path, 'r') as f:
-            for line in f:
-                # Parse log line
-                try:
-                    parts = line.strip().split('|')
-                    analytics.append({
-                        'timestamp': parts[0].split(' ')[0],
-                        'user': parts[1].split(':')[1].strip(),
-                        'query': parts[2].split(':')[1].strip(),
-                        'answer': parts[3].split(':')[1].strip(),
-                        'actions': parts[4].split(':')[1].strip()
-                    })
-                except Exception:
-                    continue
-    return jsonify({'analytics': analytics})
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    return jsonify(rollups(days=days))
 
 @ai_chat_bp.route('/admin/ai_chat_analytics_dashboard')
 @login_required
 def ai_chat_analytics_dashboard():
-    if not getattr(current_user, 'is_admin', False):
+    if not current_user.is_admin():
         return "Unauthorized", 403
     return render_template('admin/ai_chat_analytics.html')
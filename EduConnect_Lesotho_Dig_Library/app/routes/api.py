@@ -7,6 +7,7 @@ from app.models.user import User
 from app.models.borrowing import BorrowingTransaction
 from app.models.offline import OfflineToken, DigitalDownload
 from app.models.review import BookReview
+from app.services.rate_limit import rate_limit
 import hashlib
 from datetime import datetime, timedelta
 
@@ -23,6 +24,18 @@ def check_notifications():
         'notifications': []
     })
 
+@api_bp.route('/jobs/<int:job_id>')
+@login_required
+def get_job_status(job_id):
+    """API endpoint to poll the status of a background job"""
+    from app.models.job_queue import BackgroundJob
+    
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.created_by != current_user.id and not (current_user.is_admin() or current_user.is_librarian()):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    return jsonify(job.to_dict())
+
 @api_bp.route('/books')
 @login_required
 def get_books():
@@ -224,6 +237,7 @@ def offline_download_book(book_id):
         return jsonify({'error': 'Download failed'}), 500
 
 @api_bp.route('/search/suggestions')
+@rate_limit('120/minute', anonymous='60/minute')
 def search_suggestions():
     """API endpoint for search suggestions"""
     query = request.args.get('q', '').strip()
@@ -386,16 +400,10 @@ def add_book_review(book_id):
 
 @api_bp.route('/books/<int:book_id>/related')
 def get_related_books(book_id):
-    """Get related books based on category"""
+    """Get related books from the precomputed related-books list"""
     try:
-        book = Book.query.get_or_404(book_id)
-        
-        # Get books in the same category, excluding the current book
-        related_books = Book.query.filter(
-            Book.category_id == book.category_id,
-            Book.id != book_id,
-            Book.is_active == True
-        ).order_by(db.func.random()).limit(6).all()
+        from app.services.related_books import related_books_for
+        related_books = related_books_for(book_id, count=6)
         
         return jsonify({
             'success': True,
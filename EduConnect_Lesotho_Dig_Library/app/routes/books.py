@@ -206,11 +206,16 @@ def my_book(book_id):
 def borrow_book(book_id):
     """Borrow a book"""
     book = Book.query.get_or_404(book_id)
-    if not book.is_available():
+    from app.services.reservations import active_hold
+    if not book.is_available() and active_hold(current_user.id, book.id) is None:
         flash('This book is not available for borrowing.', 'error')
         return redirect(url_for('main.book_detail', book_id=book_id))
-    # Find a librarian (example logic, adjust as needed)
-    librarian = UserRole.query.filter_by(role='librarian').first()
+    # Assign the request to a librarian (or admin) until it is approved
+    from app.models.user import User
+    librarian = User.query.join(UserRole).filter(
+        UserRole.role_name.in_(['librarian', 'admin']),
+        User.is_active == True
+    ).first()
     if not librarian:
         flash('No librarian available to process the borrowing request.', 'error')
         return redirect(url_for('main.book_detail', book_id=book_id))
@@ -227,7 +232,7 @@ def borrow_book(book_id):
     try:
         db.session.add(transaction)
         db.session.commit()
-        flash(f'You have successfully borrowed "{book.title}". Due date: {due_date.strftime("%Y-%m-%d")}', 'success')
+        flash(f'Your request to borrow "{book.title}" has been sent to the librarian for approval.', 'success')
     except Exception as e:
         db.session.rollback()
         flash('An error occurred while borrowing the book. Please try again.', 'error')
@@ -405,17 +410,12 @@ def reserve_book(book_id):
         flash('You already have an active reservation for this book.', 'info')
         return redirect(url_for('main.book_detail', book_id=book_id))
     
-    # Create reservation
-    reservation = BookReservation(
-        user_id=current_user.id,
-        book_id=book_id
-    )
-    
     try:
-        db.session.add(reservation)
-        db.session.commit()
+        from app.services.reservations import join_queue
+        reservation = join_queue(current_user.id, book_id)
         
-        flash(f'You have successfully reserved "{book.title}". You will be notified when it becomes available.', 'success')
+        flash(f'You have successfully reserved "{book.title}". You are number {reservation.queue_position} '
+              f'in the queue and will be notified when it becomes available.', 'success')
         return redirect(url_for('main.book_detail', book_id=book_id))
         
     except Exception as e:
@@ -536,24 +536,19 @@ def review_book(book_id):
     form = CSRFOnlyForm()
 
     if request.method == 'POST':
-        current_app.logger.info('POST request received for review_book')
         rating = request.form.get('rating', type=int)
         content = request.form.get('content', '').strip()
-        current_app.logger.info(f'Form data: rating={rating}, content={content}')
 
         # Validation
         if not rating or rating < 1 or rating > 5:
             flash('Please provide a rating between 1 and 5 stars.', 'error')
-            current_app.logger.warning('Rating validation failed')
             return render_template('books/review.html', book=book, existing_review=existing_review, form=form)
         if not content or len(content) < 10:
             flash('Your review should be at least 10 characters long.', 'error')
-            current_app.logger.warning('Content validation failed')
             return render_template('books/review.html', book=book, existing_review=existing_review, form=form)
 
         if existing_review:
             # Update existing review
-            current_app.logger.info('Updating existing review')
             existing_review.rating = rating
             existing_review.review_text = content
             existing_review.updated_at = datetime.utcnow()
@@ -561,7 +556,7 @@ def review_book(book_id):
             try:
                 db.session.commit()
                 flash('Your review has been updated and is pending approval.', 'success')
-                current_app.logger.info('Review updated and committed')
+                current_app.logger.info('Review %s of book %s updated by user %s', existing_review.id, book_id, current_user.id)
                 return redirect(url_for('main.book_detail', book_id=book_id))
             except Exception as e:
                 db.session.rollback()
@@ -569,7 +564,6 @@ def review_book(book_id):
                 current_app.logger.error(f'Review update error: {str(e)}')
         else:
             # Create new review
-            current_app.logger.info('Creating new review')
             review = BookReview(
                 user_id=current_user.id,
                 book_id=book_id,
@@ -583,7 +577,7 @@ def review_book(book_id):
                 db.session.add(review)
                 db.session.commit()
                 flash('Your review has been submitted and is pending approval.', 'success')
-                current_app.logger.info('Review created and committed')
+                current_app.logger.info('Review %s of book %s created by user %s', review.id, book_id, current_user.id)
                 return redirect(url_for('main.book_detail', book_id=book_id))
             except Exception as e:
                 db.session.rollback()
@@ -665,28 +659,22 @@ def book_suggestions():
     if not current_user.is_authenticated:
         return jsonify([])
     
-    # Get user's reading categories
-    user_categories = db.session.query(Category.id).join(
-        Book, Category.id == Book.category_id
-    ).join(
-        BorrowingTransaction, Book.id == BorrowingTransaction.book_id
-    ).filter(
+    # Get the user's most recently borrowed books
+    recent_book_ids = [row[0] for row in db.session.query(BorrowingTransaction.book_id).filter(
         BorrowingTransaction.user_id == current_user.id
-    ).group_by(Category.id).all()
+    ).order_by(db.desc(BorrowingTransaction.borrowed_date)).limit(10).all()]
     
-    category_ids = [cat[0] for cat in user_categories]
+    suggestions = []
+    if recent_book_ids:
+        # Suggest from the precomputed related-books lists of those books
+        from app.services.related_books import related_books_for_many
+        suggestions = related_books_for_many(recent_book_ids, count=6, exclude=recent_book_ids)
     
-    if not category_ids:
+    if not suggestions:
         # If no history, suggest popular books
         suggestions = Book.query.filter_by(is_active=True).order_by(
             db.desc(Book.view_count + Book.download_count)
         ).limit(6).all()
-    else:
-        # Suggest books from user's preferred categories
-        suggestions = Book.query.filter(
-            Book.category_id.in_(category_ids),
-            Book.is_active == True
-        ).order_by(db.func.random()).limit(6).all()
     
     return jsonify([book.to_dict() for book in suggestions])
 
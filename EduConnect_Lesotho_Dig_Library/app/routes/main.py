@@ -28,6 +28,8 @@ from app.models.book import Book, Category
 from app.models.borrowing import BorrowingTransaction
 from app.models.review import BookReview
 from app.models.user import User
+from app.services.recommender import recommend_for_user
+from app.services.related_books import related_books_for
 from werkzeug.utils import secure_filename
 import os
 from datetime import datetime, date, timedelta
@@ -251,12 +253,8 @@ def book_detail(book_id):
             book_id=book.id
         ).first()
 
-    # Get similar books (same category, excluding current book)
-    similar_books = Book.query.filter(
-        Book.category_id == book.category_id,
-        Book.id != book.id,
-        Book.is_active == True
-    ).order_by(db.func.random()).limit(6).all()
+    # Rotate through the precomputed related-books list
+    similar_books = related_books_for(book.id, count=6)
 
     return render_template('main/book_detail.html',
                          book=book,
@@ -516,19 +514,18 @@ def health_check():
 @main_bp.route('/recommendations')
 @login_required
 def recommendations():
-    user_id = current_user.id
-    # Collaborative filtering: get books borrowed by similar users
-    user_borrowed_books = set([bt.book_id for bt in BorrowingTransaction.query.filter_by(user_id=user_id).all()])
-    similar_users = db.session.query(BorrowingTransaction.user_id).filter(BorrowingTransaction.book_id.in_(user_borrowed_books)).distinct()
-    similar_books = db.session.query(BorrowingTransaction.book_id).filter(BorrowingTransaction.user_id.in_(similar_users)).distinct()
-    # Content-based: get books in same categories as user's borrowed books
-    borrowed_books = Book.query.filter(Book.id.in_(user_borrowed_books)).all()
-    category_ids = set([b.category_id for b in borrowed_books])
-    content_books = Book.query.filter(Book.category_id.in_(category_ids), Book.id.notin_(user_borrowed_books), Book.is_active==True).limit(10).all()
-    # Combine and remove duplicates
-    recommended_book_ids = set([b.book_id for b in similar_books]) | set([b.id for b in content_books])
+    # Collaborative filtering from the precomputed book_similarities table
+    recommended_books = recommend_for_user(current_user.id, limit=12)
+    if not recommended_books:
+        # Content-based fallback until the nightly model has data for this member
+        user_borrowed_books = db.session.query(BorrowingTransaction.book_id).filter_by(user_id=current_user.id)
+        category_ids = db.session.query(Book.category_id).filter(Book.id.in_(user_borrowed_books))
+        recommended_books = Book.query.filter(
+            Book.category_id.in_(category_ids),
+            Book.id.notin_(user_borrowed_books),
+            Book.is_active == True
+        ).limit(12).all()
     import random
-    recommended_books = Book.query.filter(Book.id.in_(recommended_book_ids), Book.is_active==True).limit(12).all()
     svg_placeholders = [
         'uploads/books/cover_placeholder1.svg',
         'uploads/books/cover_placeholder2.svg',
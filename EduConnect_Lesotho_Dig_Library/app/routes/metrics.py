@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, abort, current_app, request
+import hmac
+from app.services.metrics import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint; requires "Authorization: Bearer <METRICS_TOKEN>" if a token is set"""
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token and current_app.config.get('METRICS_REQUIRE_TOKEN'):
+        current_app.logger.warning('/metrics requested but METRICS_TOKEN is not set; not serving it')
+        abort(404)
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
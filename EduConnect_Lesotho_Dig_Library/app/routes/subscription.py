@@ -5,7 +5,7 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 from app import db
 from app.models.subscription import SubscriptionPlan, UserSubscription, BillingRecord, Payment
-from app.models.user import User
+from app.models.user import User, UserRole
 
 subscription_bp = Blueprint('subscription', __name__, url_prefix='/subscription')
 
@@ -290,9 +290,9 @@ def create_automatic_renewal_bill(user_id, expired_subscription):
         new_subscription = UserSubscription(
             user_id=user_id,
             plan_id=expired_subscription.plan_id,
-            start_date=expired_subscription.end_date,  # Start from expiry date
-            is_active=False  # Will be activated when paid
+            start_date=expired_subscription.end_date  # Start from expiry date
         )
+        new_subscription.is_active = False  # Will be activated when paid
         db.session.add(new_subscription)
         db.session.flush()  # Get subscription ID
         
@@ -308,6 +308,17 @@ def create_automatic_renewal_bill(user_id, expired_subscription):
         db.session.add(billing_record)
         db.session.commit()
         
+        user = billing_record.user
+        if user:
+            from app.services.mailer import queue_email
+            queue_email(
+                user.email,
+                f'Subscription renewal: {expired_subscription.plan.name} plan',
+                f'Dear {user.first_name},\n\nYour {expired_subscription.plan.name} subscription has expired. '
+                f'A renewal bill of {billing_record.amount} is due by {billing_record.due_date.strftime("%b %d, %Y")}.',
+                category='billing'
+            )
+        
         return billing_record
         
     except Exception as e:
@@ -315,38 +326,47 @@ def create_automatic_renewal_bill(user_id, expired_subscription):
         current_app.logger.error(f'Error creating automatic renewal bill: {str(e)}')
         return None
 
+def process_expired_subscriptions(batch_size=None):
+    """Deactivate recently expired subscriptions and raise renewal bills.
+
+    Returns a tuple of (expired_subscriptions, renewal_bills_created).
+    """
+    # Find subscriptions that expired in the last 7 days but don't have renewal bills.
+    # Admins are left out here: they stay active, so skipping them in the loop
+    # would let them fill every batch
+    query = UserSubscription.query.join(User, User.id == UserSubscription.user_id).join(UserRole).filter(
+        UserSubscription.end_date <= datetime.utcnow(),
+        UserSubscription.end_date >= datetime.utcnow() - timedelta(days=7),
+        UserSubscription.is_active == True,
+        UserRole.role_name != 'admin'
+    ).order_by(UserSubscription.id)
+    if batch_size:
+        query = query.limit(batch_size)
+    expired_subscriptions = query.all()
+    
+    renewal_bills_created = 0
+    
+    for subscription in expired_subscriptions:
+        # Mark subscription as inactive
+        subscription.is_active = False
+        
+        # Create automatic renewal bill
+        renewal_bill = create_automatic_renewal_bill(subscription.user_id, subscription)
+        if renewal_bill:
+            renewal_bills_created += 1
+    
+    db.session.commit()
+    return len(expired_subscriptions), renewal_bills_created
+
 @subscription_bp.route('/api/check-expired-subscriptions', methods=['POST'])
 def check_expired_subscriptions():
     """API endpoint to check and handle expired subscriptions (for admin/cron jobs)"""
     try:
-        # Find subscriptions that expired in the last 7 days but don't have renewal bills
-        expired_subscriptions = UserSubscription.query.filter(
-            UserSubscription.end_date <= datetime.utcnow(),
-            UserSubscription.end_date >= datetime.utcnow() - timedelta(days=7),
-            UserSubscription.is_active == True
-        ).all()
-        
-        renewal_bills_created = 0
-        
-        for subscription in expired_subscriptions:
-            # Skip admin users
-            user = User.query.get(subscription.user_id)
-            if user and user.is_admin():
-                continue
-            
-            # Mark subscription as inactive
-            subscription.is_active = False
-            
-            # Create automatic renewal bill
-            renewal_bill = create_automatic_renewal_bill(subscription.user_id, subscription)
-            if renewal_bill:
-                renewal_bills_created += 1
-        
-        db.session.commit()
+        expired_count, renewal_bills_created = process_expired_subscriptions()
         
         return jsonify({
             'success': True,
-            'expired_subscriptions': len(expired_subscriptions),
+            'expired_subscriptions': expired_count,
             'renewal_bills_created': renewal_bills_created
         })
         
@@ -1,40 +1,66 @@
 from flask import Blueprint, request, jsonify
-import os, requests
+import time
+from app.services.ai_cache import cached_completion, stream_completion
+from app.services.ai_providers import ProviderError
+from app.services.ai_streaming import sse_response
+from app.services.chat_analytics import record_chat_event
+from app.services.rate_limit import AI_ANONYMOUS_LIMIT, AI_LIMIT, rate_limit
 
 summarize_search_bp = Blueprint('summarize_search', __name__)
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-OPENAI_API_URL = 'https://api.openai.com/v1/chat/completions'
-
 @summarize_search_bp.route('/api/summarize', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
 def summarize():
+    started = time.perf_counter()
     data = request.get_json()
     text = data.get('text', '')
     if not text:
         return jsonify({'summary': 'No text provided.'}), 400
-    headers = {
-        'Authorization': f'Bearer {OPENAI_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'model': 'gpt-3.5-turbo',
-        'messages': [
-            {'role': 'user', 'content': f'Summarize this: {text}'}
-        ]
-    }
+    messages = [{'role': 'user', 'content': f'Summarize this: {text}'}]
     try:
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        summary = result['choices'][0]['message']['content']
-        return jsonify({'summary': summary})
-    except Exception as e:
-        return jsonify({'summary': f'Error: {str(e)}'}), 500
+        completion = cached_completion('summary', messages)
+    except ProviderError as e:
+        record_chat_event('summarize', text, messages, started, answer='', error=True)
+        return jsonify({'summary': f'Error: {str(e)}'}), 503
+    record_chat_event('summarize', text, messages, started, completion)
+    return jsonify({'summary': completion.text})
+
+@summarize_search_bp.route('/api/summarize/stream', methods=['POST'])
+@rate_limit(AI_LIMIT, anonymous=AI_ANONYMOUS_LIMIT, scope='ai')
+def summarize_stream():
+    """/api/summarize, streamed as server-sent events"""
+    started = time.perf_counter()
+    data = request.get_json()
+    text = data.get('text', '')
+    if not text:
+        return jsonify({'summary': 'No text provided.'}), 400
+    messages = [{'role': 'user', 'content': f'Summarize this: {text}'}]
+    stream = stream_completion('summary', messages)
+    return sse_response(
+        stream, 'Unable to summarize right now. Please try again later.',
+        on_complete=lambda stream: record_chat_event('summarize', text, messages, started, stream, streamed=True),
+        on_error=lambda error: record_chat_event('summarize', text, messages, started, stream, error=True,
+                                                 streamed=True)
+    )
 
 @summarize_search_bp.route('/api/semantic-search', methods=['POST'])
 def semantic_search():
-    data = request.get_json()
-    query = data.get('query', '')
-    # For demo, return mock results. Integrate with real search API or embeddings for production.
-    results = [f"Result for '{query}' #1", f"Result for '{query}' #2"]
-    return jsonify({'results': results})
+    from app.services.semantic_search import search_books
+    data = request.get_json(silent=True) or {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        return jsonify({'results': [], 'books': [], 'error': 'No query provided.'}), 400
+    try:
+        k = min(max(int(data.get('k', 10) or 10), 1), 50)
+    except (TypeError, ValueError):
+        return jsonify({'results': [], 'books': [], 'error': 'k must be a whole number.'}), 400
+    matches = search_books(query, k=k)
+    return jsonify({
+        'results': [f'{book.title} by {book.author}' for book, _ in matches],
+        'books': [{
+            'id': book.id,
+            'title': book.title,
+            'author': book.author,
+            'score': round(score, 4)
+        } for book, score in matches]
+    })
@@ -0,0 +1,361 @@
+"""
+Response cache for AI chat answers and summaries.
+
+Many members ask the same thing ("summarize chapter 1 of Introduction to
+Computer Science"), so answers are cached under a key made of:
+
+- the kind of request (chat, summary)
+- the normalised prompt: case, punctuation and spacing are ignored, except
+  ``+`` and ``#`` at the end of a word ("C++", "C#")
+- a fingerprint of everything else that shapes the answer: the system
+  prompt, retrieved context, earlier turns, provider, model and sampling
+  settings
+
+Lookups go to a per-process LRU first and then to the shared
+``ai_response_cache`` table, so one process's answer serves them all until it
+expires (``AI_CACHE_TTL_SECONDS`` per kind). Concurrent identical requests in
+a process are single-flighted: one calls the provider and the rest wait for
+its answer. Failed calls are never cached. Database reads and writes run in
+their own transaction, never committing the caller's session.
+
+``stream_completion`` is the streaming equivalent: a hit is replayed at once,
+a miss is relayed from the provider as it arrives and stored only if it
+completes. Streamed misses are not single-flighted, since every reader wants
+its own tokens as soon as they exist.
+
+``ResponseCache.stats`` reports hits per tier, upstream calls and their time,
+and an estimate of the provider calls and tokens saved.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models.ai_cache import AIResponseCache
+from app.services.ai_providers import ai_client
+from app.services.chat_retrieval import estimate_tokens
+from app.services.metrics import AI_CACHE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+CachedCompletion = namedtuple('CachedCompletion', 'text provider latency source')
+
+_Entry = namedtuple('_Entry', 'text provider expires_at')
+
+# "C++" and "C#" are different questions from "C"
+_WORD = re.compile(r'\w+[+#]*')
+
+def normalize_prompt(prompt):
+    return ' '.join(_WORD.findall((prompt or '').casefold()))
+
+def fingerprint(*parts):
+    """Stable hash of any JSON-serialisable context"""
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def cache_key(kind, prompt, context=None):
+    return fingerprint(kind, normalize_prompt(prompt), fingerprint(context))
+
+class _Flight:
+    """One in-progress upstream call that identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+class ResponseCache:
+    """Two-tier (memory, database) cache with single-flight misses"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.counts = Counter()
+        self.upstream_seconds = 0.0
+        self.tokens_saved = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, tokens=0):
+        with self._lock:
+            self.counts[name] += 1
+            self.tokens_saved += tokens
+        AI_CACHE_EVENTS.inc(name)
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self.memory[key]
+                return None
+            self.memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, entry):
+        with self._lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def _db_get(self, key):
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(select(
+                    AIResponseCache.response, AIResponseCache.provider, AIResponseCache.expires_at
+                ).where(AIResponseCache.key == key, AIResponseCache.expires_at > now)).first()
+                if row is None:
+                    return None
+                connection.execute(update(AIResponseCache).where(AIResponseCache.key == key).values(
+                    hit_count=AIResponseCache.hit_count + 1, last_hit_at=now
+                ))
+        except SQLAlchemyError:
+            logger.exception('AI response cache lookup failed')
+            return None
+        expires_at = time.time() + (row.expires_at - now).total_seconds()
+        return _Entry(row.response, row.provider, expires_at)
+
+    def _db_put(self, key, kind, entry, ttl):
+        now = datetime.utcnow()
+        values = {'kind': kind, 'provider': entry.provider, 'response': entry.text, 'hit_count': 0,
+                  'created_at': now, 'expires_at': now + timedelta(seconds=ttl), 'last_hit_at': None}
+        try:
+            with db.engine.begin() as connection:
+                # Replace an expired answer left under the same key
+                replaced = connection.execute(update(AIResponseCache).where(AIResponseCache.key == key)
+                                              .values(values))
+                if not replaced.rowcount:
+                    connection.execute(insert(AIResponseCache).values(key=key, **values))
+        except SQLAlchemyError:
+            # Most likely another process stored the same answer first
+            logger.warning('Could not store AI response %s', key[:12], exc_info=True)
+
+    def _db_lookup(self, key):
+        entry = self._db_get(key)
+        if entry is not None:
+            self._count('database_hits', estimate_tokens(entry.text))
+            self._memory_put(key, entry)
+        return entry
+
+    def lookup(self, key, persist=True):
+        """(entry, source) from memory or the database, or (None, None)"""
+        self._count('requests')
+        entry = self._memory_get(key)
+        if entry is not None:
+            self._count('memory_hits', estimate_tokens(entry.text))
+            return entry, 'memory'
+        entry = self._db_lookup(key) if persist else None
+        return (entry, 'database') if entry is not None else (None, None)
+
+    def store(self, key, kind, text, provider, ttl, upstream_seconds=0.0, persist=True):
+        """Record an answer fresh from the provider"""
+        with self._lock:
+            self.counts['upstream_calls'] += 1
+            self.upstream_seconds += upstream_seconds
+        AI_CACHE_EVENTS.inc('upstream_calls')
+        entry = _Entry(text, provider, time.time() + ttl)
+        if persist:
+            self._db_put(key, kind, entry, ttl)
+        self._memory_put(key, entry)
+        return entry
+
+    def get_or_compute(self, key, kind, compute, ttl, persist=True):
+        """Cached answer for ``key``, or the result of ``compute()``.
+
+        ``compute`` returns an object with ``text`` and ``provider``; anything
+        it raises is re-raised to every waiting caller and nothing is cached.
+        """
+        started = time.perf_counter()
+        self._count('requests')
+
+        entry = self._memory_get(key)
+        if entry is not None:
+            self._count('memory_hits', estimate_tokens(entry.text))
+            return CachedCompletion(entry.text, entry.provider, time.perf_counter() - started, 'memory')
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            self._count('shared', estimate_tokens(flight.entry.text))
+            return CachedCompletion(flight.entry.text, flight.entry.provider, time.perf_counter() - started,
+                                    'shared')
+
+        try:
+            entry = self._db_lookup(key) if persist else None
+            if entry is not None:
+                source = 'database'
+            else:
+                source = 'upstream'
+                called = time.perf_counter()
+                try:
+                    result = compute()
+                except Exception:
+                    self._count('errors')
+                    raise
+                entry = self.store(key, kind, result.text, result.provider, ttl,
+                                   time.perf_counter() - called, persist=persist)
+            flight.entry = entry
+            return CachedCompletion(entry.text, entry.provider, time.perf_counter() - started, source)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            upstream_seconds = self.upstream_seconds
+            tokens_saved = self.tokens_saved
+            entries = len(self.memory)
+        requests = counts.get('requests', 0)
+        hits = sum(counts.get(name, 0) for name in ('memory_hits', 'database_hits', 'shared'))
+        upstream_calls = counts.get('upstream_calls', 0)
+        average_upstream = upstream_seconds / upstream_calls if upstream_calls else 0.0
+        return {
+            'requests': requests,
+            'memory_hits': counts.get('memory_hits', 0),
+            'database_hits': counts.get('database_hits', 0),
+            'shared': counts.get('shared', 0),
+            'upstream_calls': upstream_calls,
+            'errors': counts.get('errors', 0),
+            'evictions': counts.get('evictions', 0),
+            'memory_entries': entries,
+            'hit_rate': round(hits / requests, 4) if requests else 0.0,
+            'upstream_seconds': round(upstream_seconds, 3),
+            'estimated_seconds_saved': round(hits * average_upstream, 3),
+            'estimated_tokens_saved': tokens_saved,
+        }
+
+def get_response_cache():
+    """The response cache for the current app"""
+    max_entries = current_app.config.get('AI_CACHE_MAX_ENTRIES', 2048)
+    return current_app.extensions.setdefault('ai_response_cache', ResponseCache(max_entries))
+
+def _cache_key(kind, messages, provider, max_tokens, temperature):
+    """Key for a conversation: the last user message is the prompt, the rest is context"""
+    config = current_app.config
+    prompt_index = max((i for i, m in enumerate(messages) if m['role'] == 'user'), default=len(messages) - 1)
+    context = ([m for i, m in enumerate(messages) if i != prompt_index],
+               provider or config.get('AI_PROVIDER'), config.get('OPENAI_MODEL'), max_tokens, temperature)
+    return cache_key(kind, messages[prompt_index]['content'], context)
+
+def cached_completion(kind, messages, provider=None, max_tokens=256, temperature=0.7):
+    """``ai_client.complete`` through the response cache.
+
+    Raises ProviderError if the answer is not cached and no provider could
+    produce one.
+    """
+    config = current_app.config
+    if not config.get('AI_CACHE_ENABLED', True):
+        completion = ai_client.complete(messages, provider=provider, max_tokens=max_tokens, temperature=temperature)
+        return CachedCompletion(completion.text, completion.provider, completion.latency, 'upstream')
+
+    key = _cache_key(kind, messages, provider, max_tokens, temperature)
+    ttl = config.get('AI_CACHE_TTL_SECONDS', {}).get(kind, 86400)
+    return get_response_cache().get_or_compute(
+        key, kind,
+        lambda: ai_client.complete(messages, provider=provider, max_tokens=max_tokens, temperature=temperature),
+        ttl, persist=config.get('AI_CACHE_PERSIST', True)
+    )
+
+class CachedStream:
+    """A cached answer with the CompletionStream interface, replayed in one delta"""
+
+    complete = True
+    latency = first_token_latency = 0.0
+
+    def __init__(self, entry, source):
+        self.text = entry.text
+        self.provider = entry.provider
+        self.source = source
+
+    def __iter__(self):
+        if self.text:
+            yield self.text
+
+class StoringStream:
+    """Relay a CompletionStream and cache the answer once it has fully arrived"""
+
+    def __init__(self, cache, key, kind, stream, ttl, persist):
+        self.cache = cache
+        self.key = key
+        self.kind = kind
+        self.stream = stream
+        self.ttl = ttl
+        self.persist = persist
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        except Exception:
+            self.cache._count('errors')
+            raise
+        if self.stream.complete:
+            self.cache.store(self.key, self.kind, self.stream.text, self.stream.provider, self.ttl,
+                             self.stream.latency, persist=self.persist)
+
+def stream_completion(kind, messages, provider=None, max_tokens=256, temperature=0.7):
+    """``ai_client.stream`` through the response cache.
+
+    Returns an iterable of text deltas with ``text``, ``provider`` and
+    ``source`` attributes. Iterating raises ProviderError if no provider
+    could start an answer.
+    """
+    config = current_app.config
+    stream = ai_client.stream(messages, provider=provider, max_tokens=max_tokens, temperature=temperature)
+    if not config.get('AI_CACHE_ENABLED', True):
+        return stream
+
+    key = _cache_key(kind, messages, provider, max_tokens, temperature)
+    persist = config.get('AI_CACHE_PERSIST', True)
+    cache = get_response_cache()
+    entry, source = cache.lookup(key, persist=persist)
+    if entry is not None:
+        return CachedStream(entry, source)
+    ttl = config.get('AI_CACHE_TTL_SECONDS', {}).get(kind, 86400)
+    return StoringStream(cache, key, kind, stream, ttl, persist)
+
+def purge_expired(batch_size=1000):
+    """Delete expired cache rows in batches; returns the number deleted"""
+    deleted = 0
+    while True:
+        keys = [row[0] for row in db.session.query(AIResponseCache.key).filter(
+            AIResponseCache.expires_at <= datetime.utcnow()
+        ).limit(batch_size).all()]
+        if not keys:
+            break
+        db.session.execute(delete(AIResponseCache).where(AIResponseCache.key.in_(keys)))
+        db.session.commit()
+        deleted += len(keys)
+    return deleted
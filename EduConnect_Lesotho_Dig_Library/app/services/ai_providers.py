@@ -0,0 +1,473 @@
+"""
+Shared client for AI chat/completion providers.
+
+Every call to OpenAI, Gemini or HuggingFace goes through ``ai_client``:
+
+- one pooled ``requests.Session`` per process with strict connect and read
+  timeouts, so a stalled provider can no longer hold a worker forever
+- a circuit breaker per provider that stops calling it after
+  ``AI_CIRCUIT_FAILURES`` consecutive failures and lets a single trial
+  request through after ``AI_CIRCUIT_RESET_SECONDS``
+- fallback across ``AI_FALLBACK_PROVIDERS``, and optional hedging: with
+  ``AI_HEDGE_DELAY_SECONDS`` set, the next provider is raced against a slow
+  one and the first answer wins
+- an asyncio path (``acomplete``/``acomplete_many``, on httpx) so one worker
+  can keep many completions in flight
+- streaming (``stream``): text deltas are relayed as the provider sends them,
+  read from the provider only as fast as the caller consumes them
+
+Provider URLs come from config, so tests and benchmarks can point them at
+``app.services.fake_ai_provider.FakeProviderServer``.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.services.metrics import AI_PROVIDER_LATENCY
+
+logger = logging.getLogger(__name__)
+
+Completion = namedtuple('Completion', 'text provider latency')
+
+class ProviderError(Exception):
+    """A provider call failed"""
+
+class ProviderUnavailable(ProviderError):
+    """No configured provider could be called"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open trial request"""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give up a half-open trial without judging the provider"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+class Provider:
+    """Request building and response parsing for one provider's API"""
+
+    name = None
+
+    def __init__(self, api_key, url, model=None):
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.url)
+
+    def build_request(self, messages, max_tokens, temperature):
+        """Return (url, headers, json payload)"""
+        raise NotImplementedError
+
+    def parse(self, result):
+        raise NotImplementedError
+
+    def build_stream_request(self, messages, max_tokens, temperature):
+        url, headers, payload = self.build_request(messages, max_tokens, temperature)
+        payload['stream'] = True
+        return url, headers, payload
+
+    def parse_stream(self, event):
+        """Text delta carried by one server-sent event, if any"""
+        raise NotImplementedError
+
+class OpenAIProvider(Provider):
+    name = 'openai'
+
+    def build_request(self, messages, max_tokens, temperature):
+        headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+        payload = {'model': self.model, 'messages': messages, 'max_tokens': max_tokens,
+                   'temperature': temperature}
+        return self.url, headers, payload
+
+    def parse(self, result):
+        return result['choices'][0]['message']['content']
+
+    def parse_stream(self, event):
+        choices = event.get('choices') or []
+        return choices[0].get('delta', {}).get('content') if choices else None
+
+class GeminiProvider(Provider):
+    name = 'gemini'
+
+    def build_request(self, messages, max_tokens, temperature):
+        system = '\n'.join(m['content'] for m in messages if m['role'] == 'system')
+        contents = [{'role': 'model' if m['role'] == 'assistant' else 'user', 'parts': [{'text': m['content']}]}
+                    for m in messages if m['role'] != 'system']
+        payload = {'contents': contents,
+                   'generationConfig': {'maxOutputTokens': max_tokens, 'temperature': temperature}}
+        if system:
+            payload['systemInstruction'] = {'parts': [{'text': system}]}
+        return f'{self.url}?key={self.api_key}', {'Content-Type': 'application/json'}, payload
+
+    def parse(self, result):
+        return result['candidates'][0]['content']['parts'][0]['text']
+
+    def build_stream_request(self, messages, max_tokens, temperature):
+        url, headers, payload = self.build_request(messages, max_tokens, temperature)
+        url = url.replace(':generateContent?', ':streamGenerateContent?alt=sse&')
+        return url, headers, payload
+
+    def parse_stream(self, event):
+        candidates = event.get('candidates') or []
+        parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+        return ''.join(part.get('text', '') for part in parts)
+
+class HuggingFaceProvider(Provider):
+    name = 'huggingface'
+
+    def build_request(self, messages, max_tokens, temperature):
+        prompt = '\n'.join(m['content'] for m in messages)
+        headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+        payload = {'inputs': prompt, 'parameters': {'max_new_tokens': max_tokens, 'temperature': temperature,
+                                                    'return_full_text': False}}
+        return self.url, headers, payload
+
+    def parse(self, result):
+        if isinstance(result, list) and result and 'generated_text' in result[0]:
+            return result[0]['generated_text']
+        raise KeyError('generated_text')
+
+    def parse_stream(self, event):
+        token = event.get('token') or {}
+        return None if token.get('special') else token.get('text')
+
+class CompletionStream:
+    """Text deltas of one completion, as the provider produces them.
+
+    Falls back to the next provider only until the first delta has been
+    yielded. Afterwards ``text``, ``provider``, ``first_token_latency`` and
+    ``latency`` describe the answer, and ``complete`` says whether it was
+    received in full.
+    """
+
+    source = 'upstream'
+
+    def __init__(self, client, messages, provider=None, max_tokens=256, temperature=0.7):
+        self.client = client
+        self.messages = messages
+        self.preferred = provider
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.provider = None
+        self.parts = []
+        self.complete = False
+        self.first_token_latency = None
+        self.latency = None
+
+    @property
+    def text(self):
+        return ''.join(self.parts).strip()
+
+    def __iter__(self):
+        started = time.perf_counter()
+        errors = []
+        for candidate in self.client.candidates(self.preferred):
+            if not self.client.breakers[candidate.name].allow():
+                errors.append(f'{candidate.name}: circuit open')
+                continue
+            deltas = self.client._stream_call(candidate, self.messages, self.max_tokens, self.temperature)
+            try:
+                for delta in deltas:
+                    if self.first_token_latency is None:
+                        self.provider = candidate.name
+                        self.first_token_latency = time.perf_counter() - started
+                    self.parts.append(delta)
+                    yield delta
+            except ProviderError as e:
+                if self.parts:
+                    raise
+                errors.append(str(e))
+                continue
+            finally:
+                deltas.close()
+            self.provider = candidate.name
+            self.complete = True
+            self.latency = time.perf_counter() - started
+            return
+        raise ProviderUnavailable('; '.join(errors) or 'No AI provider is configured')
+
+class AIClient:
+    """Pooled, time-limited, circuit-broken access to the AI providers"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.breakers = {}
+        self._session = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['ai_client'] = self
+        self.breakers = {name: CircuitBreaker(app.config.get('AI_CIRCUIT_FAILURES', 5),
+                                              app.config.get('AI_CIRCUIT_RESET_SECONDS', 30))
+                         for name in ('openai', 'gemini', 'huggingface')}
+        if self._session is not None:
+            self._session.close()
+        self._session = None
+
+    @property
+    def providers(self):
+        config = self.app.config
+        return {
+            'openai': OpenAIProvider(config.get('OPENAI_API_KEY'), config.get('OPENAI_API_URL'),
+                                     config.get('OPENAI_MODEL')),
+            'gemini': GeminiProvider(config.get('GEMINI_API_KEY'), config.get('GEMINI_API_URL')),
+            'huggingface': HuggingFaceProvider(config.get('HF_API_KEY'), config.get('HF_API_URL')),
+        }
+
+    @property
+    def timeout(self):
+        return (self.app.config.get('AI_CONNECT_TIMEOUT', 3.05), self.app.config.get('AI_READ_TIMEOUT', 20))
+
+    @property
+    def session(self):
+        if self._session is None:
+            pool_size = self.app.config.get('AI_POOL_SIZE', 20)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(self.breakers), pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def candidates(self, provider=None):
+        """Configured providers to try, preferred one first"""
+        providers = self.providers
+        preferred = provider or self.app.config.get('AI_PROVIDER', 'openai')
+        order = [preferred] + [name for name in self.app.config.get('AI_FALLBACK_PROVIDERS', list(providers))
+                               if name != preferred]
+        return [providers[name] for name in order if name in providers and providers[name].configured]
+
+    def status(self):
+        return {name: {'configured': provider.configured, 'circuit': self.breakers[name].state,
+                       'failures': self.breakers[name].failures}
+                for name, provider in self.providers.items()}
+
+    def _failed(self, provider, error):
+        self.breakers[provider.name].record_failure()
+        logger.warning('AI provider %s failed: %s', provider.name, error)
+
+    # Synchronous path ------------------------------------------------------
+
+    def _call(self, provider, messages, max_tokens, temperature):
+        url, headers, payload = provider.build_request(messages, max_tokens, temperature)
+        started = time.perf_counter()
+        try:
+            response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            text = provider.parse(response.json())
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+            self._failed(provider, e)
+            AI_PROVIDER_LATENCY.observe(time.perf_counter() - started, provider.name, 'error')
+            raise ProviderError(f'{provider.name}: {e}') from e
+        self.breakers[provider.name].record_success()
+        latency = time.perf_counter() - started
+        AI_PROVIDER_LATENCY.observe(latency, provider.name, 'ok')
+        return Completion(text.strip(), provider.name, latency)
+
+    def complete(self, messages, provider=None, max_tokens=256, temperature=0.7):
+        """Get a completion, falling back across providers; raises ProviderError"""
+        if self.app.config.get('AI_HEDGE_DELAY_SECONDS'):
+            return asyncio.run(self.acomplete(messages, provider, max_tokens, temperature))
+
+        errors = []
+        for candidate in self.candidates(provider):
+            if not self.breakers[candidate.name].allow():
+                errors.append(f'{candidate.name}: circuit open')
+                continue
+            try:
+                return self._call(candidate, messages, max_tokens, temperature)
+            except ProviderError as e:
+                errors.append(str(e))
+        raise ProviderUnavailable('; '.join(errors) or 'No AI provider is configured')
+
+    # Streaming -------------------------------------------------------------
+
+    def _stream_call(self, provider, messages, max_tokens, temperature):
+        """Yield text deltas from one provider's server-sent events"""
+        url, headers, payload = provider.build_stream_request(messages, max_tokens, temperature)
+        breaker = self.breakers[provider.name]
+        response = None
+        outcome = None
+        started = time.perf_counter()
+        try:
+            response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout, stream=True)
+            response.raise_for_status()
+            response.encoding = 'utf-8'
+            # The read timeout applies between chunks, so a stalled stream still fails
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                delta = provider.parse_stream(json.loads(data))
+                if delta:
+                    yield delta
+            outcome = 'success'
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            outcome = 'failure'
+            self._failed(provider, e)
+            raise ProviderError(f'{provider.name}: {e}') from e
+        finally:
+            if response is not None:
+                response.close()
+            if outcome is not None:
+                AI_PROVIDER_LATENCY.observe(time.perf_counter() - started, provider.name,
+                                            'ok' if outcome == 'success' else 'error')
+            if outcome == 'success':
+                breaker.record_success()
+            elif outcome is None:
+                # The caller stopped reading (e.g. the browser went away)
+                breaker.release()
+
+    def stream(self, messages, provider=None, max_tokens=256, temperature=0.7):
+        """A CompletionStream; iterate it to receive the answer as it is generated"""
+        return CompletionStream(self, messages, provider, max_tokens, temperature)
+
+    # Asyncio path ----------------------------------------------------------
+
+    def async_client(self):
+        """An httpx.AsyncClient with this app's pool limits and timeouts"""
+        import httpx
+
+        connect, read = self.timeout
+        max_in_flight = self.app.config.get('AI_MAX_IN_FLIGHT', 50)
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+        )
+
+    async def _acall(self, client, provider, messages, max_tokens, temperature):
+        import httpx
+
+        url, headers, payload = provider.build_request(messages, max_tokens, temperature)
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            text = provider.parse(response.json())
+        except asyncio.CancelledError:
+            # Lost a hedged race; not the provider's fault
+            self.breakers[provider.name].release()
+            raise
+        except (httpx.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+            self._failed(provider, e)
+            AI_PROVIDER_LATENCY.observe(time.perf_counter() - started, provider.name, 'error')
+            raise ProviderError(f'{provider.name}: {e!r}') from e
+        self.breakers[provider.name].record_success()
+        latency = time.perf_counter() - started
+        AI_PROVIDER_LATENCY.observe(latency, provider.name, 'ok')
+        return Completion(text.strip(), provider.name, latency)
+
+    async def acomplete(self, messages, provider=None, max_tokens=256, temperature=0.7, client=None):
+        """Async completion with fallback and optional hedging across providers"""
+        if client is None:
+            async with self.async_client() as client:
+                return await self.acomplete(messages, provider, max_tokens, temperature, client)
+
+        hedge_delay = self.app.config.get('AI_HEDGE_DELAY_SECONDS')
+        remaining = list(self.candidates(provider))
+        running = set()
+        errors = []
+
+        def start_next():
+            while remaining:
+                candidate = remaining.pop(0)
+                if self.breakers[candidate.name].allow():
+                    running.add(asyncio.ensure_future(
+                        self._acall(client, candidate, messages, max_tokens, temperature)))
+                    return True
+                errors.append(f'{candidate.name}: circuit open')
+            return False
+
+        start_next()
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, timeout=hedge_delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The current attempt is slow: hedge with the next provider
+                    start_next()
+                    continue
+                for task in done:
+                    running.discard(task)
+                    try:
+                        return task.result()
+                    except ProviderError as e:
+                        errors.append(str(e))
+                if not running:
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+        raise ProviderUnavailable('; '.join(errors) or 'No AI provider is configured')
+
+    async def acomplete_many(self, conversations, provider=None, max_tokens=256, temperature=0.7):
+        """Run many completions concurrently over one connection pool.
+
+        Returns a Completion or ProviderError per conversation, in order.
+        """
+        max_in_flight = self.app.config.get('AI_MAX_IN_FLIGHT', 50)
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async with self.async_client() as client:
+            async def one(messages):
+                async with semaphore:
+                    try:
+                        return await self.acomplete(messages, provider, max_tokens, temperature, client)
+                    except ProviderError as e:
+                        return e
+            return await asyncio.gather(*(one(messages) for messages in conversations))
+
+ai_client = AIClient()
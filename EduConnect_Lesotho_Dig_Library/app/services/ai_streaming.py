@@ -0,0 +1,60 @@
+"""
+Server-sent event responses for streamed AI answers.
+
+``sse_response`` relays a completion stream (see ``ai_cache.stream_completion``)
+to the browser as it arrives:
+
+- ``event: token`` with ``{"text": ...}`` for every delta
+- ``event: done`` with the full answer, provider and whether it was cached
+- ``event: error`` if no provider could answer
+
+The relay is pull-based: the WSGI server asks for the next event only after
+writing the previous one to the socket, and only then is the next chunk read
+from the provider. A slow reader therefore slows the provider connection
+instead of buffering the answer in memory, and a reader that disconnects
+closes it.
+"""
+
+import json
+import logging
+
+from flask import Response, stream_with_context
+
+from app.services.ai_providers import ProviderError
+
+logger = logging.getLogger(__name__)
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def sse_response(stream, error_message, on_complete=None, on_error=None):
+    """Stream ``stream`` as server-sent events.
+
+    ``on_complete(stream)`` runs after the last token, still inside the
+    request, and may return extra fields for the ``done`` event.
+    ``on_error(error)`` runs if no provider could answer.
+    """
+    def generate():
+        # Send the headers and a first byte straight away
+        yield ': stream opened\n\n'
+        try:
+            for delta in stream:
+                yield sse_event('token', {'text': delta})
+        except ProviderError as e:
+            logger.warning('Streamed AI answer failed: %s', e)
+            if on_error:
+                on_error(e)
+            yield sse_event('error', {'message': error_message})
+            return
+        extra = on_complete(stream) if on_complete else None
+        yield sse_event('done', dict({
+            'answer': stream.text or error_message,
+            'provider': stream.provider,
+            'cached': stream.source != 'upstream'
+        }, **(extra or {})))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx and similar proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
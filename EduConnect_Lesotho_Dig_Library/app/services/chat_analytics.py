@@ -0,0 +1,293 @@
+"""
+AI chat analytics.
+
+Every AI answer is recorded as an ``ai_chat_events`` row with the member,
+question, provider, latency, estimated token counts, cache outcome and
+suggested actions. Request handlers only put the event on an in-memory
+queue; a writer thread started on first use inserts queued events in
+batches every ``AI_ANALYTICS_FLUSH_SECONDS`` and, in the same transaction,
+adds them to the per-day rollups (``ai_chat_daily_rollups`` per provider and
+``ai_chat_query_rollups`` per normalised question). The dashboard reads only
+the rollups, so it costs the same however many events have been recorded;
+raw events are paged by id.
+
+If the queue is full (``AI_ANALYTICS_QUEUE_SIZE``) events are dropped and
+counted rather than slowing down the request.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.ai_chat_event import AIChatDailyRollup, AIChatEvent, AIChatQueryRollup
+from app.services.ai_cache import normalize_prompt
+from app.services.chat_retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DAILY_COUNTERS = ('requests', 'errors', 'cache_hits', 'prompt_tokens', 'completion_tokens', 'total_latency_ms')
+
+class ChatEventRecorder:
+    """Queue of chat events written to the database by a background thread"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['chat_events'] = self
+        app.config.setdefault('AI_ANALYTICS_ENABLED', True)
+        app.config.setdefault('AI_ANALYTICS_ASYNC', True)
+        app.config.setdefault('AI_ANALYTICS_FLUSH_SECONDS', 2)
+        app.config.setdefault('AI_ANALYTICS_BATCH_SIZE', 200)
+        app.config.setdefault('AI_ANALYTICS_QUEUE_SIZE', 10000)
+        self._queue = queue.Queue(maxsize=app.config['AI_ANALYTICS_QUEUE_SIZE'])
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def record(self, **event):
+        """Queue an event for writing; never blocks the caller"""
+        if not self.app.config.get('AI_ANALYTICS_ENABLED', True):
+            return
+        event.setdefault('created_at', datetime.utcnow())
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.app.config.get('AI_ANALYTICS_ASYNC', True):
+            self.start()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of events written"""
+        batch_size = self.app.config.get('AI_ANALYTICS_BATCH_SIZE', 200)
+        total = 0
+        with self._write_lock:
+            while True:
+                batch = []
+                while len(batch) < batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    break
+                try:
+                    self.write(batch)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Could not write %d AI chat events', len(batch))
+                    break
+                total += len(batch)
+        self.written += total
+        return total
+
+    def write(self, events):
+        """Insert events and add them to the rollups in one transaction"""
+        for attempt in range(2):
+            try:
+                db.session.execute(insert(AIChatEvent), events)
+                _add_to_rollups(events)
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Another process created the same rollup row first; its
+                # counters now exist and can be incremented
+                db.session.rollback()
+                if attempt:
+                    raise
+
+    # Writer thread ---------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='chat-analytics', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self.app.app_context():
+            self.flush()
+
+    def _loop(self):
+        interval = self.app.config.get('AI_ANALYTICS_FLUSH_SECONDS', 2)
+        while not self._stop.wait(interval):
+            with self.app.app_context():
+                try:
+                    self.flush()
+                finally:
+                    db.session.remove()
+
+chat_events = ChatEventRecorder()
+
+def query_hash(query):
+    return hashlib.sha256(normalize_prompt(query).encode()).hexdigest()
+
+def _bump(model, key, increments, extra=None):
+    """Add ``increments`` to the rollup row at ``key``, creating it if needed"""
+    result = db.session.execute(
+        update(model).where(*[getattr(model, column) == value for column, value in key.items()])
+        .values({column: getattr(model, column) + amount for column, amount in increments.items()})
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(model).values(**key, **increments, **(extra or {})))
+
+def _add_to_rollups(events):
+    daily = defaultdict(Counter)
+    queries = Counter()
+    texts = {}
+    for event in events:
+        day = event['created_at'].date()
+        counters = daily[(day, event.get('provider') or 'none')]
+        counters['requests'] += 1
+        counters['errors'] += event.get('status') == 'error'
+        counters['cache_hits'] += bool(event.get('cached'))
+        counters['prompt_tokens'] += event.get('prompt_tokens') or 0
+        counters['completion_tokens'] += event.get('completion_tokens') or 0
+        counters['total_latency_ms'] += event.get('latency_ms') or 0
+        digest = query_hash(event['question'])
+        queries[(day, digest)] += 1
+        texts[digest] = normalize_prompt(event['question'])[:255]
+
+    for (day, provider), counters in sorted(daily.items()):
+        _bump(AIChatDailyRollup, {'day': day, 'provider': provider},
+              {name: counters[name] for name in DAILY_COUNTERS})
+    for (day, digest), count in sorted(queries.items()):
+        _bump(AIChatQueryRollup, {'day': day, 'query_hash': digest}, {'count': count},
+              extra={'question': texts[digest]})
+
+def record_chat_event(endpoint, query, messages, started, completion=None, answer=None, actions=None,
+                      error=False, streamed=False):
+    """Queue an analytics event for one AI request.
+
+    ``completion`` is whatever the cache or client returned (a
+    CachedCompletion or a stream); ``started`` is a ``time.perf_counter()``
+    value from the start of the request.
+    """
+    answer = answer if answer is not None else (completion.text if completion is not None else '')
+    first_token = getattr(completion, 'first_token_latency', None) if streamed else None
+    source = getattr(completion, 'source', None)
+    chat_events.record(
+        user_id=current_user.id if current_user.is_authenticated else None,
+        endpoint=endpoint,
+        question=query,
+        answer_preview=(answer or '')[:300],
+        provider=getattr(completion, 'provider', None),
+        status='error' if error else 'ok',
+        cached=source not in (None, 'upstream'),
+        cache_source=source,
+        streamed=streamed,
+        latency_ms=round((time.perf_counter() - started) * 1000),
+        first_token_ms=round(first_token * 1000) if first_token is not None else None,
+        prompt_tokens=sum(estimate_tokens(message['content']) for message in messages),
+        completion_tokens=estimate_tokens(answer or ''),
+        actions=json.dumps(actions) if actions else None
+    )
+
+# Reading ---------------------------------------------------------------------
+
+def rollups(days=30, top=10):
+    """Per-day and per-provider totals and the most asked questions"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = AIChatDailyRollup.query.filter(AIChatDailyRollup.day >= since).order_by(AIChatDailyRollup.day).all()
+
+    by_day = defaultdict(Counter)
+    by_provider = defaultdict(Counter)
+    for row in rows:
+        for name in DAILY_COUNTERS:
+            by_day[row.day][name] += getattr(row, name)
+            by_provider[row.provider][name] += getattr(row, name)
+    totals = Counter()
+    for counters in by_provider.values():
+        totals.update(counters)
+
+    def summary(counters):
+        requests = counters['requests']
+        return {
+            'requests': requests,
+            'errors': counters['errors'],
+            'cache_hits': counters['cache_hits'],
+            'cache_hit_rate': round(counters['cache_hits'] / requests, 4) if requests else 0.0,
+            'prompt_tokens': counters['prompt_tokens'],
+            'completion_tokens': counters['completion_tokens'],
+            'average_latency_ms': round(counters['total_latency_ms'] / requests) if requests else None
+        }
+
+    count = func.sum(AIChatQueryRollup.count)
+    top_queries = db.session.query(func.max(AIChatQueryRollup.question), count).filter(
+        AIChatQueryRollup.day >= since
+    ).group_by(AIChatQueryRollup.query_hash).order_by(count.desc()).limit(top).all()
+
+    return {
+        'days': days,
+        'totals': summary(totals),
+        'daily': [dict(summary(counters), day=day.isoformat()) for day, counters in sorted(by_day.items())],
+        'providers': [dict(summary(counters), provider=provider)
+                      for provider, counters in sorted(by_provider.items())],
+        'top_queries': [{'query': text, 'count': int(total)} for text, total in top_queries]
+    }
+
+def events_page(before_id=None, per_page=50, user_id=None, endpoint=None):
+    """Newest events first, paged by id so every page costs the same"""
+    query = AIChatEvent.query
+    if before_id:
+        query = query.filter(AIChatEvent.id < before_id)
+    if user_id is not None:
+        query = query.filter(AIChatEvent.user_id == user_id)
+    if endpoint:
+        query = query.filter(AIChatEvent.endpoint == endpoint)
+    events = query.order_by(AIChatEvent.id.desc()).limit(per_page + 1).all()
+    more = len(events) > per_page
+    events = events[:per_page]
+    return {
+        'events': [event.to_dict() for event in events],
+        'next_before_id': events[-1].id if more else None
+    }
+
+def purge_old_events(retention_days=None, batch_size=1000):
+    """Delete raw events older than the retention period; rollups are kept"""
+    retention_days = retention_days or current_app.config.get('AI_ANALYTICS_RETENTION_DAYS', 180)
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = [row[0] for row in db.session.query(AIChatEvent.id).filter(
+            AIChatEvent.created_at < cutoff
+        ).order_by(AIChatEvent.id).limit(batch_size).all()]
+        if not ids:
+            break
+        db.session.execute(delete(AIChatEvent).where(AIChatEvent.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
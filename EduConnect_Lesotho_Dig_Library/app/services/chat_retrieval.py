@@ -0,0 +1,291 @@
+"""
+Retrieval for AI chat context.
+
+Books, approved reviews, categories and the library's static information
+pages are split into short overlapping passages and indexed in memory with
+BM25. ``retrieve`` scores a question against that index, optionally fuses in
+the semantic search index for books (reciprocal rank fusion), and returns the
+best passages that fit in ``CHAT_CONTEXT_TOKEN_BUDGET``. Results are cached
+per normalised question until the index is rebuilt.
+
+Each process builds its own index on first use. After that, requests only
+read the current index: at most every ``CHAT_INDEX_CHECK_SECONDS`` a
+background thread (and the ``refresh_chat_index`` scheduler job) rebuilds
+it when new books, reviews or categories appear or when it is older than
+``CHAT_INDEX_MAX_AGE_SECONDS``, which picks up edits, and swaps it in.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.models.book import Book, Category
+from app.models.review import BookReview
+
+logger = logging.getLogger(__name__)
+
+Passage = namedtuple('Passage', 'kind ref_id title text tokens')
+
+STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'with', 'is', 'are', 'was', 'be',
+    'by', 'at', 'it', 'this', 'that', 'as', 'from', 'i', 'me', 'my', 'you', 'your', 'we', 'do',
+    'does', 'can', 'could', 'what', 'which', 'who', 'how', 'about', 'any', 'there', 'have', 'has',
+    'please', 'tell', 'give', 'some', 'want', 'need', 'would', 'like',
+}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+CHUNK_WORDS = 80
+CHUNK_OVERLAP = 20
+
+def tokenize(text):
+    return [word for word in _WORD.findall((text or '').lower()) if word not in STOPWORDS]
+
+def normalize_query(query):
+    return ' '.join(_WORD.findall((query or '').lower()))
+
+def estimate_tokens(text):
+    """Rough LLM token count: about four tokens for every three words"""
+    return math.ceil(len(text.split()) * 4 / 3)
+
+def chunk(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Split text into windows of ``size`` words that overlap by ``overlap``"""
+    words = (text or '').split()
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    step = size - overlap
+    return [' '.join(words[start:start + size]) for start in range(0, len(words) - overlap, step)]
+
+def static_pages():
+    """Library information that is not stored in the database"""
+    config = current_app.config
+    return [
+        ('Library hours and contact',
+         'Library hours: 8am-6pm. Contact: info@educonnect.ls. Location: Maseru, Lesotho.'),
+        ('Borrowing rules',
+         f"Books are lent for {config.get('DEFAULT_BORROWING_DAYS', 14)} days and can be renewed "
+         f"{config.get('MAX_RENEWALS', 2)} times unless someone has reserved them. Members may borrow up to "
+         f"{config.get('MAX_BOOKS_PER_USER', 5)} books at once. Overdue books are fined "
+         f"{config.get('FINE_PER_DAY', 1.00)} per day."),
+        ('Reservations',
+         'When a book is out on loan you can reserve it and join its queue. When a copy comes back it is '
+         f"held for the first person in line for {config.get('RESERVATION_HOLD_DAYS', 3)} days."),
+        ('Digital books and offline access',
+         'Digital books can be read online or downloaded for offline reading for '
+         f"{config.get('OFFLINE_ACCESS_DAYS', 30)} days, depending on your subscription plan."),
+    ]
+
+def load_passages():
+    passages = []
+
+    def add(kind, ref_id, title, text):
+        for piece in chunk(text):
+            tokens = tokenize(f'{title} {piece}')
+            if tokens:
+                passages.append(Passage(kind, ref_id, title, piece, tokens))
+
+    categories = dict(db.session.query(Category.id, Category.name))
+    for row in db.session.query(Book.id, Book.title, Book.author, Book.category_id, Book.description).filter(
+        Book.is_active == True
+    ):
+        category = categories.get(row.category_id, '')
+        add('book', row.id, row.title,
+            f'{row.title} by {row.author}. Category: {category}. {row.description or ""}')
+
+    for row in db.session.query(BookReview.id, BookReview.rating, BookReview.review_text, Book.title).join(
+        Book, Book.id == BookReview.book_id
+    ).filter(BookReview.is_approved == True, BookReview.review_text.isnot(None)):
+        add('review', row.id, row.title, f'Review of {row.title} ({row.rating}/5): {row.review_text}')
+
+    for row in db.session.query(Category.id, Category.name, Category.description).filter(
+        Category.is_active == True
+    ):
+        add('category', row.id, row.name, f'Category: {row.name}. {row.description or ""}')
+
+    for index, (title, text) in enumerate(static_pages()):
+        add('page', index, title, text)
+    return passages
+
+class BM25Index:
+    """Inverted index over passages scored with Okapi BM25"""
+
+    def __init__(self, passages):
+        self.passages = passages
+        self.postings = defaultdict(list)
+        self.lengths = [len(passage.tokens) for passage in passages]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if passages else 0.0
+        for position, passage in enumerate(passages):
+            for token, count in Counter(passage.tokens).items():
+                self.postings[token].append((position, count))
+        total = len(passages)
+        self.idf = {token: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for token, posting in self.postings.items()}
+
+    def search(self, query_tokens, limit=20):
+        """[(position, score)] of the best passages, best first"""
+        scores = defaultdict(float)
+        for token in set(query_tokens):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for position, count in self.postings[token]:
+                norm = K1 * (1 - B + B * self.lengths[position] / self.average_length)
+                scores[position] += idf * count * (K1 + 1) / (count + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+class ChatRetriever:
+    """Per-process BM25 index with a cache of recent retrievals"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._refresher = None
+        self.index = None
+        self.signature = None
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        self.cache = OrderedDict()
+
+    def _signature(self):
+        books = db.session.query(func.count(Book.id), func.max(Book.id)).filter(Book.is_active == True).one()
+        reviews = db.session.query(func.count(BookReview.id), func.max(BookReview.updated_at)).filter(
+            BookReview.is_approved == True
+        ).one()
+        categories = db.session.query(func.count(Category.id), func.max(Category.id)).one()
+        return tuple(books) + tuple(reviews) + tuple(categories)
+
+    def refresh(self, force=False):
+        """Rebuild and swap in the index if the catalogue changed; returns passages indexed"""
+        with self._build_lock:
+            now = time.monotonic()
+            self.checked_at = now
+            signature = self._signature()
+            stale = now - self.built_at > current_app.config.get('CHAT_INDEX_MAX_AGE_SECONDS', 3600)
+            if not (force or self.index is None or signature != self.signature or stale):
+                return 0
+
+            started = time.perf_counter()
+            index = BM25Index(load_passages())
+            with self._lock:
+                self.index = index
+                self.signature = signature
+                self.built_at = now
+                self.cache.clear()
+        logger.info('Built chat retrieval index: %d passages in %.2fs',
+                    len(index.passages), time.perf_counter() - started)
+        return len(index.passages)
+
+    def _refresh_in_background(self):
+        """Check for changes on a worker thread while requests keep using the current index"""
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Could not refresh the chat retrieval index')
+                finally:
+                    db.session.remove()
+
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self.checked_at = time.monotonic()
+            self._refresher = threading.Thread(target=run, name='chat-index-refresh', daemon=True)
+            self._refresher.start()
+
+    def _current_index(self):
+        if self.index is None:
+            # Nothing to serve yet, so the first request has to wait for a build
+            self.refresh()
+        elif time.monotonic() - self.checked_at >= current_app.config.get('CHAT_INDEX_CHECK_SECONDS', 60):
+            self._refresh_in_background()
+        return self.index
+
+    def _semantic_ranks(self, query):
+        """Rank of each book in the semantic search index, if one is available"""
+        try:
+            from app.services.semantic_search import get_index
+            hits = get_index().search(query, k=20)
+        except ImportError:
+            return {}
+        return {book_id: rank for rank, (book_id, _) in enumerate(hits)}
+
+    def retrieve(self, query, token_budget=None, limit=None):
+        """Best passages for ``query`` that fit within the token budget"""
+        config = current_app.config
+        token_budget = token_budget or config.get('CHAT_CONTEXT_TOKEN_BUDGET', 600)
+        limit = limit or config.get('CHAT_CONTEXT_MAX_PASSAGES', 6)
+        normalized = normalize_query(query)
+        if not normalized:
+            return []
+
+        index = self._current_index()
+        key = (normalized, token_budget, limit)
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        ranked = index.search(tokenize(normalized), limit=limit * 4)
+        semantic = self._semantic_ranks(normalized) if config.get('CHAT_CONTEXT_USE_VECTORS', True) else {}
+        if semantic:
+            # Reciprocal rank fusion of BM25 with the book vector index
+            fused = {}
+            for rank, (position, _) in enumerate(ranked):
+                passage = index.passages[position]
+                fused[position] = 1 / (RRF_K + rank)
+                if passage.kind == 'book' and passage.ref_id in semantic:
+                    fused[position] += 1 / (RRF_K + semantic[passage.ref_id])
+            ranked = sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+        chosen = []
+        used = 0
+        for position, _ in ranked:
+            passage = index.passages[position]
+            cost = estimate_tokens(passage.text)
+            if used + cost > token_budget:
+                continue
+            chosen.append(passage)
+            used += cost
+            if len(chosen) >= limit:
+                break
+
+        with self._lock:
+            if self.index is not index:
+                # Swapped while this query ran; do not cache against the new index
+                return chosen
+            self.cache[key] = chosen
+            while len(self.cache) > config.get('CHAT_RETRIEVAL_CACHE_SIZE', 512):
+                self.cache.popitem(last=False)
+        return chosen
+
+def get_retriever():
+    """The retriever for the current app"""
+    return current_app.extensions.setdefault('chat_retriever', ChatRetriever())
+
+def refresh_index():
+    """Rebuild this process's chat index if books, reviews or categories changed"""
+    return get_retriever().refresh()
+
+def build_context(query, token_budget=None):
+    """Context text for the chat model, one passage per line"""
+    labels = {'book': 'Book', 'review': 'Review', 'category': 'Category', 'page': 'Library info'}
+    return '\n'.join(f'{labels[passage.kind]}: {passage.text}'
+                     for passage in get_retriever().retrieve(query, token_budget=token_budget))
@@ -0,0 +1,154 @@
+"""
+Local fake AI provider for tests, benchmarks and development.
+
+Answers OpenAI chat completion, Gemini generateContent and HuggingFace
+inference requests on 127.0.0.1 with canned replies, so the provider client
+can be exercised without network access or API keys. Latency and failures
+can be injected per provider. Streaming requests get one server-sent event
+per word, ``token_delay`` apart, and providers in ``cut`` drop the
+connection after the first word::
+
+    with FakeProviderServer() as server:
+        app.config.update(server.config())
+        server.delay['openai'] = 0.5
+        server.fail.add('gemini')
+        ...
+        assert server.calls['huggingface'] == 1
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATHS = {
+    '/openai/v1/chat/completions': 'openai',
+    '/gemini/v1beta/models/gemini-pro:generateContent': 'gemini',
+    '/gemini/v1beta/models/gemini-pro:streamGenerateContent': 'gemini',
+    '/huggingface/models/gpt2': 'huggingface',
+}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, provider, answer):
+        fake = self.server.fake
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = answer.split(' ')
+        for index, word in enumerate(words):
+            delta = word if index == 0 else ' ' + word
+            if provider == 'openai':
+                event = {'choices': [{'delta': {'content': delta}}]}
+            elif provider == 'gemini':
+                event = {'candidates': [{'content': {'parts': [{'text': delta}]}}]}
+            else:
+                event = {'token': {'text': delta, 'special': False}, 'generated_text': None}
+            self._chunk(f'data: {json.dumps(event)}\n\n'.encode())
+            if provider in fake.cut:
+                self.close_connection = True
+                return
+            if fake.token_delay:
+                time.sleep(fake.token_delay)
+        if provider == 'openai':
+            self._chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_POST(self):
+        fake = self.server.fake
+        provider = PATHS.get(self.path.split('?', 1)[0])
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if provider is None:
+            return self._send(404, {'error': 'not found'})
+
+        with fake.lock:
+            fake.calls[provider] += 1
+            fake.connections.add(self.client_address)
+            fake.requests.append((provider, payload))
+        delay = fake.delay.get(provider, 0)
+        if delay:
+            time.sleep(delay)
+        if provider in fake.fail:
+            return self._send(503, {'error': f'{provider} unavailable'})
+
+        answer = fake.reply(provider, payload)
+        if payload.get('stream') or ':streamGenerateContent' in self.path:
+            return self._stream(provider, answer)
+        if provider == 'openai':
+            body = {'choices': [{'message': {'role': 'assistant', 'content': answer}}]}
+        elif provider == 'gemini':
+            body = {'candidates': [{'content': {'parts': [{'text': answer}]}}]}
+        else:
+            body = [{'generated_text': answer}]
+        self._send(200, body)
+
+class FakeProviderServer:
+    """Run the fake provider endpoints on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.lock = threading.Lock()
+        self.delay = {}
+        self.fail = set()
+        self.cut = set()
+        self.token_delay = 0
+        self.calls = Counter()
+        self.connections = set()
+        self.requests = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def reply(self, provider, payload):
+        return f'{provider} answer'
+
+    def config(self):
+        """App config pointing every provider at this server"""
+        paths = {provider: path for path, provider in PATHS.items() if 'stream' not in path}
+        return {
+            'OPENAI_API_URL': self.url + paths['openai'],
+            'OPENAI_API_KEY': 'test-openai-key',
+            'GEMINI_API_URL': self.url + paths['gemini'],
+            'GEMINI_API_KEY': 'test-gemini-key',
+            'HF_API_URL': self.url + paths['huggingface'],
+            'HF_API_KEY': 'test-hf-key',
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,),
+                                        name='fake-ai-provider', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
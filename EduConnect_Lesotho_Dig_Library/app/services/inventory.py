@@ -0,0 +1,154 @@
+"""
+Race-free inventory counters.
+
+``available_copies`` is only ever changed with conditional UPDATEs evaluated by
+the database (``available_copies = available_copies - 1 WHERE
+available_copies > 0``), so two librarians approving the last copy at the same
+moment cannot oversell it. Whole operations are wrapped in ``with_retry`` which
+re-runs them on lock timeouts and deadlocks. ``reconcile_inventory`` recomputes
+availability from active loans and held copies in bulk and is run nightly by the scheduler.
+"""
+
+import logging
+import random
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.reservation import BookReservation
+
+logger = logging.getLogger(__name__)
+
+# Loans that hold a physical copy
+ACTIVE_LOAN_STATUSES = ('borrowed', 'overdue', 'renewed')
+
+RETRYABLE_ERRORS = (
+    'database is locked',    # SQLite
+    'deadlock found',        # MySQL 1213
+    'lock wait timeout',     # MySQL 1205
+    'could not serialize',   # PostgreSQL
+)
+
+def is_retryable(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return any(marker in message for marker in RETRYABLE_ERRORS)
+
+def with_retry(operation, *args, **kwargs):
+    """Run ``operation`` and commit, retrying the whole transaction on lock conflicts"""
+    max_retries = current_app.config.get('INVENTORY_MAX_RETRIES', 5)
+    backoff = current_app.config.get('INVENTORY_RETRY_BACKOFF_SECONDS', 0.05)
+
+    for attempt in range(max_retries + 1):
+        try:
+            result = operation(*args, **kwargs)
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.info('Inventory transaction conflict (%s), retry %d in %.3fs', e.orig, attempt + 1, delay)
+            time.sleep(delay)
+
+def checkout_copy(book_id):
+    """Take one copy if any is left; returns False when none are available"""
+    taken = Book.query.filter(
+        Book.id == book_id,
+        Book.available_copies > 0
+    ).update({'available_copies': Book.available_copies - 1}, synchronize_session=False)
+    return taken == 1
+
+def checkin_copy(book_id, count=1):
+    """Put copies back, never exceeding total_copies"""
+    Book.query.filter(Book.id == book_id).update({
+        'available_copies': case(
+            (Book.available_copies + count > Book.total_copies, Book.total_copies),
+            else_=Book.available_copies + count
+        )
+    }, synchronize_session=False)
+
+def _approve(transaction_id, librarian_id):
+    loan = db.session.query(
+        BorrowingTransaction.user_id, BorrowingTransaction.book_id, BorrowingTransaction.status, Book.is_digital
+    ).join(Book, Book.id == BorrowingTransaction.book_id).filter(
+        BorrowingTransaction.id == transaction_id
+    ).first()
+    if loan is None:
+        return False, 'Borrowing request not found'
+
+    # Claim the request first so a double click cannot take two copies
+    claimed = BorrowingTransaction.query.filter(
+        BorrowingTransaction.id == transaction_id,
+        BorrowingTransaction.status == 'pending'
+    ).update({
+        'status': 'borrowed',
+        'librarian_id': librarian_id,
+        'borrowed_date': datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    }, synchronize_session=False)
+    if not claimed:
+        return False, f'Request is already {loan.status}'
+
+    if loan.is_digital:
+        return True, 'Borrowing approved'
+
+    # A copy already on the hold shelf for this borrower is handed over
+    from app.services.reservations import active_hold, remove_from_queue
+    hold = active_hold(loan.user_id, loan.book_id)
+    if hold is not None and remove_from_queue(hold.id, hold.book_id, hold.queue_position, 'fulfilled'):
+        return True, 'Borrowing approved from hold shelf'
+
+    if not checkout_copy(loan.book_id):
+        db.session.rollback()
+        return False, 'No copies available'
+    return True, 'Borrowing approved'
+
+def approve_loan(transaction_id, librarian_id):
+    """Approve a pending borrowing request, taking a copy atomically"""
+    return with_retry(_approve, transaction_id, librarian_id)
+
+def reconcile_inventory(batch_size=500, book_ids=None):
+    """Recompute available_copies from active loans and held copies for physical books.
+
+    Works through books in id order, one UPDATE per batch, and only touches
+    rows whose stored count is wrong. Returns the number of books corrected.
+    """
+    active_loans = select(func.count(BorrowingTransaction.id)).where(
+        BorrowingTransaction.book_id == Book.id,
+        BorrowingTransaction.status.in_(ACTIVE_LOAN_STATUSES)
+    ).correlate(Book).scalar_subquery()
+    held_copies = select(func.count(BookReservation.id)).where(
+        BookReservation.book_id == Book.id,
+        BookReservation.status == 'active',
+        BookReservation.hold_expires_at.isnot(None)
+    ).correlate(Book).scalar_subquery()
+    on_shelf = Book.total_copies - active_loans - held_copies
+    expected = case((on_shelf < 0, 0), else_=on_shelf)
+
+    corrected = 0
+    last_id = 0
+    while True:
+        query = db.session.query(Book.id).filter(Book.id > last_id, Book.is_digital == False)
+        if book_ids is not None:
+            query = query.filter(Book.id.in_(book_ids))
+        batch = [row[0] for row in query.order_by(Book.id).limit(batch_size).all()]
+        if not batch:
+            break
+        last_id = batch[-1]
+
+        corrected += Book.query.filter(
+            Book.id.in_(batch),
+            db.or_(Book.available_copies.is_(None), Book.available_copies != expected)
+        ).update({'available_copies': expected}, synchronize_session=False)
+        db.session.commit()
+
+    if corrected:
+        logger.warning('Inventory reconciliation corrected %d books', corrected)
+    return corrected
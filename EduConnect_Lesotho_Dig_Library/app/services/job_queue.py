@@ -0,0 +1,275 @@
+"""
+Persistent background job queue.
+
+Request handlers call ``job_queue.enqueue()`` which only inserts a row into
+``background_jobs`` and returns. A small pool of worker threads (or a separate
+``flask jobs-work`` process) claims queued rows with a conditional UPDATE, runs
+the registered task inside an app context and records the result. Failed jobs
+are retried with exponential backoff until ``max_attempts`` is reached. No
+external broker is needed; the database is the queue.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.job_queue import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+class Task:
+    """A registered background task"""
+
+    def __init__(self, name, func, max_attempts=None):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+
+class JobQueue:
+    """Task registry, enqueue API and worker pool, initialised like other extensions"""
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.app = None
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['job_queue'] = self
+        app.config.setdefault('JOB_QUEUE_ENABLED', False)
+        app.config.setdefault('JOB_QUEUE_WORKERS', 2)
+        app.config.setdefault('JOB_QUEUE_POLL_SECONDS', 2)
+        app.config.setdefault('JOB_QUEUE_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOB_QUEUE_RETRY_BASE_SECONDS', 10)
+        app.config.setdefault('JOB_QUEUE_RETRY_MAX_SECONDS', 3600)
+        app.config.setdefault('JOB_QUEUE_LOCK_SECONDS', 600)
+
+    def task(self, name, max_attempts=None):
+        """Decorator registering a function as a background task"""
+        def decorator(func):
+            self.tasks[name] = Task(name, func, max_attempts=max_attempts)
+            return func
+        return decorator
+
+    # Producer side ---------------------------------------------------------
+
+    def enqueue(self, task_name, payload=None, idempotency_key=None, delay=0,
+                max_attempts=None, created_by=None):
+        """Queue a task and return its job row.
+
+        If ``idempotency_key`` matches an existing job, that job is returned
+        instead of creating a duplicate; a job that failed for good is queued
+        again with the new payload and a fresh set of attempts.
+        """
+        if task_name not in self.tasks:
+            raise KeyError(f'Unknown background task: {task_name}')
+
+        task = self.tasks[task_name]
+        max_attempts = max_attempts or task.max_attempts or self.app.config['JOB_QUEUE_MAX_ATTEMPTS']
+        run_after = datetime.utcnow() + timedelta(seconds=delay)
+
+        if idempotency_key:
+            existing = BackgroundJob.query.filter_by(idempotency_key=idempotency_key).first()
+            if existing:
+                if existing.status == 'failed':
+                    return self._requeue(existing, payload, max_attempts, run_after, created_by)
+                return existing
+
+        job = BackgroundJob(
+            task_name=task_name,
+            payload=payload or {},
+            idempotency_key=idempotency_key,
+            max_attempts=max_attempts,
+            run_after=run_after,
+            created_by=created_by
+        )
+        try:
+            db.session.add(job)
+            db.session.commit()
+        except IntegrityError:
+            # Lost a race with a concurrent enqueue using the same key
+            db.session.rollback()
+            return BackgroundJob.query.filter_by(idempotency_key=idempotency_key).first()
+
+        self._wakeup.set()
+        return job
+
+    def _requeue(self, job, payload, max_attempts, run_after, created_by):
+        # Conditional so that concurrent enqueues revive the failed job only once
+        BackgroundJob.query.filter(
+            BackgroundJob.id == job.id,
+            BackgroundJob.status == 'failed'
+        ).update({
+            'status': 'queued',
+            'payload': payload or {},
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'run_after': run_after,
+            'locked_by': None,
+            'locked_until': None,
+            'result': None,
+            'last_error': None,
+            'started_at': None,
+            'finished_at': None,
+            'created_by': created_by
+        }, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(job)
+        self._wakeup.set()
+        return job
+
+    # Worker side -----------------------------------------------------------
+
+    def _claimable(self, now):
+        """Queued jobs that are due, plus running jobs whose worker died"""
+        return db.or_(
+            db.and_(BackgroundJob.status == 'queued', BackgroundJob.run_after <= now),
+            db.and_(BackgroundJob.status == 'running', BackgroundJob.locked_until < now)
+        )
+
+    def claim(self, now=None):
+        """Atomically claim the next due job for this worker, or return None"""
+        now = now or datetime.utcnow()
+        lock_seconds = self.app.config['JOB_QUEUE_LOCK_SECONDS']
+        candidate_ids = [row[0] for row in db.session.query(BackgroundJob.id).filter(
+            self._claimable(now),
+            BackgroundJob.task_name.in_(list(self.tasks))
+        ).order_by(BackgroundJob.run_after, BackgroundJob.id).limit(5).all()]
+
+        for job_id in candidate_ids:
+            claimed = BackgroundJob.query.filter(
+                BackgroundJob.id == job_id,
+                self._claimable(now)
+            ).update({
+                'status': 'running',
+                'locked_by': f'{self.instance_id}:{threading.get_ident()}',
+                'locked_until': now + timedelta(seconds=lock_seconds),
+                'started_at': now,
+                'attempts': BackgroundJob.attempts + 1
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed == 1:
+                return db.session.get(BackgroundJob, job_id)
+        return None
+
+    def retry_delay(self, attempts):
+        """Exponential backoff with +/-20% jitter"""
+        base = self.app.config['JOB_QUEUE_RETRY_BASE_SECONDS']
+        cap = self.app.config['JOB_QUEUE_RETRY_MAX_SECONDS']
+        delay = min(base * (2 ** max(attempts - 1, 0)), cap)
+        return delay * random.uniform(0.8, 1.2)
+
+    def execute(self, job):
+        """Run a claimed job and record success, retry or failure"""
+        task = self.tasks.get(job.task_name)
+        job_id = job.id
+
+        if job.attempts > job.max_attempts:
+            # Reclaimed after its worker died on the final attempt
+            job.status = 'failed'
+            job.last_error = job.last_error or 'Worker stopped before the job finished'
+            job.finished_at = datetime.utcnow()
+            job.locked_by = job.locked_until = None
+            db.session.commit()
+            return job
+
+        started = time.perf_counter()
+        try:
+            result = task.func(**(job.payload or {}))
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(BackgroundJob, job_id)
+            job.last_error = f'{type(e).__name__}: {e}'
+            job.locked_by = job.locked_until = None
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+                logger.exception('Background job %s (%s) failed permanently', job_id, job.task_name)
+            else:
+                job.status = 'queued'
+                job.run_after = datetime.utcnow() + timedelta(seconds=self.retry_delay(job.attempts))
+                logger.warning('Background job %s (%s) failed, retry %d/%d at %s',
+                               job_id, job.task_name, job.attempts, job.max_attempts, job.run_after)
+            db.session.commit()
+            return job
+
+        job = db.session.get(BackgroundJob, job_id)
+        job.status = 'succeeded'
+        job.result = result if isinstance(result, (dict, list, str, int, float, bool)) else None
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        job.locked_by = job.locked_until = None
+        db.session.commit()
+        logger.info('Background job %s (%s) succeeded in %.0fms',
+                    job_id, job.task_name, (time.perf_counter() - started) * 1000)
+        return job
+
+    def work_once(self):
+        """Claim and run a single job; returns the job or None if the queue was empty"""
+        job = self.claim()
+        if job is None:
+            return None
+        return self.execute(job)
+
+    def run_until_empty(self, limit=None):
+        """Drain due jobs in the current thread; used by the CLI and tests"""
+        processed = 0
+        while limit is None or processed < limit:
+            if self.work_once() is None:
+                break
+            processed += 1
+        return processed
+
+    # Worker pool -----------------------------------------------------------
+
+    def start(self, workers=None):
+        """Start the worker thread pool"""
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        workers = workers or self.app.config['JOB_QUEUE_WORKERS']
+        # A forked worker must not hold locks under its parent's name
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop.clear()
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info('Job queue started %d workers on %s', workers, self.instance_id)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker_loop(self):
+        poll = self.app.config['JOB_QUEUE_POLL_SECONDS']
+        while not self._stop.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    job = self.work_once()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Job worker error')
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+job_queue = JobQueue()
@@ -0,0 +1,306 @@
+"""
+Outbound email subsystem.
+
+Callers queue messages with ``queue_email``/``queue_emails``, which only
+insert rows into ``email_outbox``. ``deliver_outbox`` (run by the job queue
+and swept every minute by the scheduler) claims due messages in batches,
+respecting per-domain rate limits, and sends each batch over a single SMTP
+connection that is opened and authenticated once. Transient failures (4xx
+replies, dropped connections) are retried with exponential backoff; permanent
+5xx rejections are marked failed.
+"""
+
+import logging
+import random
+import smtplib
+import socket
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import make_msgid, formatdate
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db
+from app.models.email_outbox import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+class TransientEmailError(Exception):
+    """Delivery failed but may succeed later"""
+
+class PermanentEmailError(Exception):
+    """Delivery was rejected and should not be retried"""
+
+def email_enabled():
+    return bool(current_app.config.get('MAIL_SERVER'))
+
+def _domain_of(address):
+    return address.rsplit('@', 1)[-1].strip().lower()
+
+def queue_emails(messages, category=None, deliver=True, commit=True):
+    """Queue many emails with one INSERT.
+
+    ``messages`` is an iterable of dicts with ``recipient``, ``subject``,
+    ``body`` and optionally ``html``. Returns the number queued. With
+    ``commit=False`` the INSERT joins the caller's transaction, which must
+    commit it and then call ``schedule_delivery``.
+    """
+    if not email_enabled():
+        return 0
+
+    now = datetime.utcnow()
+    max_attempts = current_app.config['EMAIL_MAX_ATTEMPTS']
+    rows = [{
+        'recipient': message['recipient'],
+        'domain': _domain_of(message['recipient']),
+        'subject': message['subject'],
+        'body_text': message['body'],
+        'body_html': message.get('html'),
+        'category': message.get('category', category),
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'next_attempt_at': now,
+        'created_at': now
+    } for message in messages if message.get('recipient')]
+
+    if not rows:
+        return 0
+
+    db.session.execute(insert(OutboundEmail), rows)
+    if not commit:
+        return len(rows)
+    db.session.commit()
+
+    if deliver:
+        schedule_delivery(now)
+    return len(rows)
+
+def schedule_delivery(now=None):
+    """Start delivering the outbox in the background"""
+    from app.services.job_queue import job_queue
+    now = now or datetime.utcnow()
+    # Collapse the kick-off jobs for one minute into one; the scheduler
+    # sweep picks up anything queued after that job has finished
+    job_queue.enqueue('deliver_outbox', idempotency_key=f"deliver_outbox:{now.strftime('%Y%m%d%H%M')}")
+
+def queue_email(recipient, subject, body, html=None, category=None):
+    """Queue a single email for background delivery"""
+    return queue_emails([{'recipient': recipient, 'subject': subject, 'body': body, 'html': html}],
+                        category=category)
+
+class SMTPConnection:
+    """A single SMTP session reused for a whole batch of messages"""
+
+    def __init__(self, config):
+        self.host = config.get('MAIL_SERVER')
+        self.port = config.get('MAIL_PORT', 25)
+        self.use_tls = config.get('MAIL_USE_TLS', False)
+        self.use_ssl = config.get('MAIL_USE_SSL', False)
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.timeout = config.get('EMAIL_SMTP_TIMEOUT', 30)
+        self.server = None
+        self.messages_sent = 0
+
+    def open(self):
+        try:
+            if self.use_ssl:
+                self.server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            else:
+                self.server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            self.server.ehlo()
+            if self.use_tls and not self.use_ssl:
+                self.server.starttls()
+                self.server.ehlo()
+            if self.username and self.password:
+                self.server.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError) as e:
+            self.server = None
+            raise TransientEmailError(f'Could not connect to {self.host}:{self.port}: {e}')
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, message):
+        """Send one message, reconnecting once if the server dropped the session"""
+        for attempt in (1, 2):
+            if self.server is None:
+                self.open()
+            try:
+                self.server.send_message(message)
+                self.messages_sent += 1
+                return
+            except smtplib.SMTPServerDisconnected as e:
+                self.server = None
+                if attempt == 2:
+                    raise TransientEmailError(str(e))
+            except smtplib.SMTPRecipientsRefused as e:
+                codes = [code for code, _ in e.recipients.values()]
+                error = '; '.join(f'{code} {reply.decode(errors="replace")}' for code, reply in e.recipients.values())
+                if all(code >= 500 for code in codes):
+                    raise PermanentEmailError(error)
+                raise TransientEmailError(error)
+            except smtplib.SMTPResponseException as e:
+                error = f'{e.smtp_code} {e.smtp_error.decode(errors="replace") if isinstance(e.smtp_error, bytes) else e.smtp_error}'
+                if e.smtp_code >= 500:
+                    raise PermanentEmailError(error)
+                # Reset the transaction so the session stays usable
+                try:
+                    self.server.rset()
+                except (smtplib.SMTPException, OSError):
+                    self.server = None
+                raise TransientEmailError(error)
+            except (smtplib.SMTPException, OSError, socket.timeout) as e:
+                self.server = None
+                raise TransientEmailError(str(e))
+
+def build_message(email, sender):
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = email.recipient
+    message['Subject'] = email.subject
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid(domain=_domain_of(sender) if sender and '@' in sender else None)
+    message.set_content(email.body_text)
+    if email.body_html:
+        message.add_alternative(email.body_html, subtype='html')
+    return message
+
+def _domain_allowances(now):
+    """Messages each domain may still receive in the current minute"""
+    config = current_app.config
+    default_limit = config['EMAIL_RATE_LIMIT_PER_MINUTE']
+    limits = config.get('EMAIL_DOMAIN_RATE_LIMITS', {})
+    recent = dict(db.session.query(OutboundEmail.domain, db.func.count(OutboundEmail.id)).filter(
+        OutboundEmail.sent_at >= now - timedelta(minutes=1)
+    ).group_by(OutboundEmail.domain).all())
+
+    def allowance(domain):
+        return max(limits.get(domain, default_limit) - recent.get(domain, 0), 0)
+    return allowance
+
+def claim_outbox_batch(batch_size, now=None):
+    """Claim due emails for this worker within each domain's rate limit"""
+    now = now or datetime.utcnow()
+    claimable = db.or_(
+        db.and_(OutboundEmail.status == 'queued', OutboundEmail.next_attempt_at <= now),
+        db.and_(OutboundEmail.status == 'sending', OutboundEmail.locked_until < now)
+    )
+    candidates = db.session.query(OutboundEmail.id, OutboundEmail.domain).filter(
+        claimable
+    ).order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(batch_size * 4).all()
+    if not candidates:
+        return [], False
+
+    allowance = _domain_allowances(now)
+    remaining = {}
+    chosen = []
+    for email_id, domain in candidates:
+        if domain not in remaining:
+            remaining[domain] = allowance(domain)
+        if remaining[domain] > 0:
+            remaining[domain] -= 1
+            chosen.append(email_id)
+            if len(chosen) >= batch_size:
+                break
+    if not chosen:
+        # Everything due is rate limited for now
+        return [], True
+
+    locked_until = now + timedelta(seconds=current_app.config['EMAIL_LOCK_SECONDS'])
+    OutboundEmail.query.filter(OutboundEmail.id.in_(chosen), claimable).update({
+        'status': 'sending',
+        'locked_until': locked_until,
+        'attempts': OutboundEmail.attempts + 1
+    }, synchronize_session=False)
+    db.session.commit()
+
+    emails = OutboundEmail.query.filter(
+        OutboundEmail.id.in_(chosen),
+        OutboundEmail.status == 'sending',
+        OutboundEmail.locked_until == locked_until
+    ).order_by(OutboundEmail.domain, OutboundEmail.id).all()
+    return emails, False
+
+def _retry_delay(attempts):
+    base = current_app.config['EMAIL_RETRY_BASE_SECONDS']
+    cap = current_app.config['EMAIL_RETRY_MAX_SECONDS']
+    return min(base * (2 ** max(attempts - 1, 0)), cap) * random.uniform(0.8, 1.2)
+
+def _record_failure(email, error, permanent):
+    email.last_error = error[:1000]
+    email.locked_until = None
+    if permanent or email.attempts >= email.max_attempts:
+        email.status = 'failed'
+    else:
+        email.status = 'queued'
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=_retry_delay(email.attempts))
+
+def deliver_outbox(batch_size=None, max_batches=None):
+    """Send due emails batch by batch; returns the number delivered"""
+    if not email_enabled():
+        return 0
+
+    config = current_app.config
+    batch_size = batch_size or config['EMAIL_BATCH_SIZE']
+    sender = config.get('MAIL_DEFAULT_SENDER') or config.get('MAIL_USERNAME')
+    delivered = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        emails, rate_limited = claim_outbox_batch(batch_size)
+        if not emails:
+            if rate_limited:
+                logger.info('Email delivery paused by per-domain rate limits')
+            break
+        batches += 1
+        sent_ids = []
+
+        connection = SMTPConnection(config)
+        try:
+            for index, email in enumerate(emails):
+                try:
+                    connection.send(build_message(email, sender))
+                    sent_ids.append(email.id)
+                except PermanentEmailError as e:
+                    _record_failure(email, str(e), permanent=True)
+                except TransientEmailError as e:
+                    _record_failure(email, str(e), permanent=False)
+                    if connection.server is None:
+                        # Server unreachable: push the rest of the batch back as well
+                        for pending in emails[index + 1:]:
+                            _record_failure(pending, str(e), permanent=False)
+                        break
+        finally:
+            connection.close()
+
+        if sent_ids:
+            OutboundEmail.query.filter(OutboundEmail.id.in_(sent_ids)).update({
+                'status': 'sent',
+                'sent_at': datetime.utcnow(),
+                'locked_until': None,
+                'last_error': None
+            }, synchronize_session=False)
+        db.session.commit()
+        delivered += len(sent_ids)
+
+        logger.info('Delivered %d/%d emails over one SMTP connection', len(sent_ids), len(emails))
+        if len(sent_ids) < len(emails) and connection.messages_sent == 0:
+            # Nothing got through; leave the rest for the next sweep
+            break
+
+    return delivered
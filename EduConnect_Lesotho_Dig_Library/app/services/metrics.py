@@ -0,0 +1,507 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+Exported:
+
+- ``http_request_duration_seconds``: histogram per blueprint, endpoint and
+  status (its ``_count`` is the request count)
+- ``download_bytes_total``: bytes of files sent, per endpoint
+- ``db_pool_checkout_wait_seconds``: time spent waiting for a pooled
+  connection, and the pool gauges ``db_pool_size``, ``db_pool_max_overflow``,
+  ``db_pool_checked_out`` and ``db_pool_overflow``
+- ``ai_provider_request_duration_seconds``: per provider and outcome
+- ``ai_cache_events_total``: response cache lookups (``event="requests"``)
+  and how they were answered (``memory_hits``, ``database_hits``,
+  ``shared``, ``upstream_calls``, ``errors``); the hit rate is
+  ``sum(rate(ai_cache_events_total{event=~"memory_hits|database_hits|shared"}[5m]))
+  / sum(rate(ai_cache_events_total{event="requests"}[5m]))``
+- ``job_queue_jobs``: background jobs per status
+
+Counters and histograms are recorded without locks: each thread writes to
+its own shard and the shards are only summed when metrics are collected.
+
+Under gunicorn every worker is a separate process with its own shards. Set
+``METRICS_DIR`` (or ``PROMETHEUS_MULTIPROC_DIR``) to a directory shared by
+the workers and each writes a snapshot there every
+``METRICS_FLUSH_SECONDS``; whichever worker answers the scrape adds them
+up. Counters of workers that have exited are kept so totals never go
+backwards; their gauges are dropped. The scrape that finds an exited
+worker's snapshot folds its counters into ``retired.json`` and deletes it,
+so the directory holds one file per live worker plus that one. Empty the
+directory when the master starts.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from flask import current_app, g, request
+
+from app import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: exited workers' snapshots are not folded
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROVIDER_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0)
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+RETIRED_SNAPSHOT = 'retired.json'
+
+class _Shard:
+    """One thread's counters and histograms"""
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+
+class Metric:
+    def __init__(self, registry, kind, name, help, labelnames=(), buckets=None, collect=None, per_process=True):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.collect = collect
+        self.per_process = per_process
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        shard.counters[key] = shard.counters.get(key, 0) + amount
+
+    def observe(self, value, *labels):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        values = shard.histograms.get(key)
+        if values is None:
+            values = shard.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+        # Tells this process's snapshots from those of an exited one with the same pid
+        self.instance = uuid.uuid4().hex
+
+    def _define(self, *args, **kwargs):
+        metric = Metric(self, *args, **kwargs)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._define('counter', name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._define('histogram', name, help, labelnames, buckets=buckets)
+
+    def gauge(self, name, help, labelnames, collect, per_process=True):
+        """A gauge read when metrics are collected: ``collect()`` returns {labels: value}.
+
+        Per-process gauges are added up over live workers; the others are
+        read only by the worker answering the scrape.
+        """
+        return self._define('gauge', name, help, labelnames, collect=collect, per_process=per_process)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def reset(self):
+        """Forget everything recorded, e.g. in a freshly forked worker"""
+        with self._lock:
+            self._local = threading.local()
+            self._shards = []
+            self._retired = _Shard(None)
+            self.instance = uuid.uuid4().hex
+
+    def _collect_gauges(self, per_process):
+        gauges = {}
+        for metric in self.metrics.values():
+            if metric.kind != 'gauge' or metric.per_process != per_process:
+                continue
+            try:
+                gauges[metric.name] = {tuple(labels): value for labels, value in metric.collect().items()}
+            except Exception:
+                logger.exception('Could not collect metric %s', metric.name)
+        return gauges
+
+    def snapshot(self):
+        """This process's counters, histograms and per-process gauges"""
+        counters = defaultdict(float)
+        histograms = {}
+        with self._lock:
+            # Fold in the shards of threads that have finished so they do not pile up
+            for shard in [shard for shard in self._shards if not shard.thread.is_alive()]:
+                self._shards.remove(shard)
+                _merge(self._retired.counters, self._retired.histograms, shard.counters, shard.histograms)
+            shards = [self._retired] + list(self._shards)
+        for shard in shards:
+            # dict() copies atomically while the owning thread keeps writing
+            _merge(counters, histograms, dict(shard.counters),
+                   {key: list(values) for key, values in dict(shard.histograms).items()})
+        return {
+            'pid': os.getpid(),
+            'instance': self.instance,
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+            'gauges': {name: [[list(labels), value] for labels, value in values.items()]
+                       for name, values in self._collect_gauges(per_process=True).items()}
+        }
+
+    def render(self, snapshots):
+        """Prometheus text format for the given process snapshots"""
+        counters = defaultdict(float)
+        histograms = {}
+        gauges = defaultdict(float)
+        for snapshot in snapshots:
+            _merge(counters, histograms,
+                   {(name, tuple(labels)): value for name, labels, value in snapshot['counters']},
+                   {(name, tuple(labels)): values for name, labels, values in snapshot['histograms']})
+            if snapshot.get('live', True):
+                for name, values in snapshot['gauges'].items():
+                    for labels, value in values:
+                        gauges[name, tuple(labels)] += value
+        for name, values in self._collect_gauges(per_process=False).items():
+            for labels, value in values.items():
+                gauges[name, labels] = value
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if metric.kind == 'histogram':
+                for (name, labels), values in sorted(histograms.items()):
+                    if name != metric.name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), values):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{_labels(metric.labelnames + ("le",), labels + (le,))} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_sum{_labels(metric.labelnames, labels)} {_number(values[-1])}')
+                    lines.append(f'{name}_count{_labels(metric.labelnames, labels)} {cumulative}')
+            else:
+                source = counters if metric.kind == 'counter' else gauges
+                for (name, labels), value in sorted(source.items()):
+                    if name == metric.name:
+                        lines.append(f'{name}{_labels(metric.labelnames, labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _combine(snapshots):
+    """One snapshot with the counters and histograms of all the given ones"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        _merge(counters, histograms,
+               {(name, tuple(labels)): value for name, labels, value in snapshot['counters']},
+               {(name, tuple(labels)): values for name, labels, values in snapshot['histograms']})
+    return {
+        'pid': None,
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+        'gauges': {}
+    }
+
+def _merge(counters, histograms, more_counters, more_histograms):
+    for key, value in more_counters.items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in more_histograms.items():
+        existing = histograms.get(key)
+        if existing is None:
+            histograms[key] = list(values)
+        else:
+            for index, value in enumerate(values):
+                existing[index] += value
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+registry = MetricsRegistry()
+
+# Metrics ---------------------------------------------------------------------------
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce a response', ('blueprint', 'endpoint', 'status'))
+DOWNLOAD_BYTES = registry.counter('download_bytes_total', 'Bytes of files sent to clients', ('endpoint',))
+POOL_CHECKOUT_WAIT = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a database connection from the pool', ('bind',),
+    buckets=CHECKOUT_BUCKETS)
+AI_PROVIDER_LATENCY = registry.histogram(
+    'ai_provider_request_duration_seconds', 'AI provider call duration', ('provider', 'outcome'),
+    buckets=PROVIDER_BUCKETS)
+AI_CACHE_EVENTS = registry.counter('ai_cache_events_total', 'AI response cache lookups and outcomes', ('event',))
+
+def _pool_gauge(read):
+    def collect():
+        values = {}
+        for bind, engine in _engines().items():
+            value = read(engine.pool)
+            if value is not None:
+                values[(bind or 'default',)] = value
+        return values
+    return collect
+
+def _engines():
+    app = current_app._get_current_object()
+    engines = app.extensions.get('metrics_engines')
+    if engines is None:
+        engines = app.extensions['metrics_engines'] = dict(db.engines)
+    for bind, engine in engines.items():
+        time_checkouts(engine, bind)
+    return engines
+
+def _pool_max_overflow(pool):
+    if not hasattr(pool, 'overflow'):
+        return None
+    options = current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    return options.get('max_overflow', getattr(pool, '_max_overflow', None))
+
+registry.gauge('db_pool_size', 'Connections the pool keeps open', ('bind',),
+               _pool_gauge(lambda pool: pool.size() if hasattr(pool, 'size') else None))
+registry.gauge('db_pool_max_overflow', 'Connections the pool may open beyond its size', ('bind',),
+               _pool_gauge(_pool_max_overflow))
+registry.gauge('db_pool_checked_out', 'Connections currently in use', ('bind',),
+               _pool_gauge(lambda pool: pool.checkedout() if hasattr(pool, 'checkedout') else None))
+registry.gauge('db_pool_overflow', 'Connections open beyond the pool size', ('bind',),
+               _pool_gauge(lambda pool: max(pool.overflow(), 0) if hasattr(pool, 'overflow') else None))
+
+def _job_queue_depth():
+    from app.models.job_queue import BackgroundJob
+    return {(status,): count for status, count in BackgroundJob.get_status_counts().items()}
+
+registry.gauge('job_queue_jobs', 'Background jobs per status', ('status',), _job_queue_depth, per_process=False)
+
+def time_checkouts(engine, bind=None):
+    """Time waits for pooled connections.
+
+    SQLAlchemy has no event before a checkout, so the pool's own getter is
+    wrapped; ``engine.dispose()`` replaces the pool, which is why this is
+    re-applied every time metrics are collected.
+    """
+    pool = engine.pool
+    if getattr(pool, '_metrics_timed', False):
+        return
+    do_get = pool._do_get
+    bind = bind or 'default'
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, bind)
+
+    pool._do_get = timed_do_get
+    pool._metrics_timed = True
+
+# Flask integration ---------------------------------------------------------------
+
+class Metrics:
+    """Request hooks and the multi-process snapshot writer"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self._flusher = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['metrics'] = self
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_SECONDS', 5)
+        self.directory = app.config['METRICS_DIR']
+        if not app.config['METRICS_ENABLED']:
+            return
+        with app.app_context():
+            app.extensions['metrics_engines'] = dict(db.engines)
+            for bind, engine in app.extensions['metrics_engines'].items():
+                time_checkouts(engine, bind)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g._metrics_started = time.perf_counter()
+
+    def _finish(self, response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or '<unmatched>'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, request.blueprint or '', endpoint,
+                                str(response.status_code))
+        if response.direct_passthrough and endpoint != 'static' and request.method != 'HEAD' \
+                and response.content_length:
+            DOWNLOAD_BYTES.inc(endpoint, amount=response.content_length)
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        return response
+
+    # Multi-process snapshots
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _write(self, path, snapshot):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def write_snapshot(self):
+        if not self.directory:
+            return
+        with self.app.app_context():
+            snapshot = registry.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(snapshot['pid'])
+        # An exited worker whose pid we were given may have left its counters here
+        previous = _read(path)
+        if previous is not None and previous.get('instance') != snapshot['instance']:
+            self.fold([path])
+        self._write(path, snapshot)
+
+    def fold(self, paths):
+        """Add exited workers' snapshots to the retired snapshot and delete them"""
+        if fcntl is None:
+            return
+        with open(os.path.join(self.directory, 'retired.lock'), 'a') as lock:
+            # Workers scraping at the same time must not fold a snapshot twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                retired_path = os.path.join(self.directory, RETIRED_SNAPSHOT)
+                folded = [snapshot for snapshot in map(_read, paths) if snapshot is not None]
+                if not folded:
+                    return
+                retired = _read(retired_path) or _combine([])
+                self._write(retired_path, _combine([retired] + folded))
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _start_flusher(self):
+        self._flusher_pid = os.getpid()
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self._flusher.start()
+        atexit.register(self._stop_flusher)
+
+    def _stop_flusher(self):
+        self._stop.set()
+        if self._flusher is not None and self._flusher.is_alive():
+            self._flusher.join(5)
+        try:
+            self.write_snapshot()
+        except Exception:
+            logger.exception('Could not write final metrics snapshot')
+
+    def _flush_loop(self):
+        interval = self.app.config.get('METRICS_FLUSH_SECONDS', 5)
+        while not self._stop.wait(interval):
+            try:
+                self.write_snapshot()
+            except Exception:
+                logger.exception('Could not write metrics snapshot')
+
+    def snapshots(self):
+        """This process's snapshot plus those the other workers have written"""
+        own = registry.snapshot()
+        snapshots = [own]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        exited = {}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json') or entry.name == RETIRED_SNAPSHOT:
+                continue
+            snapshot = _read(entry.path)
+            if snapshot is None:
+                continue
+            if snapshot.get('pid') == own['pid']:
+                if snapshot.get('instance') != own['instance']:
+                    exited[entry.path] = snapshot  # Left by an exited worker with our pid
+            elif _alive(snapshot.get('pid')):
+                snapshots.append(snapshot)
+            else:
+                exited[entry.path] = snapshot
+        if fcntl is None:
+            snapshots.extend(dict(snapshot, live=False) for snapshot in exited.values())
+        elif exited:
+            self.fold(list(exited))
+        retired = _read(os.path.join(self.directory, RETIRED_SNAPSHOT))
+        if retired is not None:
+            retired['live'] = False
+            snapshots.append(retired)
+        return snapshots
+
+    def render(self):
+        return registry.render(self.snapshots())
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _alive(pid):
+    if not isinstance(pid, int):
+        return False
+    if os.name != 'posix':
+        return True  # Signal 0 is only a liveness check on POSIX
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+metrics = Metrics()
+
+# A forked worker starts with its parent's numbers, which the parent reports itself
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset)
@@ -0,0 +1,372 @@
+"""
+On-demand request profiling.
+
+An admin starts a profiling run from /admin/profiles with an endpoint
+pattern (``fnmatch`` style, matched against the endpoint name and the
+path, e.g. ``auth.profile`` or ``/api/*``), the fraction of matching
+requests to profile, a mode, and when to stop. The run is written to
+``trigger.json`` in ``PROFILE_DIR`` so every worker process picks it up
+without a restart; each worker re-reads the file at most once a second.
+
+Modes:
+
+- ``sampling`` (default): a single background thread looks at the stacks
+  of the profiled request threads every ``PROFILE_SAMPLE_INTERVAL_MS``
+  through ``sys._current_frames()``. The request itself runs at full
+  speed, so this is safe on production traffic. Captures are written as
+  collapsed stacks (``frame;frame;frame count`` per line), which
+  flamegraph.pl, speedscope and inferno read directly.
+- ``cprofile``: deterministic cProfile of a single request, written as a
+  ``.pstats`` file (snakeviz, ``python -m pstats``) plus a text summary.
+  It slows the request down noticeably and only one request per process
+  is profiled at a time, so use it for one-off investigations.
+
+Each capture also gets a ``.json`` file with the request details and the
+hottest functions under ``app.``, which is what the admin list shows.
+Captures are pruned to ``PROFILE_MAX_CAPTURES``, ``PROFILE_MAX_AGE_DAYS``
+and ``PROFILE_MAX_MB`` after every write and by the scheduler.
+
+Only the work done inside the request context is profiled; a streamed
+body generated after the view returns is not.
+"""
+
+import cProfile
+import fnmatch
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sampling', 'cprofile')
+TRIGGER_FILE = 'trigger.json'
+KINDS = {'collapsed': 'text/plain', 'pstats': 'application/octet-stream', 'txt': 'text/plain'}
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+@functools.lru_cache(maxsize=8192)
+def _frame_name(code, module):
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}".replace(';', ':').replace(' ', '_')
+
+def collapse_stack(frame):
+    """A frame and its callers as one collapsed-stack line, outermost first"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code, frame.f_globals.get('__name__', '?')))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+class Sampler:
+    """Samples the stacks of registered threads from one background thread"""
+
+    def __init__(self):
+        self.interval = 0.005
+        self.targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self.targets[thread_id] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def remove(self, thread_id):
+        with self._lock:
+            return self.targets.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.targets:
+                    self._thread = None
+                    return
+                targets = list(self.targets.items())
+            frames = sys._current_frames()
+            for thread_id, samples in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+class _Capture:
+    __slots__ = ('trigger', 'mode', 'started', 'thread_id', 'samples', 'profile', 'status')
+
+    def __init__(self, trigger, mode):
+        self.trigger = trigger
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.samples = None
+        self.profile = None
+        self.status = None
+
+def hot_functions(samples, prefix='app.', limit=5):
+    """Functions under ``prefix`` by share of samples they were on the stack for"""
+    total = sum(samples.values())
+    inclusive = Counter()
+    for stack, count in samples.items():
+        for name in set(stack.split(';')):
+            if name.startswith(prefix):
+                inclusive[name] += count
+    return [{'function': name, 'percent': round(count * 100 / total, 1)}
+            for name, count in inclusive.most_common(limit)] if total else []
+
+def _hot_pstats(stats, limit=5):
+    total = stats.total_tt or 1
+    rows = []
+    for (filename, line, name), (_, _, _, cumulative, _) in stats.stats.items():
+        if filename.startswith(_APP_ROOT):
+            rows.append((cumulative, f'{os.path.relpath(filename, _APP_ROOT)}:{line}:{name}'))
+    rows.sort(reverse=True)
+    return [{'function': name, 'percent': round(min(cumulative / total, 1) * 100, 1)}
+            for cumulative, name in rows[:limit]]
+
+class Profiler:
+    """Profiles a fraction of the requests matching an admin-set pattern"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.sampler = Sampler()
+        self._cprofile_lock = threading.Lock()
+        self._trigger = None
+        self._trigger_mtime = None
+        self._trigger_checked = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['profiler'] = self
+        app.config.setdefault('PROFILE_ENABLED', True)
+        app.config.setdefault('PROFILE_SAMPLE_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILE_MAX_CAPTURES', 200)
+        app.config.setdefault('PROFILE_MAX_AGE_DAYS', 7)
+        app.config.setdefault('PROFILE_MAX_MB', 200)
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self._trigger = self._trigger_mtime = None
+        self._trigger_checked = 0.0
+        if app.config['PROFILE_ENABLED']:
+            app.before_request(self._start)
+            app.after_request(self._finish)
+            app.teardown_request(self._stop)
+
+    # Triggers
+
+    def start(self, pattern, fraction=1.0, mode='sampling', minutes=30, max_captures=20, started_by=None):
+        """Profile ``fraction`` of the requests matching ``pattern`` for ``minutes`` in every worker"""
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode: {mode}')
+        if not pattern or not 0 < fraction <= 1 or minutes <= 0 or max_captures <= 0:
+            raise ValueError('Profiling needs a pattern, a fraction in (0, 1], and positive limits')
+        trigger = {
+            'id': secrets.token_hex(4), 'pattern': pattern, 'fraction': fraction, 'mode': mode,
+            'max_captures': int(max_captures), 'started_by': started_by,
+            'started_at': time.time(), 'expires_at': time.time() + minutes * 60
+        }
+        self._write_json(TRIGGER_FILE, trigger)
+        self._trigger_checked = 0.0
+        logger.info('Profiling %s (%s, %.0f%% of requests) for %d minutes', pattern, mode, fraction * 100, minutes)
+        return trigger
+
+    def stop(self):
+        try:
+            os.remove(os.path.join(self.directory, TRIGGER_FILE))
+        except FileNotFoundError:
+            pass
+        self._trigger = self._trigger_mtime = None
+        self._trigger_checked = 0.0
+
+    def active(self):
+        """The running trigger, or None; re-reads the shared file at most once a second"""
+        now = time.monotonic()
+        if now - self._trigger_checked >= 1.0:
+            self._trigger_checked = now
+            path = os.path.join(self.directory, TRIGGER_FILE)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._trigger = self._trigger_mtime = None
+            else:
+                if mtime != self._trigger_mtime:
+                    try:
+                        with open(path) as file:
+                            self._trigger = json.load(file)
+                    except (OSError, ValueError):
+                        self._trigger = None
+                    self._trigger_mtime = mtime
+        trigger = self._trigger
+        if trigger is not None and trigger['expires_at'] <= time.time():
+            return None
+        return trigger
+
+    # Request hooks
+
+    def _start(self):
+        trigger = self.active()
+        if trigger is None or request.endpoint in (None, 'static'):
+            return
+        pattern = trigger['pattern']
+        if not (fnmatch.fnmatchcase(request.endpoint, pattern) or fnmatch.fnmatchcase(request.path, pattern)):
+            return
+        if random.random() >= trigger['fraction']:
+            return
+        capture = _Capture(trigger, trigger['mode'])
+        if capture.mode == 'cprofile':
+            if not self._cprofile_lock.acquire(blocking=False):
+                return  # Only one deterministic profile at a time per process
+            capture.profile = cProfile.Profile()
+            try:
+                capture.profile.enable()
+            except ValueError:  # Another profiler (a debugger, coverage) is active
+                self._cprofile_lock.release()
+                return
+        else:
+            self.sampler.interval = current_app.config.get('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000
+            capture.samples = self.sampler.add(capture.thread_id)
+        g._profile_capture = capture
+
+    def _finish(self, response):
+        capture = g.get('_profile_capture')
+        if capture is not None:
+            capture.status = response.status_code
+        return response
+
+    def _stop(self, exc=None):
+        capture = g.pop('_profile_capture', None)
+        if capture is None:
+            return
+        duration = time.perf_counter() - capture.started
+        if capture.profile is not None:
+            capture.profile.disable()
+            self._cprofile_lock.release()
+        else:
+            self.sampler.remove(capture.thread_id)
+        try:
+            self.save(capture, duration, status=capture.status or (500 if exc else None))
+        except OSError:
+            logger.exception('Could not save profile of %s', request.endpoint)
+
+    # Captures
+
+    def save(self, capture, duration, status=None):
+        trigger = capture.trigger
+        if capture.samples is not None and not capture.samples:
+            return None  # Finished before the first sample
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+        capture_id = f'{stamp}-{_UNSAFE.sub("_", request.endpoint)}-{secrets.token_hex(3)}'
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {
+            'id': capture_id, 'trigger': trigger['id'], 'pattern': trigger['pattern'], 'mode': capture.mode,
+            'endpoint': request.endpoint, 'method': request.method, 'path': request.path,
+            'status': status, 'duration_ms': round(duration * 1000, 1),
+            'created_at': time.time()
+        }
+        if capture.samples is not None:
+            lines = ''.join(f'{stack} {count}\n' for stack, count in capture.samples.most_common())
+            self._write_text(f'{capture_id}.collapsed', lines)
+            meta.update(samples=sum(capture.samples.values()), files=['collapsed'],
+                        hot=hot_functions(capture.samples))
+        else:
+            capture.profile.dump_stats(os.path.join(self.directory, f'{capture_id}.pstats'))
+            summary = io.StringIO()
+            stats = pstats.Stats(capture.profile, stream=summary)
+            stats.sort_stats('cumulative').print_stats(40)
+            self._write_text(f'{capture_id}.txt', summary.getvalue())
+            meta.update(samples=None, files=['pstats', 'txt'], hot=_hot_pstats(stats))
+        self._write_json(f'{capture_id}.json', meta)
+
+        captured = sum(1 for item in self.captures() if item.get('trigger') == trigger['id'])
+        if captured >= trigger['max_captures']:
+            logger.info('Profiling of %s finished after %d captures', trigger['pattern'], captured)
+            self.stop()
+        self.prune()
+        return meta
+
+    def captures(self):
+        """Metadata of the stored captures, newest first"""
+        try:
+            names = [name for name in os.listdir(self.directory)
+                     if name.endswith('.json') and name != TRIGGER_FILE]
+        except FileNotFoundError:
+            return []
+        items = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    items.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        items.sort(key=lambda item: item.get('created_at', 0), reverse=True)
+        return items
+
+    def capture_path(self, capture_id, kind):
+        """Path of one capture file, or None if there is no such capture"""
+        if kind not in KINDS or _UNSAFE.search(capture_id) or capture_id.startswith('.'):
+            return None
+        path = os.path.join(self.directory, f'{capture_id}.{kind}')
+        return path if os.path.isfile(path) else None
+
+    def prune(self):
+        """Delete captures beyond the count, age and size limits; returns how many were deleted"""
+        config = self.app.config if self.app is not None else {}
+        max_captures = config.get('PROFILE_MAX_CAPTURES', 200)
+        oldest = time.time() - config.get('PROFILE_MAX_AGE_DAYS', 7) * 86400
+        max_bytes = config.get('PROFILE_MAX_MB', 200) * 1024 * 1024
+        kept = total_bytes = deleted = 0
+        for item in self.captures():
+            paths = [os.path.join(self.directory, f"{item['id']}.{kind}") for kind in item.get('files', [])]
+            size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            if kept < max_captures and item.get('created_at', 0) >= oldest and total_bytes + size <= max_bytes:
+                kept += 1
+                total_bytes += size
+                continue
+            for path in paths + [os.path.join(self.directory, f"{item['id']}.json")]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            deleted += 1
+        return deleted
+
+    def _write_text(self, name, text):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(text)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _write_json(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_text(name, json.dumps(data))
+
+profiler = Profiler()
+
+def purge_old_captures():
+    """Apply the profile retention limits"""
+    return profiler.prune()
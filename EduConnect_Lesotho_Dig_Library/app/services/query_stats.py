@@ -0,0 +1,210 @@
+"""
+Per-request SQL instrumentation.
+
+SQLAlchemy engine events time every statement executed while a request is
+being handled; Flask request hooks then fold the numbers into per-endpoint
+totals for this process:
+
+- number of queries and total database time
+- the slowest statement
+- statements repeated within one request, by fingerprint (the statement
+  with literals and IN lists collapsed), which is what an N+1 pattern
+  looks like
+
+In debug mode, or with ``QUERY_STATS_HEADERS``, responses carry
+``X-Query-Count`` and a ``Server-Timing`` header that browser dev tools
+show next to the request. Statements slower than
+``QUERY_STATS_SLOW_QUERY_MS`` and fingerprints repeated at least
+``QUERY_STATS_N_PLUS_ONE`` times in a request are logged as warnings.
+
+Statements run while a streamed body is being sent happen after the
+request hooks and are not counted.
+"""
+
+import functools
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=2048)
+def normalize_statement(statement):
+    """The statement with literals replaced by ? and IN lists collapsed"""
+    text = _STRING.sub('?', statement)
+    text = _NUMBER.sub('?', text)
+    text = text.replace('%s', '?')
+    text = _IN_LIST.sub('(?)', text)
+    return _SPACE.sub(' ', text).strip()
+
+@functools.lru_cache(maxsize=2048)
+def statement_fingerprint(statement):
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+class RequestQueries:
+    """Statements executed by one request"""
+
+    __slots__ = ('count', 'seconds', 'slowest', 'slowest_statement', 'fingerprints', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.fingerprints = Counter()
+        self.started = time.perf_counter()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.fingerprints[normalize_statement(statement)] += 1
+        if seconds >= self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+
+    def most_repeated(self):
+        if not self.fingerprints:
+            return None, 0
+        return self.fingerprints.most_common(1)[0]
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_stats_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_stats_started', None)
+    if started is None or not has_request_context():
+        return
+    queries = g.get('_request_queries')
+    if queries is not None:
+        queries.add(statement, time.perf_counter() - started)
+
+_listening = False
+
+def _listen():
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+class QueryStats:
+    """Per-endpoint query counts and database time for this process"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['query_stats'] = self
+        app.config.setdefault('QUERY_STATS_ENABLED', True)
+        app.config.setdefault('QUERY_STATS_HEADERS', None)  # None: only in debug mode
+        app.config.setdefault('QUERY_STATS_SLOW_QUERY_MS', 100)
+        app.config.setdefault('QUERY_STATS_N_PLUS_ONE', 10)
+        self.endpoints = {}
+        if app.config['QUERY_STATS_ENABLED']:
+            _listen()
+            app.before_request(self._start)
+            app.after_request(self._finish)
+
+    def _start(self):
+        g._request_queries = RequestQueries()
+
+    def _finish(self, response):
+        queries = g.pop('_request_queries', None)
+        if queries is None:
+            return response
+        endpoint = request.endpoint or '<unmatched>'
+        config = current_app.config
+        show_headers = config.get('QUERY_STATS_HEADERS')
+        if show_headers or (show_headers is None and current_app.debug):
+            total_ms = (time.perf_counter() - queries.started) * 1000
+            response.headers['X-Query-Count'] = str(queries.count)
+            response.headers['Server-Timing'] = (
+                f'db;dur={queries.seconds * 1000:.1f};desc="{queries.count} queries", app;dur={total_ms:.1f}'
+            )
+
+        repeated, repeats = queries.most_repeated()
+        if queries.slowest * 1000 >= config.get('QUERY_STATS_SLOW_QUERY_MS', 100):
+            logger.warning('Slow query in %s (%.1f ms): %s', endpoint, queries.slowest * 1000,
+                           normalize_statement(queries.slowest_statement))
+        n_plus_one = repeats >= config.get('QUERY_STATS_N_PLUS_ONE', 10)
+        if n_plus_one:
+            logger.warning('Possible N+1 in %s: %d queries, one statement %d times: %s', endpoint,
+                           queries.count, repeats, normalize_statement(repeated))
+        self.record(endpoint, queries, n_plus_one)
+        return response
+
+    def record(self, endpoint, queries, n_plus_one=False):
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'db_seconds': 0.0, 'max_db_seconds': 0.0,
+                    'slowest_ms': 0.0, 'slowest_statement': None, 'n_plus_one_requests': 0,
+                    'repeated_statement': None, 'max_repeats': 0
+                }
+            stats['requests'] += 1
+            stats['queries'] += queries.count
+            stats['max_queries'] = max(stats['max_queries'], queries.count)
+            stats['db_seconds'] += queries.seconds
+            stats['max_db_seconds'] = max(stats['max_db_seconds'], queries.seconds)
+            if queries.slowest * 1000 > stats['slowest_ms']:
+                stats['slowest_ms'] = queries.slowest * 1000
+                stats['slowest_statement'] = queries.slowest_statement
+            repeated, repeats = queries.most_repeated()
+            if repeats > stats['max_repeats']:
+                stats['max_repeats'] = repeats
+                stats['repeated_statement'] = repeated
+            stats['n_plus_one_requests'] += n_plus_one
+
+    def report(self, sort='db_ms', limit=50):
+        """Endpoints with per-request averages, worst first"""
+        with self._lock:
+            items = [(endpoint, dict(stats)) for endpoint, stats in self.endpoints.items()]
+        rows = []
+        for endpoint, stats in items:
+            requests = stats['requests']
+            rows.append({
+                'endpoint': endpoint,
+                'requests': requests,
+                'avg_queries': round(stats['queries'] / requests, 1),
+                'max_queries': stats['max_queries'],
+                'avg_db_ms': round(stats['db_seconds'] * 1000 / requests, 2),
+                'max_db_ms': round(stats['max_db_seconds'] * 1000, 2),
+                'slowest_ms': round(stats['slowest_ms'], 2),
+                'slowest_statement': _describe(stats['slowest_statement']),
+                'max_repeats': stats['max_repeats'],
+                'repeated_statement': _describe(stats['repeated_statement']),
+                'n_plus_one_requests': stats['n_plus_one_requests']
+            })
+        key = {'queries': 'avg_queries', 'db_ms': 'avg_db_ms', 'slowest': 'slowest_ms'}.get(sort, 'avg_db_ms')
+        rows.sort(key=lambda row: row[key], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+def _describe(statement):
+    if statement is None:
+        return None
+    return {'fingerprint': statement_fingerprint(statement), 'statement': normalize_statement(statement)[:500]}
+
+query_stats = QueryStats()
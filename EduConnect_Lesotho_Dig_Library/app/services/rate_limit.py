@@ -0,0 +1,256 @@
+"""
+Per-user and per-IP rate limits for expensive endpoints.
+
+Views declare their policy with a decorator::
+
+    @rate_limit('30/minute', anonymous='10/minute', scope='ai')
+
+Members are limited by user id and visitors by IP address (taken from
+``CLIENT_IP_HEADER`` when a trusted proxy sets one), each with a token
+bucket: it holds up to N tokens, refills at N per period and every request
+takes one. Views sharing a ``scope`` share a bucket, so all the AI endpoints
+draw on one allowance per member. ``RATELIMIT_POLICIES`` overrides the
+declared limits per scope without touching the code, e.g.
+``{'ai': {'limit': '60/minute', 'anonymous': '5/minute'}}``.
+
+Buckets live in memory (``RATELIMIT_BACKEND='memory'``, per process, the
+least recently used dropped beyond ``RATELIMIT_MAX_KEYS``) or in the
+``rate_limit_buckets`` table (``'database'``), shared by every process at the
+cost of one UPDATE per request. If the database cannot be reached requests
+are let through.
+
+Rejected requests get a 429 with ``Retry-After``; allowed and rejected
+counts per scope are kept for the admin status page.
+"""
+
+import functools
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from app.models.rate_limit import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+Limit = namedtuple('Limit', 'rate burst text')  # tokens per second, bucket size
+Decision = namedtuple('Decision', 'allowed remaining retry_after')
+
+# Shared by every endpoint that calls an AI provider (scope 'ai')
+AI_LIMIT = '30/minute'
+AI_ANONYMOUS_LIMIT = '10/minute'
+
+_LIMIT = re.compile(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*')
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+@functools.lru_cache(maxsize=256)
+def parse_limit(text):
+    """'10/minute' or '100/5 minutes' as a Limit"""
+    match = _LIMIT.fullmatch(text)
+    if match is None:
+        raise ValueError(f'Invalid rate limit {text!r}')
+    count, periods, unit = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    return Limit(count / (periods * _PERIODS[unit]), count, text)
+
+class MemoryBuckets:
+    """Token buckets for this process"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            state = self.buckets.get(key)
+            if state is None:
+                tokens = limit.burst
+            else:
+                tokens = min(limit.burst, state[0] + (now - state[1]) * limit.rate)
+                self.buckets.move_to_end(key)
+            if tokens >= cost:
+                self.buckets[key] = (tokens - cost, now)
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+                return Decision(True, tokens - cost, 0.0)
+            self.buckets[key] = (tokens, now)
+            return Decision(False, tokens, (cost - tokens) / limit.rate)
+
+    def __len__(self):
+        return len(self.buckets)
+
+class DatabaseBuckets:
+    """Token buckets in the ``rate_limit_buckets`` table, shared between processes.
+
+    Uses its own connection so a rejected request never commits anything the
+    view has pending in ``db.session``.
+    """
+
+    def hit(self, key, limit, cost=1):
+        now = time.time()
+        refilled = RateLimitBucket.tokens + (now - RateLimitBucket.updated_at) * limit.rate
+        refilled = case((refilled > limit.burst, limit.burst), else_=refilled)
+        with db.engine.begin() as connection:
+            # tokens must be assigned before updated_at: MySQL evaluates
+            # single-table UPDATE assignments left to right
+            taken = connection.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.key == key, refilled >= cost)
+                .ordered_values((RateLimitBucket.tokens, refilled - cost), (RateLimitBucket.updated_at, now))
+            )
+            if taken.rowcount:
+                return Decision(True, None, 0.0)
+            row = connection.execute(
+                select(RateLimitBucket.tokens, RateLimitBucket.updated_at).where(RateLimitBucket.key == key)
+            ).first()
+            if row is None:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(insert(RateLimitBucket).values(key=key, tokens=limit.burst - cost,
+                                                                          updated_at=now))
+                    return Decision(True, limit.burst - cost, 0.0)
+                except IntegrityError:
+                    # Created by another process since the UPDATE; count this
+                    # request against it next time rather than retrying now
+                    return Decision(True, None, 0.0)
+        tokens = min(limit.burst, row.tokens + (now - row.updated_at) * limit.rate)
+        return Decision(False, tokens, (cost - tokens) / limit.rate)
+
+    def purge_idle(self, idle_seconds=86400, batch_size=1000):
+        """Delete buckets untouched for ``idle_seconds``; they would be full again"""
+        deleted = 0
+        while True:
+            with db.engine.begin() as connection:
+                keys = connection.execute(
+                    select(RateLimitBucket.key).where(RateLimitBucket.updated_at < time.time() - idle_seconds)
+                    .limit(batch_size)
+                ).scalars().all()
+                if not keys:
+                    break
+                connection.execute(delete(RateLimitBucket).where(RateLimitBucket.key.in_(keys)))
+            deleted += len(keys)
+        return deleted
+
+class RateLimiter:
+    """Applies rate_limit policies with the configured bucket backend"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.buckets = MemoryBuckets()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['rate_limiter'] = self
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATELIMIT_MAX_KEYS', 100000)
+        app.config.setdefault('RATELIMIT_POLICIES', {})
+        backend = app.config['RATELIMIT_BACKEND']
+        if backend == 'memory':
+            self.buckets = MemoryBuckets(max_keys=app.config['RATELIMIT_MAX_KEYS'])
+        elif backend == 'database':
+            self.buckets = DatabaseBuckets()
+        else:
+            raise ValueError(f'Unknown RATELIMIT_BACKEND {backend!r}')
+        self.counts = Counter()
+
+    def policy(self, scope, limit, anonymous):
+        """The (limit, anonymous limit) for a scope after config overrides"""
+        override = current_app.config.get('RATELIMIT_POLICIES', {}).get(scope)
+        if isinstance(override, str):
+            return parse_limit(override), parse_limit(override)
+        if override:
+            limit = override.get('limit', limit)
+            anonymous = override.get('anonymous', anonymous)
+        return parse_limit(limit), parse_limit(anonymous or limit)
+
+    def check(self, scope, limit, anonymous=None, cost=1):
+        """Take ``cost`` tokens from the caller's bucket for ``scope``"""
+        member_limit, anonymous_limit = self.policy(scope, limit, anonymous)
+        if current_user.is_authenticated:
+            key, applied = f'{scope}:user:{current_user.id}', member_limit
+        else:
+            key, applied = f'{scope}:ip:{client_address()}', anonymous_limit
+        try:
+            decision = self.buckets.hit(key, applied, cost)
+        except SQLAlchemyError:
+            logger.exception('Rate limit check failed; allowing the request')
+            decision = Decision(True, None, 0.0)
+        with self._lock:
+            self.counts[scope, 'allowed' if decision.allowed else 'rejected'] += 1
+        if not decision.allowed:
+            logger.info('Rate limited %s (%s)', key, applied.text)
+        return decision
+
+    def stats(self):
+        scopes = {}
+        with self._lock:
+            for (scope, outcome), count in self.counts.items():
+                scopes.setdefault(scope, {'allowed': 0, 'rejected': 0})[outcome] = count
+        return {
+            'enabled': current_app.config.get('RATELIMIT_ENABLED', True),
+            'backend': current_app.config.get('RATELIMIT_BACKEND', 'memory'),
+            'buckets_in_memory': len(self.buckets) if isinstance(self.buckets, MemoryBuckets) else None,
+            'scopes': scopes
+        }
+
+rate_limiter = RateLimiter()
+
+def client_address():
+    """The visitor's IP address.
+
+    Behind a proxy REMOTE_ADDR is the proxy, so the address is read from the
+    header it sets (``CLIENT_IP_HEADER``). Headers the visitor can send, such
+    as X-Real-IP, are never trusted.
+    """
+    header = current_app.config.get('CLIENT_IP_HEADER')
+    return (header and request.headers.get(header)) or request.remote_addr
+
+def rate_limit(limit, anonymous=None, scope=None, cost=1):
+    """Limit a view to ``limit`` per member and ``anonymous`` per visitor IP.
+
+    ``scope`` names the bucket (defaults to the view's name); views with the
+    same scope share it.
+    """
+    parse_limit(limit)
+    if anonymous:
+        parse_limit(anonymous)
+
+    def decorator(view):
+        name = scope or view.__name__
+
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if current_app.config.get('RATELIMIT_ENABLED', True):
+                decision = rate_limiter.check(name, limit, anonymous, cost)
+                if not decision.allowed:
+                    retry_after = max(1, math.ceil(decision.retry_after))
+                    response = jsonify({
+                        'error': f'Too many requests. Please try again in {retry_after} seconds.',
+                        'retry_after': retry_after
+                    })
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+def purge_idle_buckets(batch_size=1000):
+    """Delete idle shared buckets; nothing to do for the in-memory backend"""
+    if not isinstance(rate_limiter.buckets, DatabaseBuckets):
+        return 0
+    return rate_limiter.buckets.purge_idle(batch_size=batch_size)
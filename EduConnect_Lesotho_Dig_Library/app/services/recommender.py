@@ -0,0 +1,150 @@
+"""
+Item-item book recommender.
+
+``rebuild_recommendations`` (run nightly by the scheduler) turns loans,
+favourites, downloads and reading sessions into a sparse user x book matrix,
+computes cosine similarity between books with SciPy in column blocks and
+stores each book's top-K neighbours in ``book_similarities``.
+``recommend_for_user`` then serves a member's recommendations from that table
+with a single indexed query, summing the similarity of every candidate to the
+books the member already knows.
+
+Building the model needs the optional ``numpy`` and ``scipy`` packages;
+serving recommendations does not.
+"""
+
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, union_all
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.offline import DigitalDownload, ReadingSession
+from app.models.recommendation import BookSimilarity
+from app.models.user_favorites import user_favorites
+
+logger = logging.getLogger(__name__)
+
+# How strongly each kind of interaction says "this member likes this book"
+INTERACTION_WEIGHTS = {
+    'loan': 3.0,
+    'favourite': 2.0,
+    'download': 1.5,
+    'reading': 1.0,
+}
+
+def _interaction_sources(user_id=None):
+    sources = [
+        (BorrowingTransaction.user_id, BorrowingTransaction.book_id, 'loan'),
+        (user_favorites.c.user_id, user_favorites.c.book_id, 'favourite'),
+        (DigitalDownload.user_id, DigitalDownload.book_id, 'download'),
+        (ReadingSession.user_id, ReadingSession.book_id, 'reading'),
+    ]
+    selects = []
+    for user_column, book_column, kind in sources:
+        query = db.select(
+            user_column.label('user_id'),
+            book_column.label('book_id'),
+            literal(INTERACTION_WEIGHTS[kind]).label('weight')
+        ).distinct()
+        if user_id is not None:
+            query = query.where(user_column == user_id)
+        selects.append(query)
+    return union_all(*selects).subquery()
+
+def load_interactions():
+    """Return (user_id, book_id, weight) rows, one per member and book"""
+    interactions = _interaction_sources()
+    return db.session.execute(
+        db.select(interactions.c.user_id, interactions.c.book_id, func.sum(interactions.c.weight))
+        .group_by(interactions.c.user_id, interactions.c.book_id)
+    ).all()
+
+def build_similarity(rows, top_k=20, min_score=0.0, block_size=2048):
+    """Compute the top-K cosine neighbours of every book.
+
+    ``rows`` are (user_id, book_id, weight) triples. Returns a list of
+    (book_id, similar_book_id, score, rank) tuples.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    if not rows:
+        return []
+
+    users, user_index = np.unique(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                                  return_inverse=True)
+    books, book_index = np.unique(np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)),
+                                  return_inverse=True)
+    weights = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+
+    # Dampen heavy readers so one enthusiast does not dominate the similarities
+    matrix = sparse.csc_matrix((np.log1p(weights), (user_index, book_index)),
+                               shape=(len(users), len(books)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    matrix = matrix @ sparse.diags(1.0 / norms)
+    matrix_t = matrix.T.tocsr()
+
+    neighbours = []
+    for start in range(0, len(books), block_size):
+        stop = min(start + block_size, len(books))
+        # Cosine similarity of this block of books against all books
+        block = (matrix_t[start:stop] @ matrix).tocsr()
+        block.setdiag(0, k=start)
+        block.eliminate_zeros()
+
+        for offset in range(stop - start):
+            row_start, row_end = block.indptr[offset], block.indptr[offset + 1]
+            if row_start == row_end:
+                continue
+            scores = block.data[row_start:row_end]
+            columns = block.indices[row_start:row_end]
+            if len(scores) > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                scores, columns = scores[keep], columns[keep]
+            order = np.lexsort((books[columns], -scores))
+            rank = 0
+            for score, column in zip(scores[order], columns[order]):
+                if score <= min_score:
+                    break
+                rank += 1
+                neighbours.append((int(books[start + offset]), int(books[column]), float(score), rank))
+    return neighbours
+
+def rebuild_recommendations(top_k=None, batch_size=5000):
+    """Recompute and replace the book_similarities table; returns rows stored"""
+    top_k = top_k or current_app.config.get('RECOMMENDER_TOP_K', 20)
+    min_score = current_app.config.get('RECOMMENDER_MIN_SCORE', 0.0)
+
+    rows = load_interactions()
+    neighbours = build_similarity(rows, top_k=top_k, min_score=min_score)
+
+    now = datetime.utcnow()
+    db.session.execute(delete(BookSimilarity))
+    for start in range(0, len(neighbours), batch_size):
+        db.session.execute(insert(BookSimilarity), [
+            {'book_id': book_id, 'similar_book_id': similar_id, 'score': score, 'rank': rank, 'computed_at': now}
+            for book_id, similar_id, score, rank in neighbours[start:start + batch_size]
+        ])
+    db.session.commit()
+
+    logger.info('Rebuilt recommendations: %d interactions, %d neighbour rows', len(rows), len(neighbours))
+    return len(neighbours)
+
+def recommend_for_user(user_id, limit=12):
+    """Books most similar to what the member has borrowed, read or saved"""
+    interactions = _interaction_sources(user_id)
+    known_books = db.select(interactions.c.book_id)
+
+    score = func.sum(BookSimilarity.score).label('score')
+    return db.session.query(Book).join(
+        BookSimilarity, BookSimilarity.similar_book_id == Book.id
+    ).filter(
+        BookSimilarity.book_id.in_(known_books),
+        BookSimilarity.similar_book_id.notin_(known_books),
+        Book.is_active == True
+    ).group_by(Book.id).order_by(score.desc(), Book.id).limit(limit).all()
@@ -0,0 +1,226 @@
+"""
+Precomputed "related books" lists.
+
+Book pages used to pick related titles with ``ORDER BY random()`` over the
+whole category on every view. Instead each book gets a ranked list of up to
+``RELATED_BOOKS_LIMIT`` neighbours stored in ``related_books``, scored from
+shared author, co-borrowing (``book_similarities``), title/description word
+overlap and category, with popular category mates filling any gaps. Pages
+read the list with one primary-key range lookup and rotate through it by
+sampling in Python.
+
+Lists are refreshed for new and edited books by a background job, for books
+that have no list yet by a frequent scheduler sweep, and for the whole
+catalogue nightly. A book with nothing related gets a single rank-0 marker
+row so the sweep does not pick it up again. Refreshing a few books only
+loads the books that can be related to them: their category and author
+mates and co-borrowed titles; text matches from other categories are
+found by the nightly run.
+"""
+
+import logging
+import random
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, insert
+
+from app import db
+from app.models.book import Book
+from app.models.recommendation import BookSimilarity, RelatedBook
+
+logger = logging.getLogger(__name__)
+
+AUTHOR_WEIGHT = 3.0
+CO_BORROW_WEIGHT = 3.0
+TEXT_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+
+# Words shared by more books than this say nothing about relatedness
+MAX_TOKEN_BOOKS = 200
+
+# Rank of the row recorded for a book whose list came out empty
+EMPTY_LIST_RANK = 0
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'from', 'this', 'that', 'into', 'your', 'about', 'book', 'books',
+    'edition', 'volume', 'guide', 'introduction', 'are', 'was', 'were', 'has', 'have', 'its',
+    'their', 'which', 'who', 'how', 'what', 'when', 'will', 'can', 'all', 'not', 'but', 'also',
+}
+
+_WORD = re.compile(r'[a-z0-9]{3,}')
+
+def tokenize(*texts):
+    words = set()
+    for text in texts:
+        if text:
+            words.update(_WORD.findall(text.lower()))
+    return words - STOPWORDS
+
+def _author_key(author):
+    return ' '.join((author or '').lower().split())
+
+class Catalogue:
+    """In-memory index of active books used to score related-book candidates.
+
+    With ``book_ids`` only the candidates for those books are loaded.
+    """
+
+    def __init__(self, book_ids=None):
+        query = db.session.query(
+            Book.id, Book.category_id, Book.author, Book.title,
+            func.substr(Book.description, 1, 1000),
+            func.coalesce(Book.view_count, 0) + func.coalesce(Book.download_count, 0)
+        ).filter(Book.is_active == True)
+        similarities = db.session.query(
+            BookSimilarity.book_id, BookSimilarity.similar_book_id, BookSimilarity.score
+        )
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            similarities = similarities.filter(BookSimilarity.book_id.in_(book_ids))
+            author = func.lower(func.trim(Book.author))
+            targets = db.session.query(Book.category_id, author).filter(Book.id.in_(book_ids)).all()
+            query = query.filter(db.or_(
+                Book.id.in_(book_ids),
+                Book.id.in_(similarities.with_entities(BookSimilarity.similar_book_id)),
+                Book.category_id.in_({category_id for category_id, _ in targets}),
+                author.in_({key for _, key in targets if key})
+            ))
+        rows = query.all()
+
+        self.category = {}
+        self.author = {}
+        self.tokens = {}
+        self.popularity = {}
+        self.by_category = defaultdict(list)
+        self.by_author = defaultdict(list)
+        self.postings = defaultdict(list)
+        for book_id, category_id, author, title, description, popularity in rows:
+            self.category[book_id] = category_id
+            self.author[book_id] = _author_key(author)
+            self.tokens[book_id] = tokenize(title, description)
+            self.popularity[book_id] = popularity
+            self.by_category[category_id].append(book_id)
+            self.by_author[self.author[book_id]].append(book_id)
+            for token in self.tokens[book_id]:
+                self.postings[token].append(book_id)
+
+        for book_ids in self.by_category.values():
+            book_ids.sort(key=lambda book_id: (-self.popularity[book_id], book_id))
+
+        self.co_borrowed = defaultdict(dict)
+        for book_id, similar_id, score in similarities:
+            self.co_borrowed[book_id][similar_id] = score
+
+    def rank(self, book_id, limit):
+        """Return [(related_book_id, score)] for a book, best first"""
+        if book_id not in self.category:
+            return []
+        scores = defaultdict(float)
+
+        author = self.author[book_id]
+        if author and author != 'unknown':
+            for other in self.by_author[author]:
+                scores[other] += AUTHOR_WEIGHT
+
+        for other, score in self.co_borrowed[book_id].items():
+            if other in self.category:
+                scores[other] += CO_BORROW_WEIGHT * score
+
+        mine = self.tokens[book_id]
+        shared = Counter()
+        for token in mine:
+            posting = self.postings[token]
+            if len(posting) <= MAX_TOKEN_BOOKS:
+                shared.update(posting)
+        for other, common in shared.items():
+            scores[other] += TEXT_WEIGHT * common / (len(mine) + len(self.tokens[other]) - common)
+
+        category = self.category[book_id]
+        for other in list(scores):
+            if self.category[other] == category:
+                scores[other] += CATEGORY_WEIGHT
+        # Popular books from the same category fill any remaining places
+        for other in self.by_category[category]:
+            if len(scores) > limit:
+                break
+            if other not in scores:
+                scores[other] = CATEGORY_WEIGHT
+
+        scores.pop(book_id, None)
+        best = sorted(scores.items(), key=lambda item: (-item[1], -self.popularity[item[0]], item[0]))
+        return best[:limit]
+
+def refresh_related_books(book_ids=None, batch_size=500):
+    """Recompute related-book lists for ``book_ids`` (all active books if None).
+
+    Returns the number of books refreshed.
+    """
+    limit = current_app.config.get('RELATED_BOOKS_LIMIT', 18)
+    if book_ids is not None:
+        book_ids = list(book_ids)
+    # The candidates for one batch are cheaper to load than the whole catalogue
+    few = book_ids is not None and len(book_ids) <= batch_size
+    catalogue = Catalogue(book_ids if few else None)
+    if book_ids is None:
+        book_ids = sorted(catalogue.category)
+        # Drop lists of books that are no longer active
+        db.session.execute(delete(RelatedBook).where(RelatedBook.book_id.notin_(book_ids)))
+
+    now = datetime.utcnow()
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        rows = []
+        for book_id in batch:
+            ranked = list(enumerate(catalogue.rank(book_id, limit), start=1))
+            if not ranked and book_id in catalogue.category:
+                # Nothing related: record that, or the sweep would retry the book forever
+                ranked = [(EMPTY_LIST_RANK, (book_id, 0.0))]
+            rows.extend({'book_id': book_id, 'rank': rank, 'related_book_id': related_id,
+                         'score': score, 'computed_at': now}
+                        for rank, (related_id, score) in ranked)
+        db.session.execute(delete(RelatedBook).where(RelatedBook.book_id.in_(batch)))
+        if rows:
+            db.session.execute(insert(RelatedBook), rows)
+        db.session.commit()
+
+    logger.info('Refreshed related books for %d books', len(book_ids))
+    return len(book_ids)
+
+def refresh_missing_related_books(batch_size=500):
+    """Build lists for active books that do not have one yet"""
+    missing = [row[0] for row in db.session.query(Book.id).filter(
+        Book.is_active == True,
+        ~db.exists().where(RelatedBook.book_id == Book.id)
+    ).all()]
+    if not missing:
+        return 0
+    return refresh_related_books(missing, batch_size=batch_size)
+
+def _sample(books, count):
+    return random.sample(books, min(count, len(books)))
+
+def related_books_for(book_id, count=6):
+    """A rotating selection of books related to ``book_id``"""
+    limit = current_app.config.get('RELATED_BOOKS_LIMIT', 18)
+    books = Book.query.join(RelatedBook, RelatedBook.related_book_id == Book.id).filter(
+        RelatedBook.book_id == book_id,
+        RelatedBook.rank.between(1, limit),
+        Book.is_active == True
+    ).order_by(RelatedBook.rank).all()
+    return _sample(books, count)
+
+def related_books_for_many(book_ids, count=6, exclude=()):
+    """A rotating selection of books related to any of ``book_ids``"""
+    limit = current_app.config.get('RELATED_BOOKS_LIMIT', 18)
+    rows = db.session.query(Book, func.sum(RelatedBook.score)).join(
+        RelatedBook, RelatedBook.related_book_id == Book.id
+    ).filter(
+        RelatedBook.book_id.in_(book_ids),
+        RelatedBook.rank > EMPTY_LIST_RANK,
+        Book.id.notin_(exclude),
+        Book.is_active == True
+    ).group_by(Book.id).order_by(func.sum(RelatedBook.score).desc()).limit(limit).all()
+    return _sample([book for book, _ in rows], count)
@@ -0,0 +1,174 @@
+"""
+Set-based loan reminder fan-out.
+
+Due-soon and overdue loans are selected in SQL together with the book title,
+skipping loans that were already reminded in the current window. Each batch is
+written with two bulk INSERTs (``loan_reminders`` then ``notifications``) and
+a single commit. Emails are handed to the job queue afterwards and sent in
+batches by ``send_reminder_emails``.
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.notification import Notification, LoanReminder
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+REMINDER_TEMPLATES = {
+    'overdue': {
+        'title': 'Book Return Reminder',
+        'message': "Your borrowed book '{title}' is {days} day(s) overdue. Please return it as soon as possible to avoid fines.",
+        'type': 'warning',
+        'priority': 3
+    },
+    'due_soon': {
+        'title': 'Book Return Reminder',
+        'message': "Reminder: Your borrowed book '{title}' is due in {days} day(s). Due date: {due_date:%b %d, %Y}.",
+        'type': 'info',
+        'priority': 2
+    }
+}
+
+EMAIL_SUBJECTS = {
+    'overdue': 'Overdue library book: {title}',
+    'due_soon': 'Library book due soon: {title}'
+}
+
+def reminder_window_start(today=None, window_days=1):
+    """First day of the dedupe window containing ``today``"""
+    today = today or date.today()
+    return today - timedelta(days=today.toordinal() % window_days)
+
+def render_reminder(kind, title, due_date, today):
+    """Build the notification fields for a loan reminder"""
+    template = REMINDER_TEMPLATES[kind]
+    days = abs((due_date - today).days)
+    return {
+        'title': template['title'],
+        'message': template['message'].format(title=title, days=days, due_date=due_date),
+        'type': template['type'],
+        'priority': template['priority']
+    }
+
+def send_loan_reminders(due_within_days=None, window_days=None, batch_size=None, today=None,
+                        email=True):
+    """Create reminders for due-soon and overdue loans not yet reminded in this window.
+
+    Returns the number of reminders created.
+    """
+    config = current_app.config
+    due_within_days = config['REMINDER_DUE_WITHIN_DAYS'] if due_within_days is None else due_within_days
+    window_days = window_days or config['REMINDER_WINDOW_DAYS']
+    batch_size = batch_size or config['REMINDER_BATCH_SIZE']
+    today = today or date.today()
+    window_start = reminder_window_start(today, window_days)
+
+    already_reminded = db.session.query(LoanReminder.id).filter(
+        LoanReminder.transaction_id == BorrowingTransaction.id,
+        LoanReminder.window_start == window_start
+    ).exists()
+
+    base_query = db.session.query(
+        BorrowingTransaction.id,
+        BorrowingTransaction.user_id,
+        BorrowingTransaction.due_date,
+        Book.title
+    ).join(Book, Book.id == BorrowingTransaction.book_id).filter(
+        BorrowingTransaction.status.in_(['borrowed', 'overdue']),
+        BorrowingTransaction.due_date <= today + timedelta(days=due_within_days),
+        ~already_reminded
+    ).order_by(BorrowingTransaction.id)
+
+    created = 0
+    last_id = 0
+    now = datetime.utcnow()
+
+    while True:
+        rows = base_query.filter(BorrowingTransaction.id > last_id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        reminders = []
+        notifications = []
+        for transaction_id, user_id, due_date, title in rows:
+            kind = 'overdue' if due_date < today else 'due_soon'
+            reminders.append({
+                'transaction_id': transaction_id,
+                'user_id': user_id,
+                'window_start': window_start,
+                'kind': kind,
+                'created_at': now
+            })
+            notification = render_reminder(kind, title, due_date, today)
+            notification.update({'user_id': user_id, 'is_read': False, 'is_system_wide': False,
+                                 'created_at': now})
+            notifications.append(notification)
+
+        try:
+            # Reminders first: the unique (transaction, window) key stops a
+            # concurrent run before any duplicate notification is written
+            db.session.execute(insert(LoanReminder), reminders)
+            db.session.execute(insert(Notification), notifications)
+            db.session.commit()
+            created += len(rows)
+        except IntegrityError:
+            db.session.rollback()
+            logger.info('Reminder batch ending at loan %s already handled by another run', last_id)
+
+    if created and email and config.get('REMINDER_EMAILS_ENABLED'):
+        from app.services.job_queue import job_queue
+        job_queue.enqueue('send_reminder_emails', {'window_start': window_start.isoformat()})
+
+    logger.info('Created %d loan reminders for window starting %s', created, window_start)
+    return created
+
+def claim_email_batch(window_start, batch_size):
+    """Claim up to ``batch_size`` reminders that still need an email.
+
+    Does not commit: the claim must be committed together with the queued
+    emails, so a failure leaves the reminders unclaimed.
+    """
+    candidate_ids = [row[0] for row in db.session.query(LoanReminder.id).filter(
+        LoanReminder.window_start == window_start,
+        LoanReminder.emailed_at.is_(None)
+    ).order_by(LoanReminder.id).limit(batch_size).all()]
+    if not candidate_ids:
+        return []
+
+    claimed_at = datetime.utcnow()
+    LoanReminder.query.filter(
+        LoanReminder.id.in_(candidate_ids),
+        LoanReminder.emailed_at.is_(None)
+    ).update({'emailed_at': claimed_at}, synchronize_session=False)
+
+    return db.session.query(
+        LoanReminder.id,
+        LoanReminder.kind,
+        User.email,
+        User.first_name,
+        Book.title,
+        BorrowingTransaction.due_date
+    ).join(User, User.id == LoanReminder.user_id).join(
+        BorrowingTransaction, BorrowingTransaction.id == LoanReminder.transaction_id
+    ).join(Book, Book.id == BorrowingTransaction.book_id).filter(
+        LoanReminder.id.in_(candidate_ids),
+        LoanReminder.emailed_at == claimed_at
+    ).all()
+
+def build_reminder_email(kind, first_name, title, due_date, today=None):
+    """Subject and body for a reminder email"""
+    today = today or date.today()
+    rendered = render_reminder(kind, title, due_date, today)
+    subject = EMAIL_SUBJECTS[kind].format(title=title)
+    body = f"Dear {first_name},\n\n{rendered['message']}\n\n{current_app.config.get('LIBRARY_NAME', 'EduConnect Lesotho Digital Library')}"
+    return subject, body
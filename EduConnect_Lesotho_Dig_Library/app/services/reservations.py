@@ -0,0 +1,286 @@
+"""
+Reservation queue engine.
+
+Every active reservation carries its 1-based ``queue_position`` for the book,
+kept compact as people leave the queue, so a patron's place in line and the
+next person to serve are read straight from an index instead of sorting the
+whole queue. When copies come back, ``allocate_holds`` puts them on the hold
+shelf for the front of each queue in one pass (taking the copy out of
+``available_copies``); holds that are not collected by ``hold_expires_at``
+lapse in ``expire_reservations`` and the copy moves on to the next patron.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, insert, update
+
+from app import db
+from app.models.book import Book
+from app.models.notification import Notification
+from app.models.reservation import BookReservation
+from app.models.user import User
+from app.services.inventory import checkin_copy, with_retry
+
+logger = logging.getLogger(__name__)
+
+def _waiting():
+    return db.and_(BookReservation.status == 'active', BookReservation.hold_expires_at.is_(None))
+
+def queue_length(book_id):
+    """Number of active reservations (waiting or on hold) for a book"""
+    return db.session.query(func.count(BookReservation.id)).filter(
+        BookReservation.book_id == book_id,
+        BookReservation.status == 'active'
+    ).scalar()
+
+def next_in_line(book_id):
+    """The first waiting reservation for a book, or None"""
+    return BookReservation.query.filter(
+        BookReservation.book_id == book_id,
+        _waiting()
+    ).order_by(BookReservation.queue_position).first()
+
+def active_hold(user_id, book_id):
+    """The user's reservation that has a copy on the hold shelf, or None"""
+    return BookReservation.query.filter(
+        BookReservation.user_id == user_id,
+        BookReservation.book_id == book_id,
+        BookReservation.status == 'active',
+        BookReservation.hold_expires_at.isnot(None)
+    ).first()
+
+def _lock_book(book_id):
+    """Hold the book row's lock until commit.
+
+    SQLite ignores FOR UPDATE, so there a no-op UPDATE takes its write lock instead.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        # Setting updated_at to itself keeps its onupdate default from firing
+        db.session.execute(update(Book).where(Book.id == book_id).values(updated_at=Book.updated_at))
+    else:
+        db.session.query(Book.id).filter(Book.id == book_id).with_for_update().one()
+
+def _join(user_id, book_id):
+    # With the book locked, concurrent joins queue up behind each other
+    # instead of counting the same queue and taking the same place in it
+    _lock_book(book_id)
+    reservation = BookReservation(user_id=user_id, book_id=book_id,
+                                  queue_position=queue_length(book_id) + 1)
+    db.session.add(reservation)
+    return reservation
+
+def join_queue(user_id, book_id):
+    """Add a reservation at the back of the book's queue"""
+    return with_retry(_join, user_id, book_id)
+
+def remove_from_queue(reservation_id, book_id, position, status, notes=None, now=None):
+    """Close an active reservation and move everyone behind it up one place.
+
+    Does not commit. Returns False if the reservation was no longer active.
+    """
+    now = now or datetime.utcnow()
+    values = {'status': status, 'queue_position': None, 'hold_expires_at': None}
+    if status == 'fulfilled':
+        values['fulfilled_at'] = now
+    if notes:
+        values['notes'] = notes
+
+    closed = BookReservation.query.filter(
+        BookReservation.id == reservation_id,
+        BookReservation.status == 'active'
+    ).update(values, synchronize_session=False)
+    if not closed:
+        return False
+
+    if position is not None:
+        BookReservation.query.filter(
+            BookReservation.book_id == book_id,
+            BookReservation.status == 'active',
+            BookReservation.queue_position > position
+        ).update({'queue_position': BookReservation.queue_position - 1}, synchronize_session=False)
+    return True
+
+def leave_queue(reservation, status, notes=None):
+    """Cancel, fulfil or expire one reservation.
+
+    A copy held for a reservation that is not being fulfilled goes back on the
+    shelf and straight on to the next patron in line.
+    """
+    was_holding = reservation.hold_expires_at is not None
+    if not remove_from_queue(reservation.id, reservation.book_id, reservation.queue_position, status, notes):
+        db.session.rollback()
+        return False
+
+    alerts = []
+    if was_holding and status != 'fulfilled':
+        checkin_copy(reservation.book_id)
+        alerts = allocate_holds([reservation.book_id])
+    db.session.commit()
+    db.session.refresh(reservation)
+    _send_alerts(alerts)
+    return True
+
+def renumber_queues(book_ids):
+    """Rewrite queue positions as 1..n for each book, touching only rows that moved"""
+    rows = db.session.query(
+        BookReservation.id, BookReservation.book_id, BookReservation.queue_position
+    ).filter(
+        BookReservation.book_id.in_(list(book_ids)),
+        BookReservation.status == 'active'
+    ).order_by(
+        BookReservation.book_id,
+        BookReservation.queue_position.is_(None),
+        BookReservation.queue_position,
+        BookReservation.reserved_date,
+        BookReservation.id
+    ).all()
+
+    changes = []
+    positions = Counter()
+    for row in rows:
+        positions[row.book_id] += 1
+        if row.queue_position != positions[row.book_id]:
+            changes.append({'id': row.id, 'queue_position': positions[row.book_id]})
+    if changes:
+        db.session.execute(update(BookReservation), changes)
+    return len(changes)
+
+def allocate_holds(book_ids=None, now=None):
+    """Put free copies on the hold shelf for the front of each reservation queue.
+
+    Takes the held copies out of ``available_copies`` and records in-app
+    notifications. Does not commit; returns the emails to queue once the
+    caller has committed.
+    """
+    now = now or datetime.utcnow()
+    query = db.session.query(Book.id, Book.available_copies).filter(
+        Book.available_copies > 0,
+        Book.is_digital == False
+    )
+    if book_ids is not None:
+        query = query.filter(Book.id.in_(list(book_ids)))
+    available = dict(query.all())
+    if not available:
+        return []
+
+    queue = db.session.query(
+        BookReservation.id,
+        BookReservation.book_id,
+        BookReservation.user_id,
+        User.email,
+        User.first_name,
+        Book.title
+    ).join(User, User.id == BookReservation.user_id).join(
+        Book, Book.id == BookReservation.book_id
+    ).filter(
+        BookReservation.book_id.in_(list(available)),
+        _waiting()
+    ).order_by(BookReservation.book_id, BookReservation.queue_position).all()
+
+    chosen = []
+    per_book = Counter()
+    for entry in queue:
+        if per_book[entry.book_id] < available[entry.book_id]:
+            per_book[entry.book_id] += 1
+            chosen.append(entry)
+    if not chosen:
+        return []
+
+    hold_until = now + timedelta(days=current_app.config.get('RESERVATION_HOLD_DAYS', 3))
+    BookReservation.query.filter(
+        BookReservation.id.in_([entry.id for entry in chosen]),
+        _waiting()
+    ).update({'hold_expires_at': hold_until, 'notified': True}, synchronize_session=False)
+
+    books_by_count = defaultdict(list)
+    for book_id, count in per_book.items():
+        books_by_count[count].append(book_id)
+    for count, ids in books_by_count.items():
+        taken = Book.query.filter(
+            Book.id.in_(ids),
+            Book.available_copies >= count
+        ).update({'available_copies': Book.available_copies - count}, synchronize_session=False)
+        if taken != len(ids):
+            logger.warning('Hold allocation found fewer copies than expected for books %s', ids)
+
+    notifications = []
+    alerts = []
+    for entry in chosen:
+        message = (f"The book '{entry.title}' is now available for borrowing. "
+                   f"It is on the hold shelf for you until {hold_until.strftime('%d %B %Y')}.")
+        notifications.append({'user_id': entry.user_id, 'title': 'Book Available', 'message': message,
+                              'type': 'info', 'is_read': False, 'is_system_wide': False,
+                              'priority': 2, 'created_at': now})
+        alerts.append({
+            'recipient': entry.email,
+            'subject': f'Reserved book available: {entry.title}',
+            'body': f"Dear {entry.first_name},\n\n{message} "
+                    f"Please visit the library to borrow it before your hold expires."
+        })
+    db.session.execute(insert(Notification), notifications)
+    return alerts
+
+def _send_alerts(alerts):
+    if alerts:
+        from app.services.mailer import queue_emails
+        queue_emails(alerts, category='reservation')
+
+def allocate_returned_copies(book_ids):
+    """Hand returned copies to waiting patrons and notify them"""
+    alerts = allocate_holds(book_ids)
+    db.session.commit()
+    _send_alerts(alerts)
+    return len(alerts)
+
+def expire_reservations(now=None, batch_size=500):
+    """Expire lapsed holds and stale waiting reservations.
+
+    Copies from lapsed holds are offered to the next patron in each queue.
+    Returns the number of reservations expired.
+    """
+    now = now or datetime.utcnow()
+    lapsed = db.and_(
+        BookReservation.status == 'active',
+        db.or_(
+            BookReservation.hold_expires_at < now,
+            db.and_(BookReservation.hold_expires_at.is_(None), BookReservation.expires_at < now)
+        )
+    )
+
+    expired = 0
+    while True:
+        batch = db.session.query(
+            BookReservation.id, BookReservation.book_id, BookReservation.hold_expires_at, Book.is_digital
+        ).join(Book, Book.id == BookReservation.book_id).filter(
+            lapsed
+        ).order_by(BookReservation.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        count = BookReservation.query.filter(
+            BookReservation.id.in_([row.id for row in batch]),
+            lapsed
+        ).update({'status': 'expired', 'queue_position': None, 'hold_expires_at': None},
+                 synchronize_session=False)
+        expired += count
+
+        returned = Counter(row.book_id for row in batch
+                           if row.hold_expires_at is not None and not row.is_digital)
+        for book_id, copies in returned.items():
+            checkin_copy(book_id, copies)
+
+        affected = {row.book_id for row in batch}
+        renumber_queues(affected)
+        alerts = allocate_holds(affected, now=now)
+        db.session.commit()
+        _send_alerts(alerts)
+
+        if len(batch) < batch_size:
+            break
+
+    if expired:
+        logger.info('Expired %d reservations', expired)
+    return expired
@@ -0,0 +1,497 @@
+"""
+In-app periodic job scheduler.
+
+Jobs are registered by name with an interval ('every 15m') or a five-field
+cron expression ('0 2 * * *'). Every instance runs the same tick loop, but a
+job only runs on the instance that wins the conditional UPDATE on its
+``scheduled_jobs`` row, so a job never runs twice for the same slot even when
+several machines are up. Each run is recorded in ``scheduled_job_runs``.
+"""
+
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.scheduler import ScheduledJobState, ScheduledJobRun
+
+logger = logging.getLogger(__name__)
+
+class IntervalSchedule:
+    """Run a job every N seconds"""
+
+    UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('Interval must be positive')
+        self.seconds = int(seconds)
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse 'every 15m', '30s', '2h' or '1d'"""
+        match = re.fullmatch(r'(?:every\s+)?(\d+)\s*([smhd])', spec.strip().lower())
+        if not match:
+            raise ValueError(f'Invalid interval: {spec}')
+        return cls(int(match.group(1)) * cls.UNITS[match.group(2)])
+
+    def next_after(self, moment):
+        return moment + timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return f'<IntervalSchedule {self.seconds}s>'
+
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week"""
+
+    ALIASES = {
+        '@hourly': '0 * * * *',
+        '@daily': '0 0 * * *',
+        '@midnight': '0 0 * * *',
+        '@weekly': '0 0 * * 0',
+        '@monthly': '0 0 1 * *'
+    }
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        self.expression = self.ALIASES.get(expression.strip(), expression.strip())
+        fields = self.expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        ]
+        # Standard cron: if both day fields are restricted, either may match
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        weekday = (low, high) == (0, 6)
+        # Sunday may also be written as 7
+        top = high + 1 if weekday else high
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f'Invalid cron step: {field}')
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(p) for p in part.split('-', 1)]
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > top or start > end:
+                raise ValueError(f'Cron field out of range: {field}')
+            values.update(range(start, end + 1, step))
+        if weekday and 7 in values:
+            values.discard(7)
+            values.add(0)
+        return values
+
+    def _day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7  # cron: Sunday == 0
+        day_ok = moment.day in self.days
+        weekday_ok = weekday in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment):
+        """Return the first matching minute strictly after ``moment``"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (1 if candidate.month == 12 else 0)
+                month = 1 if candidate.month == 12 else candidate.month + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f'Cron expression never matches: {self.expression}')
+
+    def __repr__(self):
+        return f'<CronSchedule {self.expression}>'
+
+def parse_schedule(spec):
+    """Build a schedule from an int (seconds), an interval string or a cron expression"""
+    if isinstance(spec, (IntervalSchedule, CronSchedule)):
+        return spec
+    if isinstance(spec, (int, float)):
+        return IntervalSchedule(spec)
+    spec = spec.strip()
+    if spec.startswith('@') or len(spec.split()) == 5:
+        return CronSchedule(spec)
+    return IntervalSchedule.parse(spec)
+
+class ScheduledJob:
+    """A registered periodic job"""
+
+    def __init__(self, name, func, schedule, batch_size=None, jitter=0, lock_timeout=3600,
+                 description=None):
+        self.name = name
+        self.func = func
+        self.schedule = parse_schedule(schedule)
+        self.batch_size = batch_size
+        self.jitter = jitter
+        self.lock_timeout = lock_timeout
+        self.description = description or (func.__doc__ or '').strip().split('\n')[0]
+
+    def next_run_after(self, moment):
+        """Next run time with random jitter to spread load across the window"""
+        next_run = self.schedule.next_after(moment)
+        if self.jitter:
+            next_run += timedelta(seconds=random.uniform(0, self.jitter))
+        return next_run
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'schedule': repr(self.schedule),
+            'batch_size': self.batch_size,
+            'jitter': self.jitter
+        }
+
+class Scheduler:
+    """Job registry plus a background tick loop, initialised like other extensions"""
+
+    def __init__(self, app=None):
+        self.jobs = {}
+        self.app = None
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._thread = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['scheduler'] = self
+        app.config.setdefault('SCHEDULER_ENABLED', False)
+        app.config.setdefault('SCHEDULER_TICK_SECONDS', 30)
+        app.config.setdefault('SCHEDULER_JOBS', {})
+
+    def register(self, name, func, schedule, batch_size=None, jitter=0, lock_timeout=3600,
+                 description=None):
+        """Register a job; SCHEDULER_JOBS config entries override the defaults"""
+        overrides = {}
+        if self.app is not None:
+            overrides = self.app.config.get('SCHEDULER_JOBS', {}).get(name, {})
+        if overrides.get('enabled') is False:
+            self.jobs.pop(name, None)
+            return None
+
+        job = ScheduledJob(
+            name,
+            func,
+            overrides.get('schedule', schedule),
+            batch_size=overrides.get('batch_size', batch_size),
+            jitter=overrides.get('jitter', jitter),
+            lock_timeout=overrides.get('lock_timeout', lock_timeout),
+            description=description
+        )
+        self.jobs[name] = job
+        return job
+
+    def job(self, name, schedule, **options):
+        """Decorator form of register()"""
+        def decorator(func):
+            self.register(name, func, schedule, **options)
+            return func
+        return decorator
+
+    # Leader lock -----------------------------------------------------------
+
+    def _ensure_state(self, job, now):
+        """Create the shared state row for a job the first time it is seen"""
+        if db.session.get(ScheduledJobState, job.name) is not None:
+            return
+        try:
+            db.session.add(ScheduledJobState(
+                job_name=job.name,
+                next_run_at=job.next_run_after(now)
+            ))
+            db.session.commit()
+        except IntegrityError:
+            # Another instance created it first
+            db.session.rollback()
+
+    def _acquire(self, job, now, force=False):
+        """Claim the job row with a conditional UPDATE; True if this instance won"""
+        conditions = [
+            ScheduledJobState.job_name == job.name,
+            db.or_(
+                ScheduledJobState.locked_until.is_(None),
+                ScheduledJobState.locked_until < now
+            )
+        ]
+        if not force:
+            conditions.append(ScheduledJobState.next_run_at <= now)
+
+        claimed = ScheduledJobState.query.filter(*conditions).update({
+            'locked_by': self.instance_id,
+            'locked_until': now + timedelta(seconds=job.lock_timeout)
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _release(self, job, claimed_at, finished_at, status, duration_ms):
+        # Missed slots (e.g. after the machine was scaled to zero) collapse into
+        # this one run; the next slot is computed from now, not replayed
+        next_run_at = job.next_run_after(max(claimed_at, finished_at))
+        ScheduledJobState.query.filter_by(
+            job_name=job.name,
+            locked_by=self.instance_id
+        ).update({
+            'locked_by': None,
+            'locked_until': None,
+            'last_run_at': finished_at,
+            'last_status': status,
+            'last_duration_ms': duration_ms,
+            'next_run_at': next_run_at
+        }, synchronize_session=False)
+        db.session.commit()
+
+    # Running ---------------------------------------------------------------
+
+    def run_job(self, name, force=False, now=None):
+        """Run one job if it is due (or unconditionally with force) and record the run"""
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(f'Unknown scheduled job: {name}')
+
+        now = now or datetime.utcnow()
+        self._ensure_state(job, now)
+        if not self._acquire(job, now, force=force):
+            return None
+
+        run = ScheduledJobRun(
+            job_name=job.name,
+            instance_id=self.instance_id,
+            started_at=datetime.utcnow(),
+            batch_size=job.batch_size
+        )
+        db.session.add(run)
+        db.session.commit()
+        run_id = run.id
+
+        started = time.perf_counter()
+        status, processed, error = 'success', 0, None
+        try:
+            if job.batch_size:
+                processed = job.func(batch_size=job.batch_size)
+            else:
+                processed = job.func()
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)
+            logger.exception('Scheduled job %s failed', job.name)
+
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        finished_at = datetime.utcnow()
+
+        run = db.session.get(ScheduledJobRun, run_id)
+        run.finished_at = finished_at
+        run.duration_ms = duration_ms
+        run.status = status
+        run.items_processed = processed if isinstance(processed, int) else 0
+        run.error = error
+        db.session.commit()
+
+        self._release(job, now, finished_at, status, duration_ms)
+        logger.info('Scheduled job %s %s in %dms (%s items)', job.name, status, duration_ms, run.items_processed)
+        return run
+
+    def run_pending(self, now=None):
+        """Run every job that is due; returns the runs performed by this instance"""
+        runs = []
+        for name in list(self.jobs):
+            try:
+                run = self.run_job(name, now=now)
+                if run is not None:
+                    runs.append(run)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Scheduler tick failed for job %s', name)
+        return runs
+
+    def get_status(self):
+        """Registry, shared state and duration metrics for every job"""
+        states = {s.job_name: s for s in ScheduledJobState.query.filter(
+            ScheduledJobState.job_name.in_(list(self.jobs))
+        ).all()}
+        status = []
+        for name, job in sorted(self.jobs.items()):
+            entry = job.to_dict()
+            state = states.get(name)
+            entry['state'] = state.to_dict() if state else None
+            entry['metrics'] = ScheduledJobRun.get_duration_stats(name)
+            status.append(entry)
+        return status
+
+    # Background loop -------------------------------------------------------
+
+    def start(self):
+        """Start the tick loop in a daemon thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # A forked worker must not hold locks under its parent's name
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info('Scheduler started on %s with %d jobs', self.instance_id, len(self.jobs))
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        tick = self.app.config.get('SCHEDULER_TICK_SECONDS', 30)
+        # Stagger the first tick so instances started together do not collide
+        self._stop.wait(random.uniform(0, min(tick, 5)))
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                finally:
+                    db.session.remove()
+            self._stop.wait(tick)
+
+scheduler = Scheduler()
+
+def register_maintenance_jobs(scheduler):
+    """Register the library's periodic maintenance jobs"""
+    from app.models.borrowing import BorrowingTransaction
+    from app.models.reservation import BookReservation
+    from app.models.offline import OfflineToken
+
+    def update_overdue(batch_size=None):
+        """Mark overdue loans and recalculate fines"""
+        return BorrowingTransaction.update_overdue_status(batch_size=batch_size or 500)
+
+    def cleanup_expired():
+        """Expire stale reservations and offline tokens"""
+        return BookReservation.cleanup_expired() + OfflineToken.cleanup_expired()
+
+    def check_expired_subscriptions(batch_size=None):
+        """Deactivate expired subscriptions and raise renewal bills"""
+        from app.routes.subscription import process_expired_subscriptions
+        expired_count, _ = process_expired_subscriptions(batch_size=batch_size)
+        return expired_count
+
+    def send_loan_reminders(batch_size=None):
+        """Notify users about loans due soon or overdue"""
+        from app.services.reminders import send_loan_reminders
+        return send_loan_reminders(batch_size=batch_size)
+
+    def deliver_outbox(batch_size=None):
+        """Send queued emails, including retries and rate-limited leftovers"""
+        from app.services.mailer import deliver_outbox
+        return deliver_outbox(batch_size=batch_size)
+
+    def reconcile_inventory(batch_size=None):
+        """Recompute available copies from active loans"""
+        from app.services.inventory import reconcile_inventory
+        return reconcile_inventory(batch_size=batch_size or 500)
+
+    def rebuild_recommendations(batch_size=None):
+        """Recompute book-to-book similarities from reading history"""
+        from app.services.recommender import rebuild_recommendations
+        return rebuild_recommendations(batch_size=batch_size or 5000)
+
+    def refresh_related_books(batch_size=None):
+        """Build related-books lists for books that do not have one yet"""
+        from app.services.related_books import refresh_missing_related_books
+        return refresh_missing_related_books(batch_size=batch_size or 500)
+
+    def rebuild_related_books(batch_size=None):
+        """Recompute every related-books list, picking up new co-borrowing data"""
+        from app.services.related_books import refresh_related_books
+        return refresh_related_books(batch_size=batch_size or 500)
+
+    def sync_search_index():
+        """Add new and edited books to the semantic search index"""
+        from app.services.semantic_search import sync_index
+        return sync_index()
+
+    def refresh_chat_index():
+        """Rebuild the AI chat retrieval index when books, reviews or categories change"""
+        from app.services.chat_retrieval import refresh_index
+        return refresh_index()
+
+    def rebuild_search_index():
+        """Rebuild the semantic search index with fresh term weights"""
+        from app.services.semantic_search import rebuild_index
+        return rebuild_index()
+
+    def purge_ai_cache(batch_size=None):
+        """Delete expired AI responses from the shared cache"""
+        from app.services.ai_cache import purge_expired
+        return purge_expired(batch_size=batch_size or 1000)
+
+    def purge_ai_chat_events(batch_size=None):
+        """Delete raw AI chat events past the retention period"""
+        from app.services.chat_analytics import purge_old_events
+        return purge_old_events(batch_size=batch_size or 1000)
+
+    def purge_sessions(batch_size=None):
+        """Delete expired server-side sessions"""
+        from app.services.sessions import purge_expired_sessions
+        return purge_expired_sessions(batch_size=batch_size or 1000)
+
+    def purge_rate_limits(batch_size=None):
+        """Delete shared rate limit buckets that have refilled"""
+        from app.services.rate_limit import purge_idle_buckets
+        return purge_idle_buckets(batch_size=batch_size or 1000)
+
+    def purge_profiles():
+        """Delete request profiles beyond the retention limits"""
+        from app.services.profiler import purge_old_captures
+        return purge_old_captures()
+
+    scheduler.register('purge_rate_limits', purge_rate_limits, 'every 1h', batch_size=1000, jitter=120)
+    scheduler.register('purge_profiles', purge_profiles, 'every 6h', jitter=600)
+    scheduler.register('purge_sessions', purge_sessions, 'every 1h', batch_size=1000, jitter=120)
+    scheduler.register('update_overdue', update_overdue, '15 0 * * *', batch_size=500, jitter=300)
+    scheduler.register('reconcile_inventory', reconcile_inventory, '30 3 * * *', batch_size=500, jitter=600)
+    scheduler.register('purge_ai_cache', purge_ai_cache, 'every 1h', batch_size=1000, jitter=120)
+    scheduler.register('purge_ai_chat_events', purge_ai_chat_events, '0 4 * * *', batch_size=1000, jitter=600)
+    scheduler.register('rebuild_recommendations', rebuild_recommendations, '0 2 * * *', batch_size=5000, jitter=900)
+    scheduler.register('rebuild_related_books', rebuild_related_books, '30 2 * * *', batch_size=500, jitter=900)
+    scheduler.register('refresh_related_books', refresh_related_books, 'every 15m', batch_size=500)
+    scheduler.register('rebuild_search_index', rebuild_search_index, '45 2 * * *', jitter=900)
+    scheduler.register('sync_search_index', sync_search_index, 'every 5m')
+    scheduler.register('refresh_chat_index', refresh_chat_index, 'every 5m', jitter=60)
+    scheduler.register('deliver_outbox', deliver_outbox, 'every 1m', batch_size=100)
+    scheduler.register('send_loan_reminders', send_loan_reminders, '0 7 * * *', batch_size=1000, jitter=300)
+    scheduler.register('cleanup_expired', cleanup_expired, 'every 1h', jitter=120)
+    scheduler.register('check_expired_subscriptions', check_expired_subscriptions, 'every 6h',
+                       batch_size=200, jitter=300)
@@ -0,0 +1,569 @@
+"""
+Synthetic production-scale data for load and performance testing.
+
+``seed_scale`` (the ``flask seed-scale`` command) adds a large, realistic
+catalogue and usage history on top of an initialised database: members,
+books, loans, downloads, reading sessions, reviews, subscriptions with
+their billing records and payments, and notifications. The data
+follows the skew that real libraries show rather than a uniform spread:
+
+- Book popularity is Zipfian, so a few hundred titles take most of the
+  loans and downloads, and the popular titles have more copies.
+- Member activity is skewed too. A minority of members do most of the
+  borrowing, and heavy readers are more likely to subscribe.
+- Loans follow the school calendar. There are peaks in term time, lows
+  over the December and June holidays, fewer loans at weekends, daytime
+  hours, and slow growth over the period.
+- Loan outcomes are consistent with each other:
+  - most loans are returned on time;
+  - some are renewed;
+  - late returns carry fines, and the fines become late-fee bills;
+  - loans still open at the end of the period never exceed a book's
+    copies, and ``available_copies`` matches them.
+
+Rows are written with bulk core INSERTs of ``batch_size`` rows, each
+batch in its own transaction, with ids assigned up front so child rows
+never have to read their parents back. The ids continue after the
+existing rows, so seeding twice adds a second batch.
+
+Every table draws from its own random generator, derived from ``seed``.
+The same seed, counts, ``days`` and ``end`` always produce the same data,
+and changing the size of one table does not reshuffle the others.
+Seeded members all share one password, and seeded digital books have no
+files behind them.
+"""
+
+import logging
+import random
+import time
+from bisect import bisect
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from flask import current_app
+from sqlalchemy import func, update
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models.book import Book, Category
+from app.models.borrowing import BorrowingTransaction
+from app.models.notification import Notification
+from app.models.offline import DigitalDownload, ReadingSession
+from app.models.review import BookReview
+from app.models.subscription import BillingRecord, Payment, SubscriptionPlan, UserSubscription
+from app.models.user import User, UserRole
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTS = {
+    'users': 50000,
+    'books': 100000,
+    'borrowings': 2000000,
+    'downloads': 300000,
+    'reading_sessions': 500000,
+    'reviews': 150000,
+    'notifications': 200000,
+}
+
+BOOK_ZIPF = 1.07  # Exponent of the book popularity curve
+USER_ZIPF = 0.8  # Exponent of the member activity curve
+DIGITAL_SHARE = 0.4
+SUBSCRIBER_SHARE = 0.35
+LIBRARIANS_PER_MEMBER = 1 / 1000
+
+# Relative loan volume by month (school terms) and by weekday, Monday first
+MONTH_WEIGHTS = {1: 0.55, 2: 1.2, 3: 1.3, 4: 1.1, 5: 1.3, 6: 0.7, 7: 0.9, 8: 1.2, 9: 1.3, 10: 1.25, 11: 1.0, 12: 0.35}
+WEEKDAY_WEIGHTS = (1.0, 1.05, 1.05, 1.0, 0.9, 0.55, 0.25)
+HOUR_WEIGHTS = (0, 0, 0, 0, 0, 0, 0.2, 0.6, 1.5, 2.2, 2.6, 2.6, 2.4, 2.6, 2.8, 2.6, 2.0, 1.4,
+                1.0, 0.9, 0.8, 0.6, 0.3, 0.1)
+READING_HOUR_WEIGHTS = (0.2, 0.1, 0, 0, 0, 0.1, 0.4, 0.8, 0.6, 0.6, 0.7, 0.8, 1.0, 1.0, 0.9, 1.0, 1.2, 1.6,
+                        2.2, 2.8, 3.0, 2.6, 1.6, 0.6)
+
+DISTRICTS = {'Maseru': 519, 'Leribe': 337, 'Berea': 262, 'Mafeteng': 178, "Mohale's Hoek": 165,
+             'Thaba-Tseka': 135, 'Butha-Buthe': 118, 'Quthing': 115, 'Mokhotlong': 100, "Qacha's Nek": 75}
+MEMBER_ROLES = {'student': 60, 'public': 32, 'researcher': 8}
+FIRST_NAMES = ('Thabo', 'Lerato', 'Mpho', 'Palesa', 'Teboho', 'Lineo', 'Tumelo', 'Nthabiseng', 'Katleho',
+               'Refiloe', 'Limpho', 'Tsepo', 'Mamello', 'Rethabile', 'Lebohang', 'Keketso', 'Puleng',
+               'Motlatsi', 'Bokang', 'Nthati', 'Relebohile', 'Hlompho', 'Karabo', 'Neo', 'Lintle',
+               'Bohlale', 'Tlotliso', 'Mosa', 'Grace', 'John', 'Mary', 'Peter', 'Sarah', 'David')
+LAST_NAMES = ('Mokoena', 'Molapo', 'Mofokeng', 'Letsie', 'Thamae', 'Ramakatsa', 'Sekhonyana', 'Majara',
+              'Lerotholi', 'Mohapi', 'Nkhahle', 'Ramoholi', 'Makhetha', 'Tau', 'Phakoe', 'Mosala', 'Khoali',
+              'Seeiso', 'Mokhethi', 'Ntsekhe', 'Matete', 'Lekhanya', 'Mahao', 'Moorosi', 'Sello', 'Smith')
+TITLE_SUBJECTS = ('Mathematics', 'Physical Science', 'Biology', 'Agriculture', 'Sesotho Grammar',
+                  'English Literature', 'History of Lesotho', 'Geography', 'Accounting', 'Economics',
+                  'Computer Studies', 'Public Health', 'Nursing', 'Civic Education', 'Soil Conservation',
+                  'Small Business', 'Climate', 'Water Resources', 'Livestock Farming', 'Poetry')
+TITLE_PATTERNS = ('Introduction to {subject}', '{subject} for Secondary Schools', 'A Practical Guide to {subject}',
+                  '{subject}: Concepts and Practice', 'Essentials of {subject}', '{subject} in Southern Africa',
+                  'Readings in {subject}', '{subject} Workbook', 'Advanced {subject}', 'Stories of {place}',
+                  'The {adjective} Mountain', 'Voices from {place}', 'The {adjective} Season')
+ADJECTIVES = ('Silent', 'Blue', 'Long', 'Hidden', 'Golden', 'Cold', 'Last', 'Distant', 'Quiet', 'Red')
+PUBLISHERS = ('Morija Sesuto Book Depot', 'Longman Lesotho', 'Macmillan Boleswa', 'Mazenod Publishers',
+              'Education Press', 'Heinemann', 'Oxford University Press Southern Africa', 'Pearson')
+LANGUAGES = {'English': 70, 'Sesotho': 25, 'French': 5}
+DEVICES = {'mobile': 70, 'desktop': 20, 'tablet': 10}
+USER_AGENTS = ('Mozilla/5.0 (Linux; Android 12) Chrome/120.0 Mobile', 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0',
+               'Mozilla/5.0 (Linux; Android 10) Opera Mini/70.0', 'Mozilla/5.0 (X11; Linux x86_64) Firefox/121.0')
+PAYMENT_METHODS = {'mobile_money': 60, 'cash': 25, 'card': 10, 'bank_transfer': 5}
+RATINGS = {1: 5, 2: 8, 3: 17, 4: 35, 5: 35}
+REVIEW_TEXTS = ('Very helpful for my exams.', 'Clear explanations and good examples throughout.',
+                'A bit outdated but still useful.', 'My children loved the stories.',
+                'Hard to follow in places, the later chapters are better.', 'Highly recommended for teachers.')
+NOTIFICATIONS = (
+    ('info', 1, 'Book due soon', 'A book you borrowed is due back in 2 days.'),
+    ('warning', 2, 'Book overdue', 'A book you borrowed is overdue. Please return it to avoid further fines.'),
+    ('success', 1, 'Reservation ready', 'A book you reserved is waiting for you at the front desk.'),
+    ('info', 1, 'Subscription expiring', 'Your subscription ends in 5 days.'),
+    ('info', 1, 'New arrivals', 'New books have been added in your favourite categories.'),
+)
+
+class Weighted:
+    """Draws items with fixed relative weights in O(log n)"""
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = list(accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def draw(self, rng):
+        index = bisect(self.cumulative, rng.random() * self.total)
+        return self.items[min(index, len(self.items) - 1)]
+
+    @classmethod
+    def of(cls, mapping):
+        return cls(mapping.keys(), mapping.values())
+
+def zipf_weights(count, exponent, rng):
+    """Zipf weights for ``count`` items in shuffled rank order, and the ranks"""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return [rank ** -exponent for rank in ranks], ranks
+
+def spread(total, weights, rng):
+    """Split ``total`` into integer counts proportional to ``weights``"""
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    remainders = Weighted(range(len(weights)), [weight * scale - count for weight, count in zip(weights, counts)])
+    for _ in range(total - sum(counts)):
+        counts[remainders.draw(rng)] += 1
+    return counts
+
+def _isbn(number):
+    digits = f'979{number % 10 ** 9:09d}'
+    check = (10 - sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits)) % 10) % 10
+    return f'{digits[:3]}-{digits[3:]}{check}'
+
+class ScaleSeeder:
+    """Generates and bulk-inserts one synthetic dataset"""
+
+    def __init__(self, counts=None, seed=42, days=730, end=None, batch_size=5000, password='library123',
+                 echo=None):
+        self.counts = dict(DEFAULT_COUNTS, **(counts or {}))
+        self.seed = seed
+        self.days = days
+        self.end = end or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.batch_size = batch_size
+        self.password = password
+        self.echo = echo or (lambda message: logger.info(message))
+        self.fine_per_day = current_app.config.get('FINE_PER_DAY', 1.0)
+        self.loan_days = current_app.config.get('DEFAULT_BORROWING_DAYS', 14)
+        self.inserted = Counter()
+
+        day_weights = []
+        for offset in range(days):
+            day = self.start + timedelta(days=offset)
+            growth = 1 + 0.5 * offset / days
+            day_weights.append(MONTH_WEIGHTS[day.month] * WEEKDAY_WEIGHTS[day.weekday()] * growth)
+        self.day_weights = day_weights
+        self.hours = Weighted(range(24), HOUR_WEIGHTS)
+        self.reading_hours = Weighted(range(24), READING_HOUR_WEIGHTS)
+
+    def rng(self, table):
+        return random.Random(f'{self.seed}:{table}')
+
+    def run(self):
+        roles = {role.role_name: role.id for role in UserRole.query.all()}
+        categories = [category.id for category in Category.query.filter_by(is_active=True)]
+        missing = [name for name in ('librarian', *MEMBER_ROLES) if name not in roles]
+        if missing or not categories:
+            raise RuntimeError("Roles or categories are missing; run 'flask init-db' first")
+        plans = SubscriptionPlan.query.filter_by(is_active=True).order_by(SubscriptionPlan.id).all()
+
+        self._timed('users', self._users, roles)
+        self._timed('books', self._books, categories)
+        self._timed('borrowing_transactions', self._borrowings)
+        if plans:
+            self._timed('user_subscriptions', self._subscriptions, plans)
+        else:
+            self.echo('No active subscription plans; skipping subscriptions (run setup_subscriptions.py)')
+            self.subscribers = None
+        self._timed('billing_records', self._late_fees)
+        self._timed('digital_downloads', self._downloads)
+        self._timed('reading_sessions', self._reading_sessions)
+        self._timed('book_reviews', self._reviews)
+        self._timed('notifications', self._notifications)
+        self._timed('books (counters)', self._book_counters)
+        return dict(self.inserted)
+
+    # Helpers
+
+    def _timed(self, label, step, *args):
+        started = time.perf_counter()
+        step(*args)
+        self.echo(f'{label}: done in {time.perf_counter() - started:.1f}s')
+
+    def _next_id(self, model):
+        return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+    def _writer(self, model):
+        """Buffer rows and insert them ``batch_size`` at a time; call with None to flush"""
+        buffer = []
+        table = model.__table__
+
+        def write(row):
+            if row is not None:
+                buffer.append(row)
+            if buffer and (row is None or len(buffer) >= self.batch_size):
+                db.session.execute(table.insert(), buffer)
+                db.session.commit()
+                self.inserted[table.name] += len(buffer)
+                buffer.clear()
+        return write
+
+    def _moment(self, rng, day, hours=None):
+        hour = (hours or self.hours).draw(rng)
+        return self.start + timedelta(days=day, hours=hour, seconds=rng.randrange(3600))
+
+    def _moments(self, rng, total, hours=None):
+        """``total`` timestamps over the period, in order, following the day weights"""
+        for day, count in enumerate(spread(total, self.day_weights, rng)):
+            yield from sorted(self._moment(rng, day, hours) for _ in range(count))
+
+    # Tables
+
+    def _users(self, roles):
+        rng = self.rng('users')
+        count = self.counts['users']
+        first_id = self._next_id(User)
+        password_hash = generate_password_hash(self.password)
+        librarians = max(1, int(count * LIBRARIANS_PER_MEMBER))
+        member_roles = Weighted([roles[name] for name in MEMBER_ROLES], MEMBER_ROLES.values())
+        districts = Weighted.of(DISTRICTS)
+        write = self._writer(User)
+        for offset in range(count):
+            user_id = first_id + offset
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            created = self.start - timedelta(days=rng.uniform(0, 1095))
+            write({
+                'id': user_id, 'username': f'{first.lower()}.{last.lower()}{user_id}',
+                'email': f'{first.lower()}.{last.lower()}{user_id}@seed.example', 'password_hash': password_hash,
+                'first_name': first, 'last_name': last, 'phone_number': f'+266 5{rng.randrange(10 ** 7):07d}',
+                'address': None, 'district': districts.draw(rng), 'profile_image': None,
+                'role_id': roles['librarian'] if offset < librarians else member_roles.draw(rng),
+                'is_active': rng.random() > 0.02, 'email_verified': rng.random() < 0.8,
+                'created_at': created, 'updated_at': created,
+                'last_login': self.end - timedelta(days=rng.expovariate(1 / 30)) if rng.random() < 0.7 else None,
+            })
+        write(None)
+
+        self.librarian_ids = list(range(first_id, first_id + librarians))
+        self.member_ids = list(range(first_id + librarians, first_id + count)) or self.librarian_ids
+        weights, _ = zipf_weights(len(self.member_ids), USER_ZIPF, rng)
+        self.member_weights = weights
+        self.members = Weighted(self.member_ids, weights)
+
+    def _books(self, categories):
+        rng = self.rng('books')
+        count = self.counts['books']
+        first_id = self._next_id(Book)
+        weights, ranks = zipf_weights(count, BOOK_ZIPF, rng)
+        category_weights = Weighted(categories, [3 if index == 0 else 1 for index in range(len(categories))])
+        languages = Weighted.of(LANGUAGES)
+        authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}' for _ in range(max(50, count // 4))]
+        places = list(DISTRICTS)
+        physical, physical_weights, digital, digital_weights = [], [], [], []
+        self.copies = {}
+        self.file_sizes = {}
+        write = self._writer(Book)
+        for offset in range(count):
+            book_id = first_id + offset
+            rank = ranks[offset]
+            is_digital = rng.random() < DIGITAL_SHARE
+            title = rng.choice(TITLE_PATTERNS).format(subject=rng.choice(TITLE_SUBJECTS), place=rng.choice(places),
+                                                      adjective=rng.choice(ADJECTIVES))
+            if is_digital:
+                copies = 1
+                file_format = 'PDF' if rng.random() < 0.7 else 'EPUB'
+                file_size = int(rng.lognormvariate(15.2, 0.8))  # Around 4 MB
+                digital.append(book_id)
+                digital_weights.append(weights[offset])
+                self.file_sizes[book_id] = file_size
+            else:
+                copies = 1 + int(rng.expovariate(1.2)) + (rng.randint(3, 10) if rank <= count / 100 else 0)
+                file_format = file_size = None
+                physical.append(book_id)
+                physical_weights.append(weights[offset])
+            self.copies[book_id] = copies
+            created = self.start - timedelta(days=rng.uniform(0, 1825))
+            write({
+                'id': book_id, 'title': title, 'author': rng.choice(authors), 'isbn': _isbn(book_id),
+                'publisher': rng.choice(PUBLISHERS),
+                'publication_year': max(1950, 2025 - int(rng.expovariate(1 / 12))),
+                'edition': None, 'pages': min(1500, max(24, int(rng.lognormvariate(5.3, 0.5)))),
+                'language': languages.draw(rng), 'description': f'{title}, published for readers in Lesotho.',
+                'category_id': category_weights.draw(rng), 'is_digital': is_digital,
+                'file_path': f'books/seed-{book_id}.{file_format.lower()}' if is_digital else None,
+                'file_size': file_size, 'file_format': file_format, 'cover_image': None,
+                'total_copies': copies, 'available_copies': copies, 'is_active': True,
+                'is_featured': rank <= 20, 'download_count': 0, 'view_count': 0,
+                'created_at': created, 'updated_at': created, 'created_by': rng.choice(self.librarian_ids),
+            })
+        write(None)
+
+        self.physical = Weighted(physical, physical_weights) if physical else None
+        self.digital = Weighted(digital, digital_weights) if digital else None
+        self.loans_per_book = Counter()
+        self.active_loans = Counter()
+
+    def _borrowings(self):
+        if self.physical is None:
+            return
+        rng = self.rng('borrowings')
+        first_id = self._next_id(BorrowingTransaction)
+        end_date = self.end.date()
+        self.late_fees = []
+        write = self._writer(BorrowingTransaction)
+        for offset, borrowed in enumerate(self._moments(rng, self.counts['borrowings'])):
+            user_id = self.members.draw(rng)
+            book_id = self.physical.draw(rng)
+            self.loans_per_book[book_id] += 1
+            due = borrowed.date() + timedelta(days=self.loan_days)
+            renewals = 0
+            returned = None
+            fine = 0.0
+            outcome = rng.random()
+            if outcome < 0.01:
+                status = 'rejected'
+            elif outcome < 0.05 and borrowed > self.end - timedelta(days=2):
+                status = 'pending'
+            else:
+                if outcome < 0.70:
+                    kept = rng.uniform(1, self.loan_days)
+                elif outcome < 0.88:
+                    renewals = rng.randint(1, 2)
+                    due += timedelta(days=self.loan_days * renewals)
+                    kept = self.loan_days * renewals + rng.uniform(1, self.loan_days)
+                else:
+                    kept = self.loan_days + rng.expovariate(1 / 10)
+                returned = borrowed + timedelta(days=kept)
+                if returned > self.end and self.active_loans[book_id] >= self.copies[book_id]:
+                    # Every copy is out; this one came back before the end of the period
+                    returned = borrowed + (self.end - borrowed) * rng.random()
+                if returned <= self.end:
+                    status = 'returned'
+                    fine = max(0, (returned.date() - due).days) * self.fine_per_day
+                else:
+                    returned = None
+                    self.active_loans[book_id] += 1
+                    if due < end_date:
+                        status = 'overdue'
+                        fine = (end_date - due).days * self.fine_per_day
+                    else:
+                        status = 'renewed' if renewals else 'borrowed'
+            fine_paid = bool(fine) and status == 'returned' and rng.random() < 0.85
+            if fine and status == 'returned':
+                self.late_fees.append((user_id, fine, returned, fine_paid))
+            write({
+                'id': first_id + offset, 'user_id': user_id, 'book_id': book_id, 'borrowed_date': borrowed,
+                'due_date': due, 'returned_date': returned, 'status': status, 'renewal_count': renewals,
+                'fine_amount': round(fine, 2), 'fine_paid': fine_paid,
+                'librarian_id': rng.choice(self.librarian_ids), 'notes': None,
+                'created_at': borrowed, 'updated_at': returned or borrowed,
+            })
+        write(None)
+
+    def _billing_rows(self, rng, billing_id, user_id, amount, description, billing_type, due, paid,
+                      subscription_id=None):
+        method = self.payment_methods.draw(rng) if paid else None
+        reference = f'SEED{billing_id:010d}' if paid else None
+        paid_at = due + timedelta(minutes=rng.randrange(1, 2880)) if paid else None
+        if not paid:
+            status = 'overdue' if due < self.end - timedelta(days=30) else 'pending'
+        billing = {
+            'id': billing_id, 'user_id': user_id, 'subscription_id': subscription_id, 'amount': amount,
+            'description': description, 'billing_type': billing_type, 'status': 'paid' if paid else status,
+            'due_date': due, 'paid_date': paid_at, 'payment_method': method,
+            'transaction_reference': reference, 'created_at': due,
+        }
+        payment = None
+        if paid:
+            payment = {
+                'user_id': user_id, 'billing_record_id': billing_id, 'amount': amount, 'payment_method': method,
+                'transaction_reference': reference, 'payment_status': 'completed', 'gateway_response': None,
+                'processed_at': paid_at, 'created_at': paid_at,
+            }
+        return billing, payment
+
+    def _subscriptions(self, plans):
+        rng = self.rng('subscriptions')
+        self.payment_methods = Weighted.of(PAYMENT_METHODS)
+        plan_weights = Weighted(plans, [1 / max(float(plan.price), 1) for plan in plans])
+        mean_weight = sum(self.member_weights) / len(self.member_weights)
+        subscribers, subscriber_weights = [], []
+        for user_id, weight in zip(self.member_ids, self.member_weights):
+            # Heavier readers are more likely to pay for a subscription
+            if rng.random() < min(1.0, SUBSCRIBER_SHARE * (weight / mean_weight) ** 0.5):
+                subscribers.append(user_id)
+                subscriber_weights.append(weight)
+        self.subscribers = Weighted(subscribers, subscriber_weights) if subscribers else None
+
+        subscription_id = self._next_id(UserSubscription)
+        self.billing_id = self._next_id(BillingRecord)
+        write_subscription = self._writer(UserSubscription)
+        write_billing = self._writer(BillingRecord)
+        write_payment = self._writer(Payment)
+        for user_id in subscribers:
+            plan = plan_weights.draw(rng)
+            price = float(plan.price)
+            start = self.start + timedelta(days=rng.uniform(0, self.days))
+            auto_renew = rng.random() < 0.4
+            for _ in range(1 + int(rng.expovariate(1 / 5))):
+                if start > self.end:
+                    break
+                end = start + timedelta(days=plan.duration_days)
+                write_subscription({
+                    'id': subscription_id, 'user_id': user_id, 'plan_id': plan.id, 'start_date': start,
+                    'end_date': end, 'is_active': end > self.end, 'auto_renew': auto_renew, 'created_at': start,
+                })
+                # Nearly every subscription is paid up front; a few bills are still open
+                billing, payment = self._billing_rows(
+                    rng, self.billing_id, user_id, price, f'{plan.name} subscription ({plan.duration_days} days)',
+                    'subscription', start, rng.random() < 0.97, subscription_id)
+                write_billing(billing)
+                if payment:
+                    write_payment(payment)
+                subscription_id += 1
+                self.billing_id += 1
+                start = end + timedelta(days=rng.expovariate(1 / 20) if rng.random() < 0.2 else 0)
+        write_subscription(None)
+        write_billing(None)
+        write_payment(None)
+
+    def _late_fees(self):
+        rng = self.rng('late_fees')
+        if not hasattr(self, 'billing_id'):
+            self.payment_methods = Weighted.of(PAYMENT_METHODS)
+            self.billing_id = self._next_id(BillingRecord)
+        write_billing = self._writer(BillingRecord)
+        write_payment = self._writer(Payment)
+        for user_id, fine, returned, paid in getattr(self, 'late_fees', ()):
+            billing, payment = self._billing_rows(rng, self.billing_id, user_id, round(fine, 2),
+                                                  'Late return fine', 'late_fee', returned, paid)
+            write_billing(billing)
+            if payment:
+                write_payment(payment)
+            self.billing_id += 1
+        write_billing(None)
+        write_payment(None)
+        self.late_fees = []
+
+    def _readers(self):
+        return self.subscribers or self.members
+
+    def _downloads(self):
+        if self.digital is None:
+            return
+        rng = self.rng('downloads')
+        readers = self._readers()
+        self.downloads_per_book = Counter()
+        write = self._writer(DigitalDownload)
+        for moment in self._moments(rng, self.counts['downloads']):
+            book_id = self.digital.draw(rng)
+            self.downloads_per_book[book_id] += 1
+            offline = rng.random() < 0.3
+            write({
+                'user_id': readers.draw(rng), 'book_id': book_id, 'download_date': moment,
+                'ip_address': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+                'user_agent': rng.choice(USER_AGENTS), 'file_size': self.file_sizes[book_id],
+                'download_complete': rng.random() > 0.03, 'offline_access_granted': offline,
+                'offline_expiry_date': (moment + timedelta(days=30)).date() if offline else None,
+            })
+        write(None)
+
+    def _reading_sessions(self):
+        if self.digital is None:
+            return
+        rng = self.rng('reading_sessions')
+        readers = self._readers()
+        devices = Weighted.of(DEVICES)
+        write = self._writer(ReadingSession)
+        for moment in self._moments(rng, self.counts['reading_sessions'], self.reading_hours):
+            minutes = min(240.0, rng.lognormvariate(3.0, 0.7))  # Around 20 minutes
+            write({
+                'user_id': readers.draw(rng), 'book_id': self.digital.draw(rng), 'session_start': moment,
+                'session_end': moment + timedelta(minutes=minutes), 'pages_read': int(minutes * rng.uniform(0.4, 1.2)),
+                'reading_progress': round(rng.uniform(0, 100), 2), 'device_type': devices.draw(rng),
+                'is_offline': rng.random() < 0.25,
+            })
+        write(None)
+
+    def _reviews(self):
+        pools = [(pool, share) for pool, share in ((self.physical, 1 - DIGITAL_SHARE), (self.digital, DIGITAL_SHARE))
+                 if pool is not None]
+        if not pools:
+            return
+        rng = self.rng('reviews')
+        books = Weighted(*zip(*pools))
+        ratings = Weighted.of(RATINGS)
+        reviewed = set()
+        write = self._writer(BookReview)
+        for moment in self._moments(rng, self.counts['reviews']):
+            user_id = self.members.draw(rng)
+            book_id = books.draw(rng).draw(rng)
+            if (user_id, book_id) in reviewed:
+                continue  # One review per member and book
+            reviewed.add((user_id, book_id))
+            write({
+                'user_id': user_id, 'book_id': book_id, 'rating': ratings.draw(rng),
+                'review_text': rng.choice(REVIEW_TEXTS), 'is_approved': rng.random() < 0.9,
+                'created_at': moment, 'updated_at': moment,
+            })
+        write(None)
+
+    def _notifications(self):
+        rng = self.rng('notifications')
+        write = self._writer(Notification)
+        recent = self.end - timedelta(days=14)
+        for moment in self._moments(rng, self.counts['notifications']):
+            kind, priority, title, message = rng.choice(NOTIFICATIONS)
+            system_wide = rng.random() < 0.01
+            write({
+                'user_id': None if system_wide else self.members.draw(rng), 'title': title, 'message': message,
+                'type': kind, 'is_read': moment < recent and rng.random() < 0.8, 'is_system_wide': system_wide,
+                'priority': priority, 'created_at': moment, 'expires_at': moment + timedelta(days=30),
+            })
+        write(None)
+
+    def _book_counters(self):
+        """Store availability, downloads and views that match the generated activity"""
+        downloads = getattr(self, 'downloads_per_book', Counter())
+        rng = self.rng('book_counters')
+        rows = []
+        for book_id in sorted(set(self.loans_per_book) | set(downloads)):
+            activity = 2 * self.loans_per_book[book_id] + 3 * downloads[book_id]
+            rows.append({
+                'id': book_id,
+                'available_copies': max(0, self.copies[book_id] - self.active_loans[book_id]),
+                'download_count': downloads[book_id],
+                'view_count': activity + int(activity * rng.uniform(0, 2)),
+            })
+        for start in range(0, len(rows), self.batch_size):
+            db.session.execute(update(Book), rows[start:start + self.batch_size])
+            db.session.commit()
+
+def seed_scale(counts=None, seed=42, days=730, end=None, batch_size=5000, password='library123', echo=None):
+    """Add a synthetic production-scale dataset; returns the rows inserted per table"""
+    return ScaleSeeder(counts=counts, seed=seed, days=days, end=end, batch_size=batch_size,
+                       password=password, echo=echo).run()
@@ -0,0 +1,390 @@
+"""
+Local semantic search over the catalogue.
+
+Books are turned into hashed TF-IDF vectors: words and word pairs from the
+title (counted twice), author, description and, for plain-text digital books,
+the start of the book itself are hashed into ``SEMANTIC_SEARCH_DIM`` signed
+buckets, weighted by sublinear term frequency and inverse document frequency
+and L2-normalised. The vectors live in a float32 matrix that is memory-mapped
+from disk, so every worker process shares one copy through the page cache,
+and a query is a single matrix-vector product followed by ``argpartition``.
+``search_many`` scores a batch of queries with one matrix-matrix product.
+
+``rebuild_index`` writes a fresh index (nightly, to refresh the IDF
+weights); ``sync_index`` adds new and edited books and blanks removed ones in
+place, growing the file when it is full. Both run as scheduler jobs, never
+inside a search request, so ``SEMANTIC_INDEX_DIR`` should be storage that
+every machine serving searches can read. Readers notice a newer index
+through a version number in ``meta.json`` and reopen it; writers in
+different processes take turns through a lock file. No network or model
+service is involved.
+
+Building and searching the index needs the optional ``numpy`` package.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models.book import Book
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'from', 'this', 'that', 'into', 'your', 'about', 'are', 'was',
+    'were', 'has', 'have', 'its', 'their', 'which', 'who', 'how', 'what', 'when', 'will', 'can',
+    'all', 'not', 'but', 'also', 'any', 'book', 'books', 'there', 'some', 'more', 'than',
+}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+# Characters of a plain-text book file included in its vector
+EXTRACT_CHARS = 20000
+
+# A write lock older than this was left behind by a crashed process
+STALE_LOCK_SECONDS = 600
+
+def terms(text):
+    """Words (minus stopwords and single characters) and adjacent word pairs"""
+    words = [word for word in _WORD.findall((text or '').lower()) if len(word) > 1 and word not in STOPWORDS]
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+def _bucket(term, dim):
+    code = zlib.crc32(term.encode('utf-8'))
+    return code % dim, (1.0 if (code >> 31) & 1 else -1.0)
+
+def _extracted_text(file_path):
+    """The start of a plain-text book file, if there is one on disk"""
+    if not file_path or not file_path.lower().endswith('.txt'):
+        return ''
+    for folder in (os.path.join(current_app.root_path, 'static', 'uploads', 'books'),
+                   os.path.join(current_app.config['UPLOAD_FOLDER'], 'books')):
+        path = os.path.join(folder, file_path)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8', errors='ignore') as f:
+                return f.read(EXTRACT_CHARS)
+    return ''
+
+def document_terms(title, author, description, file_path=None):
+    return terms(title) * 2 + terms(author) + terms(description) + terms(_extracted_text(file_path))
+
+def _load_documents(book_ids=None):
+    query = db.session.query(Book.id, Book.title, Book.author, Book.description, Book.file_path).filter(
+        Book.is_active == True
+    )
+    if book_ids is not None:
+        query = query.filter(Book.id.in_(list(book_ids)))
+    return [(row.id, document_terms(row.title, row.author, row.description, row.file_path))
+            for row in query.order_by(Book.id)]
+
+class SemanticIndex:
+    """A memory-mapped hashed TF-IDF matrix stored in one directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self._lock = threading.Lock()
+        self._version = None
+        self.meta = None
+        self.vectors = None
+        self.ids = None
+        self.df = None
+        self._row_of = {}
+
+    # Loading ---------------------------------------------------------------
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _refresh(self):
+        """Reopen the files if another process published a newer version"""
+        import numpy as np
+
+        meta = self._read_meta()
+        if meta is None:
+            self.meta, self.vectors, self.ids, self.df, self._row_of = None, None, None, None, {}
+            self._version = None
+            return False
+        if meta['version'] == self._version:
+            return True
+        with self._lock:
+            try:
+                vectors = np.memmap(os.path.join(self.directory, meta['vectors']), dtype=np.float32,
+                                    mode='r', shape=(meta['capacity'], meta['dim']))
+                ids = np.load(os.path.join(self.directory, meta['ids']))
+                df = np.load(os.path.join(self.directory, meta['df']))
+            except OSError:
+                # A writer replaced these files meanwhile; pick them up next time
+                return self.meta is not None
+            self.vectors, self.ids, self.df = vectors, ids, df
+            self._row_of = {int(book_id): row for row, book_id in enumerate(self.ids) if book_id >= 0}
+            self.meta = meta
+            self._version = meta['version']
+        return True
+
+    def __len__(self):
+        return len(self.ids) if self._refresh() else 0
+
+    # Vectors ---------------------------------------------------------------
+
+    def _idf(self, df, documents):
+        import numpy as np
+        return np.log((1.0 + documents) / (1.0 + df)).astype(np.float32) + 1.0
+
+    def _vectorize(self, term_lists, dim, idf):
+        import numpy as np
+
+        matrix = np.zeros((len(term_lists), dim), dtype=np.float32)
+        for row, term_list in enumerate(term_lists):
+            for term, count in Counter(term_list).items():
+                bucket, sign = _bucket(term, dim)
+                matrix[row, bucket] += sign * (1.0 + math.log(count))
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _document_frequency(self, term_lists, dim):
+        import numpy as np
+
+        df = np.zeros(dim, dtype=np.float32)
+        for term_list in term_lists:
+            df[list({_bucket(term, dim)[0] for term in term_list})] += 1
+        return df
+
+    # Writing ---------------------------------------------------------------
+
+    @contextmanager
+    def writer(self):
+        """Yield True if this process may write the index, False if another one is"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, 'write.lock')
+        try:
+            if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            yield False
+            return
+        try:
+            os.close(fd)
+            yield True
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def _publish(self, meta):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _write_files(self, version, vectors, ids, df, capacity):
+        import numpy as np
+
+        dim = vectors.shape[1]
+        names = {'vectors': f'vectors-{version}.f32', 'ids': f'ids-{version}.npy', 'df': f'df-{version}.npy'}
+        matrix = np.memmap(os.path.join(self.directory, names['vectors']), dtype=np.float32,
+                           mode='w+', shape=(capacity, dim))
+        matrix[:len(vectors)] = vectors
+        matrix.flush()
+        del matrix
+        np.save(os.path.join(self.directory, names['ids']), np.asarray(ids, dtype=np.int64))
+        np.save(os.path.join(self.directory, names['df']), df)
+        return names
+
+    def _remove_old_files(self, keep):
+        for name in os.listdir(self.directory):
+            if name.split('-')[0] in ('vectors', 'ids', 'df') and name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def rebuild(self, documents, dim, synced_at=None):
+        """Write a fresh index for ``documents`` ([(book_id, terms)])"""
+        import numpy as np
+
+        term_lists = [term_list for _, term_list in documents]
+        df = self._document_frequency(term_lists, dim)
+        vectors = self._vectorize(term_lists, dim, self._idf(df, len(documents)))
+        if not len(vectors):
+            vectors = np.zeros((0, dim), dtype=np.float32)
+
+        previous = self._read_meta()
+        version = (previous['version'] + 1) if previous else 1
+        capacity = max(64, int(len(documents) * 1.25))
+        names = self._write_files(version, vectors, [book_id for book_id, _ in documents], df, capacity)
+        self._publish(dict(names, version=version, dim=dim, capacity=capacity, documents=len(documents),
+                           synced_at=synced_at))
+        self._remove_old_files(set(names.values()))
+        self._refresh()
+        return len(documents)
+
+    def update(self, documents, removed_ids=(), synced_at=None):
+        """Add or replace some books in place, and blank out removed ones"""
+        import numpy as np
+
+        if not self._refresh():
+            raise RuntimeError('Semantic index has not been built yet')
+        meta = dict(self.meta)
+        dim = meta['dim']
+
+        # New documents join the corpus statistics; replaced ones keep theirs
+        new_terms = [term_list for book_id, term_list in documents if book_id not in self._row_of]
+        df = self.df + self._document_frequency(new_terms, dim)
+        total = meta['documents'] + len(new_terms)
+        vectors = self._vectorize([term_list for _, term_list in documents], dim, self._idf(df, total))
+
+        ids = list(map(int, self.ids))
+        row_of = dict(self._row_of)
+        rows = []
+        for book_id, _ in documents:
+            if book_id not in row_of:
+                row_of[book_id] = len(ids)
+                ids.append(book_id)
+            rows.append(row_of[book_id])
+        blanked = [row_of.pop(book_id) for book_id in removed_ids if book_id in row_of]
+        for row in blanked:
+            ids[row] = -1
+
+        version = meta['version'] + 1
+        if len(ids) > meta['capacity']:
+            # Grow into new files so readers keep using the old ones meanwhile
+            capacity = int(len(ids) * 1.5)
+            current = np.array(self.vectors[:len(self.ids)])
+            current = np.vstack([current, np.zeros((len(ids) - len(current), dim), dtype=np.float32)])
+            current[rows] = vectors
+            current[blanked] = 0
+            names = self._write_files(version, current, ids, df, capacity)
+            meta.update(names, capacity=capacity)
+        else:
+            matrix = np.memmap(os.path.join(self.directory, meta['vectors']), dtype=np.float32,
+                               mode='r+', shape=(meta['capacity'], dim))
+            matrix[rows] = vectors
+            matrix[blanked] = 0
+            matrix.flush()
+            del matrix
+            names = {'ids': f'ids-{version}.npy', 'df': f'df-{version}.npy'}
+            np.save(os.path.join(self.directory, names['ids']), np.asarray(ids, dtype=np.int64))
+            np.save(os.path.join(self.directory, names['df']), df)
+            meta.update(names)
+
+        meta.update(version=version, documents=total, synced_at=synced_at or meta.get('synced_at'))
+        self._publish(meta)
+        self._remove_old_files({meta['vectors'], meta['ids'], meta['df']})
+        self._refresh()
+        return len(rows)
+
+    def indexed_ids(self):
+        return set(self._row_of) if self._refresh() else set()
+
+    # Searching -------------------------------------------------------------
+
+    def search_many(self, queries, k=10):
+        """Top-k (book_id, score) lists for a batch of query strings"""
+        import numpy as np
+
+        if not queries:
+            return []
+        if not self._refresh() or not len(self.ids):
+            return [[] for _ in queries]
+
+        count = len(self.ids)
+        idf = self._idf(self.df, self.meta['documents'])
+        query_vectors = self._vectorize([terms(query) for query in queries], self.meta['dim'], idf)
+        scores = query_vectors @ self.vectors[:count].T
+
+        results = []
+        k = min(k, count)
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind='stable')]
+            results.append([(int(self.ids[i]), float(row[i])) for i in top if row[i] > 0])
+        return results
+
+    def search(self, query, k=10):
+        return self.search_many([query], k)[0]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index():
+    """The semantic index for the current app's SEMANTIC_INDEX_DIR"""
+    directory = current_app.config.get('SEMANTIC_INDEX_DIR') or os.path.join(current_app.instance_path,
+                                                                             'semantic_index')
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = SemanticIndex(directory)
+        return _indexes[directory]
+
+def _dim():
+    return current_app.config.get('SEMANTIC_SEARCH_DIM', 512)
+
+def rebuild_index():
+    """Index every active book from scratch; returns the number indexed"""
+    index = get_index()
+    with index.writer() as acquired:
+        if not acquired:
+            return 0
+        synced_at = datetime.utcnow().isoformat()
+        count = index.rebuild(_load_documents(), _dim(), synced_at=synced_at)
+    logger.info('Rebuilt semantic search index with %d books', count)
+    return count
+
+def sync_index():
+    """Bring the index up to date with the catalogue; returns books (re)indexed or removed"""
+    index = get_index()
+    if not len(index) and not index.meta:
+        return rebuild_index()
+
+    with index.writer() as acquired:
+        if not acquired:
+            return 0
+        synced_at = datetime.utcnow().isoformat()
+        active = {row[0] for row in db.session.query(Book.id).filter(Book.is_active == True)}
+        indexed = index.indexed_ids()
+        changed = active - indexed
+        if index.meta.get('synced_at'):
+            since = datetime.fromisoformat(index.meta['synced_at'])
+            changed |= {row[0] for row in db.session.query(Book.id).filter(
+                Book.is_active == True,
+                Book.updated_at >= since
+            )}
+        removed = sorted(indexed - active)
+        if not changed and not removed:
+            return 0
+        index.update(_load_documents(sorted(changed)), removed_ids=removed, synced_at=synced_at)
+    logger.info('Semantic search index synced: %d updated, %d removed', len(changed), len(removed))
+    return len(changed) + len(removed)
+
+def search_books(query, k=10):
+    """Active books best matching ``query`` as [(book, score)], best first"""
+    hits = get_index().search(query, k)
+    if not hits:
+        return []
+    books = {book.id: book for book in Book.query.filter(
+        Book.id.in_([book_id for book_id, _ in hits]),
+        Book.is_active == True
+    )}
+    return [(books[book_id], score) for book_id, score in hits if book_id in books]
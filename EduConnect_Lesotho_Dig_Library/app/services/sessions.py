@@ -0,0 +1,364 @@
+"""
+Server-side sessions.
+
+Flask's default session keeps everything in a signed cookie, so the AI chat
+history made every request (static files included) upload and verify a
+cookie of several kilobytes. Here the data stays on the server and the
+cookie only carries ``<session id>.<version>``, about 25 bytes:
+
+- the id is 16 random bytes, URL-safe encoded
+- the version is bumped on every write
+
+Data is stored by a pluggable backend chosen with ``SESSION_BACKEND``:
+
+- ``database``: the ``server_sessions`` table (SQLite or MySQL)
+- ``filesystem``: one file per session in ``SESSION_FILE_DIR``
+- ``cookie``: Flask's signed cookie sessions, unchanged
+
+In front of the backend each process keeps the last ``SESSION_CACHE_SIZE``
+sessions it has seen. A cached session is used only if its version matches
+the cookie's, so a write made by another process is always read from the
+backend. Unchanged sessions are not written back, except to extend their
+expiry once less than half of ``PERMANENT_SESSION_LIFETIME`` remains.
+Requests for static files get no session at all.
+
+A streamed response sends its cookie before the body, so a view that changes
+the session while streaming calls ``defer_session_save`` before returning and
+``save_deferred_session`` once it is done. The cookie sent with the headers
+already names the version written at the end.
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from flask import current_app, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from flask_login import user_logged_in
+from sqlalchemy import delete, insert, select, update
+
+from app import db
+from app.models.session import ServerSession
+
+logger = logging.getLogger(__name__)
+
+SessionRecord = namedtuple('SessionRecord', 'data version expires_at')
+
+_COOKIE = re.compile(r'([A-Za-z0-9_-]{22})\.(\d{1,9})')
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+class ServerSideSession(SecureCookieSession):
+    """Session dict that remembers its id and the version it was loaded at"""
+
+    def __init__(self, initial=None, sid=None, version=0, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.version = version
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.previous_sid = None
+        self.deferred = False
+
+    def regenerate(self):
+        """Move the data to a new id, e.g. after logging in"""
+        if self.sid is not None:
+            self.previous_sid = self.sid
+            self.sid = None
+        self.modified = True
+
+# Backends ----------------------------------------------------------------------
+
+class DatabaseSessionStore:
+    """Sessions in the ``server_sessions`` table.
+
+    Writes use their own connection so saving the session never commits (or
+    waits on) whatever the view left in ``db.session``.
+    """
+
+    def load(self, sid):
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(ServerSession.data, ServerSession.version, ServerSession.expires_at)
+                .where(ServerSession.id == sid)
+            ).first()
+        return SessionRecord(*row) if row else None
+
+    def save(self, sid, data, version, expires_at):
+        values = {'data': data, 'version': version, 'expires_at': expires_at, 'updated_at': datetime.utcnow()}
+        with db.engine.begin() as connection:
+            result = connection.execute(update(ServerSession).where(ServerSession.id == sid).values(**values))
+            if result.rowcount == 0:
+                connection.execute(insert(ServerSession).values(id=sid, **values))
+
+    def touch(self, sid, expires_at):
+        with db.engine.begin() as connection:
+            connection.execute(update(ServerSession).where(ServerSession.id == sid).values(expires_at=expires_at))
+
+    def delete(self, sid):
+        with db.engine.begin() as connection:
+            connection.execute(delete(ServerSession).where(ServerSession.id == sid))
+
+    def purge_expired(self, batch_size=1000):
+        deleted = 0
+        while True:
+            with db.engine.begin() as connection:
+                ids = connection.execute(
+                    select(ServerSession.id).where(ServerSession.expires_at < datetime.utcnow()).limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    break
+                connection.execute(delete(ServerSession).where(ServerSession.id.in_(ids)))
+            deleted += len(ids)
+        return deleted
+
+class FileSessionStore:
+    """Sessions as JSON files, one per id, replaced atomically on write"""
+
+    suffix = '.session'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid + self.suffix)
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                record = json.load(f)
+            return SessionRecord(record['data'], record['version'], datetime.fromisoformat(record['expires_at']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def load(self, sid):
+        return self._read(self._path(sid))
+
+    def save(self, sid, data, version, expires_at):
+        record = {'data': data, 'version': version, 'expires_at': expires_at.isoformat()}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self._path(sid))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def touch(self, sid, expires_at):
+        record = self.load(sid)
+        if record is not None:
+            self.save(sid, record.data, record.version, expires_at)
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self, batch_size=None):
+        now = datetime.utcnow()
+        deleted = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                record = self._read(entry.path)
+                if record is None or record.expires_at < now:
+                    try:
+                        os.remove(entry.path)
+                        deleted += 1
+                    except FileNotFoundError:
+                        pass
+        return deleted
+
+# Session interface ---------------------------------------------------------------
+
+class ServerSideSessionInterface(SessionInterface):
+    """Loads and saves ``ServerSideSession`` through a store and an in-memory LRU"""
+
+    session_class = ServerSideSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, cache_size=10000):
+        self.store = store
+        self.cache_size = cache_size
+        self.memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    # In-memory front
+
+    def _remember(self, sid, record):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self.memory[sid] = record
+            self.memory.move_to_end(sid)
+            while len(self.memory) > self.cache_size:
+                self.memory.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._lock:
+            self.memory.pop(sid, None)
+
+    def _lookup(self, sid, version):
+        with self._lock:
+            record = self.memory.get(sid)
+            if record is not None and record.version == version:
+                self.memory.move_to_end(sid)
+                return record
+        record = self.store.load(sid)
+        if record is not None:
+            self._remember(sid, record)
+        return record
+
+    def _write(self, sess):
+        data = self.serializer.dumps(dict(sess))
+        record = SessionRecord(data, sess.version, sess.expires_at)
+        self.store.save(sess.sid, data, sess.version, sess.expires_at)
+        self._remember(sess.sid, record)
+
+    # SessionInterface
+
+    def is_static(self, app, request):
+        return app.static_url_path is not None and request.path.startswith(app.static_url_path + '/')
+
+    def open_session(self, app, request):
+        if self.is_static(app, request):
+            return None  # Flask substitutes a read-only empty session
+        match = _COOKIE.fullmatch(request.cookies.get(self.get_cookie_name(app)) or '')
+        if match is None:
+            return self.session_class()
+        sid, version = match.group(1), int(match.group(2))
+        try:
+            record = self._lookup(sid, version)
+        except Exception:
+            logger.exception('Could not load session')
+            return self.session_class()
+        if record is None or record.expires_at <= datetime.utcnow():
+            return self.session_class()
+        try:
+            data = self.serializer.loads(record.data)
+        except ValueError:
+            return self.session_class()
+        return self.session_class(data, sid=sid, version=record.version, expires_at=record.expires_at)
+
+    def save_session(self, app, sess, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if sess.accessed:
+            response.vary.add('Cookie')
+
+        if sess.previous_sid is not None:
+            self.store.delete(sess.previous_sid)
+            self._forget(sess.previous_sid)
+
+        if not sess:
+            if sess.sid is not None and sess.modified:
+                self.store.delete(sess.sid)
+                self._forget(sess.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        changed = sess.modified or sess.sid is None
+        if changed:
+            if sess.sid is None:
+                sess.sid = new_session_id()
+            sess.version += 1
+            sess.expires_at = now + lifetime
+            self._write(sess)
+        elif sess.expires_at - now < lifetime / 2:
+            sess.expires_at = now + lifetime
+            self.store.touch(sess.sid, sess.expires_at)
+            self._remember(sess.sid, SessionRecord(self.serializer.dumps(dict(sess)), sess.version,
+                                                   sess.expires_at))
+
+        if not changed and not sess.deferred and not self.should_set_cookie(app, sess):
+            return
+        # A deferred session is written once more when the streamed body ends
+        version = sess.version + 1 if sess.deferred else sess.version
+        response.set_cookie(
+            name,
+            f'{sess.sid}.{version}',
+            expires=self.get_expiration_time(app, sess),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite
+        )
+        response.vary.add('Cookie')
+
+    def save_deferred(self, sess):
+        """Write a session changed after its cookie was sent"""
+        if not sess.deferred or sess.sid is None:
+            return
+        sess.deferred = False
+        sess.version += 1
+        try:
+            self._write(sess)
+        except Exception:
+            logger.exception('Could not save session after streaming')
+
+    def purge_expired(self, batch_size=1000):
+        with self._lock:
+            now = datetime.utcnow()
+            for sid in [sid for sid, record in self.memory.items() if record.expires_at <= now]:
+                del self.memory[sid]
+        return self.store.purge_expired(batch_size=batch_size)
+
+def _regenerate_on_login(sender, user, **extra):
+    # A new id on login, so an id planted before logging in is useless
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+def init_app(app):
+    """Install the backend chosen by ``SESSION_BACKEND``"""
+    app.config.setdefault('SESSION_BACKEND', 'database')
+    app.config.setdefault('SESSION_CACHE_SIZE', 10000)
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return
+    if backend == 'database':
+        store = DatabaseSessionStore()
+    elif backend == 'filesystem':
+        store = FileSessionStore(app.config.get('SESSION_FILE_DIR') or os.path.join(app.instance_path, 'sessions'))
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND {backend!r}')
+    app.session_interface = ServerSideSessionInterface(store, cache_size=app.config['SESSION_CACHE_SIZE'])
+    user_logged_in.connect(_regenerate_on_login, app)
+
+def defer_session_save():
+    """Call before returning a streamed response that changes the session"""
+    if isinstance(current_app.session_interface, ServerSideSessionInterface):
+        session.deferred = True
+
+def save_deferred_session():
+    """Call from the streamed body once it has finished changing the session"""
+    if isinstance(current_app.session_interface, ServerSideSessionInterface):
+        current_app.session_interface.save_deferred(session._get_current_object())
+
+def purge_expired_sessions(batch_size=1000):
+    """Delete expired sessions from the server-side store"""
+    interface = current_app.session_interface
+    if not isinstance(interface, ServerSideSessionInterface):
+        return 0
+    return interface.purge_expired(batch_size=batch_size)
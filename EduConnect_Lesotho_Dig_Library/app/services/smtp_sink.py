@@ -0,0 +1,91 @@
+"""
+Local SMTP sink for tests, benchmarks and development.
+
+Accepts every message on 127.0.0.1 and keeps it in memory instead of
+delivering it. Failures can be injected per recipient to exercise retries::
+
+    with LocalSMTPSink() as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False)
+        ...
+        assert len(sink.messages) == 10
+
+Requires the optional ``aiosmtpd`` package.
+"""
+
+import asyncio
+import threading
+
+class SinkHandler:
+    """aiosmtpd handler that records messages and injects failures"""
+
+    def __init__(self, delay=0):
+        self.messages = []
+        self.peers = set()
+        self.delay = delay
+        self.fail_once = set()
+        self.reject = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return '550 5.1.1 Mailbox does not exist'
+        with self._lock:
+            if address in self.fail_once and address not in self._failed:
+                self._failed.add(address)
+                return '451 4.3.0 Try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        with self._lock:
+            self.peers.add(session.peer)
+            self.messages.append({
+                'peer': session.peer,
+                'mail_from': envelope.mail_from,
+                'rcpt_tos': list(envelope.rcpt_tos),
+                'data': envelope.content
+            })
+        return '250 Message accepted for delivery'
+
+class LocalSMTPSink:
+    """Run a SinkHandler on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0):
+        from aiosmtpd.controller import Controller
+
+        self.handler = SinkHandler(delay=delay)
+        self.host = host
+        self.controller = Controller(self.handler, hostname=host, port=port or self._free_port(host))
+        self.port = self.controller.port
+
+    @staticmethod
+    def _free_port(host):
+        import socket
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            return sock.getsockname()[1]
+
+    @property
+    def messages(self):
+        return self.handler.messages
+
+    @property
+    def connections(self):
+        """Number of distinct client connections that delivered mail"""
+        return len(self.handler.peers)
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,216 @@
+"""
+Non-blocking structured logging.
+
+Every log record goes through a ``QueueHandler`` on the root logger into a
+bounded in-memory queue; a ``QueueListener`` thread formats the records
+and writes them to the rotating ``LOG_FILE`` and to stderr. A request
+thread only pays for building the record and a ``put_nowait``, so a slow
+disk never holds up a response. If the queue is full, records are dropped
+and counted rather than waited for.
+
+Records are written as one JSON object per line (``LOG_FORMAT = 'text'``
+keeps the old layout). The request method, path, endpoint and user id are
+captured by the thread that logs, since the listener has no request
+context, and anything passed with ``extra=`` is kept as a field.
+
+``LOG_LEVEL`` sets the root level and, optionally, per-logger levels:
+``INFO,app.services.ai_providers=DEBUG,sqlalchemy.engine=WARNING``.
+
+DEBUG records are sampled: of each repeated debug line (same logger and
+message template), only the first and then one in ``LOG_DEBUG_SAMPLE``
+are kept, with a ``sampled`` field saying how many it stands for.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+def parse_levels(spec):
+    """``'INFO,app.x=DEBUG'`` -> ``('INFO', {'app.x': 'DEBUG'})``"""
+    root, levels = None, {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, level = part.partition('=')
+        if sep:
+            levels[name.strip()] = level.strip().upper()
+        else:
+            root = name.upper()
+    return root or 'INFO', levels
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    converter = time.gmtime
+
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = record.stack_info
+        return json.dumps(data, default=str)
+
+class DebugSampler(logging.Filter):
+    """Keeps the first and then one in ``every`` of each repeated DEBUG line"""
+
+    def __init__(self, every=10, max_keys=10000):
+        super().__init__()
+        self.every = every
+        self.max_keys = max_keys
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        with self._lock:
+            if key not in self.counts and len(self.counts) >= self.max_keys:
+                self.counts.clear()
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        if count == 0:
+            return True
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+class RequestQueueHandler(QueueHandler):
+    """Queues records without blocking, adding the request they came from"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Resolve everything that needs this thread or live objects; the
+        # listener only formats and writes
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+            record.endpoint = request.endpoint
+            user = g.get('_login_user')
+            record.user_id = getattr(user, 'id', None)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _Pipeline:
+    """The installed queue handler and listener, restarted in forked workers"""
+
+    def __init__(self, handler, listener):
+        self.handler = handler
+        self.listener = listener
+
+    def stop(self):
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def restart_in_child(self):
+        # The parent's listener thread does not exist in the child
+        self.handler.queue = self.listener.queue = queue.Queue(self.handler.queue.maxsize)
+        self.listener._thread = None
+        self.listener.start()
+
+_pipeline = None
+
+def configure_logging(app):
+    """Route all logging through a queue to JSON (or text) file and stderr handlers"""
+    global _pipeline
+    config = app.config
+    if _pipeline is not None:
+        _pipeline.stop()
+
+    if config.get('LOG_FORMAT', 'json') == 'text':
+        formatter = logging.Formatter(TEXT_FORMAT)
+    else:
+        formatter = JsonFormatter()
+    handlers = []
+    if config.get('LOG_TO_STDERR', True):
+        handlers.append(logging.StreamHandler(sys.stderr))
+    log_file = config.get('LOG_FILE')
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handlers.append(RotatingFileHandler(log_file, maxBytes=config.get('LOG_MAX_BYTES', 10240000),
+                                            backupCount=config.get('LOG_BACKUP_COUNT', 10), delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    handler = RequestQueueHandler(queue.Queue(config.get('LOG_QUEUE_SIZE', 10000)))
+    handler.addFilter(DebugSampler(config.get('LOG_DEBUG_SAMPLE', 10)))
+    listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+
+    root_level, levels = parse_levels(config.get('LOG_LEVEL'))
+    root = logging.getLogger()
+    root.setLevel(root_level)
+    root.addHandler(handler)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    # Flask's own stderr handler would print every app.logger line twice
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(levels.get(app.logger.name, logging.NOTSET))
+
+    listener.start()
+    _pipeline = _Pipeline(handler, listener)
+    app.extensions['structured_logging'] = _pipeline
+    return _pipeline
+
+def shutdown_logging():
+    """Flush queued records and remove the pipeline"""
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+        _pipeline = None
+
+def _after_fork():
+    if _pipeline is not None:
+        _pipeline.restart_in_child()
+
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
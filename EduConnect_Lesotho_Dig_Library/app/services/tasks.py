@@ -0,0 +1,162 @@
+"""
+Background tasks run by the job queue.
+
+Each task receives its job payload as keyword arguments and runs inside an
+app context, so models and ``current_app`` are available as in a view.
+"""
+
+import os
+import random
+
+import requests
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.services.job_queue import job_queue
+
+@job_queue.task('generate_book_cover', max_attempts=3)
+def generate_book_cover(book_id, color):
+    """Generate and store an SVG cover for a book added without one"""
+    from app.models.book import Book
+    from app.routes.admin import generate_svg_cover, save_svg_to_file
+
+    book = db.session.get(Book, book_id)
+    if book is None or book.cover_image:
+        return {'skipped': True}
+
+    cat_name = book.category.name.split(' ')[0] if book.category else 'Academic'
+    svg = generate_svg_cover(book.title, book.author, color)
+    fname = f"{secure_filename(cat_name)}_{secure_filename(book.title)}_{secure_filename(book.author)}.svg"
+    book.cover_image = save_svg_to_file(svg, fname)
+    db.session.commit()
+    return {'book_id': book.id, 'cover_image': book.cover_image}
+
+@job_queue.task('harvest_free_books', max_attempts=4)
+def harvest_free_books(category_id, color, user_id, count=10):
+    """Load free books for one category from Open Library"""
+    from app.models.book import Book, Category
+    from app.routes.admin import fetch_free_books_for_category, generate_svg_cover, save_svg_to_file
+
+    category = db.session.get(Category, category_id)
+    if category is None:
+        return {'added': 0, 'skipped': []}
+
+    books_data = fetch_free_books_for_category(category.name, count=count)
+    added_count = 0
+    skipped_books = []
+    covers_dir = os.path.join(current_app.root_path, '../static/uploads/covers')
+    http = requests.Session()
+
+    for book_info in books_data:
+        title = book_info.get('title', 'Untitled')
+        author = ', '.join(book_info.get('author_name', ['Unknown']))
+        isbn = book_info.get('isbn', [''])[0] if book_info.get('isbn') else None
+
+        # Check for duplicate ISBN before fetching the cover
+        if isbn and Book.query.filter_by(isbn=isbn).first():
+            skipped_books.append({'title': title, 'author': author, 'reason': 'Duplicate ISBN'})
+            continue
+
+        # Sanitize file name for cover image
+        safe_title = secure_filename(title)
+        safe_author = secure_filename(author)
+        cover_image = None
+        if book_info.get('cover_i'):
+            cover_url = f"https://covers.openlibrary.org/b/id/{book_info['cover_i']}-L.jpg"
+            try:
+                img_resp = http.get(cover_url, timeout=10)
+                if img_resp.status_code == 200:
+                    fname = f"{secure_filename(category.name)}_{safe_title}_{safe_author}_{random.randint(1000,9999)}.jpg"
+                    os.makedirs(covers_dir, exist_ok=True)
+                    with open(os.path.join(covers_dir, fname), 'wb') as img_file:
+                        img_file.write(img_resp.content)
+                    cover_image = f'covers/{fname}'
+            except Exception as e:
+                current_app.logger.error(f"Cover image download error: {str(e)}")
+        if not cover_image:
+            svg = generate_svg_cover(title, author, color)
+            fname = f"{secure_filename(category.name)}_{safe_title}_{safe_author}_{random.randint(1000,9999)}.svg"
+            cover_image = save_svg_to_file(svg, fname)
+
+        book = Book(
+            title=title,
+            author=author,
+            isbn=isbn,
+            publisher=book_info.get('publisher', [''])[0] if book_info.get('publisher') else '',
+            publication_year=book_info.get('first_publish_year', None),
+            pages=book_info.get('number_of_pages_median', None),
+            language='English',
+            description=book_info.get('subtitle', ''),
+            category_id=category.id,
+            is_digital=True,
+            cover_image=cover_image,
+            total_copies=1,
+            available_copies=1,
+            is_featured=False,
+            created_by=user_id
+        )
+        try:
+            db.session.add(book)
+            db.session.commit()
+            added_count += 1
+        except Exception as e:
+            db.session.rollback()
+            skipped_books.append({'title': title, 'author': author, 'reason': str(e)})
+            current_app.logger.error(f"Error adding book: {str(e)}")
+
+    current_app.logger.info(f"Loaded {added_count} free books for {category.name}, skipped {len(skipped_books)}")
+    return {'category': category.name, 'added': added_count, 'skipped': skipped_books}
+
+@job_queue.task('send_bulk_reminders', max_attempts=3)
+def send_bulk_reminders():
+    """Notify every user with a loan due soon or overdue"""
+    from app.services.reminders import send_loan_reminders
+    return {'sent_count': send_loan_reminders()}
+
+@job_queue.task('send_reminder_emails', max_attempts=5)
+def send_reminder_emails(window_start):
+    """Move reminders created in a window into the email outbox, batch by batch"""
+    from datetime import date
+    from app.services.mailer import email_enabled, queue_emails, schedule_delivery
+    from app.services.reminders import claim_email_batch, build_reminder_email
+
+    if not email_enabled():
+        # Leave the reminders unclaimed rather than marking them emailed
+        return {'queued': 0}
+
+    window_start = date.fromisoformat(window_start)
+    batch_size = current_app.config['REMINDER_EMAIL_BATCH_SIZE']
+    queued = 0
+
+    while True:
+        try:
+            batch = claim_email_batch(window_start, batch_size)
+            if not batch:
+                break
+            messages = []
+            for row in batch:
+                subject, body = build_reminder_email(row.kind, row.first_name, row.title, row.due_date)
+                messages.append({'recipient': row.email, 'subject': subject, 'body': body})
+            # The claim and the outbox rows are committed together
+            queued += queue_emails(messages, category='reminder', commit=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    if queued:
+        schedule_delivery()
+    return {'queued': queued}
+
+@job_queue.task('deliver_outbox', max_attempts=3)
+def deliver_outbox():
+    """Send queued emails over batched SMTP connections"""
+    from app.services.mailer import deliver_outbox
+    return {'delivered': deliver_outbox()}
+
+@job_queue.task('refresh_related_books', max_attempts=3)
+def refresh_related_books(book_ids):
+    """Rebuild the related-books lists of new or edited books"""
+    from app.services.related_books import refresh_related_books
+    return {'refreshed': refresh_related_books(book_ids)}
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmarks with a regression gate.
+
+    python -m benchmarks.endpoints                 # compare with benchmarks/baseline.json
+    python -m benchmarks.endpoints --save          # record a new baseline
+    python -m benchmarks.endpoints --only main.search admin.dashboard
+
+Seeds a temporary SQLite database with ``seed_scale`` (``--scale`` of the
+production-sized defaults, fixed seed and end date) and drives the hot
+endpoints through the Flask test client. For each scenario it records
+latency percentiles, SQL statements per request and the peak Python
+memory allocated while handling one request (measured in a separate
+tracemalloc pass, so it does not distort the timings).
+
+The run exits with status 1 when a scenario regresses against the
+baseline:
+
+- p95 latency grows by more than ``--latency-tolerance`` (and by at least
+  ``--min-latency-ms``, so sub-millisecond noise never fails a run)
+- it runs more SQL statements than the baseline did
+- peak memory grows by more than ``--memory-tolerance``
+
+Latencies depend on the machine and how busy it is, hence the wide
+default tolerance; record the baseline with ``--save`` on the machine
+that runs the gate. Query counts do not, so they are compared exactly
+everywhere and are the most reliable signal.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func
+
+from app import create_app, db
+from config.config import TestingConfig, config
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SEED_END = datetime(2025, 11, 30, 18)
+
+class BenchmarkConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='library-bench-'), 'bench.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    UPLOAD_FOLDER = tempfile.mkdtemp(prefix='library-bench-uploads-')
+    QUERY_STATS_ENABLED = False
+    METRICS_ENABLED = False
+    PROFILE_ENABLED = False
+
+config['benchmark'] = BenchmarkConfig
+
+class Scenario:
+    """One endpoint (or service call) to time; ``share`` scales the iteration count for slow ones"""
+
+    def __init__(self, name, run, share=1.0):
+        self.name = name
+        self.run = run
+        self.share = share
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def seed_database(app, scale, seed):
+    from app.models.book import Category
+    from app.models.subscription import SubscriptionPlan
+    from app.models.user import User, UserRole
+    from app.services.seed_scale import DEFAULT_COUNTS, seed_scale
+
+    db.create_all()
+    for role_name in ('admin', 'librarian', 'student', 'public', 'researcher'):
+        db.session.add(UserRole(role_name=role_name, description=role_name.title()))
+    for name in ('Academic', 'Literature', 'Science & Technology', 'Local Resources'):
+        db.session.add(Category(name=name, description=name))
+    db.session.add(SubscriptionPlan(name='Student', price=30, duration_days=30, max_books=2))
+    db.session.add(SubscriptionPlan(name='Standard', price=100, duration_days=30, max_books=3))
+    db.session.commit()
+    seed_scale(counts={name: max(1, int(count * scale)) for name, count in DEFAULT_COUNTS.items()},
+               seed=seed, end=SEED_END, echo=lambda message: None)
+
+    admin = User(username='bench-admin', email='bench-admin@seed.example', first_name='Bench', last_name='Admin',
+                 role_id=UserRole.query.filter_by(role_name='admin').one().id, is_active=True)
+    admin.set_password('library123')
+    db.session.add(admin)
+    db.session.commit()
+
+def pick_fixtures(app):
+    """Ids the scenarios use: the most borrowed book, a digital book, a subscriber and an admin"""
+    from app.models.book import Book
+    from app.models.borrowing import BorrowingTransaction
+    from app.models.subscription import UserSubscription
+    from app.models.user import User, UserRole
+
+    # Subscriptions in the seeded history end at SEED_END; extend one so downloads are allowed
+    subscription = UserSubscription.query.order_by(UserSubscription.end_date.desc(), UserSubscription.id).first()
+    subscription.end_date = datetime.utcnow() + timedelta(days=365)
+    subscription.is_active = True
+    popular = db.session.query(BorrowingTransaction.book_id).group_by(BorrowingTransaction.book_id) \
+        .order_by(func.count().desc(), BorrowingTransaction.book_id).first()[0]
+    digital = Book.query.filter_by(is_digital=True).order_by(Book.download_count.desc(), Book.id).first()
+    admin = User.query.join(UserRole).filter(UserRole.role_name == 'admin').order_by(User.id).first()
+    db.session.commit()
+
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'books', digital.file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(os.urandom(256 * 1024))
+    return {'book': popular, 'digital': digital.id, 'member': subscription.user_id, 'admin': admin.id}
+
+def logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+def build_scenarios(app, ids):
+    member = logged_in_client(app, ids['member'])
+    admin = logged_in_client(app, ids['admin'])
+    anonymous = app.test_client()
+
+    def get(client, url):
+        def run():
+            response = client.get(url)
+            response.get_data()
+            assert response.status_code == 200, f'{url} returned {response.status_code}'
+            response.close()
+        return run
+
+    reminder_day = iter(range(10 ** 6))
+
+    def reminders():
+        from app.services.reminders import send_loan_reminders
+        # Each call is a new reminder window well after every seeded due date, so it does the same work
+        with app.app_context():
+            send_loan_reminders(today=SEED_END.date() + timedelta(days=30 + next(reminder_day)), window_days=1,
+                                email=False)
+
+    return [
+        Scenario('main.index', get(anonymous, '/')),
+        Scenario('main.search', get(member, '/search?q=Mathematics')),
+        Scenario('main.book_detail', get(member, f"/book/{ids['book']}")),
+        Scenario('api.get_books', get(member, '/api/books?search=Guide&per_page=24')),
+        Scenario('admin.dashboard', get(admin, '/admin/dashboard')),
+        Scenario('books.download_book', get(member, f"/books/download/{ids['digital']}")),
+        Scenario('admin.export_borrowings', get(admin, '/admin/borrowings/export'), share=0.2),
+        Scenario('admin.export_users', get(admin, '/admin/users/export'), share=0.5),
+        Scenario('reminders.send_loan_reminders', reminders, share=0.5),
+    ]
+
+def measure(scenario, iterations, engine, warmup=2):
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    for _ in range(warmup):
+        scenario.run()
+    runs = max(3, int(iterations * scenario.share))
+    timings = []
+    event.listen(engine, 'after_cursor_execute', count)
+    try:
+        for _ in range(runs):
+            started = time.perf_counter()
+            scenario.run()
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        event.remove(engine, 'after_cursor_execute', count)
+
+    tracemalloc.start()
+    try:
+        scenario.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'iterations': runs,
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'mean_ms': round(sum(timings) / runs, 2),
+        'queries': round(statements[0] / runs, 1),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def compare(results, baseline, latency_tolerance=0.5, min_latency_ms=5.0, memory_tolerance=0.25,
+            min_memory_kib=256):
+    """Regressions of ``results`` against ``baseline`` scenarios, as readable strings"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if (current['p95_ms'] > base['p95_ms'] * (1 + latency_tolerance)
+                and current['p95_ms'] - base['p95_ms'] >= min_latency_ms):
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current['queries'] > base['queries']:
+            regressions.append(f"{name}: {base['queries']} -> {current['queries']} queries per request")
+        if (current['peak_kib'] > base['peak_kib'] * (1 + memory_tolerance)
+                and current['peak_kib'] - base['peak_kib'] >= min_memory_kib):
+            regressions.append(f"{name}: peak memory {base['peak_kib']} KiB -> {current['peak_kib']} KiB")
+    return regressions
+
+def run_benchmarks(scale=0.01, seed=42, iterations=30, only=None, echo=print):
+    app = create_app('benchmark')
+    with app.app_context():
+        seed_database(app, scale, seed)
+        ids = pick_fixtures(app)
+    scenarios = [scenario for scenario in build_scenarios(app, ids) if not only or scenario.name in only]
+
+    with app.app_context():
+        engine = db.engine
+    # No app context is held while measuring: each request gets its own, with
+    # a fresh database session, as it would in production
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = row = measure(scenario, iterations, engine)
+        echo(f"{scenario.name:32} p50 {row['p50_ms']:8.2f}  p95 {row['p95_ms']:8.2f}  p99 {row['p99_ms']:8.2f} ms"
+             f"  {row['queries']:6.1f} queries  {row['peak_kib']:9.1f} KiB")
+    with app.app_context():
+        db.drop_all()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=0.01, help='Share of the seed-scale default volumes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=30, help='Timed requests per scenario')
+    parser.add_argument('--only', nargs='*', help='Scenario names to run')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5)
+    parser.add_argument('--min-latency-ms', type=float, default=5.0)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(scale=args.scale, seed=args.seed, iterations=args.iterations, only=args.only)
+    meta = {'scale': args.scale, 'seed': args.seed, 'iterations': args.iterations,
+            'python': platform.python_version(), 'machine': platform.machine(), 'date': date.today().isoformat()}
+
+    if args.save:
+        scenarios = dict(results)
+        if args.only and os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                scenarios = dict(json.load(file)['scenarios'], **results)
+        with open(args.baseline, 'w') as file:
+            json.dump({'meta': meta, 'scenarios': scenarios}, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save to create one')
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if (baseline['meta']['scale'], baseline['meta']['seed']) != (args.scale, args.seed):
+        print('Warning: the baseline was recorded with a different --scale or --seed')
+    regressions = compare(results, baseline['scenarios'], latency_tolerance=args.latency_tolerance,
+                          min_latency_ms=args.min_latency_ms, memory_tolerance=args.memory_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        return 1
+    print(f'No regressions against {args.baseline}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Closed-loop load test against a local gunicorn server.
+
+    python -m benchmarks.load                            # 50 students for 60 s
+    python -m benchmarks.load --users 200 --duration 300 --workers 3 --threads 8
+    python -m benchmarks.load --json results.json
+
+Everything runs on this machine and needs no network access. The harness
+seeds a temporary SQLite database with ``seed_scale``, adds one account
+with an active subscription per virtual user, writes files for the most
+downloaded digital books and starts gunicorn with ``gunicorn.conf.py`` on
+a free local port. ``--workers``, ``--threads`` and ``--no-preload``
+override its defaults to compare server settings.
+
+Each virtual user is a thread with its own cookie session that repeats a
+student's journey: open the login form and log in, search, view a popular
+book and ask to borrow it, open a digital book in the reader, send reading
+heartbeats, download it and log out. It waits for every response and then
+for an exponentially distributed think time before the next request
+(a closed loop), so the offered load grows with ``--users`` rather than
+with how fast the server answers.
+
+Users start evenly over ``--ramp-up``; only the ``--duration`` seconds
+after that are measured. The report gives requests per second, error rate
+and p50/p95/p99 latency for each step, and the server's memory at the end.
+A step fails when the server answers with an unexpected status, a login is
+rejected, or the request times out or cannot connect.
+
+SQLite lets one writer in at a time, so write-heavy steps (borrow,
+heartbeat, download) queue up sooner than they would on MySQL; treat
+their latencies as an upper bound.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from benchmarks.endpoints import percentile, seed_database
+from config.config import Config, config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'LoadTest123'
+STEPS = ('login_form', 'login', 'search', 'view_book', 'borrow', 'read', 'heartbeat', 'download', 'logout')
+CSRF = re.compile(r'name="csrf[-_]token" (?:content|value)="([^"]+)"')
+READING_SESSION = re.compile(r'/books/reading-session/(\d+)/end')
+
+def load_config(directory, **overrides):
+    """Settings for the server under test: production-like, but local files and plain HTTP"""
+    settings = {
+        'DEBUG': False,
+        'TESTING': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'load.db'),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_pre_ping': True, 'connect_args': {'timeout': 30}},
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+        'SEMANTIC_INDEX_DIR': os.path.join(directory, 'semantic_index'),
+        'PROFILE_DIR': os.path.join(directory, 'profiles'),
+        'LOG_FILE': os.path.join(directory, 'library.log'),
+        'LOG_TO_STDERR': False,
+        # Every virtual user comes from 127.0.0.1
+        'RATELIMIT_ENABLED': False,
+        'SCHEDULER_ENABLED': False,
+    }
+    settings.update(overrides)
+    return type('LoadConfig', (Config,), settings)
+
+def load_app():
+    """Application factory for gunicorn: ``gunicorn 'benchmarks.load:load_app()'``"""
+    config['load'] = load_config(os.environ['LOAD_TEST_DIR'])
+    return create_app('load')
+
+def prepare(directory, users, scale, seed, file_kib=512):
+    """Seed the database and return what the journeys need: search terms and book ids"""
+    from app.models.book import Book
+    from app.models.borrowing import BorrowingTransaction
+    from app.models.subscription import SubscriptionPlan, UserSubscription
+    from app.models.user import User, UserRole
+
+    config['load'] = load_config(directory, JOB_QUEUE_ENABLED=False, LOG_FILE='')
+    app = create_app('load')
+    with app.app_context():
+        db.session.execute(db.text('PRAGMA journal_mode=WAL'))
+        seed_database(app, scale, seed)
+
+        role_id = UserRole.query.filter_by(role_name='student').one().id
+        plan = SubscriptionPlan.query.filter_by(name='Standard').one()
+        password_hash = generate_password_hash(PASSWORD)
+        accounts = [User(username=f'load-user-{n}', email=f'load-user-{n}@load.example', first_name='Load',
+                         last_name=f'User {n}', role_id=role_id, is_active=True, password_hash=password_hash)
+                    for n in range(users)]
+        db.session.add_all(accounts)
+        db.session.flush()
+        for account in accounts:
+            subscription = UserSubscription(account.id, plan.id)
+            subscription.end_date = datetime.utcnow() + timedelta(days=365)
+            db.session.add(subscription)
+
+        popular = [book_id for (book_id,) in db.session.query(BorrowingTransaction.book_id)
+                   .group_by(BorrowingTransaction.book_id)
+                   .order_by(func.count().desc(), BorrowingTransaction.book_id).limit(200)]
+        digital = Book.query.filter_by(is_digital=True, is_active=True) \
+            .order_by(Book.download_count.desc(), Book.id).limit(50).all()
+        for book in digital:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], 'books', book.file_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(os.urandom(file_kib * 1024))
+        terms = sorted({word for (title,) in db.session.query(Book.title).filter(Book.id.in_(popular))
+                        for word in title.split() if len(word) > 3 and word.isalpha()})
+        db.session.commit()
+        return {'accounts': [account.username for account in accounts], 'terms': terms, 'popular': popular,
+                'digital': [book.id for book in digital]}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(directory, workers=None, threads=None, preload=True, timeout=60):
+    """Start gunicorn with gunicorn.conf.py on a free port and wait until it answers; returns (process, base url)"""
+    port = free_port()
+    env = dict(os.environ, LOAD_TEST_DIR=directory, PYTHONPATH=ROOT, GUNICORN_PRELOAD=str(preload).lower())
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    if threads:
+        env['GUNICORN_THREADS'] = str(threads)
+    log = open(os.path.join(directory, 'gunicorn.log'), 'wb')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--bind', f'127.0.0.1:{port}', 'benchmarks.load:load_app()'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(f'{base}/auth/login', timeout=2).status_code == 200:
+                return process, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    with open(os.path.join(directory, 'gunicorn.log'), errors='replace') as file:
+        raise RuntimeError('gunicorn did not start:\n' + ''.join(file.readlines()[-20:]))
+
+def server_memory(master_pid):
+    """Memory of the gunicorn master and its workers from /proc (Linux), in MiB
+
+    ``pss_mb`` shares pages between the processes that map them, so it is what
+    the server really uses; ``worker_private_mb`` is the largest worker's
+    unshared memory, the cost of one more worker.
+    """
+    def rollup(pid):
+        values = {}
+        with open(f'/proc/{pid}/smaps_rollup') as file:
+            for line in file:
+                name, _, rest = line.partition(':')
+                if rest.strip().endswith('kB'):
+                    values[name] = int(rest.split()[0]) / 1024
+        return values
+
+    try:
+        workers = [int(pid) for pid in os.listdir('/proc') if pid.isdigit() and _parent(int(pid)) == master_pid]
+        master = rollup(master_pid)
+        usage = [rollup(pid) for pid in workers]
+    except OSError:
+        return None
+    return {
+        'workers': len(workers),
+        'rss_mb': round(master['Rss'] + sum(u['Rss'] for u in usage), 1),
+        'pss_mb': round(master['Pss'] + sum(u['Pss'] for u in usage), 1),
+        'worker_private_mb': round(max((u['Private_Clean'] + u['Private_Dirty'] for u in usage), default=0), 1),
+    }
+
+def _parent(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            return int(file.read().rpartition(')')[2].split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+class Recorder:
+    """Per-step latencies and errors for one virtual user, kept inside the measured window"""
+
+    def __init__(self, window_start, window_end):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.journeys = 0
+
+    def record(self, step, started, elapsed, error=None):
+        if not self.window_start <= started < self.window_end:
+            return
+        self.timings[step].append(elapsed * 1000)
+        if error:
+            self.errors[step][error] += 1
+
+class StepFailed(Exception):
+    pass
+
+class VirtualUser(threading.Thread):
+    """One student repeating the journey until the test ends"""
+
+    def __init__(self, base, username, plan, recorder, start_at, stop_at, think_time, heartbeats, seed,
+                 request_timeout=30):
+        super().__init__(daemon=True)
+        self.base = base
+        self.username = username
+        self.plan = plan
+        self.recorder = recorder
+        self.start_at = start_at
+        self.stop_at = stop_at
+        self.think_time = think_time
+        self.heartbeats = heartbeats
+        self.random = random.Random(f'{seed}:{username}')
+        self.request_timeout = request_timeout
+
+    def think(self):
+        if self.think_time:
+            time.sleep(min(self.random.expovariate(1 / self.think_time), max(0, self.stop_at - time.monotonic())))
+
+    def step(self, name, method, path, expect=200, **kwargs):
+        if time.monotonic() >= self.stop_at:
+            raise StepFailed('stopped')
+        started = time.monotonic()
+        try:
+            response = self.http.request(method, self.base + path, allow_redirects=False,
+                                         timeout=self.request_timeout, **kwargs)
+            response.content
+        except requests.RequestException as exc:
+            self.recorder.record(name, started, time.monotonic() - started, type(exc).__name__)
+            raise StepFailed(name)
+        error = None if response.status_code == expect else f'HTTP {response.status_code}'
+        if name == 'login' and response.status_code == 200:
+            error = 'login rejected'  # The form is shown again with a flash message
+        self.recorder.record(name, started, time.monotonic() - started, error)
+        if error:
+            raise StepFailed(name)
+        self.think()
+        return response
+
+    def csrf_token(self, response):
+        match = CSRF.search(response.text)
+        if not match:
+            raise StepFailed('no csrf token')
+        return match.group(1)
+
+    def journey(self):
+        form = self.step('login_form', 'GET', '/auth/login')
+        self.step('login', 'POST', '/auth/login', expect=302,
+                  data={'username_or_email': self.username, 'password': PASSWORD,
+                        'csrf_token': self.csrf_token(form)})
+        self.step('search', 'GET', '/search', params={'q': self.random.choice(self.plan['terms'])})
+
+        book_id = self.random.choice(self.plan['popular'])
+        page = self.step('view_book', 'GET', f'/book/{book_id}')
+        self.step('borrow', 'POST', f'/books/borrow/{book_id}', expect=302,
+                  data={'csrf_token': self.csrf_token(page)})
+
+        book_id = self.random.choice(self.plan['digital'])
+        reader = self.step('read', 'GET', f'/books/read/{book_id}')
+        match = READING_SESSION.search(reader.text)
+        if not match:
+            raise StepFailed('no reading session')
+        for beat in range(self.heartbeats):
+            self.step('heartbeat', 'POST', match.group(0),
+                      json={'pages_read': beat + 1, 'progress': round(100 * (beat + 1) / self.heartbeats)},
+                      headers={'X-CSRFToken': self.csrf_token(reader)})
+        self.step('download', 'GET', f'/books/download/{book_id}')
+        self.step('logout', 'GET', '/auth/logout', expect=302)
+
+    def run(self):
+        time.sleep(max(0, self.start_at - time.monotonic()))
+        while time.monotonic() < self.stop_at:
+            self.http = requests.Session()
+            try:
+                self.journey()
+                if time.monotonic() < self.recorder.window_end:
+                    self.recorder.journeys += 1
+            except StepFailed:
+                # Start over with a new session, as a student would after an error page
+                self.think()
+            finally:
+                self.http.close()
+
+def summarize(recorders, duration):
+    """Throughput, error rate and latency percentiles per step, plus a total row"""
+    def row(timings, errors):
+        timings = sorted(timings)
+        failed = sum(errors.values())
+        return {
+            'requests': len(timings),
+            'rps': round(len(timings) / duration, 2),
+            'errors': failed,
+            'error_rate': round(failed / len(timings), 4),
+            'p50_ms': round(percentile(timings, 0.50), 1),
+            'p95_ms': round(percentile(timings, 0.95), 1),
+            'p99_ms': round(percentile(timings, 0.99), 1),
+            'top_errors': dict(errors.most_common(3)),
+        }
+
+    report = {}
+    all_timings, all_errors = [], Counter()
+    for step in STEPS:
+        timings = [t for recorder in recorders for t in recorder.timings.get(step, ())]
+        errors = sum((recorder.errors.get(step, Counter()) for recorder in recorders), Counter())
+        if timings:
+            report[step] = row(timings, errors)
+            all_timings.extend(timings)
+            all_errors.update({f'{step}: {reason}': count for reason, count in errors.items()})
+    if all_timings:
+        report['total'] = row(all_timings, all_errors)
+    return report
+
+def run_load(users=50, duration=60.0, ramp_up=10.0, think_time=1.0, heartbeats=3, workers=None, threads=None,
+             preload=True, scale=0.01, seed=42, echo=print):
+    directory = tempfile.mkdtemp(prefix='library-load-')
+    try:
+        echo(f'Seeding {directory} (scale {scale}) ...')
+        plan = prepare(directory, users, scale, seed)
+        process, base = start_server(directory, workers, threads, preload)
+        try:
+            echo(f'gunicorn at {base}; {users} users, {ramp_up:g} s ramp-up, {duration:g} s measured')
+            now = time.monotonic()
+            window_start = now + ramp_up
+            window_end = window_start + duration
+            recorders = []
+            threads_ = []
+            for n, username in enumerate(plan['accounts']):
+                recorder = Recorder(window_start, window_end)
+                recorders.append(recorder)
+                threads_.append(VirtualUser(base, username, plan, recorder, start_at=now + ramp_up * n / users,
+                                            stop_at=window_end, think_time=think_time, heartbeats=heartbeats,
+                                            seed=seed))
+            for thread in threads_:
+                thread.start()
+            for thread in threads_:
+                thread.join()
+            memory = server_memory(process.pid)
+        finally:
+            stop_server(process)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = summarize(recorders, duration)
+    journeys = sum(recorder.journeys for recorder in recorders)
+    echo(f"{'step':12} {'requests':>9} {'req/s':>8} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for step, row in report.items():
+        echo(f"{step:12} {row['requests']:9d} {row['rps']:8.2f} {row['error_rate']:8.2%} "
+             f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}"
+             + (f"  {row['top_errors']}" if row['top_errors'] else ''))
+    echo(f'{journeys} journeys completed ({journeys / duration * 60:.1f} per minute)')
+    if memory:
+        echo(f"server memory: {memory['workers']} workers, {memory['pss_mb']:.0f} MiB PSS "
+             f"({memory['rss_mb']:.0f} MiB RSS), {memory['worker_private_mb']:.0f} MiB private per worker")
+    return {'steps': report, 'journeys': journeys, 'memory': memory}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='Measured seconds after the ramp-up')
+    parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which users start')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Mean pause between requests (seconds)')
+    parser.add_argument('--heartbeats', type=int, default=3, help='Reading heartbeats per journey')
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes (default: gunicorn.conf.py)')
+    parser.add_argument('--threads', type=int, help='Threads per gunicorn worker (default: gunicorn.conf.py)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='Load the app in each worker instead of once in the master')
+    parser.add_argument('--scale', type=float, default=0.01, help='Share of the seed-scale default volumes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args(argv)
+
+    result = run_load(users=args.users, duration=args.duration, ramp_up=args.ramp_up, think_time=args.think_time,
+                      heartbeats=args.heartbeats, workers=args.workers, threads=args.threads, preload=args.preload,
+                      scale=args.scale,
+                      seed=args.seed)
+    if args.json:
+        meta = {key: value for key, value in vars(args).items() if key != 'json'}
+        meta.update(python=platform.python_version(), machine=platform.machine(), cpus=os.cpu_count(),
+                    date=datetime.now().isoformat(timespec='seconds'))
+        with open(args.json, 'w') as file:
+            json.dump(dict(result, meta=meta), file, indent=2)
+            file.write('\n')
+    return 1 if result['steps'].get('total', {}).get('errors') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the rate limiter's per-request overhead.
+
+    python -m benchmarks.rate_limit [--iterations 20000]
+
+Reports the cost of one bucket check on its own and the difference it makes
+to a full request to /api/search/suggestions (with a query too short to hit
+the database) with limits switched on and off.
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from app import create_app, db
+from app.services.rate_limit import DatabaseBuckets, MemoryBuckets, parse_limit, rate_limiter
+from config.config import TestingConfig, config
+
+class BenchmarkConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='library-bench-'), 'bench.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+config['benchmark'] = BenchmarkConfig
+
+def per_call(function, iterations):
+    """Best of five runs, in microseconds per call"""
+    return min(timeit.repeat(function, number=iterations, repeat=5)) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    iterations = parser.parse_args().iterations
+
+    # Generous enough that no request is rejected during the run
+    limit = parse_limit(f'{iterations * 100}/second')
+    buckets = MemoryBuckets()
+    keys = [f'bench:ip:10.0.{n // 256}.{n % 256}' for n in range(1000)]
+    print(f'memory bucket check, one key       {per_call(lambda: buckets.hit(keys[0], limit), iterations):8.2f} us')
+    spread = iter(range(10 ** 9))
+    print(f'memory bucket check, 1000 keys     '
+          f'{per_call(lambda: buckets.hit(keys[next(spread) % 1000], limit), iterations):8.2f} us')
+
+    app = create_app('benchmark')
+    app.config['RATELIMIT_POLICIES'] = {'search_suggestions': f'{iterations * 100}/second'}
+    with app.app_context():
+        db.create_all()
+        shared = DatabaseBuckets()
+        print(f'database bucket check (SQLite)     '
+              f'{per_call(lambda: shared.hit(keys[0], limit), max(iterations // 20, 100)):8.2f} us')
+
+        client = app.test_client()
+        request = lambda: client.get('/api/search/suggestions?q=a')
+        timings = {}
+        for enabled in (False, True):
+            app.config['RATELIMIT_ENABLED'] = enabled
+            rate_limiter.init_app(app)
+            timings[enabled] = per_call(request, max(iterations // 10, 100))
+        print(f'request, limits off                {timings[False]:8.2f} us')
+        print(f'request, limits on                 {timings[True]:8.2f} us')
+        print(f'overhead per request               {timings[True] - timings[False]:8.2f} us')
+        db.drop_all()
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,9 @@ class Config:
     SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'database')  # database, filesystem or cookie
+    SESSION_FILE_DIR = os.environ.get('SESSION_FILE_DIR')  # Defaults to instance/sessions
+    SESSION_CACHE_SIZE = 10000  # Sessions kept in memory per process
     
     # Pagination
     BOOKS_PER_PAGE = 12
@@ -43,7 +46,40 @@ class Config:
     MAX_RENEWALS = 2
     MAX_BOOKS_PER_USER = 5
     FINE_PER_DAY = 1.00  # Local currency
+    RECOMMENDER_TOP_K = 20  # Neighbours stored per book by the nightly recommender
+    RECOMMENDER_MIN_SCORE = 0.0
+    RELATED_BOOKS_LIMIT = 18  # Precomputed related books per book; pages show a sample
+    SEMANTIC_SEARCH_DIM = 512  # Hashed TF-IDF features per book in the local search index
+    SEMANTIC_INDEX_DIR = os.environ.get('SEMANTIC_INDEX_DIR')  # Defaults to instance/semantic_index
+    CHAT_CONTEXT_TOKEN_BUDGET = 600  # Tokens of retrieved passages sent with each AI chat question
+    CHAT_CONTEXT_MAX_PASSAGES = 6
+    CHAT_CONTEXT_USE_VECTORS = True  # Fuse semantic search ranks into BM25 retrieval
+    CHAT_INDEX_CHECK_SECONDS = 60  # How often each process checks for new books/reviews (in a background thread)
+    CHAT_INDEX_MAX_AGE_SECONDS = 3600  # Rebuild at least this often to pick up edits
+    CHAT_RETRIEVAL_CACHE_SIZE = 512
+    RESERVATION_HOLD_DAYS = 3  # Days a returned copy waits on the hold shelf for the next patron
     OFFLINE_ACCESS_DAYS = 30
+    INVENTORY_MAX_RETRIES = 5  # Retries on lock timeouts/deadlocks when changing copy counts
+    INVENTORY_RETRY_BACKOFF_SECONDS = 0.05
+    
+    # Background scheduler for maintenance jobs (overdue fines, expiry cleanup)
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'false').lower() in ['true', 'on', '1']
+    SCHEDULER_TICK_SECONDS = int(os.environ.get('SCHEDULER_TICK_SECONDS') or 30)
+    # Per-job overrides, e.g. {'update_overdue': {'schedule': '0 3 * * *', 'batch_size': 1000}}
+    SCHEDULER_JOBS = {}
+    
+    # Start the scheduler and job queue when the app is created. gunicorn.conf.py turns this
+    # off and starts them in each worker instead, as threads do not survive a fork
+    START_BACKGROUND_THREADS = os.environ.get('START_BACKGROUND_THREADS', 'true').lower() in ['true', 'on', '1']
+    
+    # Background job queue (database-backed, no broker needed)
+    JOB_QUEUE_ENABLED = os.environ.get('JOB_QUEUE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    JOB_QUEUE_WORKERS = int(os.environ.get('JOB_QUEUE_WORKERS') or 2)
+    JOB_QUEUE_POLL_SECONDS = 2
+    JOB_QUEUE_MAX_ATTEMPTS = 5
+    JOB_QUEUE_RETRY_BASE_SECONDS = 10  # Doubles on each retry
+    JOB_QUEUE_RETRY_MAX_SECONDS = 3600
+    JOB_QUEUE_LOCK_SECONDS = 600  # Running jobs older than this are retried
     
     # Email configuration (for notifications)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
@@ -51,14 +87,97 @@ class Config:
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or MAIL_USERNAME
+    
+    # Loan reminders
+    REMINDER_DUE_WITHIN_DAYS = 3
+    REMINDER_WINDOW_DAYS = 1  # A loan is reminded at most once per window
+    REMINDER_BATCH_SIZE = 1000
+    REMINDER_EMAILS_ENABLED = bool(MAIL_SERVER)
+    REMINDER_EMAIL_BATCH_SIZE = 500  # Reminders moved into the outbox per batch
+    
+    # Outbound email delivery
+    MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', 'false').lower() in ['true', 'on', '1']
+    EMAIL_BATCH_SIZE = 100  # Messages sent per SMTP connection
+    EMAIL_RATE_LIMIT_PER_MINUTE = 120  # Per recipient domain
+    EMAIL_DOMAIN_RATE_LIMITS = {}  # e.g. {'gmail.com': 300}
+    EMAIL_MAX_ATTEMPTS = 5
+    EMAIL_RETRY_BASE_SECONDS = 60  # Doubles on each retry
+    EMAIL_RETRY_MAX_SECONDS = 6 * 3600
+    EMAIL_LOCK_SECONDS = 300
+    EMAIL_SMTP_TIMEOUT = 30
+    
+    # AI providers (chat, summaries)
+    AI_PROVIDER = os.environ.get('AI_PROVIDER', 'openai')  # Preferred provider
+    AI_FALLBACK_PROVIDERS = ['openai', 'gemini', 'huggingface']  # Tried in order if it fails
+    OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+    OPENAI_API_URL = os.environ.get('OPENAI_API_URL') or 'https://api.openai.com/v1/chat/completions'
+    OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+    GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    GEMINI_API_URL = os.environ.get('GEMINI_API_URL') or 'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent'
+    HF_API_KEY = os.environ.get('HF_API_KEY')
+    HF_API_URL = os.environ.get('HF_API_URL') or 'https://api-inference.huggingface.co/models/gpt2'
+    AI_CONNECT_TIMEOUT = 3.05
+    AI_READ_TIMEOUT = 20
+    AI_POOL_SIZE = 20  # Pooled connections per provider host
+    AI_MAX_IN_FLIGHT = 50  # Concurrent requests on the asyncio path
+    AI_CIRCUIT_FAILURES = 5  # Consecutive failures that open a provider's circuit
+    AI_CIRCUIT_RESET_SECONDS = 30  # How long an open circuit rejects calls before a trial request
+    AI_HEDGE_DELAY_SECONDS = None  # If set, race the next provider when the first is this slow
+    AI_CACHE_ENABLED = os.environ.get('AI_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    AI_CACHE_TTL_SECONDS = {'chat': 24 * 3600, 'summary': 30 * 24 * 3600}
+    AI_CACHE_MAX_ENTRIES = 2048  # In-memory answers per process
+    AI_CACHE_PERSIST = True  # Share answers between processes in the ai_response_cache table
+    AI_CHAT_HISTORY_LIMIT = 10  # Messages kept in each visitor's chat history
+    AI_ANALYTICS_ENABLED = True  # Record AI chat events in ai_chat_events
+    AI_ANALYTICS_ASYNC = True  # Write events from a background thread
+    AI_ANALYTICS_FLUSH_SECONDS = 2
+    AI_ANALYTICS_BATCH_SIZE = 200
+    AI_ANALYTICS_QUEUE_SIZE = 10000  # Events beyond this are dropped rather than block requests
+    AI_ANALYTICS_RETENTION_DAYS = 180  # Raw events; daily rollups are kept
+    
+    # Rate limits on AI and search endpoints (policies are declared on the views)
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ['true', 'on', '1']
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')  # memory (per process) or database (shared)
+    RATELIMIT_MAX_KEYS = 100000  # In-memory buckets per process
+    RATELIMIT_POLICIES = {}  # Per-scope overrides, e.g. {'ai': {'limit': '60/minute', 'anonymous': '5/minute'}}
+    # Header the proxy in front of the app sets to the visitor's address; visitors must not be able to set it
+    CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER') or None
+    
+    # SQL instrumentation: query counts and database time per endpoint
+    QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    QUERY_STATS_HEADERS = None  # X-Query-Count/Server-Timing headers; None means in debug mode only
+    QUERY_STATS_SLOW_QUERY_MS = 100  # Log statements slower than this
+    QUERY_STATS_N_PLUS_ONE = 10  # Log requests that run one statement this many times
+    
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # If set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_REQUIRE_TOKEN = False  # Refuse to serve /metrics at all while METRICS_TOKEN is unset
+    # Shared by gunicorn workers so any of them can report all; empty it when the master starts
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    METRICS_FLUSH_SECONDS = 5  # How often each worker writes its numbers to METRICS_DIR
+    
+    # On-demand request profiling, started from /admin/profiles
+    PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')  # Shared by all workers; defaults to instance/profiles
+    PROFILE_SAMPLE_INTERVAL_MS = 5  # Stack sampling interval in sampling mode
+    PROFILE_MAX_CAPTURES = 200  # Retention limits for stored captures
+    PROFILE_MAX_AGE_DAYS = 7
+    PROFILE_MAX_MB = 200
     
     # Security settings
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = 3600  # 1 hour
     
     # Analytics and logging
+    # Root level plus optional per-logger levels, e.g. "INFO,app.services.ai_providers=DEBUG"
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
-    LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs', 'library.log')
+    LOG_FILE = os.environ.get('LOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs', 'library.log'))
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json (one object per line) or text
+    LOG_TO_STDERR = True
+    LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped rather than blocking a request
+    LOG_DEBUG_SAMPLE = 10  # Keep one in this many of each repeated DEBUG line
     
     # Feature flags
     ALLOW_PUBLIC_REGISTRATION = True
@@ -75,12 +194,14 @@ class Config:
         os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'covers'), exist_ok=True)
         
         # Create logs directory
-        os.makedirs(os.path.dirname(app.config['LOG_FILE']), exist_ok=True)
+        if app.config.get('LOG_FILE'):
+            os.makedirs(os.path.dirname(app.config['LOG_FILE']), exist_ok=True)
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     TESTING = False
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
     
     # Use SQLite for easier development setup
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI") or 'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'instance', 'library.db')
@@ -102,6 +223,13 @@ class ProductionConfig(Config):
     
     # Enhanced security for production
     WTF_CSRF_SSL_STRICT = True
+    # fly.io's proxy overwrites Fly-Client-IP with the address it accepted the connection from
+    CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER', 'Fly-Client-IP')
+    # The app is public, so /metrics is only served to scrapers holding METRICS_TOKEN
+    METRICS_REQUIRE_TOKEN = True
+    
+    # Run maintenance jobs in-process unless explicitly disabled
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() in ['true', 'on', '1']
     
     # Production database with connection pooling
     SQLALCHEMY_ENGINE_OPTIONS = {
@@ -116,6 +244,10 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     WTF_CSRF_ENABLED = False
+    SCHEDULER_ENABLED = False
+    JOB_QUEUE_ENABLED = False
+    AI_ANALYTICS_ASYNC = False
+    RATELIMIT_ENABLED = False
     MYSQL_DB = 'butha_buthe_library_test'
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{Config.MYSQL_USER}:{Config.MYSQL_PASSWORD}@{Config.MYSQL_HOST}:{Config.MYSQL_PORT}/butha_buthe_library_test"
 
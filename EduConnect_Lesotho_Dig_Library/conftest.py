@@ -0,0 +1,111 @@
+"""
+Shared pytest fixtures.
+
+Tests run against a throwaway SQLite database so the development database in
+instance/library.db is never touched.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+from app import create_app, db
+from config.config import TestingConfig, config
+
+class SQLiteTestingConfig(TestingConfig):
+    """Testing configuration backed by a temporary SQLite file"""
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='library-test-'), 'test.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+config['sqlite_testing'] = SQLiteTestingConfig
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app('sqlite_testing')
+    app.config['SEMANTIC_INDEX_DIR'] = str(tmp_path / 'semantic_index')
+
+    with app.app_context():
+        db.create_all()
+
+        from app.models.user import UserRole
+        from app.models.book import Category
+        for role_name in ('admin', 'librarian', 'student', 'public', 'researcher'):
+            db.session.add(UserRole(role_name=role_name, description=role_name.title()))
+        db.session.add(Category(name='Academic', description='Academic and educational resources'))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def librarian(app):
+    from app.models.user import User, UserRole
+    role = UserRole.query.filter_by(role_name='librarian').first()
+    user = User(username='librarian', email='librarian@library.test', first_name='Lerato',
+                last_name='Mokoena', role_id=role.id, is_active=True)
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def make_user(app):
+    from app.models.user import User, UserRole
+    role = UserRole.query.filter_by(role_name='student').first()
+
+    def factory(username):
+        user = User(username=username, email=f'{username}@library.test', first_name=username.title(),
+                    last_name='Student', role_id=role.id, is_active=True)
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return factory
+
+@pytest.fixture
+def make_book(app, librarian):
+    from app.models.book import Book
+
+    def factory(title, copies=1, **kwargs):
+        kwargs.setdefault('author', 'Test Author')
+        kwargs.setdefault('available_copies', copies)
+        kwargs.setdefault('category_id', 1)
+        book = Book(title=title, total_copies=copies, created_by=librarian.id, **kwargs)
+        db.session.add(book)
+        db.session.commit()
+        return book
+    return factory
+
+@pytest.fixture
+def login(client):
+    """Sign ``client`` in as a user without going through the login form"""
+    def log_in(user):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+    return log_in
+
+@pytest.fixture
+def provider_config():
+    """AI settings for the ``provider`` fixture; override in a test module to change them"""
+    return {}
+
+@pytest.fixture
+def provider(app, provider_config):
+    """A local fake of the OpenAI, Gemini and Hugging Face APIs that ai_client talks to"""
+    from app.services.ai_providers import ai_client
+    from app.services.fake_ai_provider import FakeProviderServer
+
+    with FakeProviderServer() as server:
+        app.config.update(server.config())
+        app.config.update(AI_PROVIDER='openai', AI_READ_TIMEOUT=2)
+        app.config.update(provider_config)
+        ai_client.init_app(app)
+        yield server
@@ -0,0 +1,113 @@
+"""
+Gunicorn settings for production.
+
+    gunicorn --config gunicorn.conf.py run:app
+
+The worker count follows the CPUs and memory gunicorn can use; each
+setting can be overridden from the environment (WEB_CONCURRENCY,
+GUNICORN_THREADS, ...). "Production Server" in README.md has the load
+test results behind the defaults.
+"""
+
+import math
+import os
+
+def cpu_count():
+    """CPUs this process may run on, capped by a cgroup v2 CPU quota"""
+    count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+def memory_mb():
+    """Memory limit of the container (cgroup v2) or else of the machine, in MiB"""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as file:
+            limit = file.read().strip()
+        if limit != 'max':
+            return int(limit) // 2 ** 20
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def default_workers(cpus, memory, worker_mb, reserved_mb):
+    """One worker per CPU plus one, as many as fit in memory beside the master"""
+    workers = cpus + 1
+    if memory:
+        workers = min(workers, (memory - reserved_mb) // worker_mb)
+    return max(1, workers)
+
+def env(name, default, cast=str):
+    value = os.environ.get(name)
+    return default if value in (None, '') else cast(value)
+
+def flag(name, default):
+    return env(name, 'true' if default else 'false').lower() in ['true', 'on', '1']
+
+# Private memory of one worker (about 60 MiB after a load test on a small catalogue,
+# plus room for caches that grow with it) and what the master and the OS need
+WORKER_MEMORY_MB = env('GUNICORN_WORKER_MEMORY_MB', 160, int)
+RESERVED_MEMORY_MB = env('GUNICORN_RESERVED_MEMORY_MB', 256, int)
+
+bind = env('GUNICORN_BIND', f"0.0.0.0:{env('PORT', '8080')}")
+workers = env('WEB_CONCURRENCY', default_workers(cpu_count(), memory_mb(), WORKER_MEMORY_MB, RESERVED_MEMORY_MB),
+              int)
+# Threads keep a worker busy while others wait on downloads, the database or AI providers
+worker_class = env('GUNICORN_WORKER_CLASS', 'gthread')
+threads = env('GUNICORN_THREADS', 8, int)
+worker_connections = env('GUNICORN_WORKER_CONNECTIONS', 1000, int)
+
+# Load the app once in the master; forked workers share its memory copy-on-write
+# and workers replaced after max_requests start without importing anything
+preload_app = flag('GUNICORN_PRELOAD', True)
+
+# With gthread the timeout only catches a worker whose main loop is stuck, not slow requests
+timeout = env('GUNICORN_TIMEOUT', 60, int)
+graceful_timeout = env('GUNICORN_GRACEFUL_TIMEOUT', 30, int)
+keepalive = env('GUNICORN_KEEPALIVE', 5, int)
+
+# Recycle workers now and then to bound slow memory growth; the jitter keeps
+# them from all restarting at once
+max_requests = env('GUNICORN_MAX_REQUESTS', 2000, int)
+max_requests_jitter = env('GUNICORN_MAX_REQUESTS_JITTER', 200, int)
+
+# fly.io terminates TLS and sets X-Forwarded-Proto
+forwarded_allow_ips = env('FORWARDED_ALLOW_IPS', '*')
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'  # Heartbeat files on tmpfs, not the container's overlay disk
+accesslog = env('GUNICORN_ACCESS_LOG', None)
+errorlog = '-'
+
+# The scheduler and job queue are started per worker in post_fork
+os.environ['START_BACKGROUND_THREADS'] = 'false'
+
+def on_starting(server):
+    """Remove metrics snapshots left by the workers of a previous run"""
+    directory = os.environ.get('METRICS_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.name.endswith(('.json', '.tmp', '.lock')):
+                os.unlink(entry.path)
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and background threads"""
+    from app import db, start_background_threads
+
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            # Connections opened in the master must not be shared; leave them to the master
+            engine.dispose(close=False)
+    start_background_threads(app)
@@ -6,6 +6,7 @@ with support for offline access and digital literacy programs.
 """
 
 import os
+import click
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -19,6 +20,11 @@ from app.models.review import BookReview
 from app.models.notification import Notification
 from app.models.reservation import BookReservation
 from app.models.offline import OfflineToken, DigitalDownload, ReadingSession, LiteracyProgress
+from app.models.recommendation import BookSimilarity
+from app.models.ai_cache import AIResponseCache
+from app.models.ai_chat_event import AIChatEvent, AIChatDailyRollup, AIChatQueryRollup
+from app.models.session import ServerSession
+from app.models.rate_limit import RateLimitBucket
 
 # Create Flask application
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -135,20 +141,141 @@ def update_overdue():
 def cleanup_expired():
     """Cleanup expired reservations and tokens"""
     # Cleanup expired reservations
-    from app.models.reservation import BookReservation
     expired_reservations = BookReservation.cleanup_expired()
     print(f"Marked {expired_reservations} reservations as expired")
     
     # Deactivate expired offline tokens
-    from datetime import datetime
-    expired_tokens = OfflineToken.query.filter(
-        OfflineToken.is_active == True,
-        OfflineToken.expiry_date < datetime.utcnow()
-    ).update({'is_active': False})
-    
-    db.session.commit()
+    expired_tokens = OfflineToken.cleanup_expired()
     print(f"Deactivated {expired_tokens} expired offline tokens")
 
+@app.cli.command('scheduler-status')
+def scheduler_status():
+    """Show scheduled jobs, their next run and recent durations"""
+    from app.services.scheduler import scheduler
+    for job in scheduler.get_status():
+        state = job['state'] or {}
+        metrics = job['metrics']
+        print(f"{job['name']:<30} {job['schedule']:<30} next={state.get('next_run_at')} "
+              f"last={state.get('last_status')} runs={metrics['runs']} "
+              f"avg={metrics['avg_ms']}ms p95={metrics['p95_ms']}ms")
+
+@app.cli.command('scheduler-run')
+@click.argument('job_name')
+def scheduler_run(job_name):
+    """Run a scheduled job now, regardless of its next run time"""
+    from app.services.scheduler import scheduler
+    if job_name not in scheduler.jobs:
+        print(f"Unknown job {job_name}. Available: {', '.join(sorted(scheduler.jobs))}")
+        return
+    run = scheduler.run_job(job_name, force=True)
+    if run is None:
+        print(f"Job {job_name} is currently running on another instance")
+        return
+    print(f"{job_name}: {run.status} in {run.duration_ms}ms, {run.items_processed} items processed")
+    if run.error:
+        print(f"Error: {run.error}")
+
+@app.cli.command('jobs-work')
+@click.option('--workers', default=None, type=int, help='Number of worker threads')
+def jobs_work(workers):
+    """Run background job workers in the foreground"""
+    import time
+    from app.services.job_queue import job_queue
+    job_queue.start(workers)
+    print(f"Job workers running on {job_queue.instance_id}. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+@app.cli.command('jobs-status')
+def jobs_status():
+    """Show background job counts and recent failures"""
+    from app.models.job_queue import BackgroundJob
+    counts = BackgroundJob.get_status_counts()
+    print(', '.join(f"{status}: {count}" for status, count in counts.items()))
+    failed = BackgroundJob.query.filter_by(status='failed').order_by(
+        BackgroundJob.finished_at.desc()
+    ).limit(10).all()
+    for job in failed:
+        print(f"#{job.id} {job.task_name} after {job.attempts} attempts: {job.last_error}")
+
+@app.cli.command('email-status')
+def email_status():
+    """Show outbound email queue counts and recent failures"""
+    from app.models.email_outbox import OutboundEmail
+    counts = OutboundEmail.get_status_counts()
+    print(', '.join(f"{status}: {count}" for status, count in counts.items()))
+    failed = OutboundEmail.query.filter_by(status='failed').order_by(
+        OutboundEmail.created_at.desc()
+    ).limit(10).all()
+    for email in failed:
+        print(f"#{email.id} {email.recipient} after {email.attempts} attempts: {email.last_error}")
+
+@app.cli.command('smtp-sink')
+@click.option('--port', default=8025, help='Port to listen on')
+def smtp_sink(port):
+    """Run a local SMTP server that accepts and discards all mail"""
+    import time
+    from app.services.smtp_sink import LocalSMTPSink
+    with LocalSMTPSink(port=port) as sink:
+        print(f"SMTP sink listening on {sink.host}:{sink.port}. Set MAIL_SERVER/MAIL_PORT to use it.")
+        try:
+            while True:
+                time.sleep(5)
+                print(f"{len(sink.messages)} messages received over {sink.connections} connections")
+        except KeyboardInterrupt:
+            pass
+
+@app.cli.command('recommendations-rebuild')
+@click.option('--top-k', default=None, type=int, help='Neighbours to keep per book')
+def recommendations_rebuild(top_k):
+    """Rebuild the book similarity table used for recommendations"""
+    from app.services.recommender import rebuild_recommendations
+    count = rebuild_recommendations(top_k=top_k)
+    print(f"Stored {count} book neighbours")
+
+@app.cli.command('search-index-rebuild')
+def search_index_rebuild():
+    """Rebuild the local semantic search index"""
+    from app.services.semantic_search import rebuild_index
+    count = rebuild_index()
+    print(f"Indexed {count} books")
+
+@app.cli.command('seed-scale')
+@click.option('--scale', default=1.0, type=float, help='Multiplier for every default count')
+@click.option('--users', default=None, type=int, help='Members to add (default 50,000)')
+@click.option('--books', default=None, type=int, help='Books to add (default 100,000)')
+@click.option('--borrowings', default=None, type=int, help='Loans to add (default 2,000,000)')
+@click.option('--downloads', default=None, type=int, help='Downloads to add (default 300,000)')
+@click.option('--reading-sessions', default=None, type=int, help='Reading sessions to add (default 500,000)')
+@click.option('--reviews', default=None, type=int, help='Reviews to add (default 150,000)')
+@click.option('--notifications', default=None, type=int, help='Notifications to add (default 200,000)')
+@click.option('--days', default=730, help='Length of the generated history in days')
+@click.option('--end-date', default=None, type=click.DateTime(['%Y-%m-%d']),
+              help='Last day of the history (default now); fix it for identical reruns')
+@click.option('--seed', default=42, help='Random seed')
+@click.option('--batch-size', default=5000, help='Rows per INSERT')
+@click.option('--password', default='library123', help='Password for every generated member')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation')
+def seed_scale(scale, days, end_date, seed, batch_size, password, yes, **overrides):
+    """Add a large synthetic dataset for load and performance testing"""
+    from app.services.seed_scale import DEFAULT_COUNTS, seed_scale as generate
+    counts = {name: overrides.get(name) if overrides.get(name) is not None else int(default * scale)
+              for name, default in DEFAULT_COUNTS.items()}
+    summary = ', '.join(f"{count:,} {name.replace('_', ' ')}" for name, count in counts.items())
+    if not yes:
+        click.confirm(f"Add {summary} to {db.engine.url.render_as_string(hide_password=True)}?", abort=True)
+    try:
+        inserted = generate(counts=counts, seed=seed, days=days, end=end_date, batch_size=batch_size,
+                            password=password, echo=print)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for table, count in sorted(inserted.items()):
+        print(f"  {table}: {count:,} rows")
+    print("Run 'flask recommendations-rebuild' and 'flask search-index-rebuild' to index the new data")
+
 @app.cli.command()
 def sample_data():
     """Add sample data for testing"""
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the AI response cache
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models.ai_cache import AIResponseCache
+from app.models.book import Book
+from app.services.ai_cache import cache_key, cached_completion, get_response_cache, purge_expired
+from app.services.ai_providers import ProviderUnavailable, ai_client
+
+def summary(text):
+    return [{'role': 'user', 'content': f'Summarize this: {text}'}]
+
+@pytest.fixture
+def provider_config():
+    return {'AI_HEDGE_DELAY_SECONDS': None}
+
+def test_keys_ignore_case_spacing_and_punctuation():
+    assert cache_key('summary', 'Summarize  chapter 1!') == cache_key('summary', 'summarize chapter 1')
+    assert cache_key('summary', 'chapter 1') != cache_key('chat', 'chapter 1')
+    assert cache_key('chat', 'chapter 1', ['context a']) != cache_key('chat', 'chapter 1', ['context b'])
+    languages = [cache_key('chat', f'Best book on {language}?') for language in ('C', 'C++', 'C#')]
+    assert len(set(languages)) == 3
+
+def test_repeat_requests_hit_memory_then_database(app, provider):
+    first = cached_completion('summary', summary('Chapter 1 of Introduction to Computer Science'))
+    again = cached_completion('summary', summary('chapter 1 of introduction to computer science.'))
+    assert (first.source, again.source) == ('upstream', 'memory')
+    assert again.text == first.text == 'openai answer'
+    assert provider.calls['openai'] == 1
+
+    # Another process has an empty memory tier but shares the table
+    get_response_cache().clear()
+    stored = cached_completion('summary', summary('Chapter 1 of Introduction to Computer Science'))
+    assert stored.source == 'database'
+    assert provider.calls['openai'] == 1
+    assert AIResponseCache.query.one().hit_count == 1
+
+    stats = get_response_cache().stats()
+    assert (stats['requests'], stats['upstream_calls'], stats['hit_rate']) == (3, 1, 0.6667)
+
+def test_database_hits_leave_the_callers_transaction_alone(app, provider, make_book):
+    cached_completion('summary', summary('Basotho blankets'))
+    get_response_cache().clear()
+
+    book = make_book('Blanket Patterns')
+    book.title = 'Uncommitted title'
+    assert cached_completion('summary', summary('Basotho blankets')).source == 'database'
+    db.session.rollback()
+    assert db.session.get(Book, book.id).title == 'Blanket Patterns'
+
+def test_context_changes_the_answer(app, provider):
+    cached_completion('chat', [{'role': 'system', 'content': 'Context: A'}, {'role': 'user', 'content': 'Hi'}])
+    cached_completion('chat', [{'role': 'system', 'content': 'Context: B'}, {'role': 'user', 'content': 'Hi'}])
+    assert provider.calls['openai'] == 2
+
+def test_concurrent_identical_requests_share_one_call(app, provider):
+    provider.delay['openai'] = 0.3
+    sources = []
+
+    def ask():
+        with app.app_context():
+            sources.append(cached_completion('summary', summary('Sesotho poetry')).source)
+
+    threads = [threading.Thread(target=ask) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls['openai'] == 1
+    assert sorted(sources) == ['shared'] * 7 + ['upstream']
+
+def test_failures_are_not_cached(app, provider):
+    provider.fail.update({'openai', 'gemini', 'huggingface'})
+    with pytest.raises(ProviderUnavailable):
+        cached_completion('summary', summary('Maize farming'))
+    assert AIResponseCache.query.count() == 0
+
+    provider.fail.clear()
+    ai_client.init_app(app)
+    assert cached_completion('summary', summary('Maize farming')).source == 'upstream'
+
+def test_expired_entries_are_refetched_and_purged(app, provider):
+    cached_completion('summary', summary('Geometry'))
+    AIResponseCache.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    get_response_cache().clear()
+
+    assert cached_completion('summary', summary('Geometry')).source == 'upstream'
+    assert provider.calls['openai'] == 2
+
+    AIResponseCache.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert purge_expired() == 1
+    assert AIResponseCache.query.count() == 0
+
+def test_summarize_route_uses_cache(client, provider):
+    for _ in range(3):
+        response = client.post('/api/summarize', json={'text': 'Soil conservation in Lesotho'})
+        assert response.get_json() == {'summary': 'openai answer'}
+    assert provider.calls['openai'] == 1
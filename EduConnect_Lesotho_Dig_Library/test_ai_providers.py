@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Tests for the pooled AI provider client, against a local fake provider
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.ai_providers import CircuitBreaker, ProviderUnavailable, ai_client
+
+MESSAGES = [{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': 'Opening hours?'}]
+
+@pytest.fixture
+def provider_config():
+    return {'AI_READ_TIMEOUT': 1, 'AI_CIRCUIT_FAILURES': 2, 'AI_CIRCUIT_RESET_SECONDS': 30,
+            'AI_HEDGE_DELAY_SECONDS': None}
+
+def test_each_provider_round_trip(app, provider):
+    for name in ('openai', 'gemini', 'huggingface'):
+        completion = ai_client.complete(MESSAGES, provider=name)
+        assert (completion.text, completion.provider) == (f'{name} answer', name)
+
+    gemini_payload = provider.requests[1][1]
+    assert gemini_payload['systemInstruction'] == {'parts': [{'text': 'Be brief.'}]}
+    assert [turn['role'] for turn in gemini_payload['contents']] == ['user']
+
+def test_connections_are_reused(app, provider):
+    for _ in range(5):
+        ai_client.complete(MESSAGES)
+    assert provider.calls['openai'] == 5
+    assert len(provider.connections) == 1
+
+def test_falls_back_and_opens_circuit(app, provider):
+    provider.fail.add('openai')
+
+    assert ai_client.complete(MESSAGES).provider == 'gemini'
+    assert ai_client.complete(MESSAGES).provider == 'gemini'
+    assert ai_client.status()['openai']['circuit'] == 'open'
+
+    # An open circuit is skipped without calling the provider
+    assert ai_client.complete(MESSAGES).provider == 'gemini'
+    assert provider.calls['openai'] == 2
+
+    provider.fail.update({'gemini', 'huggingface'})
+    with pytest.raises(ProviderUnavailable):
+        ai_client.complete(MESSAGES)
+
+def test_read_timeout_counts_as_failure(app, provider):
+    app.config['AI_READ_TIMEOUT'] = 0.2
+    provider.delay['openai'] = 1
+
+    started = time.perf_counter()
+    completion = ai_client.complete(MESSAGES)
+    assert completion.provider == 'gemini'
+    assert time.perf_counter() - started < 1
+    assert ai_client.breakers['openai'].failures == 1
+
+def test_half_open_circuit_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+def test_async_requests_run_concurrently(app, provider):
+    provider.delay['openai'] = 0.2
+
+    started = time.perf_counter()
+    results = asyncio.run(ai_client.acomplete_many([MESSAGES] * 20))
+    elapsed = time.perf_counter() - started
+
+    assert [result.text for result in results] == ['openai answer'] * 20
+    assert elapsed < 2  # 4s if run one after another
+
+def test_hedged_request_uses_faster_provider(app, provider):
+    app.config['AI_HEDGE_DELAY_SECONDS'] = 0.05
+    provider.delay['openai'] = 0.5
+
+    completion = ai_client.complete(MESSAGES)
+    assert completion.provider == 'gemini'
+    assert completion.latency < 0.4
+    # Losing a hedged race does not count against the slow provider
+    assert ai_client.breakers['openai'].failures == 0
+
+def test_chat_route_reports_unavailable(client, provider):
+    provider.fail.update({'openai', 'gemini', 'huggingface'})
+    response = client.post('/api/ai-chat', json={'question': 'Hello?'})
+    assert response.status_code == 503
+
+    provider.fail.clear()
+    ai_client.init_app(client.application)
+    response = client.post('/api/ai-chat', json={'question': 'Hello?', 'provider': 'huggingface'})
+    assert response.get_json() == {'answer': 'huggingface answer', 'provider': 'huggingface'}
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed AI answers, against a local fake provider
+"""
+
+import json
+
+import pytest
+
+from app.models.ai_cache import AIResponseCache
+from app.services.ai_providers import ProviderError, ProviderUnavailable, ai_client
+
+MESSAGES = [{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': 'Opening hours?'}]
+
+@pytest.fixture
+def provider_config():
+    return {'AI_CIRCUIT_FAILURES': 5}
+
+def events(response):
+    """[(event, data)] from a server-sent event response"""
+    parsed = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+def test_each_provider_streams_deltas(app, provider):
+    for name in ('openai', 'gemini', 'huggingface'):
+        stream = ai_client.stream(MESSAGES, provider=name)
+        assert list(stream) == [name, ' answer']
+        assert (stream.text, stream.provider, stream.complete) == (f'{name} answer', name, True)
+
+def test_first_token_arrives_before_the_answer_finishes(app, provider):
+    provider.token_delay = 0.3
+    stream = ai_client.stream(MESSAGES)
+    list(stream)
+    assert stream.first_token_latency < 0.2
+    assert stream.latency >= 0.3
+
+def test_falls_back_before_the_first_token_only(app, provider):
+    provider.fail.add('openai')
+    stream = ai_client.stream(MESSAGES)
+    assert ''.join(stream) == 'gemini answer'
+
+    provider.cut.add('gemini')
+    stream = ai_client.stream(MESSAGES)
+    with pytest.raises(ProviderError):
+        list(stream)
+    assert stream.parts == ['gemini']
+    assert provider.calls['huggingface'] == 0
+    assert ai_client.breakers['gemini'].failures == 1
+
+def test_reader_going_away_is_not_a_provider_failure(app, provider):
+    provider.token_delay = 0.05
+    deltas = iter(ai_client.stream(MESSAGES))
+    assert next(deltas) == 'openai'
+    deltas.close()
+    assert ai_client.breakers['openai'].failures == 0
+
+def test_summary_stream_is_cached_once_complete(client, provider):
+    response = client.post('/api/summarize/stream', json={'text': 'Soil conservation in Lesotho'})
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    first = events(response)
+    assert first[:2] == [('token', {'text': 'openai'}), ('token', {'text': ' answer'})]
+    assert first[-1] == ('done', {'answer': 'openai answer', 'provider': 'openai', 'cached': False})
+    assert AIResponseCache.query.count() == 1
+
+    again = events(client.post('/api/summarize/stream', json={'text': 'soil conservation in Lesotho!'}))
+    assert again == [('token', {'text': 'openai answer'}),
+                     ('done', {'answer': 'openai answer', 'provider': 'openai', 'cached': True})]
+    assert provider.calls['openai'] == 1
+
+    # Non-streamed requests share the same cache
+    assert client.post('/api/summarize', json={'text': 'Soil conservation in Lesotho'}).get_json() == {
+        'summary': 'openai answer'}
+    assert provider.calls['openai'] == 1
+
+def test_library_chat_stream_reports_actions(client, provider, make_book):
+    make_book('openai answer', cover_image='cover.jpg')
+    done = events(client.post('/ai_chat/stream', json={'query': 'Which book?'}))[-1]
+    assert done[0] == 'done'
+    assert [action['type'] for action in done[1]['actions']] == ['reserve', 'view']
+    with client.session_transaction() as session:
+        assert session['ai_chat_history'] == [{'role': 'user', 'content': 'Which book?'},
+                                              {'role': 'assistant', 'content': 'openai answer'}]
+
+def test_stream_reports_unavailable_providers(client, provider):
+    provider.fail.update({'openai', 'gemini', 'huggingface'})
+    parsed = events(client.post('/api/ai-chat/stream', json={'question': 'Hello?'}))
+    assert [event for event, _ in parsed] == ['error']
+    assert AIResponseCache.query.count() == 0
+    with pytest.raises(ProviderUnavailable):
+        list(ai_client.stream(MESSAGES))
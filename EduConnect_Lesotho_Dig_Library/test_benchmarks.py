@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for the endpoint benchmark suite and its regression gate
+"""
+
+import os
+
+from benchmarks.endpoints import compare, percentile, run_benchmarks
+
+BASELINE = {'main.search': {'p95_ms': 20.0, 'queries': 12.0, 'peak_kib': 400.0}}
+
+def result(**changes):
+    return {'main.search': dict(BASELINE['main.search'], **changes)}
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)) == (50, 95, 99)
+    assert percentile([7.0], 0.95) == 7.0
+
+def test_gate_allows_noise_and_catches_regressions():
+    assert compare(result(p95_ms=29.0, peak_kib=450.0), BASELINE) == []
+    assert compare(result(p95_ms=5.5), {'main.search': dict(BASELINE['main.search'], p95_ms=1.0)}) == []
+
+    regressions = compare(result(p95_ms=31.0, queries=13.0, peak_kib=900.0), BASELINE)
+    assert regressions == ['main.search: p95 20.0 ms -> 31.0 ms',
+                           'main.search: 12.0 -> 13.0 queries per request',
+                           'main.search: peak memory 400.0 KiB -> 900.0 KiB']
+    assert compare({'new.endpoint': BASELINE['main.search']}, BASELINE) == []
+
+def test_scenarios_run_against_a_seeded_database():
+    covers = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads', 'covers')
+    before = sorted(os.listdir(covers))
+    # The benchmarked book has no cover, so the detail page draws the placeholder
+    results = run_benchmarks(scale=0.001, iterations=3, only=['main.index', 'main.book_detail', 'admin.dashboard',
+                                                             'books.download_book',
+                                                             'reminders.send_loan_reminders'],
+                             echo=lambda line: None)
+    assert set(results) == {'main.index', 'main.book_detail', 'admin.dashboard', 'books.download_book',
+                            'reminders.send_loan_reminders'}
+    # Pages are only read; nothing is written into the source tree
+    assert sorted(os.listdir(covers)) == before
+    for row in results.values():
+        assert row['iterations'] >= 3 and row['queries'] > 0 and row['peak_kib'] > 0
+        assert row['p50_ms'] <= row['p95_ms'] <= row['p99_ms']
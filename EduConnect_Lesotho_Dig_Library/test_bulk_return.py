@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for single-transaction bulk returns
+"""
+
+from datetime import date, timedelta
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.notification import Notification
+from app.models.reservation import BookReservation
+from app.services.returns import bulk_return_books
+
+def lend(user, book, librarian, due):
+    loan = BorrowingTransaction(user_id=user.id, book_id=book.id, due_date=due,
+                                status='borrowed', librarian_id=librarian.id)
+    db.session.add(loan)
+    db.session.commit()
+    return loan
+
+def test_bulk_return_updates_loans_copies_fines_and_queue(app, librarian, make_user, make_book):
+    app.config['FINE_PER_DAY'] = 2.0
+    reader, waiting = make_user('palesa'), make_user('neo')
+    today = date.today()
+    popular = make_book('Popular', copies=3, available_copies=0)
+    other = make_book('Other', copies=1, available_copies=0)
+
+    loans = [lend(reader, popular, librarian, today - timedelta(days=3)),
+             lend(reader, popular, librarian, today + timedelta(days=5)),
+             lend(reader, other, librarian, today + timedelta(days=5))]
+    done = lend(reader, other, librarian, today)
+    done.status = 'returned'
+    db.session.add(BookReservation(user_id=waiting.id, book_id=popular.id, queue_position=1))
+    db.session.commit()
+
+    results = bulk_return_books([l.id for l in loans] + [done.id, 9999, 'abc'], librarian.id)
+    by_id = {r['transaction_id']: r for r in results}
+
+    assert [by_id[l.id]['status'] for l in loans] == ['returned'] * 3
+    assert by_id[loans[0].id]['fine_amount'] == 6.0
+    assert by_id[loans[1].id]['fine_amount'] == 0
+    assert by_id[done.id]['status'] == 'skipped'
+    assert by_id[9999]['status'] == 'error' and by_id['abc']['status'] == 'error'
+
+    db.session.expire_all()
+    # One of the two returned copies of Popular goes on the hold shelf for the queue
+    assert db.session.get(Book, popular.id).available_copies == 1
+    assert db.session.get(Book, other.id).available_copies == 1
+    assert BorrowingTransaction.query.filter_by(status='returned').count() == 4
+    assert BookReservation.query.one().notified
+    assert BookReservation.query.one().is_on_hold()
+    assert Notification.query.filter_by(user_id=waiting.id, title='Book Available').count() == 1
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the AI chat analytics store and rollups
+"""
+
+from datetime import datetime, timedelta
+
+from app import db
+from app.models.ai_chat_event import AIChatDailyRollup, AIChatEvent
+from app.models.user import UserRole
+from app.services.ai_providers import ai_client
+from app.services.chat_analytics import chat_events, events_page, purge_old_events, rollups
+
+def test_requests_are_recorded_with_cache_and_tokens(client, login, provider, make_user):
+    member = make_user('thabo')
+    login(member)
+    for _ in range(2):
+        client.post('/api/ai-chat', json={'question': 'When does the library open?'})
+    client.post('/api/summarize', json={'text': 'A short history of Lesotho'})
+
+    # Nothing is written during the request itself
+    assert AIChatEvent.query.count() == 0
+    assert chat_events.flush() == 3
+
+    first, second, summary = AIChatEvent.query.order_by(AIChatEvent.id).all()
+    assert (first.user_id, first.endpoint, first.provider, first.status) == (member.id, 'ai_chat', 'openai', 'ok')
+    assert (first.cached, second.cached, second.cache_source) == (False, True, 'memory')
+    assert first.prompt_tokens > 0 and first.completion_tokens == 3
+    assert first.latency_ms >= 0
+    assert summary.endpoint == 'summarize'
+
+def test_failures_and_streams_are_recorded(client, provider):
+    provider.fail.update({'openai', 'gemini', 'huggingface'})
+    client.post('/api/ai-chat', json={'question': 'Hello?'})
+    client.post('/api/ai-chat/stream', json={'question': 'Hello again?'}).get_data()
+    provider.fail.clear()
+    ai_client.init_app(client.application)
+    client.post('/api/summarize/stream', json={'text': 'Maize farming'}).get_data()
+    chat_events.flush()
+
+    failed, failed_stream, streamed = AIChatEvent.query.order_by(AIChatEvent.id).all()
+    assert (failed.status, failed.user_id, failed.provider) == ('error', None, None)
+    assert (failed_stream.status, failed_stream.streamed) == ('error', True)
+    assert (streamed.status, streamed.streamed, streamed.answer_preview) == ('ok', True, 'openai answer')
+    assert streamed.first_token_ms is not None
+
+def test_rollups_accumulate_across_flushes(client, provider):
+    for question in ('Opening hours?', 'opening hours', 'Where is the library?'):
+        client.post('/api/ai-chat', json={'question': question})
+        chat_events.flush()
+    client.post('/api/ai-chat', json={'question': 'Opening hours', 'provider': 'gemini'})
+    chat_events.flush()
+
+    assert AIChatDailyRollup.query.count() == 2
+    summary = rollups(days=7)
+    assert summary['totals']['requests'] == 4
+    assert summary['totals']['cache_hits'] == 1
+    assert [(p['provider'], p['requests']) for p in summary['providers']] == [('gemini', 1), ('openai', 3)]
+    assert [d['requests'] for d in summary['daily']] == [4]
+    assert summary['top_queries'][0] == {'query': 'opening hours', 'count': 3}
+
+def test_events_are_paged_by_id(app):
+    now = datetime.utcnow()
+    for index in range(5):
+        chat_events.record(endpoint='ai_chat', question=f'question {index}', created_at=now)
+    chat_events.flush()
+
+    first = events_page(per_page=2)
+    assert [event['query'] for event in first['events']] == ['question 4', 'question 3']
+    second = events_page(before_id=first['next_before_id'], per_page=2)
+    assert [event['query'] for event in second['events']] == ['question 2', 'question 1']
+    last = events_page(before_id=second['next_before_id'], per_page=2)
+    assert len(last['events']) == 1 and last['next_before_id'] is None
+
+def test_old_events_are_purged_but_rollups_kept(app):
+    chat_events.record(endpoint='ai_chat', question='old', created_at=datetime.utcnow() - timedelta(days=200))
+    chat_events.record(endpoint='ai_chat', question='new')
+    chat_events.flush()
+
+    assert purge_old_events(retention_days=180) == 1
+    assert [event.question for event in AIChatEvent.query.all()] == ['new']
+    assert AIChatDailyRollup.query.count() == 2
+
+def test_analytics_endpoints_are_admin_only(client, login, make_user):
+    member = make_user('lineo')
+    login(member)
+    assert client.get('/admin/ai_chat_analytics').status_code == 403
+    assert client.get('/admin/ai_chat_logs').status_code == 403
+
+    member.role_id = UserRole.query.filter_by(role_name='admin').first().id
+    db.session.commit()
+    chat_events.record(endpoint='ai_chat', question='Opening hours?')
+    chat_events.flush()
+    assert client.get('/admin/ai_chat_analytics').get_json()['totals']['requests'] == 1
+    assert [log['query'] for log in client.get('/admin/ai_chat_logs').get_json()['logs']] == ['Opening hours?']
+    # A page always holds at least one event
+    for per_page in (0, -5):
+        response = client.get(f'/admin/ai_chat_logs?per_page={per_page}')
+        assert response.status_code == 200
+        assert len(response.get_json()['logs']) == 1
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for AI chat context retrieval
+"""
+
+from app import db
+from app.models.review import BookReview
+from app.routes import ai_chat
+from app.services.chat_retrieval import chunk, estimate_tokens, get_retriever, refresh_index
+
+def test_chunks_overlap_and_cover_the_text():
+    words = [f'w{i}' for i in range(200)]
+    pieces = chunk(' '.join(words), size=80, overlap=20)
+    assert [piece.split()[0] for piece in pieces] == ['w0', 'w60', 'w120']
+    assert pieces[-1].split()[-1] == 'w199'
+
+def test_retrieval_ranks_passages_and_respects_budget(app, make_user, make_book):
+    app.config['CHAT_CONTEXT_USE_VECTORS'] = False
+    soil = make_book('Soil Conservation', description='Terracing and erosion control on steep highland farms. ' * 30)
+    make_book('Sesotho Poetry', description='Praise poems and oral tradition')
+    reader = make_user('mpho')
+    db.session.add(BookReview(user_id=reader.id, book_id=soil.id, rating=5, is_approved=True,
+                              review_text='Practical advice on erosion for our village garden'))
+    db.session.commit()
+
+    passages = get_retriever().retrieve('How do I stop soil erosion?', token_budget=200)
+    kinds = {passage.kind for passage in passages}
+    assert {'book', 'review'} <= kinds
+    assert all(passage.title != 'Sesotho Poetry' for passage in passages)
+    assert sum(estimate_tokens(passage.text) for passage in passages) <= 200
+
+    hours = get_retriever().retrieve('what are the library hours?')
+    assert hours[0].kind == 'page' and '8am-6pm' in hours[0].text
+
+def test_retrievals_are_cached_per_normalized_query(app, make_book):
+    make_book('Basic Accounting', description='Ledgers and balance sheets')
+    retriever = get_retriever()
+    first = retriever.retrieve('Balance sheets?')
+
+    calls = []
+    original = retriever.index.search
+    retriever.index.search = lambda *args, **kwargs: calls.append(args) or original(*args, **kwargs)
+    assert retriever.retrieve('  balance   SHEETS ') is first
+    assert calls == []
+
+def test_requests_keep_the_old_index_while_it_is_rebuilt(app, make_book):
+    app.config['CHAT_CONTEXT_USE_VECTORS'] = False
+    make_book('Basic Accounting', description='Ledgers and balance sheets')
+    retriever = get_retriever()
+    retriever.retrieve('balance sheets')
+    old_index = retriever.index
+
+    make_book('Poultry Farming', description='Raising broilers and layers')
+    app.config['CHAT_INDEX_CHECK_SECONDS'] = 0
+    assert retriever.retrieve('poultry broilers') == []
+    assert retriever._refresher is not None
+
+    retriever._refresher.join(5)
+    assert retriever.index is not old_index
+    assert retriever.retrieve('poultry broilers')[0].title == 'Poultry Farming'
+
+def test_scheduler_job_swaps_in_a_fresh_index(app, make_book):
+    make_book('Basic Accounting', description='Ledgers and balance sheets')
+    assert refresh_index() > 0
+    assert refresh_index() == 0
+
+    make_book('Poultry Farming', description='Raising broilers and layers')
+    assert refresh_index() > 0
+    assert any(passage.title == 'Poultry Farming' for passage in get_retriever().index.passages)
+
+def test_chat_sends_retrieved_context(app, client, make_book, monkeypatch):
+    make_book('Primary Health Care', description='Clinic guide for village health workers')
+    sent = []
+    monkeypatch.setattr(ai_chat, 'get_ai_response', lambda messages: sent.append(messages) or 'Try the clinic guide.')
+
+    response = client.post('/ai_chat', json={'query': 'village clinic guide'})
+    assert response.status_code == 200
+    assert 'Primary Health Care' in sent[0][1]['content']
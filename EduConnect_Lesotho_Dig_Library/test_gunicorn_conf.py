@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Tests for the production gunicorn settings
+"""
+
+import os
+import runpy
+
+import pytest
+
+CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+@pytest.fixture
+def load_conf(monkeypatch):
+    # Loading the file switches START_BACKGROUND_THREADS off; monkeypatch restores it
+    monkeypatch.setenv('START_BACKGROUND_THREADS', 'true')
+
+    def load(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return runpy.run_path(CONF)
+    return load
+
+def test_workers_follow_cpus_and_memory(load_conf):
+    default_workers = load_conf()['default_workers']
+    assert default_workers(1, 1024, 160, 256) == 2
+    assert default_workers(4, 1024, 160, 256) == 4  # Memory allows only four
+    assert default_workers(2, None, 160, 256) == 3
+    assert default_workers(1, 256, 160, 256) == 1
+
+def test_environment_overrides_defaults(load_conf):
+    settings = load_conf(WEB_CONCURRENCY='7', GUNICORN_THREADS='2', GUNICORN_PRELOAD='false', PORT='9000')
+    assert (settings['workers'], settings['threads'], settings['preload_app']) == (7, 2, False)
+    assert settings['bind'] == '0.0.0.0:9000'
+    assert settings['worker_class'] == 'gthread'
+    assert settings['max_requests_jitter'] > 0
+    assert os.environ['START_BACKGROUND_THREADS'] == 'false'
+
+def test_on_starting_clears_old_metrics_snapshots(load_conf, tmp_path):
+    for name in ('123.json', 'retired.json', 'retired.lock', '456.tmp', 'keep.txt'):
+        (tmp_path / name).write_text('{}')
+    load_conf(METRICS_DIR=str(tmp_path))['on_starting'](server=None)
+    assert sorted(os.listdir(tmp_path)) == ['keep.txt']
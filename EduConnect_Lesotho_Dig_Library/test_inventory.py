@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test and reconciliation tests for inventory counters
+"""
+
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.services import inventory
+from app.services.inventory import approve_loan, reconcile_inventory
+
+def request_loans(book, users, librarian):
+    loans = [BorrowingTransaction(user_id=user.id, book_id=book.id, status='pending',
+                                  librarian_id=librarian.id) for user in users]
+    db.session.add_all(loans)
+    db.session.commit()
+    return [loan.id for loan in loans]
+
+def hammer(app, calls):
+    """Run every (func, args) call at the same moment from its own thread"""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def worker(index, func, args):
+        with app.app_context():
+            barrier.wait()
+            try:
+                results[index] = func(*args)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(i, func, args)) for i, (func, args) in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_last_copies_are_never_oversold(app, librarian, make_user, make_book):
+    book = make_book('Exam Revision Guide', copies=3)
+    loan_ids = request_loans(book, [make_user(f'reader{i}') for i in range(16)], librarian)
+
+    results = hammer(app, [(approve_loan, (loan_id, librarian.id)) for loan_id in loan_ids])
+
+    assert sum(1 for success, _ in results if success) == 3
+    db.session.expire_all()
+    assert db.session.get(Book, book.id).available_copies == 0
+    assert BorrowingTransaction.query.filter_by(status='borrowed').count() == 3
+    assert BorrowingTransaction.query.filter_by(status='pending').count() == 13
+
+def test_double_approval_takes_one_copy(app, librarian, make_user, make_book):
+    book = make_book('Single Request', copies=5)
+    loan_id = request_loans(book, [make_user('lineo')], librarian)[0]
+
+    results = hammer(app, [(approve_loan, (loan_id, librarian.id))] * 8)
+
+    assert sum(1 for success, _ in results if success) == 1
+    db.session.expire_all()
+    assert db.session.get(Book, book.id).available_copies == 4
+
+def test_reconcile_recomputes_from_active_loans(app, librarian, make_user, make_book):
+    drifted = make_book('Drifted', copies=4, available_copies=4)
+    correct = make_book('Correct', copies=2, available_copies=1)
+    reader = make_user('mpho')
+    for book, status in [(drifted, 'borrowed'), (drifted, 'renewed'), (drifted, 'returned'), (correct, 'overdue')]:
+        db.session.add(BorrowingTransaction(user_id=reader.id, book_id=book.id, status=status,
+                                            due_date=date.today() + timedelta(days=3), librarian_id=librarian.id))
+    db.session.commit()
+
+    assert reconcile_inventory(batch_size=1) == 1
+    db.session.expire_all()
+    assert db.session.get(Book, drifted.id).available_copies == 2
+    assert db.session.get(Book, correct.id).available_copies == 1
+
+def test_return_is_retried_after_a_lock_conflict(app, librarian, make_user, make_book, monkeypatch):
+    book = make_book('Contended', copies=2, available_copies=1)
+    loan = BorrowingTransaction(user_id=make_user('palesa').id, book_id=book.id, status='borrowed',
+                                due_date=date.today() + timedelta(days=3), librarian_id=librarian.id)
+    db.session.add(loan)
+    db.session.commit()
+
+    checkin_copy, calls = inventory.checkin_copy, []
+    def locked_once(book_id, count=1):
+        calls.append(book_id)
+        if len(calls) == 1:
+            raise OperationalError('UPDATE books', {}, Exception('database is locked'))
+        checkin_copy(book_id, count)
+    monkeypatch.setattr(inventory, 'checkin_copy', locked_once)
+
+    assert loan.return_book(librarian.id) == (True, 'Book returned successfully')
+    assert len(calls) == 2
+    db.session.expire_all()
+    assert db.session.get(Book, book.id).available_copies == 2
+    assert db.session.get(BorrowingTransaction, loan.id).status == 'returned'
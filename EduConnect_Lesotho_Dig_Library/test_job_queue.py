@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent background job queue
+"""
+
+from datetime import datetime, timedelta
+
+from app import db
+from app.models.job_queue import BackgroundJob
+from app.services.job_queue import job_queue
+
+attempts_seen = []
+
+@job_queue.task('test_flaky', max_attempts=3)
+def flaky(fail_times):
+    attempts_seen.append(1)
+    if len(attempts_seen) <= fail_times:
+        raise RuntimeError('temporary outage')
+    return {'calls': len(attempts_seen)}
+
+def test_idempotency_key_returns_existing_job(app):
+    first = job_queue.enqueue('test_flaky', {'fail_times': 0}, idempotency_key='same')
+    second = job_queue.enqueue('test_flaky', {'fail_times': 0}, idempotency_key='same')
+    assert first.id == second.id
+    assert BackgroundJob.query.count() == 1
+
+def test_failed_job_can_be_enqueued_again_under_its_key(app):
+    attempts_seen.clear()
+    job_id = job_queue.enqueue('test_flaky', {'fail_times': 10}, idempotency_key='report', max_attempts=1).id
+    assert job_queue.work_once().status == 'failed'
+
+    again = job_queue.enqueue('test_flaky', {'fail_times': 0}, idempotency_key='report')
+    assert again.id == job_id
+    assert (again.status, again.attempts, again.payload, again.last_error) == ('queued', 0, {'fail_times': 0}, None)
+    assert job_queue.work_once().status == 'succeeded'
+    assert job_queue.enqueue('test_flaky', {'fail_times': 10}, idempotency_key='report').status == 'succeeded'
+
+def test_retries_with_backoff_then_succeeds(app):
+    attempts_seen.clear()
+    job = job_queue.enqueue('test_flaky', {'fail_times': 1})
+
+    job = job_queue.work_once()
+    assert job.status == 'queued' and job.attempts == 1
+    assert 'temporary outage' in job.last_error
+    # Backoff keeps it out of reach until run_after passes
+    assert job.run_after > datetime.utcnow()
+    assert job_queue.work_once() is None
+
+    job.run_after = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    job = job_queue.work_once()
+    assert job.status == 'succeeded' and job.result == {'calls': 2}
+
+def test_gives_up_after_max_attempts(app):
+    attempts_seen.clear()
+    job_id = job_queue.enqueue('test_flaky', {'fail_times': 10}).id
+    for _ in range(3):
+        BackgroundJob.query.filter_by(id=job_id).update({'run_after': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        job_queue.work_once()
+
+    job = db.session.get(BackgroundJob, job_id)
+    assert job.status == 'failed' and job.attempts == 3
+    assert job_queue.work_once() is None
+
+def test_stale_running_job_is_reclaimed(app):
+    attempts_seen.clear()
+    job = job_queue.enqueue('test_flaky', {'fail_times': 0})
+    job.status = 'running'
+    job.attempts = 1
+    job.locked_until = datetime.utcnow() - timedelta(minutes=1)
+    db.session.commit()
+
+    job = job_queue.work_once()
+    assert job.status == 'succeeded' and job.attempts == 2
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Tests for the closed-loop load test harness
+"""
+
+from benchmarks.load import Recorder, run_load, summarize
+
+def test_summary_counts_only_the_measured_window():
+    recorder = Recorder(window_start=10.0, window_end=20.0)
+    recorder.record('search', 5.0, 0.5)
+    for n in range(10):
+        recorder.record('search', 10.0 + n, 0.01 * (n + 1), 'HTTP 500' if n == 9 else None)
+    recorder.record('download', 19.5, 0.2)
+
+    report = summarize([recorder], duration=10.0)
+    assert list(report) == ['search', 'download', 'total']
+    search = report['search']
+    assert (search['requests'], search['rps'], search['errors'], search['error_rate']) == (10, 1.0, 1, 0.1)
+    assert (search['p50_ms'], search['p95_ms'], search['p99_ms']) == (50.0, 100.0, 100.0)
+    assert report['total']['requests'] == 11
+    assert report['total']['top_errors'] == {'search: HTTP 500': 1}
+
+def test_journeys_run_against_gunicorn():
+    result = run_load(users=2, duration=5, ramp_up=0, think_time=0, heartbeats=2, workers=1, threads=2,
+                      scale=0.001, echo=lambda line: None)
+    # How many steps land in the window depends on the machine; a whole journey without errors does not
+    assert result['journeys'] > 0
+    assert result['steps']['total']['errors'] == 0
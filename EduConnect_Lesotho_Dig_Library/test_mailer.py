@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for batched outbound email delivery against a local SMTP sink
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models.email_outbox import OutboundEmail
+from app.services.mailer import queue_emails, deliver_outbox
+
+@pytest.fixture
+def sink(app):
+    from app.services.smtp_sink import LocalSMTPSink
+    with LocalSMTPSink() as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+                          MAIL_USERNAME=None, MAIL_DEFAULT_SENDER='library@educonnect.test')
+        yield sink
+
+def queue(recipients):
+    return queue_emails([{'recipient': r, 'subject': 'Hello', 'body': 'Test'} for r in recipients],
+                        deliver=False)
+
+def test_batch_is_sent_over_one_connection(app, sink):
+    assert queue([f'member{i}@example.org' for i in range(30)]) == 30
+
+    assert deliver_outbox(batch_size=50) == 30
+    assert len(sink.messages) == 30
+    assert sink.connections == 1
+    assert OutboundEmail.get_status_counts()['sent'] == 30
+
+def test_per_domain_rate_limit(app, sink):
+    app.config['EMAIL_DOMAIN_RATE_LIMITS'] = {'slow.example': 5}
+    queue([f'a{i}@slow.example' for i in range(8)] + [f'b{i}@fast.example' for i in range(8)])
+
+    assert deliver_outbox() == 13
+    assert OutboundEmail.query.filter_by(status='queued', domain='slow.example').count() == 3
+
+def test_transient_failure_is_retried_and_permanent_is_not(app, sink):
+    sink.handler.fail_once.add('flaky@example.org')
+    sink.handler.reject.add('gone@example.org')
+    queue(['ok@example.org', 'flaky@example.org', 'gone@example.org'])
+
+    assert deliver_outbox() == 1
+    flaky = OutboundEmail.query.filter_by(recipient='flaky@example.org').one()
+    gone = OutboundEmail.query.filter_by(recipient='gone@example.org').one()
+    assert flaky.status == 'queued' and flaky.last_error.startswith('451')
+    assert gone.status == 'failed' and gone.last_error.startswith('550')
+
+    flaky.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert deliver_outbox() == 1
+    assert db.session.get(OutboundEmail, flaky.id).status == 'sent'
+
+def test_unreachable_server_requeues_batch(app):
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=1, MAIL_USE_TLS=False, EMAIL_SMTP_TIMEOUT=2)
+    queue(['x@example.org', 'y@example.org'])
+
+    assert deliver_outbox() == 0
+    assert OutboundEmail.query.filter_by(status='queued').count() == 2
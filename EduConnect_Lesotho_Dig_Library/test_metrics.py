@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus /metrics endpoint
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from app.services.metrics import DOWNLOAD_BYTES, metrics, registry
+
+DEAD_PID = 2 ** 22 + 1  # Above Linux's largest pid
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    registry.reset()
+    yield
+    registry.reset()
+
+def sample(text, series):
+    """The value of one series in the exposition text"""
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+def scrape(client, **kwargs):
+    response = client.get('/metrics', **kwargs)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return response.get_data(as_text=True)
+
+def test_request_latency_histogram(client):
+    client.get('/api/search/suggestions?q=maths')
+    client.get('/api/search/suggestions?q=maths')
+    client.get('/no-such-page')
+    text = scrape(client)
+
+    labels = 'blueprint="api",endpoint="api.search_suggestions",status="200"'
+    assert sample(text, f'http_request_duration_seconds_count{{{labels}}}') == 2
+    assert sample(text, f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}') == 2
+    assert sample(text, f'http_request_duration_seconds_sum{{{labels}}}') > 0
+    assert sample(text, 'http_request_duration_seconds_count'
+                        '{blueprint="",endpoint="<unmatched>",status="404"}') == 1
+    assert '# TYPE http_request_duration_seconds histogram' in text
+
+def test_pool_and_job_queue_gauges(client):
+    client.get('/api/search/suggestions?q=maths')
+    text = scrape(client)
+    assert sample(text, 'db_pool_size{bind="default"}') == 5
+    assert sample(text, 'db_pool_max_overflow{bind="default"}') == 10
+    assert sample(text, 'db_pool_checked_out{bind="default"}') is not None
+    assert sample(text, 'db_pool_checkout_wait_seconds_count{bind="default"}') >= 1
+    assert sample(text, 'job_queue_jobs{status="queued"}') == 0
+
+def test_download_bytes(app, client, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    (tmp_path / 'chapter.pdf').write_bytes(b'x' * 1234)
+    client.get('/uploads/chapter.pdf')
+    client.get('/static/css/style.css')
+    text = scrape(client)
+    assert sample(text, 'download_bytes_total{endpoint="main.uploaded_file"}') == 1234
+    assert 'download_bytes_total{endpoint="static"}' not in text
+
+def test_ai_provider_latency_and_cache_events(client, provider):
+    for _ in range(2):
+        client.post('/api/ai-chat', json={'question': 'Opening hours?'})
+    provider.fail.add('openai')
+    client.post('/api/ai-chat', json={'question': 'Where is the library?'})
+    text = scrape(client)
+
+    assert sample(text, 'ai_provider_request_duration_seconds_count{provider="openai",outcome="ok"}') == 1
+    assert sample(text, 'ai_provider_request_duration_seconds_count{provider="openai",outcome="error"}') == 1
+    assert sample(text, 'ai_provider_request_duration_seconds_count{provider="gemini",outcome="ok"}') == 1
+    assert sample(text, 'ai_cache_events_total{event="requests"}') == 3
+    assert sample(text, 'ai_cache_events_total{event="memory_hits"}') == 1
+    assert sample(text, 'ai_cache_events_total{event="upstream_calls"}') == 2
+
+def test_token_protects_the_endpoint(app, client):
+    app.config['METRICS_TOKEN'] = 's3cret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    scrape(client, headers={'Authorization': 'Bearer s3cret'})
+
+def test_production_refuses_to_serve_without_a_token(app, client):
+    from config.config import ProductionConfig
+    assert ProductionConfig.METRICS_REQUIRE_TOKEN
+    app.config.update(METRICS_REQUIRE_TOKEN=True, METRICS_TOKEN=None)
+    assert client.get('/metrics').status_code == 404
+    app.config['METRICS_TOKEN'] = 's3cret'
+    scrape(client, headers={'Authorization': 'Bearer s3cret'})
+
+def test_counts_from_finished_threads_are_kept(app):
+    def download():
+        for _ in range(100):
+            DOWNLOAD_BYTES.inc('books.download_book', amount=10)
+    threads = [threading.Thread(target=download) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for _ in range(2):
+        with app.test_request_context():
+            assert sample(metrics.render(), 'download_bytes_total{endpoint="books.download_book"}') == 4000
+
+def test_workers_are_added_up(app, client, tmp_path):
+    metrics.directory = str(tmp_path)
+    try:
+        def worker(pid, downloaded, checked_out):
+            return {'pid': pid, 'counters': [['download_bytes_total', ['books.download_book'], downloaded]],
+                    'histograms': [], 'gauges': {'db_pool_checked_out': [[['default'], checked_out]]}}
+        (tmp_path / 'live.json').write_text(json.dumps(worker(os.getppid(), 100, 3)))
+        (tmp_path / 'exited.json').write_text(json.dumps(worker(DEAD_PID, 50, 7)))
+        DOWNLOAD_BYTES.inc('books.download_book', amount=5)
+
+        text = scrape(client)
+        # Counters of exited workers are kept; only live workers' gauges count
+        assert sample(text, 'download_bytes_total{endpoint="books.download_book"}') == 155
+        assert sample(text, 'db_pool_checked_out{bind="default"}') == 3
+        # ...and folded into one file instead of piling up
+        assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.json')) == \
+            ['live.json', 'retired.json']
+        assert sample(scrape(client), 'download_bytes_total{endpoint="books.download_book"}') == 155
+
+        metrics.write_snapshot()
+        own = json.loads((tmp_path / f'{os.getpid()}.json').read_text())
+        assert ['download_bytes_total', ['books.download_book'], 5] in own['counters']
+    finally:
+        metrics.directory = None
+
+def test_reused_pid_keeps_the_exited_workers_counts(app, client, tmp_path):
+    metrics.directory = str(tmp_path)
+    try:
+        (tmp_path / f'{os.getpid()}.json').write_text(json.dumps({
+            'pid': os.getpid(), 'instance': 'exited', 'histograms': [], 'gauges': {},
+            'counters': [['download_bytes_total', ['books.download_book'], 40]]}))
+        DOWNLOAD_BYTES.inc('books.download_book', amount=5)
+
+        metrics.write_snapshot()
+        assert sample(scrape(client), 'download_bytes_total{endpoint="books.download_book"}') == 45
+        retired = json.loads((tmp_path / 'retired.json').read_text())
+        assert retired['counters'] == [['download_bytes_total', ['books.download_book'], 40]]
+    finally:
+        metrics.directory = None
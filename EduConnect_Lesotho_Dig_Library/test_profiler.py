@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for on-demand request profiling
+"""
+
+import json
+import os
+import time
+
+import pytest
+from flask import jsonify
+
+from app import db
+from app.models.user import UserRole
+from app.services.profiler import profiler
+
+def slow_report():
+    time.sleep(0.05)
+    return jsonify({'ok': True})
+
+@pytest.fixture(autouse=True)
+def profile_dir(app, tmp_path):
+    profiler.directory = str(tmp_path / 'profiles')
+    app.config['PROFILE_SAMPLE_INTERVAL_MS'] = 1
+    app.add_url_rule('/slow-report', 'slow_report', slow_report)
+    yield tmp_path / 'profiles'
+    profiler.stop()
+
+def test_sampling_writes_collapsed_stacks(client, profile_dir):
+    profiler.start('slow_report', max_captures=5)
+    client.get('/slow-report')
+    client.get('/api/search/suggestions?q=maths')
+
+    [capture] = profiler.captures()
+    assert (capture['endpoint'], capture['status'], capture['mode']) == ('slow_report', 200, 'sampling')
+    assert capture['duration_ms'] >= 50 and capture['samples'] > 0
+    lines = (profile_dir / f"{capture['id']}.collapsed").read_text().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert 'test_profiler:slow_report' in stack.split(';')
+
+def test_paths_match_and_fraction_zero_is_rejected(client):
+    with pytest.raises(ValueError):
+        profiler.start('/slow-*', fraction=0)
+    profiler.start('/slow-*', mode='cprofile')
+    client.get('/slow-report')
+
+    [capture] = profiler.captures()
+    assert capture['files'] == ['pstats', 'txt']
+    assert os.path.exists(profiler.capture_path(capture['id'], 'pstats'))
+
+def test_trigger_stops_after_max_captures(client):
+    profiler.start('slow_report', max_captures=2)
+    for _ in range(3):
+        client.get('/slow-report')
+    assert len(profiler.captures()) == 2
+    assert profiler.active() is None
+
+def test_retention_limits(app, profile_dir):
+    app.config['PROFILE_MAX_CAPTURES'] = 2
+    profile_dir.mkdir()
+    for index, age_days in enumerate([0, 1, 2, 10]):
+        meta = {'id': f'capture{index}', 'files': ['collapsed'], 'created_at': time.time() - age_days * 86400}
+        (profile_dir / f'capture{index}.json').write_text(json.dumps(meta))
+        (profile_dir / f'capture{index}.collapsed').write_text('a;b 1\n')
+    assert profiler.prune() == 2
+    assert sorted(os.listdir(profile_dir)) == ['capture0.collapsed', 'capture0.json',
+                                               'capture1.collapsed', 'capture1.json']
+
+def test_admin_pages(client, login, make_user):
+    member = make_user('lerato')
+    login(member)
+    assert client.get('/admin/profiles').status_code == 302
+
+    member.role_id = UserRole.query.filter_by(role_name='admin').first().id
+    db.session.commit()
+    response = client.post('/admin/profiles/start', data={'pattern': 'slow_report', 'percent': '100',
+                                                          'mode': 'sampling', 'minutes': '5'})
+    assert response.status_code == 302
+    assert profiler.active()['started_by'] == 'lerato'
+    client.get('/slow-report')
+
+    [capture] = profiler.captures()
+    page = client.get('/admin/profiles').get_data(as_text=True)
+    assert capture['id'] in page and 'slow_report' in page
+    download = client.get(f"/admin/profiles/{capture['id']}.collapsed")
+    assert download.status_code == 200 and b'slow_report' in download.data
+    assert client.get('/admin/profiles/..%2Fsecrets.collapsed').status_code == 404
+
+    client.post('/admin/profiles/stop')
+    assert profiler.active() is None
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for per-request SQL query instrumentation
+"""
+
+import logging
+
+from flask import jsonify
+
+from app import db
+from app.models.book import Book
+from app.models.user import UserRole
+from app.services.query_stats import normalize_statement, query_stats
+
+def test_statements_are_normalized():
+    assert normalize_statement("SELECT * FROM books WHERE id IN (?, ?, ?) AND title = 'It''s'  LIMIT 10") == \
+        'SELECT * FROM books WHERE id IN (?) AND title = ? LIMIT ?'
+    assert normalize_statement('SELECT * FROM books WHERE id = %s') == 'SELECT * FROM books WHERE id = ?'
+
+def test_headers_report_queries(app, client):
+    app.config['QUERY_STATS_HEADERS'] = True
+    response = client.get('/api/search/suggestions?q=maths')
+    assert response.headers['X-Query-Count'] == '2'
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert 'desc="2 queries"' in response.headers['Server-Timing']
+
+def test_headers_only_in_debug_by_default(app, client):
+    assert 'X-Query-Count' not in client.get('/api/search/suggestions?q=maths').headers
+    app.debug = True
+    assert client.get('/api/search/suggestions?q=maths').headers['X-Query-Count'] == '2'
+
+def test_repeated_statements_are_logged_as_n_plus_one(app, client, make_book, caplog):
+    for index in range(4):
+        make_book(f'Book {index}')
+    app.config['QUERY_STATS_N_PLUS_ONE'] = 4
+
+    def titles():
+        return jsonify([Book.query.get(book_id).title for (book_id,) in db.session.query(Book.id).all()])
+    app.add_url_rule('/n-plus-one', 'n_plus_one', titles)
+    db.session.expunge_all()
+
+    with caplog.at_level(logging.WARNING, logger='app.services.query_stats'):
+        client.get('/n-plus-one')
+    assert 'Possible N+1 in n_plus_one: 5 queries, one statement 4 times' in caplog.text
+
+    row = {row['endpoint']: row for row in query_stats.report()}['n_plus_one']
+    assert (row['requests'], row['max_queries'], row['max_repeats'], row['n_plus_one_requests']) == (1, 5, 4, 1)
+    assert row['repeated_statement']['statement'].endswith('WHERE books.id = ?')
+
+def test_slow_endpoints_report_is_admin_only(app, client, login, make_user):
+    member = make_user('mpho')
+    login(member)
+    assert client.get('/admin/slow-endpoints').status_code == 302
+
+    member.role_id = UserRole.query.filter_by(role_name='admin').first().id
+    db.session.commit()
+    client.get('/api/search/suggestions?q=maths')
+    client.get('/api/search/suggestions?q=history')
+    rows = client.get('/admin/slow-endpoints?sort=queries').get_json()['endpoints']
+    suggestions = next(row for row in rows if row['endpoint'] == 'api.search_suggestions')
+    assert (suggestions['requests'], suggestions['avg_queries']) == (2, 2.0)
+    assert client.get('/admin/slow-endpoints/dashboard').status_code == 200
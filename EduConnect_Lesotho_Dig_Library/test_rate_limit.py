@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for the token-bucket rate limits on AI and search endpoints
+"""
+
+import pytest
+
+from app.services import rate_limit
+from app.services.rate_limit import DatabaseBuckets, MemoryBuckets, parse_limit, rate_limiter
+
+@pytest.fixture
+def limited(app):
+    app.config['RATELIMIT_ENABLED'] = True
+    rate_limiter.init_app(app)
+    return app
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+    return now
+
+def test_parse_limit():
+    assert parse_limit('10/minute') == (10 / 60, 10, '10/minute')
+    assert parse_limit('100 / 5 minutes').rate == 100 / 300
+    with pytest.raises(ValueError):
+        parse_limit('ten per minute')
+
+@pytest.mark.parametrize('buckets', [MemoryBuckets, DatabaseBuckets])
+def test_bucket_allows_a_burst_then_refills(app, clock, buckets):
+    buckets = buckets()
+    limit = parse_limit('3/minute')
+    assert [buckets.hit('k', limit).allowed for _ in range(4)] == [True, True, True, False]
+    assert buckets.hit('k', limit).retry_after == pytest.approx(20)
+
+    clock[0] += 20
+    assert buckets.hit('k', limit).allowed
+    assert not buckets.hit('k', limit).allowed
+    # Other keys have their own bucket
+    assert buckets.hit('other', limit).allowed
+
+def test_memory_buckets_are_bounded(clock):
+    buckets = MemoryBuckets(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        buckets.hit(key, parse_limit('1/hour'))
+    assert list(buckets.buckets) == ['b', 'c']
+
+def test_anonymous_visitors_get_429_with_retry_after(limited, client, clock):
+    limited.config['RATELIMIT_POLICIES'] = {'search_suggestions': {'limit': '5/minute', 'anonymous': '2/minute'}}
+    statuses = [client.get('/api/search/suggestions?q=hi').status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    response = client.get('/api/search/suggestions?q=hi')
+    assert response.headers['Retry-After'] == '30'
+    assert response.get_json()['retry_after'] == 30
+    assert rate_limiter.stats()['scopes'] == {'search_suggestions': {'allowed': 2, 'rejected': 2}}
+
+    # Another address has its own allowance
+    assert client.get('/api/search/suggestions?q=hi', environ_base={'REMOTE_ADDR': '10.0.0.9'}).status_code == 200
+
+def test_visitors_behind_the_proxy_are_told_apart_by_its_header(limited, client, clock):
+    limited.config['RATELIMIT_POLICIES'] = {'search_suggestions': {'limit': '5/minute', 'anonymous': '1/minute'}}
+    limited.config['CLIENT_IP_HEADER'] = 'Fly-Client-IP'
+
+    def suggest(**headers):
+        return client.get('/api/search/suggestions?q=hi', environ_base={'REMOTE_ADDR': '172.16.0.1'},
+                          headers=headers).status_code
+
+    assert [suggest(**{'Fly-Client-IP': '196.11.0.5'}), suggest(**{'Fly-Client-IP': '196.11.0.5'})] == [200, 429]
+    assert suggest(**{'Fly-Client-IP': '196.11.0.6'}) == 200
+
+def test_forged_address_headers_do_not_get_a_fresh_bucket(limited, client, clock):
+    limited.config['RATELIMIT_POLICIES'] = {'search_suggestions': {'limit': '5/minute', 'anonymous': '1/minute'}}
+
+    def suggest(forged):
+        return client.get('/api/search/suggestions?q=hi', environ_base={'REMOTE_ADDR': '196.11.0.5'},
+                          headers={'X-Real-IP': forged, 'X-Forwarded-For': forged}).status_code
+
+    assert [suggest('10.0.0.1'), suggest('10.0.0.2'), suggest('10.0.0.3')] == [200, 429, 429]
+
+def test_members_share_one_ai_allowance_across_endpoints(limited, client, login, provider, make_user):
+    limited.config['RATELIMIT_POLICIES'] = {'ai': {'limit': '3/minute', 'anonymous': '1/minute'}}
+    login(make_user('thato'))
+    assert client.post('/api/ai-chat', json={'question': 'Opening hours?'}).status_code == 200
+    assert client.post('/api/summarize', json={'text': 'Maize farming'}).status_code == 200
+    assert client.post('/ai_chat', json={'query': 'Any new books?'}).status_code == 200
+    assert client.post('/api/summarize', json={'text': 'Basotho hats'}).status_code == 429
+    assert sum(provider.calls.values()) == 3
+
+def test_disabled_limits_let_everything_through(app, client):
+    app.config['RATELIMIT_POLICIES'] = {'search_suggestions': '1/hour'}
+    assert {client.get('/api/search/suggestions?q=hi').status_code for _ in range(3)} == {200}
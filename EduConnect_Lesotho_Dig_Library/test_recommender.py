@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Tests for the precomputed item-item recommender
+"""
+
+from datetime import date
+
+from app import db
+from app.models.borrowing import BorrowingTransaction
+from app.models.offline import ReadingSession
+from app.models.recommendation import BookSimilarity
+from app.services.recommender import build_similarity, rebuild_recommendations, recommend_for_user
+
+def borrow(librarian, user, *books):
+    for book in books:
+        db.session.add(BorrowingTransaction(user_id=user.id, book_id=book.id, status='returned',
+                                            due_date=date.today(), librarian_id=librarian.id))
+    db.session.commit()
+
+def test_build_similarity_keeps_top_k_by_cosine():
+    rows = [(1, 10, 3.0), (1, 20, 3.0), (2, 10, 3.0), (2, 20, 3.0), (2, 30, 3.0), (3, 30, 3.0), (3, 40, 3.0)]
+    neighbours = build_similarity(rows, top_k=2, block_size=2)
+
+    by_book = {}
+    for book_id, similar_id, score, rank in neighbours:
+        by_book.setdefault(book_id, []).append((rank, similar_id))
+    assert sorted(by_book[10]) == [(1, 20), (2, 30)]
+    assert all(book_id != similar_id for book_id, similar_id, _, _ in neighbours)
+    assert max(rank for *_, rank in neighbours) == 2
+
+def test_recommendations_come_from_precomputed_neighbours(app, librarian, make_user, make_book):
+    algebra, geometry, calculus, poetry = (make_book(title) for title in ('Algebra', 'Geometry', 'Calculus', 'Poetry'))
+    ada, ben, cam, dee = (make_user(name) for name in ('ada', 'ben', 'cam', 'dee'))
+    borrow(librarian, ada, algebra, geometry, calculus)
+    borrow(librarian, ben, algebra, calculus)
+    borrow(librarian, cam, poetry)
+    db.session.add(ReadingSession(user_id=dee.id, book_id=algebra.id))
+    db.session.commit()
+
+    assert rebuild_recommendations(top_k=5) == BookSimilarity.query.count() > 0
+    assert BookSimilarity.query.filter_by(book_id=poetry.id).count() == 0
+
+    assert [book.title for book in recommend_for_user(ben.id)] == ['Geometry']
+    assert [book.title for book in recommend_for_user(dee.id)] == ['Calculus', 'Geometry']
+    assert recommend_for_user(cam.id) == []
+
+    # Rebuilding replaces the previous model instead of adding to it
+    count = BookSimilarity.query.count()
+    assert rebuild_recommendations(top_k=5) == count == BookSimilarity.query.count()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for precomputed related-books lists
+"""
+
+from sqlalchemy import event
+
+from app import db
+from app.models.book import Category
+from app.models.recommendation import RelatedBook
+from app.services.related_books import (Catalogue, refresh_missing_related_books, refresh_related_books,
+                                        related_books_for)
+
+def test_related_lists_rank_author_and_text_above_category(app, make_book):
+    db.session.add(Category(name='Fiction', description='Novels'))
+    db.session.commit()
+    fiction = Category.query.filter_by(name='Fiction').one()
+
+    base = make_book('Farming Basotho Highlands', author='Thabo Mofokeng')
+    same_author = make_book('Cooking Without Electricity', author='Thabo Mofokeng')
+    same_words = make_book('Highlands Farming Calendar', author='Someone Else')
+    filler = make_book('Algebra Workbook', author='Another Writer', view_count=50)
+    novel = make_book('Farming Tales', author='Novelist', category_id=fiction.id)
+
+    assert refresh_related_books() == 5
+    ranked = [row.related_book_id for row in RelatedBook.query.filter_by(book_id=base.id).order_by(RelatedBook.rank)]
+    assert ranked[:2] == [same_author.id, same_words.id]
+    assert filler.id in ranked and base.id not in ranked
+    # Text overlap reaches across categories, ranked below same-category matches
+    assert ranked.index(novel.id) > ranked.index(same_words.id)
+
+def test_book_page_reads_list_in_one_query(app, make_book):
+    books = [make_book(f'Mathematics Volume {i}') for i in range(10)]
+    refresh_related_books()
+    book_id = books[0].id
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        sample = related_books_for(book_id, count=6)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len(statements) == 1 and 'random' not in statements[0].lower()
+    assert len(sample) == 6 and book_id not in [book.id for book in sample]
+
+def test_sweep_only_builds_missing_lists(app, make_book):
+    make_book('Existing One'), make_book('Existing Two')
+    refresh_related_books()
+    newcomer = make_book('Newcomer')
+
+    assert refresh_missing_related_books() == 1
+    assert RelatedBook.query.filter_by(book_id=newcomer.id).count() == 2
+    assert refresh_missing_related_books() == 0
+
+def test_books_with_nothing_related_are_not_swept_again(app, make_book):
+    db.session.add(Category(name='Poetry', description='Poems'))
+    db.session.commit()
+    loner = make_book('Lone Sonnets', author='Poet', category_id=Category.query.filter_by(name='Poetry').one().id)
+
+    assert refresh_missing_related_books() == 1
+    assert [row.rank for row in RelatedBook.query.filter_by(book_id=loner.id)] == [0]
+    assert related_books_for(loner.id) == []
+    assert refresh_missing_related_books() == 0
+
+def test_refreshing_a_few_books_loads_only_their_candidates(app, make_book):
+    db.session.add(Category(name='Fiction', description='Novels'))
+    db.session.commit()
+    fiction = Category.query.filter_by(name='Fiction').one()
+    book = make_book('Mountain Roads', author='Lineo Sello')
+    mate = make_book('River Crossings')
+    by_author = make_book('Village Stories', author='Lineo Sello', category_id=fiction.id)
+    unrelated = make_book('Harbour Nights', category_id=fiction.id)
+
+    catalogue = Catalogue([book.id])
+    assert set(catalogue.category) == {book.id, mate.id, by_author.id}
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the set-based loan reminder fan-out
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app import db
+from app.models.borrowing import BorrowingTransaction
+from app.models.notification import Notification, LoanReminder
+from app.services.reminders import send_loan_reminders
+
+def test_reminders_select_due_loans_and_dedupe_per_window(app, librarian, make_user, make_book):
+    reader = make_user('thabo')
+    today = date.today()
+    for title, due, status in [('Overdue', today - timedelta(days=2), 'borrowed'),
+                               ('Due soon', today + timedelta(days=1), 'borrowed'),
+                               ('Not yet', today + timedelta(days=10), 'borrowed'),
+                               ('Returned', today - timedelta(days=5), 'returned')]:
+        book = make_book(title)
+        db.session.add(BorrowingTransaction(user_id=reader.id, book_id=book.id, due_date=due,
+                                            status=status, librarian_id=librarian.id))
+    db.session.commit()
+
+    assert send_loan_reminders(batch_size=1) == 2
+    messages = sorted(n.message for n in Notification.query.filter_by(user_id=reader.id))
+    assert "'Due soon' is due in 1 day(s)" in messages[0]
+    assert "'Overdue' is 2 day(s) overdue" in messages[1]
+
+    # Same window: nothing new
+    assert send_loan_reminders() == 0
+    assert Notification.query.count() == 2
+
+    # Next window reminds again
+    assert send_loan_reminders(today=today + timedelta(days=1)) == 2
+    assert LoanReminder.query.count() == 4
+
+def test_single_loan_reminder_matches_the_daily_run(app, client, login, librarian, make_user, make_book):
+    reader = make_user('palesa')
+    today = date.today()
+    loans = []
+    for title, due in [('Overdue', today - timedelta(days=3)), ('Due soon', today + timedelta(days=2))]:
+        loan = BorrowingTransaction(user_id=reader.id, book_id=make_book(title).id, due_date=due,
+                                    status='borrowed', librarian_id=librarian.id)
+        db.session.add(loan)
+        loans.append(loan)
+    db.session.commit()
+
+    login(librarian)
+    for loan in loans:
+        assert client.post(f'/admin/borrowings/{loan.id}/remind').get_json()['success']
+    single = Notification.query.filter_by(user_id=reader.id).order_by(Notification.id).all()
+
+    assert send_loan_reminders() == 2
+    daily = Notification.query.filter_by(user_id=reader.id).order_by(Notification.id).all()[2:]
+    def fields(notifications):
+        return sorted((n.title, n.message, n.type, n.priority) for n in notifications)
+    assert fields(single) == fields(daily)
+
+def test_reminder_emails_are_claimed_with_the_outbox_insert(app, librarian, make_user, make_book, monkeypatch):
+    from app.models.email_outbox import OutboundEmail
+    from app.services import mailer
+    from app.services.tasks import send_reminder_emails
+
+    reader = make_user('lerato')
+    db.session.add(BorrowingTransaction(user_id=reader.id, book_id=make_book('Due').id, status='borrowed',
+                                        due_date=date.today() + timedelta(days=1), librarian_id=librarian.id))
+    db.session.commit()
+    send_loan_reminders(email=False)
+    window_start = LoanReminder.query.one().window_start.isoformat()
+    def unclaimed():
+        db.session.expire_all()
+        return LoanReminder.query.filter(LoanReminder.emailed_at.is_(None)).count()
+
+    # Email switched off: nothing is claimed
+    app.config['MAIL_SERVER'] = None
+    assert send_reminder_emails(window_start) == {'queued': 0}
+    assert unclaimed() == 1
+
+    # A failed insert leaves the reminder to be claimed again
+    app.config['MAIL_SERVER'] = 'smtp.library.test'
+    def broken(*args, **kwargs):
+        raise RuntimeError('outbox unavailable')
+    monkeypatch.setattr(mailer, 'queue_emails', broken)
+    with pytest.raises(RuntimeError):
+        send_reminder_emails(window_start)
+    assert unclaimed() == 1
+
+    monkeypatch.undo()
+    assert send_reminder_emails(window_start) == {'queued': 1}
+    assert unclaimed() == 0
+    assert OutboundEmail.query.filter_by(recipient=reader.email, category='reminder').count() == 1
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for the reservation queue engine and hold shelf
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.reservation import BookReservation
+from app.services.inventory import approve_loan, reconcile_inventory
+from app.services.reservations import expire_reservations, join_queue, next_in_line
+
+def lend(user, book, librarian, status='borrowed'):
+    loan = BorrowingTransaction(user_id=user.id, book_id=book.id, status=status, librarian_id=librarian.id,
+                                due_date=date.today() + timedelta(days=7))
+    db.session.add(loan)
+    db.session.commit()
+    return loan
+
+def positions(book):
+    db.session.expire_all()
+    return [(r.user.username, r.queue_position) for r in BookReservation.query.filter_by(
+        book_id=book.id, status='active').order_by(BookReservation.queue_position)]
+
+def test_queue_positions_stay_compact(app, make_user, make_book):
+    book = make_book('Queued', copies=1, available_copies=0)
+    first, second, third = (join_queue(make_user(name).id, book.id) for name in ('ada', 'ben', 'cam'))
+
+    assert positions(book) == [('ada', 1), ('ben', 2), ('cam', 3)]
+    assert next_in_line(book.id).id == first.id
+
+    db.session.get(BookReservation, first.id).cancel()
+    assert positions(book) == [('ben', 1), ('cam', 2)]
+    assert next_in_line(book.id).id == second.id
+
+def test_concurrent_joins_take_distinct_places(app, make_user, make_book):
+    book = make_book('Popular', copies=1, available_copies=0)
+    user_ids = [make_user(f'reader{i}').id for i in range(8)]
+    barrier = threading.Barrier(len(user_ids))
+
+    def join(user_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                join_queue(user_id, book.id)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=join, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(position for _, position in positions(book)) == list(range(1, len(user_ids) + 1))
+
+def test_return_puts_copy_on_hold_and_approval_collects_it(app, librarian, make_user, make_book):
+    reader, waiting = make_user('reader'), make_user('waiting')
+    book = make_book('Hold Shelf', copies=1, available_copies=0)
+    loan = lend(reader, book, librarian)
+    join_queue(waiting.id, book.id)
+    join_queue(make_user('later').id, book.id)
+
+    assert loan.return_book(librarian.id)[0]
+    hold = BookReservation.query.filter_by(user_id=waiting.id).one()
+    assert hold.is_on_hold()
+    assert db.session.get(Book, book.id).available_copies == 0
+    assert not loan.can_renew()[0]
+
+    request = lend(waiting, book, librarian, status='pending')
+    success, message = approve_loan(request.id, librarian.id)
+    assert success and 'hold' in message
+    db.session.expire_all()
+    assert db.session.get(BookReservation, hold.id).status == 'fulfilled'
+    assert db.session.get(Book, book.id).available_copies == 0
+    assert positions(book) == [('later', 1)]
+    assert reconcile_inventory() == 0
+
+def test_lapsed_hold_moves_to_next_patron(app, librarian, make_user, make_book):
+    reader = make_user('reader')
+    book = make_book('Popular', copies=1, available_copies=0)
+    loan = lend(reader, book, librarian)
+    first = join_queue(make_user('slow').id, book.id)
+    second = join_queue(make_user('keen').id, book.id)
+    loan.return_book(librarian.id)
+
+    assert expire_reservations(now=datetime.utcnow() + timedelta(days=4)) == 1
+    db.session.expire_all()
+    assert db.session.get(BookReservation, first.id).status == 'expired'
+    assert db.session.get(BookReservation, second.id).is_on_hold()
+    assert positions(book) == [('keen', 1)]
+    assert db.session.get(Book, book.id).available_copies == 0
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-app maintenance job scheduler
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.services.scheduler import CronSchedule, IntervalSchedule, Scheduler, parse_schedule
+from app.models.scheduler import ScheduledJobState, ScheduledJobRun
+
+def test_cron_next_after():
+    schedule = CronSchedule('15 0 * * *')
+    assert schedule.next_after(datetime(2024, 3, 1, 0, 10)) == datetime(2024, 3, 1, 0, 15)
+    assert schedule.next_after(datetime(2024, 3, 1, 0, 15)) == datetime(2024, 3, 2, 0, 15)
+
+    # Every 10 minutes during working hours on weekdays
+    schedule = CronSchedule('*/10 8-17 * * 1-5')
+    assert schedule.next_after(datetime(2024, 3, 1, 17, 55)) == datetime(2024, 3, 4, 8, 0)  # Fri -> Mon
+
+    assert CronSchedule('@monthly').next_after(datetime(2024, 12, 5)) == datetime(2025, 1, 1)
+
+    # Sunday may be written as 7, alone or at the end of a range
+    assert CronSchedule('0 0 * * 7').weekdays == {0}
+    assert CronSchedule('0 0 * * 7').next_after(datetime(2024, 3, 1)) == datetime(2024, 3, 3)  # Fri -> Sun
+    assert CronSchedule('0 0 * * 1-7').weekdays == set(range(7))
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 * * 8')
+
+def test_parse_schedule():
+    assert isinstance(parse_schedule('every 15m'), IntervalSchedule)
+    assert parse_schedule('2h').seconds == 7200
+    assert isinstance(parse_schedule('0 2 * * *'), CronSchedule)
+    with pytest.raises(ValueError):
+        parse_schedule('61 * * * *')
+
+def test_job_runs_once_per_slot(app):
+    calls = []
+    scheduler = Scheduler(app)
+    scheduler.register('count', lambda: calls.append(1) or 1, 'every 1h')
+
+    now = datetime.utcnow()
+    assert scheduler.run_pending(now=now) == []  # first sighting only schedules it
+
+    due = now + timedelta(hours=1, seconds=1)
+    first, second = Scheduler(app), Scheduler(app)
+    for instance in (first, second):
+        instance.instance_id = f'instance-{id(instance)}'
+        instance.jobs = scheduler.jobs
+
+    assert len(first.run_pending(now=due)) == 1
+    assert second.run_pending(now=due) == []
+    assert calls == [1]
+
+    state = db.session.get(ScheduledJobState, 'count')
+    assert state.last_status == 'success' and state.locked_by is None
+    assert state.next_run_at > due
+    assert ScheduledJobRun.query.filter_by(job_name='count').count() == 1
+
+def test_held_lock_blocks_forced_run(app):
+    scheduler = Scheduler(app)
+    scheduler.register('slow', lambda: 0, 'every 1h')
+    now = datetime.utcnow()
+    scheduler.run_pending(now=now)
+
+    state = db.session.get(ScheduledJobState, 'slow')
+    state.locked_by = 'other-host:1'
+    state.locked_until = now + timedelta(minutes=10)
+    db.session.commit()
+
+    assert scheduler.run_job('slow', force=True, now=now) is None
+
+def test_failed_job_is_recorded(app):
+    def broken():
+        raise RuntimeError('boom')
+
+    scheduler = Scheduler(app)
+    scheduler.register('broken', broken, 'every 1h')
+    run = scheduler.run_job('broken', force=True)
+
+    assert run.status == 'failed' and 'boom' in run.error
+    assert db.session.get(ScheduledJobState, 'broken').locked_until is None
+
+def test_subscription_sweep_is_not_blocked_by_admins(app, make_user):
+    from app.models.subscription import SubscriptionPlan, UserSubscription
+    from app.models.user import UserRole
+    from app.routes.subscription import process_expired_subscriptions
+
+    plan = SubscriptionPlan(name='Standard', price=50, duration_days=30)
+    db.session.add(plan)
+    db.session.commit()
+    admin = make_user('admin')
+    admin.role_id = UserRole.query.filter_by(role_name='admin').one().id
+    member = make_user('member')
+    for user in (admin, member):
+        subscription = UserSubscription(user.id, plan.id, start_date=datetime.utcnow() - timedelta(days=32))
+        db.session.add(subscription)
+    db.session.commit()
+
+    # The admin's subscription comes first but must not use up the batch
+    assert process_expired_subscriptions(batch_size=1) == (1, 1)
+    active = {user_id: active for user_id, active in db.session.query(
+        UserSubscription.user_id, UserSubscription.is_active).filter(UserSubscription.end_date < datetime.utcnow())}
+    assert active == {admin.id: True, member.id: False}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the synthetic dataset generator
+"""
+
+import random
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models.book import Book
+from app.models.borrowing import BorrowingTransaction
+from app.models.review import BookReview
+from app.models.subscription import BillingRecord, Payment, SubscriptionPlan, UserSubscription
+from app.services.inventory import reconcile_inventory
+from app.services.seed_scale import seed_scale, spread
+
+COUNTS = {'users': 300, 'books': 400, 'borrowings': 6000, 'downloads': 800, 'reading_sessions': 500,
+          'reviews': 400, 'notifications': 300}
+END = datetime(2025, 11, 30, 18)
+
+@pytest.fixture
+def plans(app):
+    db.session.add(SubscriptionPlan(name='Student', price=30, duration_days=30, max_books=2))
+    db.session.add(SubscriptionPlan(name='Premium', price=150, duration_days=30, max_books=5))
+    db.session.commit()
+
+def seed(**kwargs):
+    return seed_scale(counts=COUNTS, seed=7, days=365, end=END, batch_size=500, echo=lambda message: None, **kwargs)
+
+def test_spread_is_proportional_and_exact():
+    counts = spread(1000, [1, 2, 1], random.Random(1))
+    assert sum(counts) == 1000
+    assert counts[1] == 500
+
+def test_seeds_every_table_consistently(app, plans):
+    inserted = seed()
+    assert inserted['users'] == 300 and inserted['books'] == 400
+    assert inserted['borrowing_transactions'] == 6000
+    assert inserted['digital_downloads'] == 800 and inserted['notifications'] == 300
+    assert UserSubscription.query.count() > 0
+    assert Payment.query.count() == BillingRecord.query.filter_by(status='paid').count()
+
+    # Open loans never exceed a book's copies, so availability needs no correction
+    assert reconcile_inventory() == 0
+    assert Book.query.filter(Book.available_copies < 0).count() == 0
+    late = BorrowingTransaction.query.filter(BorrowingTransaction.status == 'returned',
+                                             BorrowingTransaction.fine_amount > 0).count()
+    assert BillingRecord.query.filter_by(billing_type='late_fee').count() == late
+
+    reviews = db.session.query(BookReview.user_id, BookReview.book_id).all()
+    assert len(reviews) == len(set(reviews))
+
+def test_popularity_and_seasons_are_skewed(app, plans):
+    seed()
+    loans = Counter(book_id for (book_id,) in db.session.query(BorrowingTransaction.book_id))
+    top = sum(count for _, count in loans.most_common(len(loans) // 10))
+    assert top > 0.5 * sum(loans.values())
+
+    months = Counter(borrowed.month for (borrowed,) in db.session.query(BorrowingTransaction.borrowed_date))
+    assert months[12] < months[9] / 2
+
+def test_same_seed_gives_same_data(app, plans):
+    seed()
+    seed()
+    books = db.session.query(Book.title, Book.author, Book.total_copies).order_by(Book.id).all()
+    assert books[:400] == books[400:]
+    loans = db.session.query(BorrowingTransaction.borrowed_date, BorrowingTransaction.status) \
+        .order_by(BorrowingTransaction.id).all()
+    assert loans[:6000] == loans[6000:]
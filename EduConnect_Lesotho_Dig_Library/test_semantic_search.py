@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the local semantic search index
+"""
+
+import time
+
+from app import db
+from app.services.semantic_search import get_index, rebuild_index, search_books, sync_index
+
+def titles(matches):
+    return [book.title for book, _ in matches]
+
+def test_search_ranks_by_meaningful_overlap(app, make_book):
+    make_book('Soil Conservation in Lesotho', description='Terracing and erosion control for highland farms')
+    make_book('Maize Farming Handbook', description='Planting, soil preparation and harvest of maize')
+    make_book('Sesotho Poetry', description='Lithoko praise poems and oral tradition')
+
+    assert rebuild_index() == 3
+    assert titles(search_books('soil erosion', k=2))[0] == 'Soil Conservation in Lesotho'
+    assert titles(search_books('praise poems', k=3)) == ['Sesotho Poetry']
+    assert search_books('quantum chromodynamics') == []
+
+    batch = get_index().search_many(['maize harvest', 'oral tradition'], k=1)
+    assert [len(hits) for hits in batch] == [1, 1]
+
+def test_sync_adds_edits_and_removes_books(app, make_book):
+    kept = make_book('Geometry Basics', description='Angles and triangles')
+    dropped = make_book('Old Atlas', description='Maps of southern Africa')
+    rebuild_index()
+
+    # Let the edit timestamps fall after the last sync
+    time.sleep(0.01)
+    for i in range(80):
+        make_book(f'Volume {i}', description='Rangeland management for livestock herders')
+    kept.description = 'Angles, triangles and circle theorems'
+    dropped.is_active = False
+    db.session.commit()
+
+    assert sync_index() == 82
+    assert len(get_index().indexed_ids()) == 81
+    assert titles(search_books('circle theorems', k=1)) == ['Geometry Basics']
+    assert 'Old Atlas' not in titles(search_books('maps southern africa', k=5))
+    assert len(search_books('livestock rangeland', k=100)) == 80
+    assert sync_index() == 0
+
+def test_semantic_search_endpoint(app, client, make_book):
+    make_book('Primary Health Care', description='Clinic guide for village health workers')
+    # Searches only read the index; the scheduler job keeps it in sync
+    assert search_books('village clinic') == []
+    sync_index()
+
+    response = client.post('/api/semantic-search', json={'query': 'village clinic'})
+    assert response.status_code == 200
+    assert response.get_json()['books'][0]['title'] == 'Primary Health Care'
+    assert client.post('/api/semantic-search', json={'query': ' '}).status_code == 400
+    assert client.post('/api/semantic-search', json={'query': 'clinic', 'k': 'ten'}).status_code == 400
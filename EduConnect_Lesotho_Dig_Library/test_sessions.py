@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for server-side sessions and the bounded AI chat history
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models.session import ServerSession
+from app.services import sessions
+
+def cookie(client):
+    return client.get_cookie('session').value
+
+def history(client):
+    with client.session_transaction() as session:
+        return session.get('ai_chat_history', [])
+
+def test_cookie_holds_only_a_compact_id(client):
+    with client.session_transaction() as session:
+        session['ai_chat_history'] = [{'role': 'user', 'content': 'x' * 5000}]
+
+    sid, version = cookie(client).split('.')
+    assert len(cookie(client)) < 30 and version == '1'
+    stored = db.session.get(ServerSession, sid)
+    assert stored.version == 1 and 'x' * 5000 in stored.data
+
+def test_chat_history_is_bounded(app, client, provider):
+    app.config['AI_CHAT_HISTORY_LIMIT'] = 4
+    for index in range(5):
+        client.post('/ai_chat', json={'query': f'Question {index}'})
+
+    kept = history(client)
+    assert [message['role'] for message in kept] == ['user', 'assistant'] * 2
+    assert [message['content'] for message in kept[::2]] == ['Question 3', 'Question 4']
+    # The newest question is still sent to the model with the last few turns
+    messages = provider.requests[-1][1]['messages']
+    assert messages[-1] == {'role': 'user', 'content': 'Question 4'}
+
+def test_streamed_answer_is_saved_after_the_cookie_is_sent(client, provider):
+    response = client.post('/ai_chat/stream', json={'query': 'Opening hours?'})
+    sid, version = cookie(client).split('.')
+    response.get_data()
+
+    assert history(client) == [{'role': 'user', 'content': 'Opening hours?'},
+                               {'role': 'assistant', 'content': 'openai answer'}]
+    # The cookie named the version written when the stream ended
+    assert int(version) == 2
+
+def test_memory_front_serves_unchanged_sessions(app, client, monkeypatch):
+    with client.session_transaction() as session:
+        session['theme'] = 'dark'
+    interface = app.session_interface
+    loads = []
+    load = interface.store.load
+    monkeypatch.setattr(interface.store, 'load', lambda sid: loads.append(sid) or load(sid))
+
+    for _ in range(3):
+        client.get('/no-such-page')
+    assert loads == []
+
+    # A write from another process shows up as a newer version in the cookie
+    sid, version = cookie(client).split('.')
+    interface.store.save(sid, interface.serializer.dumps({'theme': 'light'}), int(version) + 1,
+                         datetime.utcnow() + timedelta(hours=1))
+    client.set_cookie('session', f'{sid}.{int(version) + 1}')
+    with client.session_transaction() as session:
+        assert session['theme'] == 'light'
+    assert loads == [sid]
+
+def test_static_files_get_no_session(app, client, monkeypatch):
+    with client.session_transaction() as session:
+        session['theme'] = 'dark'
+    monkeypatch.setattr(app.session_interface, '_lookup', lambda *args: pytest.fail('session loaded'))
+    response = client.get('/static/css/style.css')
+    assert response.status_code == 200 and 'Set-Cookie' not in response.headers
+
+def test_login_moves_the_session_to_a_new_id(client, make_user):
+    make_user('palesa')
+    with client.session_transaction() as session:
+        session['ai_chat_history'] = [{'role': 'user', 'content': 'Hello'}]
+    planted = cookie(client).split('.')[0]
+
+    client.post('/auth/login', data={'username_or_email': 'palesa', 'password': 'password123'})
+    assert cookie(client).split('.')[0] != planted
+    assert db.session.get(ServerSession, planted) is None
+    assert history(client) == [{'role': 'user', 'content': 'Hello'}]
+
+def test_expired_sessions_are_ignored_and_purged(app, client):
+    with client.session_transaction() as session:
+        session['theme'] = 'dark'
+    sid = cookie(client).split('.')[0]
+    db.session.get(ServerSession, sid).expires_at = datetime.utcnow() - timedelta(minutes=1)
+    db.session.commit()
+    app.session_interface.memory.clear()
+
+    with client.session_transaction() as session:
+        assert 'theme' not in session
+    assert sessions.purge_expired_sessions() == 1
+    assert ServerSession.query.count() == 0
+
+def test_filesystem_backend(app, client, tmp_path):
+    app.config.update(SESSION_BACKEND='filesystem', SESSION_FILE_DIR=str(tmp_path / 'sessions'))
+    sessions.init_app(app)
+    with client.session_transaction() as session:
+        session['theme'] = 'dark'
+    app.session_interface.memory.clear()
+
+    with client.session_transaction() as session:
+        assert session['theme'] == 'dark'
+        session.clear()
+    assert list((tmp_path / 'sessions').iterdir()) == []
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for queued JSON logging
+"""
+
+import json
+import logging
+import queue
+
+import pytest
+
+from app.services.structured_logging import (DebugSampler, RequestQueueHandler, configure_logging,
+                                             parse_levels, shutdown_logging)
+
+@pytest.fixture
+def log_file(app, tmp_path):
+    root = logging.getLogger()
+    level = root.level
+    path = tmp_path / 'logs' / 'library.log'
+    app.config.update(LOG_FILE=str(path), LOG_TO_STDERR=False,
+                      LOG_LEVEL='INFO,app.services.noisy=WARNING,app.services.chatty=DEBUG')
+    configure_logging(app)
+    yield path
+    shutdown_logging()
+    root.setLevel(level)
+    for name in ('app.services.noisy', 'app.services.chatty'):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+def records(path):
+    shutdown_logging()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_levels_are_parsed():
+    assert parse_levels('debug, sqlalchemy.engine=warning') == ('DEBUG', {'sqlalchemy.engine': 'WARNING'})
+    assert parse_levels(None) == ('INFO', {})
+
+def test_records_are_written_as_json_with_request_fields(app, log_file):
+    with app.test_request_context('/books/7/review', method='POST'):
+        app.logger.info('Review %s saved', 3, extra={'book_id': 7})
+    logging.getLogger('app.services.noisy').info('not at this level')
+    try:
+        raise RuntimeError('boom')
+    except RuntimeError:
+        logging.getLogger('app.services.reminders').exception('Reminder failed')
+
+    review, failure = records(log_file)[-2:]
+    assert review['message'] == 'Review 3 saved'
+    assert (review['level'], review['logger'], review['book_id']) == ('INFO', 'app', 7)
+    assert (review['method'], review['path']) == ('POST', '/books/7/review')
+    assert failure['message'] == 'Reminder failed'
+    assert 'RuntimeError: boom' in failure['exc_info']
+
+def test_repeated_debug_lines_are_sampled(app, log_file):
+    logger = logging.getLogger('app.services.chatty')
+    for index in range(25):
+        logger.debug('Cache lookup %s', index)
+    logger.debug('Something else')
+
+    debug = [record for record in records(log_file) if record['level'] == 'DEBUG']
+    assert [record['message'] for record in debug] == [
+        'Cache lookup 0', 'Cache lookup 10', 'Cache lookup 20', 'Something else'
+    ]
+    assert debug[1]['sampled'] == 10
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = RequestQueueHandler(queue.Queue(2))
+    handler.addFilter(DebugSampler())
+    logger = logging.Logger('isolated')
+    logger.addHandler(handler)
+    for index in range(5):
+        logger.warning('line %s', index)
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3